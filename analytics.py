@@ -0,0 +1,90 @@
+"""エンティティ数・属性値ごとの件数の時系列
+
+「月ごとの稼働中のサーバー数」「過去3年のOSの構成比」のような集計を、日付ごとの問い合わせではなく
+期間の境界（date_in / date_out）のイベントスイープで1回の問い合わせにまとめて求める
+（AnalyticsRepository.count_series）。各バケットの値はその先頭日の時点で有効な件数。
+
+結果はワーカーごとに保持し、変更履歴の最新シーケンス番号が変わる（エンティティ・属性値が
+書き込まれる）まで同じ結果を返す。
+"""
+import os
+from datetime import date, timedelta
+from typing import Any, Dict, List
+
+import db_pool
+from db import AnalyticsRepository, ChangeLogRepository
+from result_cache import VersionedCache
+
+# 保持する集計結果の件数（ワーカーごと）
+ANALYTICS_CACHE_SIZE = int(os.environ.get('ANALYTICS_CACHE_SIZE', '256'))
+
+# 1回の集計のバケット数の上限（日単位で約10年）
+ANALYTICS_MAX_BUCKETS = int(os.environ.get('ANALYTICS_MAX_BUCKETS', '3660'))
+
+BUCKETS = ('day', 'week', 'month')
+
+def bucket_starts(start: date, end: date, bucket: str) -> List[str]:
+    """start から end までの各バケットの先頭日（週は月曜始まり、月は1日始まりにそろえる）"""
+    if bucket not in BUCKETS:
+        raise ValueError(f'bucket は {" / ".join(BUCKETS)} のいずれかで指定してください')
+    if start > end:
+        raise ValueError('start は end 以前の日付を指定してください')
+
+    if bucket == 'day':
+        count = (end - start).days + 1
+    elif bucket == 'week':
+        start -= timedelta(days=start.weekday())
+        count = (end - start).days // 7 + 1
+    else:
+        start = start.replace(day=1)
+        count = (end.year - start.year) * 12 + end.month - start.month + 1
+    if count > ANALYTICS_MAX_BUCKETS:
+        raise ValueError(f'バケット数が多すぎます（{count}件、上限{ANALYTICS_MAX_BUCKETS}件）。期間を短くするか bucket を大きくしてください')
+
+    if bucket == 'month':
+        return [date(start.year + (start.month - 1 + i) // 12, (start.month - 1 + i) % 12 + 1, 1).isoformat()
+                for i in range(count)]
+    step = 7 if bucket == 'week' else 1
+    return [(start + timedelta(days=i * step)).isoformat() for i in range(count)]
+
+cache = VersionedCache(ANALYTICS_CACHE_SIZE)
+
+def time_series(start: date, end: date, bucket: str = 'month', entity_class_id: int = None,
+                group_by: int = None) -> Dict[str, Any]:
+    """バケットごとのエンティティ数（group_by を指定すると属性値ごとの内訳も）を返す
+
+    count は group_by によらず有効なエンティティ数（値を持たないエンティティや、同時に複数の値を
+    持つエンティティがあるので、内訳の合計とは一致しない）。内訳はグループなしの集計と並行に求める。
+    """
+    buckets = bucket_starts(start, end, bucket)
+    key = (buckets[0], end.isoformat(), bucket, entity_class_id, group_by)
+    version = ChangeLogRepository.get_data_version()
+    result = cache.get(key, version)
+    if result is not None:
+        return result
+
+    series = {day: {'date': day, 'count': 0} for day in buckets}
+    if group_by is not None:
+        for point in series.values():
+            point['groups'] = {}
+    if group_by is None:
+        totals, grouped = AnalyticsRepository.count_series(buckets, entity_class_id), []
+    else:
+        totals, grouped = db_pool.gather(
+            lambda: AnalyticsRepository.count_series(buckets, entity_class_id),
+            lambda: AnalyticsRepository.count_series(buckets, entity_class_id, group_by))
+    for row in totals:
+        series[row['bucket']]['count'] = row['active']
+    for row in grouped:
+        series[row['bucket']]['groups'][row['grp']] = row['active']
+
+    result = {
+        'start': buckets[0],
+        'end': end.isoformat(),
+        'bucket': bucket,
+        'entity_class_id': entity_class_id,
+        'group_by': group_by,
+        'series': list(series.values()),
+    }
+    cache.put(key, version, result)
+    return result
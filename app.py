@@ -1,23 +1,47 @@
-from flask import Flask, render_template, redirect, url_for, session, flash, request, jsonify
+from flask import Flask, render_template, redirect, url_for, session, flash, request, jsonify, Response, abort
 from authlib.integrations.flask_client import OAuth
 import os
+import json
+import itertools
+import time
+import threading
 from datetime import datetime, date
 from dotenv import load_dotenv
 from db import (
     EntityMetaRepository, 
     EntityRepository, 
     AttributeRepository, 
-    AttributeMetaRepository
+    AttributeMetaRepository,
+    ChangeLogRepository,
+    BulkRepository,
+    SchemaJobRepository,
+    RelationClassRepository,
+    RelationRepository,
+    BatchValidationError,
+    IntervalConflictError,
+    init_db
 )
+from oidc_metadata import OIDCMetadataCache
+import analytics
+import compression
+import db_pool
+import facets
+import instrumentation
+import json_provider
+import rate_limit
+import reporting
+import schema_jobs
+import session_store
+import static_assets
+import templating
 
 # 環境変数を読み込み
 load_dotenv()
 
 app = Flask(__name__)
-app.secret_key = os.environ.get('SECRET_KEY', 'your-secret-key-here')
 
 # OAuth設定
-oauth = OAuth(app)
+oauth = OAuth()
 
 # 単一OIDCプロバイダー設定
 METADATA_URL = os.environ.get('OIDC_METADATA_URL')
@@ -26,18 +50,85 @@ CLIENT_SECRET = os.environ.get('OIDC_CLIENT_SECRET')
 SCOPE = os.environ.get('OIDC_SCOPE', 'openid profile email')
 PROVIDER_NAME = os.environ.get('OIDC_PROVIDER_NAME', 'OIDC Provider')
 
-# 設定チェック
-if not all([METADATA_URL, CLIENT_ID, CLIENT_SECRET]):
-    raise ValueError("OIDC_METADATA_URL, OIDC_CLIENT_ID, OIDC_CLIENT_SECRET are required")
-
-# OIDCクライアント登録
-oidc = oauth.register(
-    'oidc',
-    client_id=CLIENT_ID,
-    client_secret=CLIENT_SECRET,
-    server_metadata_url=METADATA_URL,
-    client_kwargs={'scope': SCOPE},
-)
+# メタデータ・JWKSのキャッシュ有効期間（秒）
+OIDC_METADATA_TTL = float(os.environ.get('OIDC_METADATA_TTL', '3600'))
+
+# OIDCメタデータ・JWKSのキャッシュとクライアント（クライアントは最初のログイン時に登録）
+oidc_metadata = OIDCMetadataCache(METADATA_URL, ttl=OIDC_METADATA_TTL) if METADATA_URL else None
+_oidc_client = None
+_oidc_lock = threading.Lock()
+
+def get_oidc_client():
+    """OIDCクライアントを取得（初回呼び出し時に登録し、メタデータを読み込む）"""
+    global _oidc_client
+    
+    # 設定チェック
+    if not all([METADATA_URL, CLIENT_ID, CLIENT_SECRET]):
+        raise ValueError("OIDC_METADATA_URL, OIDC_CLIENT_ID, OIDC_CLIENT_SECRET are required")
+    
+    if _oidc_client is None:
+        with _oidc_lock:
+            if _oidc_client is None:
+                # メタデータはキャッシュから書き込むので server_metadata_url は渡さない
+                client = oauth.register(
+                    'oidc',
+                    client_id=CLIENT_ID,
+                    client_secret=CLIENT_SECRET,
+                    client_kwargs={'scope': SCOPE},
+                )
+                oidc_metadata.attach(client)
+                _oidc_client = client
+    
+    oidc_metadata.ensure_loaded()
+    return _oidc_client
+
+def create_app(config: dict = None) -> Flask:
+    """アプリケーションを設定して返す（プロセスごとに1回だけ初期化）
+    
+    ネットワークアクセスは行わない。OIDCメタデータは最初のリクエストで
+    バックグラウンドで先読みし、スキーマ初期化はここで1回だけ実行する。
+    """
+    if config:
+        app.config.update(config)
+    if app.config.get('ENTY_INITIALIZED'):
+        return app
+    
+    started = time.perf_counter()
+    app.secret_key = app.config.get('SECRET_KEY') or os.environ.get('SECRET_KEY', 'your-secret-key-here')
+    
+    # リクエスト計測（SQL回数・DB時間・スロークエリログ・/metrics）
+    instrumentation.init_app(app)
+    # 高コストなルートはユーザーごとのレートと同時実行数を制限する（429 / 503）
+    rate_limit.init_app(app)
+    # JSONのエンコード（orjson があれば使い、大きな配列は少しずつ書き出す）
+    json_provider.init_app(app)
+    # HTML・JSONのレスポンスを gzip / brotli で圧縮
+    compression.init_app(app)
+    # CSS・JSを縮小してフィンガープリント付きの名前で長期キャッシュさせる
+    static_assets.init_app(app)
+    # コンパイル済みテンプレートをワーカー間で共有する
+    templating.init_app(app)
+    # セッションはサーバー側に保存し、CookieにはセッションIDだけを持たせる
+    session_store.init_app(app)
+    # 属性クラスの削除・データ型変更・統合はバックグラウンドで少しずつ実行する
+    schema_jobs.init_app(app)
+    # 集計・差分は定期的に作り直す読み取り専用のスナップショットを読む
+    reporting.init_app(app)
+    oauth.init_app(app)
+    
+    # スキーマ初期化（接続ごとではなく起動時に1回）
+    init_db()
+    
+    @app.before_request
+    def prefetch_oidc_metadata():
+        # ワーカーの最初のリクエストでメタデータ・JWKSを先読み（以降はTTL切れ時のみ）
+        if oidc_metadata is not None and oidc_metadata.is_stale:
+            oidc_metadata.refresh_async()
+    
+    app.config['ENTY_INITIALIZED'] = True
+    app.config['STARTUP_SECONDS'] = time.perf_counter() - started
+    instrumentation.metrics.set('enty_app_startup_seconds', app.config['STARTUP_SECONDS'])
+    return app
 
 # ホームページ
 @app.route('/')
@@ -51,18 +142,21 @@ def index():
 def login():
     redirect_uri = url_for('authorize', _external=True)
     print(f"Redirect URI: {redirect_uri}")
-    return oidc.authorize_redirect(redirect_uri)
+    return get_oidc_client().authorize_redirect(redirect_uri)
 
 # 認証コールバック
 @app.route('/authorize')
 def authorize():
     try:
-        token = oidc.authorize_access_token()
+        token = get_oidc_client().authorize_access_token()
         
         if token:
             userinfo = get_user_info(token)
             
             if userinfo:
+                # ログイン前のセッションIDを引き継がない（セッション固定攻撃対策）
+                if hasattr(session, 'regenerate'):
+                    session.regenerate()
                 session['user'] = userinfo
                 flash(f'{PROVIDER_NAME}でのログインに成功しました！', 'success')
                 return redirect(url_for('profile'))
@@ -108,10 +202,18 @@ def profile():
 # ログアウト
 @app.route('/logout')
 def logout():
+    user = session.get('user')
+    # ?all=1 のときは他の端末のセッションもまとめて失効させる
+    if user and request.args.get('all') == '1':
+        revoke_user_sessions(user.get('id'))
     session.clear()
     flash(f'{PROVIDER_NAME}からログアウトしました', 'info')
     return redirect(url_for('index'))
 
+def revoke_user_sessions(user_id):
+    """ユーザーの全セッションを失効させる（サーバー側セッション使用時のみ）"""
+    return session_store.revoke_user(user_id)
+
 # 認証が必要なページの例
 @app.route('/protected')
 def protected():
@@ -150,6 +252,22 @@ def get_view_date():
         # 無効な日付形式の場合は現在日を返す
         return date.today()
 
+def is_partial_request():
+    """日付切り替え時の部分更新リクエストかどうか（データ領域のHTMLだけを返す）"""
+    return request.args.get('partial') == '1'
+
+def render_partial(template_name, stream=False, **context):
+    """データ領域のHTML断片を返す（クライアントはヘッダーで断片かどうかを判定する）
+    
+    stream=True では描画しながら送る（大きな一覧で断片全体の文字列を作らない）。
+    """
+    if stream:
+        response = templating.render_stream(template_name, **context)
+    else:
+        response = app.make_response(render_template(template_name, **context))
+    response.headers['X-Partial-Content'] = '1'
+    return response
+
 @app.route('/classes')
 @require_login
 def classes_index():
@@ -217,10 +335,13 @@ def manage_attributes(entity_meta_id):
         
         # 属性メタ一覧を取得
         attributes = AttributeMetaRepository.get_by_entity_meta_id(entity_meta_id)
+        # スキーマ変更ジョブの進捗
+        jobs = [schema_jobs.progress(job) for job in SchemaJobRepository.get_recent(entity_meta_id, limit=10)]
         
         return render_template('classes/manage_attributes.html',
                              entity_meta=entity_meta,
                              attributes=attributes,
+                             jobs=jobs,
                              user=session.get('user'),
                              provider_name=PROVIDER_NAME)
     
@@ -347,13 +468,20 @@ def update_attribute(entity_meta_id):
                 flash('表示順は数値で入力してください。', 'error')
                 return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
         
-        # 属性メタを更新
-        success = AttributeMetaRepository.update(attribute_id, title, data_type, order_display_value)
+        # データ型の変更は既存の値の変換が必要なので、名前・表示順だけ先に更新してジョブに回す
+        type_changed = data_type != existing_attribute['data_type']
+        success = AttributeMetaRepository.update(attribute_id, title, None, order_display_value)
         
-        if success:
-            flash(f'属性「{title}」を更新しました。', 'success')
-        else:
+        if not success:
             flash('属性の更新に失敗しました。', 'error')
+        elif type_changed:
+            try:
+                schema_jobs.submit('change_type', attribute_id, {'data_type': data_type})
+                flash(f'属性「{title}」を更新しました。データ型の変更はバックグラウンドで実行します。', 'success')
+            except ValueError as e:
+                flash(f'属性「{title}」を更新しましたが、データ型を変更できません: {e}', 'error')
+        else:
+            flash(f'属性「{title}」を更新しました。', 'success')
         
         return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
         
@@ -391,13 +519,12 @@ def delete_attribute(entity_meta_id):
             flash('指定された属性が見つかりません。', 'error')
             return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
         
-        # 属性メタを削除
-        success = AttributeMetaRepository.delete(attribute_id)
-        
-        if success:
-            flash(f'属性「{existing_attribute["title"]}」を削除しました。', 'success')
-        else:
-            flash('属性の削除に失敗しました。', 'error')
+        # 値をすべて削除してから属性メタを削除する（バックグラウンドで実行）
+        try:
+            schema_jobs.submit('delete_class', attribute_id)
+            flash(f'属性「{existing_attribute["title"]}」の削除を開始しました。', 'success')
+        except ValueError as e:
+            flash(f'属性を削除できません: {e}', 'error')
         
         return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
         
@@ -406,6 +533,194 @@ def delete_attribute(entity_meta_id):
         flash('属性の削除中にエラーが発生しました。', 'error')
         return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
 
+@app.route('/classes/<int:entity_meta_id>/attributes/merge', methods=['POST'])
+@require_login
+def merge_attribute(entity_meta_id):
+    """属性統合（統合元の値を統合先に移して統合元を削除）"""
+    try:
+        # エンティティメタの存在確認
+        entity_meta = EntityMetaRepository.get_by_id(entity_meta_id)
+        if not entity_meta:
+            flash('指定されたエンティティタイプが見つかりません。', 'error')
+            return redirect(url_for('classes_index'))
+        
+        try:
+            source_id = int(request.form.get('source_id', ''))
+            target_id = int(request.form.get('target_id', ''))
+        except ValueError:
+            flash('統合元と統合先の属性を選択してください。', 'error')
+            return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
+        
+        # 属性の存在確認
+        source = AttributeMetaRepository.get_by_id(source_id)
+        if not source or source['entity_id'] != entity_meta_id:
+            flash('指定された属性が見つかりません。', 'error')
+            return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
+        
+        try:
+            schema_jobs.submit('merge', source_id, {'target_class_id': target_id})
+            flash(f'属性「{source["title"]}」の統合を開始しました。', 'success')
+        except ValueError as e:
+            flash(f'属性を統合できません: {e}', 'error')
+        
+        return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
+        
+    except Exception as e:
+        print(f'Error merging attribute: {e}')
+        flash('属性の統合中にエラーが発生しました。', 'error')
+        return redirect(url_for('manage_attributes', entity_meta_id=entity_meta_id))
+
+@app.route('/classes/<int:entity_meta_id>/relations')
+@require_login
+def manage_relations(entity_meta_id):
+    """リレーションクラス管理ページ"""
+    try:
+        # エンティティメタの存在確認
+        entity_meta = EntityMetaRepository.get_by_id(entity_meta_id)
+        if not entity_meta:
+            flash('指定されたエンティティタイプが見つかりません。', 'error')
+            return redirect(url_for('classes_index'))
+        
+        relations, entity_types = db_pool.gather(
+            lambda: RelationClassRepository.get_by_entity_meta_id(entity_meta_id),
+            EntityMetaRepository.get_all)
+        
+        return render_template('classes/manage_relations.html',
+                             entity_meta=entity_meta,
+                             relations=relations,
+                             entity_types=entity_types,
+                             user=session.get('user'),
+                             provider_name=PROVIDER_NAME)
+    
+    except Exception as e:
+        print(f'Error in manage_relations: {e}')
+        flash('データの取得に失敗しました。', 'error')
+        return redirect(url_for('classes_index'))
+
+def parse_relation_class_form(entity_meta_id):
+    """リレーションクラスのフォームを検証し、(タイトル, 開始クラスID, 終了クラスID) を返す（不正な場合は ValueError）"""
+    title = request.form.get('title', '').strip()
+    if not title:
+        raise ValueError('リレーション名を入力してください。')
+    if len(title) > 100:
+        raise ValueError('リレーション名は100文字以内で入力してください。')
+    try:
+        from_entity_id = int(request.form.get('from_entity_id', ''))
+        to_entity_id = int(request.form.get('to_entity_id', ''))
+    except ValueError:
+        raise ValueError('開始エンティティと終了エンティティを選択してください。')
+    if entity_meta_id not in (from_entity_id, to_entity_id):
+        raise ValueError('開始エンティティか終了エンティティのどちらかはこのエンティティタイプにしてください。')
+    if not EntityMetaRepository.get_by_id(from_entity_id) or not EntityMetaRepository.get_by_id(to_entity_id):
+        raise ValueError('指定されたエンティティタイプが存在しません。')
+    return title, from_entity_id, to_entity_id
+
+def get_relation_class_for_form(entity_meta_id):
+    """フォームの relation_id のリレーションクラス（このエンティティタイプのものでなければ ValueError）"""
+    try:
+        relation_class = RelationClassRepository.get_by_id(int(request.form.get('relation_id', '')))
+    except ValueError:
+        raise ValueError('無効なリレーションIDです。')
+    if not relation_class or entity_meta_id not in (relation_class['from_entity_id'], relation_class['to_entity_id']):
+        raise ValueError('指定されたリレーションが見つかりません。')
+    return relation_class
+
+@app.route('/classes/<int:entity_meta_id>/relations/create', methods=['POST'])
+@require_login
+def create_relation(entity_meta_id):
+    """リレーションクラス作成"""
+    try:
+        if not EntityMetaRepository.get_by_id(entity_meta_id):
+            flash('指定されたエンティティタイプが見つかりません。', 'error')
+            return redirect(url_for('classes_index'))
+        
+        try:
+            title, from_entity_id, to_entity_id = parse_relation_class_form(entity_meta_id)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+        
+        # 重複チェック
+        if RelationClassRepository.exists_by_title_and_entity(title, from_entity_id):
+            flash(f'「{title}」は既に登録されています。', 'error')
+            return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+        
+        RelationClassRepository.create(title, from_entity_id, to_entity_id)
+        flash(f'リレーション「{title}」を追加しました。', 'success')
+        return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+    
+    except Exception as e:
+        print(f'Error creating relation class: {e}')
+        flash('リレーションの追加中にエラーが発生しました。', 'error')
+        return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+
+@app.route('/classes/<int:entity_meta_id>/relations/update', methods=['POST'])
+@require_login
+def update_relation(entity_meta_id):
+    """リレーションクラス更新"""
+    try:
+        try:
+            relation_class = get_relation_class_for_form(entity_meta_id)
+            title, from_entity_id, to_entity_id = parse_relation_class_form(entity_meta_id)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+        
+        # 重複チェック（自分自身は除く）
+        if RelationClassRepository.exists_by_title_and_entity(title, from_entity_id, relation_class['identifier']):
+            flash(f'「{title}」は既に登録されています。', 'error')
+            return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+        
+        try:
+            RelationClassRepository.update(relation_class['identifier'], title, from_entity_id, to_entity_id)
+            flash(f'リレーション「{title}」を更新しました。', 'success')
+        except ValueError as e:
+            flash(f'リレーションを更新できません: {e}', 'error')
+        return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+    
+    except Exception as e:
+        print(f'Error updating relation class: {e}')
+        flash('リレーションの更新中にエラーが発生しました。', 'error')
+        return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+
+@app.route('/classes/<int:entity_meta_id>/relations/delete', methods=['POST'])
+@require_login
+def delete_relation(entity_meta_id):
+    """リレーションクラス削除（登録済みのリレーションも削除）"""
+    try:
+        try:
+            relation_class = get_relation_class_for_form(entity_meta_id)
+        except ValueError as e:
+            flash(str(e), 'error')
+            return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+        
+        deleted = RelationClassRepository.delete(relation_class['identifier'])
+        flash(f'リレーション「{relation_class["title"]}」を削除しました（登録済みのリレーション{deleted}件）。', 'success')
+        return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+    
+    except Exception as e:
+        print(f'Error deleting relation class: {e}')
+        flash('リレーションの削除中にエラーが発生しました。', 'error')
+        return redirect(url_for('manage_relations', entity_meta_id=entity_meta_id))
+
+def build_facet_links(facet_list, entity_type_id, filters):
+    """ファセットの各値に、その値の選択を切り替えた一覧のURLを付ける"""
+    base_args = {'type': entity_type_id}
+    if request.args.get('view_date'):
+        base_args['view_date'] = request.args['view_date']
+    
+    def toggled(class_id, value):
+        selected = dict(filters)
+        values = set(selected.get(class_id, ()))
+        values.symmetric_difference_update({value})
+        selected[class_id] = sorted(values)
+        return url_for('instances_list', **base_args,
+                       **{f'{facets.FILTER_PREFIX}{key}': values for key, values in selected.items() if values})
+    
+    return [{**facet, 'values': [{**value, 'url': toggled(facet['class_id'], value['value'])}
+                                 for value in facet['values']]}
+            for facet in facet_list]
+
 @app.route('/instances')
 @require_login
 def instances_list():
@@ -416,28 +731,50 @@ def instances_list():
     
     # 日付を文字列形式に変換（SQLite用）
     view_date_str = view_date.strftime('%Y-%m-%d')
+    # 属性値での絞り込み（エンティティクラスを選んだときだけ）
+    attribute_filters = facets.parse_filters(request.args) if entity_type else {}
+    facet_list = []
     
     try:
         if entity_type:
             # entity_typeを整数に変換
             try:
                 entity_type_id = int(entity_type)
-                entities = EntityRepository.get_by_type_at_date(entity_type_id, view_date_str)
             except (ValueError, TypeError):
                 flash('無効なエンティティタイプです', 'error')
                 return redirect(url_for('instances_list'))
+            load_entities = lambda: EntityRepository.get_by_type_at_date(entity_type_id, view_date_str,
+                                                                         attribute_filters)
+            load_facets = lambda: facets.facet_counts(entity_type_id, view_date_str, attribute_filters)
         else:
-            entities = EntityRepository.get_all_at_date(view_date_str)
-        
-        entity_types = EntityMetaRepository.get_all()
-        
-        return render_template('instances/list.html', 
-                             entities=entities, 
-                             entity_types=entity_types,
-                             current_type=entity_type,
-                             view_date=view_date,
-                             user=user, 
-                             provider_name=PROVIDER_NAME)
+            load_entities = lambda: EntityRepository.get_all_at_date(view_date_str)
+            load_facets = lambda: []
+        
+        # 一覧・エンティティタイプ・ファセットは独立しているので並行に取得
+        entities, entity_types, facet_list = db_pool.gather(load_entities, EntityMetaRepository.get_all, load_facets)
+        if facet_list:
+            facet_list = build_facet_links(facet_list, entity_type_id, attribute_filters)
+        
+        if is_partial_request():
+            return render_partial('instances/_list_data.html',
+                                  stream=True,
+                                  entities=entities,
+                                  entity_types=entity_types,
+                                  current_type=entity_type,
+                                  facets=facet_list,
+                                  attribute_filters=attribute_filters,
+                                  view_date=view_date)
+        
+        # 数万行になるので描画しながら送る
+        return templating.render_stream('instances/list.html', 
+                                        entities=entities, 
+                                        entity_types=entity_types,
+                                        current_type=entity_type,
+                                        facets=facet_list,
+                                        attribute_filters=attribute_filters,
+                                        view_date=view_date,
+                                        user=user, 
+                                        provider_name=PROVIDER_NAME)
     
     except Exception as e:
         flash(f'データの取得に失敗しました: {str(e)}', 'error')
@@ -445,6 +782,8 @@ def instances_list():
                              entities=[], 
                              entity_types=[],
                              current_type=entity_type,
+                             facets=[],
+                             attribute_filters={},
                              view_date=view_date,
                              user=user, 
                              provider_name=PROVIDER_NAME)
@@ -460,15 +799,17 @@ def instance_detail(entity_id):
     view_date_str = view_date.strftime('%Y-%m-%d')
     
     try:
-        # エンティティ基本情報
-        entity = EntityRepository.get_by_id(entity_id)
+        # エンティティ基本情報と属性情報（指定日付時点での最新値）を並行に取得
+        entity, attributes = db_pool.gather(
+            lambda: EntityRepository.get_by_id(entity_id),
+            lambda: AttributeRepository.get_by_entity_id_at_date(entity_id, view_date_str))
         
         if not entity:
             flash('エンティティが見つかりません', 'error')
             return redirect(url_for('instances_list'))
         
-        # 属性情報（指定日付時点での最新値）
-        attributes = AttributeRepository.get_by_entity_id_at_date(entity_id, view_date_str)
+        if is_partial_request():
+            return render_partial('instances/_detail_attributes.html', attributes=attributes)
         
         return render_template('instances/detail.html', 
                              entity=entity,
@@ -732,6 +1073,9 @@ def add_attribute_value(entity_id):
         
         return redirect(url_for('edit_instance', entity_id=entity_id))
         
+    except IntervalConflictError as e:
+        flash(f'属性値を追加できません: {e}', 'error')
+        return redirect(url_for('edit_instance', entity_id=entity_id))
     except Exception as e:
         print(f'Error adding attribute value: {e}')
         flash('属性値の追加中にエラーが発生しました。', 'error')
@@ -799,6 +1143,9 @@ def edit_attribute_value(entity_id):
         
         return redirect(url_for('edit_instance', entity_id=entity_id))
         
+    except IntervalConflictError as e:
+        flash(f'属性値を更新できません: {e}', 'error')
+        return redirect(url_for('edit_instance', entity_id=entity_id))
     except Exception as e:
         print(f'Error editing attribute value: {e}')
         flash('属性値の更新中にエラーが発生しました。', 'error')
@@ -807,25 +1154,699 @@ def edit_attribute_value(entity_id):
 @app.route('/api/entities', methods=['GET'])
 @require_login
 def get_entities_json():
-    """全エンティティ一覧をJSONで返す（ENTITY型属性の選択用）"""
+    """全エンティティ一覧をJSONで返す（ENTITY型属性の選択用、meta_id でクラスを絞り込める）"""
     try:
-        # 現在有効な全エンティティを取得
-        entities = EntityRepository.get_all()
-        
-        # JSON用にデータを整形
-        entities_list = []
-        for entity in entities:
-            entities_list.append({
-                'identifier': entity['identifier'],
-                'title': entity['title'],
-                'type_name': entity['type_name']
-            })
+        # 現在有効な全エンティティを取得（最初の行まではここで読み、DBエラーは500で返す）
+        # 各行のJSONはSQLiteで組み立て、辞書を作らずにそのままつないで書き出す
+        entities = EntityRepository.iter_all_json(class_id=request.args.get('meta_id', type=int))
+        first = next(entities, None)
+        if first is None:
+            return jsonify([])
         
-        return jsonify(entities_list)
+        return app.json.stream_response(app.json.stream_encoded_array(itertools.chain([first], entities)))
         
     except Exception as e:
         print(f'Error getting entities JSON: {e}')
         return jsonify([]), 500
 
+# === 一括API（v1） ===
+
+# 1リクエストで受け付ける操作・取得件数の上限
+BATCH_MAX_OPERATIONS = 10000
+
+def parse_date_value(value):
+    """YYYY-MM-DD 形式の文字列を検証して返す（不正な場合は ValueError）"""
+    return datetime.strptime(value, '%Y-%m-%d').strftime('%Y-%m-%d')
+
+def parse_json_payload(payload):
+    """get_json の結果をJSONオブジェクトの辞書にする（本文なしは空の辞書、配列などは ValueError）"""
+    if payload is None:
+        return {}
+    if not isinstance(payload, dict):
+        raise ValueError('リクエスト本文はJSONオブジェクトで指定してください')
+    return payload
+
+def get_json_payload():
+    """リクエスト本文のJSONオブジェクトを取得（オブジェクト以外は400のJSONエラーで中断）"""
+    try:
+        return parse_json_payload(request.get_json(silent=True))
+    except ValueError as e:
+        response = jsonify({'error': str(e)})
+        response.status_code = 400
+        abort(response)
+
+def serialize_attribute(attr):
+    """属性インスタンス行をAPI用の辞書に変換"""
+    return {
+        'identifier': attr['identifier'],
+        'class_id': attr['class_id'],
+        'name': attr['attr_name'],
+        'data_type': attr['data_type'],
+        'value': attr['title'],
+        'date_in': attr['date_in'],
+        'date_out': attr['date_out'],
+        'target_entity_id': attr['target_entity_id'],
+        'target_entity_title': attr['target_entity_title']
+    }
+
+def parse_entities_query(payload):
+    """一括取得の要求を検証し、(エンティティIDのリスト, 日付) を返す（不正な場合は ValueError）"""
+    ids = payload.get('ids')
+    
+    if not isinstance(ids, list) or not ids:
+        raise ValueError('ids にエンティティIDの配列を指定してください')
+    if len(ids) > BATCH_MAX_OPERATIONS:
+        raise ValueError(f'ids は{BATCH_MAX_OPERATIONS}件以内で指定してください')
+    
+    try:
+        entity_ids = [int(entity_id) for entity_id in ids]
+        view_date_str = parse_date_value(payload['view_date']) if payload.get('view_date') else date.today().strftime('%Y-%m-%d')
+    except (TypeError, ValueError):
+        raise ValueError('ids は整数、view_date は YYYY-MM-DD で指定してください')
+    return entity_ids, view_date_str
+
+def build_entities_query(entity_ids, view_date_str, entities, attributes):
+    """一括取得の結果をJSON用に整形"""
+    attributes_by_entity = {}
+    for attr in attributes:
+        attributes_by_entity.setdefault(attr['entity_id'], []).append(serialize_attribute(attr))
+    
+    entities_list = []
+    for entity in entities:
+        entities_list.append({
+            'identifier': entity['identifier'],
+            'title': entity['title'],
+            'class_id': entity['class_id'],
+            'type_name': entity['type_name'],
+            'date_in': entity['date_in'],
+            'date_out': entity['date_out'],
+            'attributes': attributes_by_entity.get(entity['identifier'], [])
+        })
+    
+    found = {entity['identifier'] for entity in entities}
+    return {
+        'view_date': view_date_str,
+        'entities': entities_list,
+        'missing': [entity_id for entity_id in entity_ids if entity_id not in found]
+    }
+
+@app.route('/api/v1/entities/query', methods=['POST'])
+@require_login
+def query_entities_v1():
+    """複数エンティティを指定日付時点の属性付きで一括取得"""
+    try:
+        entity_ids, view_date_str = parse_entities_query(get_json_payload())
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        entities, attributes = db_pool.gather(
+            lambda: EntityRepository.get_many(entity_ids),
+            lambda: AttributeRepository.get_by_entity_ids_at_date(entity_ids, view_date_str))
+        return jsonify(build_entities_query(entity_ids, view_date_str, entities, attributes))
+    
+    except Exception as e:
+        print(f'Error querying entities: {e}')
+        return jsonify({'error': 'エンティティの取得に失敗しました'}), 500
+
+@app.route('/api/v1/attributes/batch', methods=['POST'])
+@require_login
+def apply_attribute_batch_v1():
+    """属性値の作成・更新・論理削除・削除をまとめて1トランザクションで適用"""
+    payload = get_json_payload()
+    operations = payload.get('operations')
+    
+    if not isinstance(operations, list) or not operations:
+        return jsonify({'error': 'operations に操作の配列を指定してください'}), 400
+    if len(operations) > BATCH_MAX_OPERATIONS:
+        return jsonify({'error': f'operations は{BATCH_MAX_OPERATIONS}件以内で指定してください'}), 400
+    
+    for index, operation in enumerate(operations):
+        if not isinstance(operation, dict):
+            continue
+        for key in ('date_in', 'date_out'):
+            if operation.get(key):
+                try:
+                    operation[key] = parse_date_value(operation[key])
+                except (TypeError, ValueError):
+                    return jsonify({'error': f'operations[{index}]: {key} は YYYY-MM-DD で指定してください',
+                                    'index': index}), 400
+    
+    try:
+        results = AttributeRepository.apply_batch(operations)
+        return jsonify({'applied': len(results), 'results': results})
+    
+    except BatchValidationError as e:
+        return jsonify({'error': str(e), 'index': e.index}), 400
+    except Exception as e:
+        print(f'Error applying attribute batch: {e}')
+        return jsonify({'error': '属性値の一括更新に失敗しました'}), 500
+
+def parse_bulk_date(payload, key):
+    """一括操作の日付を検証して返す（省略時は今日、不正な場合は ValueError）"""
+    if not payload.get(key):
+        return date.today().strftime('%Y-%m-%d')
+    try:
+        return parse_date_value(payload[key])
+    except (TypeError, ValueError):
+        raise ValueError(f'{key} は YYYY-MM-DD で指定してください')
+
+def parse_bulk_filter(payload):
+    """一括操作の対象の絞り込み条件（filter）を検証して返す（不正な場合は ValueError）
+    
+    ids・class_id・attribute（class_id と value）のうち指定したものをすべて満たし、
+    at（省略時は今日）の時点で有効なエンティティが対象になる。
+    """
+    spec = payload.get('filter')
+    if not isinstance(spec, dict):
+        raise ValueError('filter に対象の絞り込み条件を指定してください')
+    
+    selection = {'at': parse_bulk_date(spec, 'at')}
+    try:
+        if spec.get('ids') is not None:
+            if not isinstance(spec['ids'], list) or not spec['ids']:
+                raise ValueError
+            selection['ids'] = [int(entity_id) for entity_id in spec['ids']]
+        if spec.get('class_id') is not None:
+            selection['class_id'] = int(spec['class_id'])
+        if spec.get('attribute') is not None:
+            if spec['attribute'].get('value') is None:
+                raise ValueError
+            selection['attribute_class_id'] = int(spec['attribute']['class_id'])
+            selection['attribute_value'] = spec['attribute']['value']
+    except (AttributeError, KeyError, TypeError, ValueError):
+        raise ValueError('filter の ids は整数の配列、class_id は整数、attribute は class_id と value で指定してください')
+    
+    if len(selection.get('ids', ())) > BATCH_MAX_OPERATIONS:
+        raise ValueError(f'filter の ids は{BATCH_MAX_OPERATIONS}件以内で指定してください')
+    if not any(key in selection for key in ('ids', 'class_id', 'attribute_class_id')):
+        raise ValueError('filter に ids・class_id・attribute のいずれかを指定してください')
+    return selection
+
+@app.route('/api/v1/entities/bulk/deactivate', methods=['POST'])
+@require_login
+def bulk_deactivate_entities_v1():
+    """絞り込んだエンティティに date_out を設定し、有効な属性値も同じ日付で閉じる"""
+    payload = get_json_payload()
+    try:
+        selection = parse_bulk_filter(payload)
+        date_out = parse_bulk_date(payload, 'date_out')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        return jsonify(BulkRepository.deactivate_entities(selection, date_out, dry_run=bool(payload.get('dry_run'))))
+    except Exception as e:
+        print(f'Error deactivating entities: {e}')
+        return jsonify({'error': 'エンティティの一括無効化に失敗しました'}), 500
+
+@app.route('/api/v1/attributes/bulk/set', methods=['POST'])
+@require_login
+def bulk_set_attribute_v1():
+    """絞り込んだエンティティの属性値を date_in から value にする"""
+    payload = get_json_payload()
+    try:
+        selection = parse_bulk_filter(payload)
+        date_in = parse_bulk_date(payload, 'date_in')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        class_id = int(payload['class_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'class_id に属性クラスIDを指定してください'}), 400
+
+    try:
+        return jsonify(BulkRepository.set_attribute(selection, class_id, payload.get('value'), date_in,
+                                                    dry_run=bool(payload.get('dry_run'))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error setting attribute values: {e}')
+        return jsonify({'error': '属性値の一括設定に失敗しました'}), 500
+
+@app.route('/api/v1/attributes/bulk/close', methods=['POST'])
+@require_login
+def bulk_close_attribute_v1():
+    """絞り込んだエンティティで有効な属性値を date_out で閉じる"""
+    payload = get_json_payload()
+    try:
+        selection = parse_bulk_filter(payload)
+        date_out = parse_bulk_date(payload, 'date_out')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    try:
+        class_id = int(payload['class_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'class_id に属性クラスIDを指定してください'}), 400
+    
+    try:
+        return jsonify(BulkRepository.close_attribute(selection, class_id, date_out,
+                                                      dry_run=bool(payload.get('dry_run'))))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error closing attribute values: {e}')
+        return jsonify({'error': '属性値の一括終了に失敗しました'}), 500
+
+@app.route('/api/entity/deactivate', methods=['POST'])
+@require_login
+def deactivate_entity_api():
+    """エンティティを1件無効化（entity_list.html から呼ばれる。処理は一括無効化と同じ）"""
+    payload = get_json_payload()
+    try:
+        entity_id = int(payload['entity_id'])
+        date_out = parse_bulk_date(payload, 'date_out')
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'success': False, 'error': 'entity_id は整数、date_out は YYYY-MM-DD で指定してください'}), 400
+    
+    try:
+        selection = {'ids': [entity_id], 'at': date.today().strftime('%Y-%m-%d')}
+        summary = BulkRepository.deactivate_entities(selection, date_out)
+        return jsonify({'success': summary['entities'] > 0, **summary})
+    except Exception as e:
+        print(f'Error deactivating entity: {e}')
+        return jsonify({'success': False, 'error': 'エンティティの無効化に失敗しました'}), 500
+
+@app.route('/api/v1/schema-jobs', methods=['GET'])
+@require_login
+def list_schema_jobs_v1():
+    """スキーマ変更ジョブの進捗一覧（entity_class_id で絞り込み可）"""
+    entity_class_id = request.args.get('entity_class_id', type=int)
+    limit = min(request.args.get('limit', 20, type=int), 100)
+    try:
+        jobs = SchemaJobRepository.get_recent(entity_class_id, limit=limit)
+        return jsonify({'jobs': [schema_jobs.progress(job) for job in jobs]})
+    except Exception as e:
+        print(f'Error getting schema jobs: {e}')
+        return jsonify({'error': 'ジョブの取得に失敗しました'}), 500
+
+@app.route('/api/v1/schema-jobs', methods=['POST'])
+@require_login
+def create_schema_job_v1():
+    """スキーマ変更ジョブを登録（kind は delete_class・change_type・merge）
+    
+    change_type は data_type、merge は target_class_id を params に指定する。
+    登録したジョブはバックグラウンドで実行され、GET /api/v1/schema-jobs/<id> で進捗を確認できる。
+    """
+    payload = get_json_payload()
+    try:
+        class_id = int(payload['class_id'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'class_id に属性クラスIDを指定してください'}), 400
+    params = payload.get('params') or {}
+    if not isinstance(params, dict):
+        return jsonify({'error': 'params はオブジェクトで指定してください'}), 400
+    
+    try:
+        job_id = schema_jobs.submit(payload.get('kind'), class_id, params)
+        return jsonify(schema_jobs.progress(SchemaJobRepository.get(job_id))), 202
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error creating schema job: {e}')
+        return jsonify({'error': 'ジョブの登録に失敗しました'}), 500
+
+@app.route('/api/v1/schema-jobs/<int:job_id>', methods=['GET'])
+@require_login
+def get_schema_job_v1(job_id):
+    """スキーマ変更ジョブの進捗"""
+    job = SchemaJobRepository.get(job_id)
+    if job is None:
+        return jsonify({'error': 'ジョブが見つかりません'}), 404
+    return jsonify(schema_jobs.progress(job))
+
+def build_timeline(entity, rows):
+    """エンティティと属性変更イベントをJSON用に整形"""
+    events = []
+    for row in rows:
+        events.append({
+            'date': row['event_date'],
+            'event': row['event'],
+            'attribute': serialize_attribute(row)
+        })
+    
+    return {
+        'entity': {
+            'identifier': entity['identifier'],
+            'title': entity['title'],
+            'type_name': entity['type_name'],
+            'date_in': entity['date_in'],
+            'date_out': entity['date_out']
+        },
+        'events': events
+    }
+
+@app.route('/api/v1/entities/<int:entity_id>/timeline', methods=['GET'])
+@require_login
+def get_entity_timeline_v1(entity_id):
+    """エンティティの属性変更イベントを時系列順に返す"""
+    try:
+        entity, rows = db_pool.gather(lambda: EntityRepository.get_by_id(entity_id),
+                                      lambda: AttributeRepository.get_timeline(entity_id))
+        if not entity:
+            return jsonify({'error': 'エンティティが見つかりません'}), 404
+        
+        return jsonify(build_timeline(entity, rows))
+    
+    except Exception as e:
+        print(f'Error getting entity timeline: {e}')
+        return jsonify({'error': '履歴の取得に失敗しました'}), 500
+
+def serialize_relation(row):
+    """リレーション（隣接エンティティ）行をAPI用の辞書に変換"""
+    return {
+        'identifier': row['identifier'],
+        'class_id': row['class_id'],
+        'name': row['relation_name'],
+        'direction': row['direction'],
+        'neighbor_id': row['neighbor_id'],
+        'neighbor_title': row['neighbor_title'],
+        'neighbor_class_id': row['neighbor_class_id'],
+        'neighbor_type_name': row['neighbor_type_name'],
+        'date_in': row['date_in'],
+        'date_out': row['date_out']
+    }
+
+def parse_relation_params(args):
+    """隣接エンティティの取得条件を検証し、(方向, リレーションクラスID) を返す（不正な場合は ValueError）"""
+    direction = args.get('direction', 'both')
+    if direction not in ('out', 'in', 'both'):
+        raise ValueError('direction は out / in / both のいずれかで指定してください')
+    try:
+        relation_class_id = int(args['class_id']) if args.get('class_id') else None
+    except ValueError:
+        raise ValueError('class_id は整数で指定してください')
+    return direction, relation_class_id
+
+@app.route('/api/v1/entities/<int:entity_id>/relations', methods=['GET'])
+@require_login
+def get_entity_relations_v1(entity_id):
+    """指定日付時点のエンティティの隣接エンティティ（direction: out / in / both）を返す"""
+    try:
+        view_date_str = parse_bulk_date(request.args, 'view_date')
+        direction, relation_class_id = parse_relation_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        rows = RelationRepository.get_neighbors(entity_id, view_date_str, direction, relation_class_id)
+        return jsonify({'entity_id': entity_id, 'view_date': view_date_str,
+                        'relations': [serialize_relation(row) for row in rows]})
+    
+    except Exception as e:
+        print(f'Error getting entity relations: {e}')
+        return jsonify({'error': 'リレーションの取得に失敗しました'}), 500
+
+@app.route('/api/v1/relations/query', methods=['POST'])
+@require_login
+def query_relations_v1():
+    """複数エンティティの指定日付時点の隣接エンティティを1回の問い合わせで返す"""
+    payload = get_json_payload()
+    try:
+        entity_ids, view_date_str = parse_entities_query(payload)
+        direction, relation_class_id = parse_relation_params(payload)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        relations = {str(entity_id): [] for entity_id in entity_ids}
+        for row in RelationRepository.get_neighbors_many(entity_ids, view_date_str, direction, relation_class_id):
+            relations[str(row['entity_id'])].append(serialize_relation(row))
+        return jsonify({'view_date': view_date_str, 'relations': relations})
+    
+    except Exception as e:
+        print(f'Error querying relations: {e}')
+        return jsonify({'error': 'リレーションの取得に失敗しました'}), 500
+
+@app.route('/api/v1/relations', methods=['POST'])
+@require_login
+def create_relation_v1():
+    """リレーションインスタンスを作成（class_id・entity_from・entity_to、date_in / date_out は任意）"""
+    payload = get_json_payload()
+    try:
+        class_id = int(payload['class_id'])
+        entity_from = int(payload['entity_from'])
+        entity_to = int(payload['entity_to'])
+        date_in = parse_date_value(payload['date_in']) if payload.get('date_in') else None
+        date_out = parse_date_value(payload['date_out']) if payload.get('date_out') else None
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'error': 'class_id・entity_from・entity_to は整数、date_in・date_out は YYYY-MM-DD で指定してください'}), 400
+    
+    try:
+        relation_id = RelationRepository.create(class_id, entity_from, entity_to, date_in, date_out)
+        return jsonify({'identifier': relation_id}), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error creating relation: {e}')
+        return jsonify({'error': 'リレーションの作成に失敗しました'}), 500
+
+@app.route('/api/v1/relations/<int:relation_id>/deactivate', methods=['POST'])
+@require_login
+def deactivate_relation_v1(relation_id):
+    """リレーションインスタンスを論理削除（date_out の省略時は今日）"""
+    payload = get_json_payload()
+    try:
+        date_out = parse_bulk_date(payload, 'date_out')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        if not RelationRepository.logical_delete(relation_id, date_out):
+            return jsonify({'error': 'リレーションが見つかりません'}), 404
+        return jsonify({'identifier': relation_id, 'date_out': date_out})
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error deactivating relation: {e}')
+        return jsonify({'error': 'リレーションの論理削除に失敗しました'}), 500
+
+def parse_diff_params(args):
+    """差分の要求を検証し、(開始日, 終了日, エンティティタイプID) を返す（不正な場合は ValueError）"""
+    try:
+        date_from = parse_date_value(args.get('from', ''))
+        date_to = parse_date_value(args.get('to', ''))
+        entity_type = args.get('type')
+        entity_type_id = int(entity_type) if entity_type else None
+    except ValueError:
+        raise ValueError('from と to は YYYY-MM-DD、type は整数で指定してください')
+    return date_from, date_to, entity_type_id
+
+def build_diff(date_from, date_to, entity_rows, attribute_rows):
+    """エンティティと属性値の差分をJSON用に整形"""
+    entities = []
+    for row in entity_rows:
+        entities.append({
+            'identifier': row['identifier'],
+            'title': row['title'],
+            'type_name': row['type_name'],
+            'date_in': row['date_in'],
+            'date_out': row['date_out'],
+            'change': row['change']
+        })
+    
+    attributes = []
+    for row in attribute_rows:
+        attributes.append({
+            'entity_id': row['entity_id'],
+            'entity_title': row['entity_title'],
+            'class_id': row['class_id'],
+            'name': row['attr_name'],
+            'data_type': row['data_type'],
+            'from': json.loads(row['values_from']),
+            'to': json.loads(row['values_to']),
+            'change': row['change']
+        })
+    
+    return {
+        'from': date_from,
+        'to': date_to,
+        'entities': entities,
+        'attributes': attributes
+    }
+
+@app.route('/api/v1/diff', methods=['GET'])
+@require_login
+@reporting.reporting_view
+def get_diff_v1():
+    """2つの日付時点の差分（エンティティの増減と属性値の変化）を返す"""
+    try:
+        date_from, date_to, entity_type_id = parse_diff_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        entity_rows, attribute_rows = db_pool.gather(
+            lambda: EntityRepository.diff_between_dates(date_from, date_to, entity_type_id),
+            lambda: AttributeRepository.diff_between_dates(date_from, date_to, entity_type_id))
+        return jsonify(build_diff(date_from, date_to, entity_rows, attribute_rows))
+    
+    except Exception as e:
+        print(f'Error getting diff: {e}')
+        return jsonify({'error': '差分の取得に失敗しました'}), 500
+
+def one_year_before(day: date) -> date:
+    """1年前の同じ日（2月29日の1年前は2月28日）"""
+    try:
+        return day.replace(year=day.year - 1)
+    except ValueError:
+        return day.replace(year=day.year - 1, day=28)
+
+def parse_series_params(args):
+    """時系列の要求を検証し、analytics.time_series の引数を返す（不正な場合は ValueError）
+    
+    end の省略時は今日、start の省略時は end の1年前。
+    """
+    try:
+        end = datetime.strptime(args['end'], '%Y-%m-%d').date() if args.get('end') else date.today()
+        start = datetime.strptime(args['start'], '%Y-%m-%d').date() if args.get('start') else one_year_before(end)
+        entity_class_id = int(args['class_id']) if args.get('class_id') else None
+        group_by = int(args['group_by']) if args.get('group_by') else None
+    except ValueError:
+        raise ValueError('start と end は YYYY-MM-DD、class_id と group_by は整数で指定してください')
+    return {'start': start, 'end': end, 'bucket': args.get('bucket', 'month'),
+            'entity_class_id': entity_class_id, 'group_by': group_by}
+
+@app.route('/api/v1/analytics/series', methods=['GET'])
+@require_login
+@reporting.reporting_view
+def get_analytics_series_v1():
+    """バケット（day / week / month）ごとの有効なエンティティ数（group_by で属性値ごとの内訳）を返す"""
+    try:
+        params = parse_series_params(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        return jsonify(analytics.time_series(**params))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f'Error getting analytics series: {e}')
+        return jsonify({'error': '集計の取得に失敗しました'}), 500
+
+# === 変更データキャプチャ（CDC） ===
+
+# 1回のレスポンスで返す変更件数の上限
+CHANGES_MAX_LIMIT = 1000
+# ロングポーリングの最大待機秒数
+CHANGES_MAX_WAIT = 30
+# 変更ログをポーリングする間隔（秒）
+CHANGES_POLL_INTERVAL = 0.5
+# SSEでハートビートを送る間隔（秒）
+CHANGES_HEARTBEAT_INTERVAL = 15
+
+# WSGI（Flask）側では待機中もワーカーのスレッドを1つ占有するので、待機時間とSSEの接続数を絞る。
+# 多数の購読者を待たせる場合は asgi:app で起動する（1つのタスクが変更ログを監視して起こす）
+# ロングポーリングの最大待機秒数（WSGI）
+CHANGES_WSGI_MAX_WAIT = 5
+# ワーカーごとの同時SSE接続数の上限（WSGI、超えると503。0 でWSGI側のSSEを無効にする）
+CHANGES_WSGI_MAX_STREAMS = int(os.environ.get('CHANGES_WSGI_MAX_STREAMS', '4'))
+# SSE接続を閉じるまでの秒数（WSGI、クライアントは Last-Event-ID で再接続する）
+CHANGES_WSGI_STREAM_SECONDS = 300
+
+_wsgi_streams = threading.BoundedSemaphore(CHANGES_WSGI_MAX_STREAMS)
+
+def parse_changes_cursor(default: int = 0, args=None, headers=None) -> int:
+    """since パラメータ（SSEでは Last-Event-ID ヘッダー）から再開位置を取得"""
+    args = request.args if args is None else args
+    headers = request.headers if headers is None else headers
+    value = args.get('since') or headers.get('Last-Event-ID')
+    if not value:
+        return default
+    try:
+        return max(int(value), 0)
+    except ValueError:
+        return default
+
+def parse_changes_params(args, max_wait: float = CHANGES_MAX_WAIT):
+    """limit と wait（ロングポーリングの秒数、max_wait まで）を取得（不正な場合は ValueError）"""
+    try:
+        # limit が 0 以下だと LIMIT -1（全件）や、カーソルの進まない has_more になる
+        limit = max(1, min(int(args.get('limit', 500)), CHANGES_MAX_LIMIT))
+        wait = max(0.0, min(float(args.get('wait', 0)), max_wait))
+    except ValueError:
+        raise ValueError('limit と wait は数値で指定してください')
+    return limit, wait
+
+def build_changes(changes, since, limit):
+    """変更ログと次のカーソルをJSON用に整形"""
+    next_cursor = changes[-1]['seq'] if changes else since
+    return {
+        'changes': changes,
+        'next': next_cursor,
+        'has_more': len(changes) == limit
+    }
+
+def format_change_event(change):
+    """変更1件をSSEのイベントに整形"""
+    data = json.dumps(change, ensure_ascii=False)
+    return f"id: {change['seq']}\nevent: change\ndata: {data}\n\n"
+
+@app.route('/api/changes', methods=['GET'])
+@require_login
+def get_changes_json():
+    """変更ログをカーソル方式で返す（wait指定時は変更が来るまでロングポーリング、最大 CHANGES_WSGI_MAX_WAIT 秒）"""
+    since = parse_changes_cursor()
+    
+    try:
+        limit, wait = parse_changes_params(request.args, CHANGES_WSGI_MAX_WAIT)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        deadline = time.monotonic() + wait
+        changes = ChangeLogRepository.get_since(since, limit)
+        while not changes and time.monotonic() < deadline:
+            time.sleep(CHANGES_POLL_INTERVAL)
+            changes = ChangeLogRepository.get_since(since, limit)
+        
+        return jsonify(build_changes(changes, since, limit))
+    
+    except Exception as e:
+        print(f'Error getting changes JSON: {e}')
+        return jsonify({'error': '変更ログの取得に失敗しました'}), 500
+
+@app.route('/api/changes/stream', methods=['GET'])
+@require_login
+def stream_changes():
+    """変更ログをServer-Sent Eventsで配信（id に seq を載せるので Last-Event-ID で再開可能）
+    
+    接続ごとにワーカーのスレッドを占有するので、同時接続数は CHANGES_WSGI_MAX_STREAMS まで、
+    1回の接続は CHANGES_WSGI_STREAM_SECONDS 秒まで（その後はクライアントが再接続する）。
+    """
+    since = parse_changes_cursor()
+    if not _wsgi_streams.acquire(blocking=False):
+        response = jsonify({'error': 'SSEの同時接続数が上限に達しています（多数の購読者には asgi:app を使用してください）'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '3'
+        return response
+    
+    def generate(cursor):
+        # 再接続間隔をクライアントへ通知
+        yield 'retry: 3000\n\n'
+        started = last_sent = time.monotonic()
+        while time.monotonic() - started < CHANGES_WSGI_STREAM_SECONDS:
+            changes = ChangeLogRepository.get_since(cursor, CHANGES_MAX_LIMIT)
+            for change in changes:
+                cursor = change['seq']
+                yield format_change_event(change)
+                last_sent = time.monotonic()
+            
+            if len(changes) == CHANGES_MAX_LIMIT:
+                continue
+            if time.monotonic() - last_sent >= CHANGES_HEARTBEAT_INTERVAL:
+                yield ': keepalive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(CHANGES_POLL_INTERVAL)
+    
+    response = Response(generate(since), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # 本文を送り始める前に切断された場合も枠を返す（ジェネレーターの finally は実行されない）
+    response.call_on_close(_wsgi_streams.release)
+    return response
+
+create_app()
+
 if __name__ == '__main__':
     app.run(debug=True, host='localhost', port=5000)
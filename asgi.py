@@ -0,0 +1,431 @@
+"""ASGIサーバーで動かすためのエントリーポイント
+
+    pip install uvicorn
+    uvicorn asgi:app --workers 4
+
+JSON API（エンティティ一覧・一括取得・履歴・差分・変更ログ）はイベントループ上の
+非同期ハンドラーで処理する。DBアクセスは db_pool の上限付きスレッドプールで実行し、
+独立したクエリは並行に発行する。ロングポーリングとSSEは待機中にスレッドを占有せず、
+変更ログの監視もプロセスで1つにまとめるため、1プロセスで多数の接続を保持できる。
+
+それ以外の画面・ログイン・書き込みAPIは、上限付きのスレッドプールでFlaskアプリ（WSGI）に
+そのまま渡すので、gunicorn で動かした場合と同じように動作する。
+"""
+import io
+import os
+import sys
+import time
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator
+
+from werkzeug.exceptions import HTTPException
+from werkzeug.routing import Map, Rule
+from werkzeug.wrappers import Request, Response
+
+import app as enty
+import compression
+import db_pool
+import instrumentation
+import rate_limit
+import reporting
+from db import EntityRepository, AttributeRepository, ChangeLogRepository
+
+# Flask（WSGI）側で同時に処理するリクエスト数
+ASGI_WSGI_THREADS = int(os.environ.get('ASGI_WSGI_THREADS', '16'))
+
+# ストリーミングのレスポンスで、スレッドプールの1回の呼び出しで進めて送る塊の数
+ASGI_STREAM_BATCH = int(os.environ.get('ASGI_STREAM_BATCH', '4'))
+
+flask_app = enty.app
+
+_wsgi_executor = ThreadPoolExecutor(max_workers=ASGI_WSGI_THREADS, thread_name_prefix='enty-wsgi')
+
+def build_environ(scope, body: bytes) -> dict:
+    """ASGIのHTTPスコープからWSGIのenvironを組み立てる"""
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+        'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+        'QUERY_STRING': scope['query_string'].decode('latin-1'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1] or 80),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': io.BytesIO(body),
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+
+    for name, value in scope['headers']:
+        name = name.decode('latin-1').lower()
+        value = value.decode('latin-1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        if key in environ:
+            value = environ[key] + ('; ' if key == 'HTTP_COOKIE' else ',') + value
+        environ[key] = value
+    return environ
+
+async def read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message['type'] != 'http.request':
+            break
+        chunks.append(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    return b''.join(chunks)
+
+async def call_wsgi(environ: dict, send):
+    """FlaskアプリをWSGIスレッドプールで実行し、レスポンスを順に送る"""
+    loop = asyncio.get_running_loop()
+
+    def send_from_thread(message):
+        asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+    def run():
+        started = []
+
+        def start_response(status, headers, exc_info=None):
+            started[:] = [{
+                'type': 'http.response.start',
+                'status': int(status.split(' ', 1)[0]),
+                'headers': [(name.lower().encode('latin-1'), value.encode('latin-1')) for name, value in headers],
+            }]
+
+        result = flask_app.wsgi_app(environ, start_response)
+        try:
+            sent_start = False
+            for chunk in result:
+                if not sent_start:
+                    send_from_thread(started[0])
+                    sent_start = True
+                if chunk:
+                    send_from_thread({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+            if not sent_start:
+                send_from_thread(started[0])
+            send_from_thread({'type': 'http.response.body', 'body': b''})
+        finally:
+            if hasattr(result, 'close'):
+                result.close()
+
+    await loop.run_in_executor(_wsgi_executor, run)
+
+class ChangeWatcher:
+    """変更ログの最新seqをプロセスで1つのタスクが監視し、待っている接続を起こす
+
+    接続ごとに変更ログをポーリングすると接続数に比例してクエリが増えるため、
+    ロングポーリング・SSEはここで新しい変更を待ってから変更ログを読む。
+    """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.latest = None
+        self._changed = None
+        self._task = None
+
+    def _ensure_started(self):
+        if self._task is None:
+            self._changed = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._poll())
+
+    async def _poll(self):
+        while True:
+            try:
+                latest = await db_pool.run(ChangeLogRepository.get_latest_seq)
+            except Exception as e:
+                print(f'Error polling change log: {e}')
+            else:
+                if latest != self.latest:
+                    self.latest = latest
+                    changed, self._changed = self._changed, asyncio.Event()
+                    changed.set()
+            await asyncio.sleep(self.interval)
+
+    async def wait(self, cursor: int, timeout: float) -> bool:
+        """cursor より新しい変更が記録されるまで最大 timeout 秒待つ"""
+        self._ensure_started()
+        deadline = time.monotonic() + timeout
+        while self.latest is None or self.latest <= cursor:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+changes_watcher = ChangeWatcher(enty.CHANGES_POLL_INTERVAL)
+
+# === 非同期ハンドラー（Flask側の同名のビューと同じ結果を返す） ===
+
+async def get_entities_json(request):
+    try:
+        # 最初の行まではここで読み、DBエラーは500で返す（残りは _respond が少しずつ書き出す）
+        entities = EntityRepository.iter_all_json(class_id=request.args.get('meta_id', type=int))
+        first = await db_pool.run(lambda: next(entities, None))
+        if first is None:
+            return 200, []
+        return 200, flask_app.json.stream_encoded_array(itertools.chain([first], entities))
+    except Exception as e:
+        print(f'Error getting entities JSON: {e}')
+        return 500, []
+
+async def query_entities_v1(request):
+    try:
+        entity_ids, view_date_str = enty.parse_entities_query(enty.parse_json_payload(request.get_json(silent=True)))
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    try:
+        entities, attributes = await db_pool.gather_async(
+            lambda: EntityRepository.get_many(entity_ids),
+            lambda: AttributeRepository.get_by_entity_ids_at_date(entity_ids, view_date_str))
+        return 200, enty.build_entities_query(entity_ids, view_date_str, entities, attributes)
+    except Exception as e:
+        print(f'Error querying entities: {e}')
+        return 500, {'error': 'エンティティの取得に失敗しました'}
+
+async def get_entity_timeline_v1(request, entity_id):
+    try:
+        entity, rows = await db_pool.gather_async(lambda: EntityRepository.get_by_id(entity_id),
+                                                  lambda: AttributeRepository.get_timeline(entity_id))
+        if not entity:
+            return 404, {'error': 'エンティティが見つかりません'}
+        return 200, enty.build_timeline(entity, rows)
+    except Exception as e:
+        print(f'Error getting entity timeline: {e}')
+        return 500, {'error': '履歴の取得に失敗しました'}
+
+async def get_diff_v1(request):
+    try:
+        date_from, date_to, entity_type_id = enty.parse_diff_params(request.args)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    try:
+        with reporting.snapshot() as info:
+            entity_rows, attribute_rows = await db_pool.gather_async(
+                lambda: EntityRepository.diff_between_dates(date_from, date_to, entity_type_id),
+                lambda: AttributeRepository.diff_between_dates(date_from, date_to, entity_type_id))
+        return 200, enty.build_diff(date_from, date_to, entity_rows, attribute_rows), reporting.headers(info)
+    except Exception as e:
+        print(f'Error getting diff: {e}')
+        return 500, {'error': '差分の取得に失敗しました'}
+
+async def get_changes_json(request):
+    since = enty.parse_changes_cursor(args=request.args, headers=request.headers)
+    try:
+        limit, wait = enty.parse_changes_params(request.args)
+    except ValueError as e:
+        return 400, {'error': str(e)}
+
+    try:
+        deadline = time.monotonic() + wait
+        changes = await db_pool.run(lambda: ChangeLogRepository.get_since(since, limit))
+        while not changes and time.monotonic() < deadline:
+            if not await changes_watcher.wait(since, deadline - time.monotonic()):
+                break
+            changes = await db_pool.run(lambda: ChangeLogRepository.get_since(since, limit))
+        return 200, enty.build_changes(changes, since, limit)
+    except Exception as e:
+        print(f'Error getting changes JSON: {e}')
+        return 500, {'error': '変更ログの取得に失敗しました'}
+
+async def stream_changes(request, send, headers):
+    """変更ログをSSEで配信（切断されるとタスクごとキャンセルされる）"""
+    cursor = enty.parse_changes_cursor(args=request.args, headers=request.headers)
+    await send({
+        'type': 'http.response.start',
+        'status': 200,
+        'headers': headers + [(b'content-type', b'text/event-stream; charset=utf-8'),
+                              (b'cache-control', b'no-cache'), (b'x-accel-buffering', b'no')],
+    })
+
+    async def write(text):
+        await send({'type': 'http.response.body', 'body': text.encode('utf-8'), 'more_body': True})
+
+    # 再接続間隔をクライアントへ通知
+    await write('retry: 3000\n\n')
+    last_sent = time.monotonic()
+    while True:
+        changes = await db_pool.run(lambda: ChangeLogRepository.get_since(cursor, enty.CHANGES_MAX_LIMIT))
+        if changes:
+            cursor = changes[-1]['seq']
+            await write(''.join(enty.format_change_event(change) for change in changes))
+            last_sent = time.monotonic()
+
+        if len(changes) == enty.CHANGES_MAX_LIMIT:
+            continue
+        if time.monotonic() - last_sent >= enty.CHANGES_HEARTBEAT_INTERVAL:
+            await write(': keepalive\n\n')
+            last_sent = time.monotonic()
+        await changes_watcher.wait(cursor, enty.CHANGES_HEARTBEAT_INTERVAL - (time.monotonic() - last_sent))
+
+routes = Map([
+    Rule('/api/entities', endpoint=get_entities_json, methods=['GET']),
+    Rule('/api/v1/entities/query', endpoint=query_entities_v1, methods=['POST']),
+    Rule('/api/v1/entities/<int:entity_id>/timeline', endpoint=get_entity_timeline_v1, methods=['GET']),
+    Rule('/api/v1/diff', endpoint=get_diff_v1, methods=['GET']),
+    Rule('/api/changes', endpoint=get_changes_json, methods=['GET']),
+    Rule('/api/changes/stream', endpoint=stream_changes, methods=['GET']),
+])
+
+def _match(environ):
+    """非同期ハンドラーで処理するリクエストなら (ハンドラー, URL引数) を返す"""
+    if environ['REQUEST_METHOD'] not in ('GET', 'POST'):
+        return None, None
+    try:
+        return routes.bind_to_environ(environ).match()
+    except HTTPException:
+        return None, None
+
+def _session_headers(session) -> list:
+    """セッションの保存（有効期限の延長）を行い、付与すべきヘッダーを返す"""
+    response = Response()
+    flask_app.session_interface.save_session(flask_app, session, response)
+    return [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in response.headers.items() if name in ('Set-Cookie', 'Vary')]
+
+async def _watch_disconnect(receive, task):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            task.cancel()
+            return
+
+async def _admit(endpoint, session, request):
+    """Flask側と同じレート・同時実行数の制限（バケットの更新と枠の待機はイベントループの外で行う）"""
+    limiter = rate_limit.limiter
+    if limiter is None or not limiter.limits(endpoint):
+        return lambda: None
+    return await asyncio.to_thread(limiter.admit, endpoint,
+                                   rate_limit.identity(session.get('user'), request.remote_addr))
+
+async def _send_rejected(error, send, headers):
+    with flask_app.app_context():
+        response = flask_app.json.response({'error': error.message})
+    await send({
+        'type': 'http.response.start',
+        'status': error.status,
+        'headers': headers + [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                              for name, value in response.headers.items()]
+                           + [(b'retry-after', str(error.retry_after).encode('latin-1'))],
+    })
+    await send({'type': 'http.response.body', 'body': response.get_data()})
+
+async def _respond(handler, values, request, receive, send, headers, stats):
+    if handler is stream_changes:
+        watcher = asyncio.create_task(_watch_disconnect(receive, asyncio.current_task()))
+        try:
+            await stream_changes(request, send, headers)
+        except asyncio.CancelledError:
+            pass
+        finally:
+            watcher.cancel()
+            instrumentation.record_request(stats, handler.__name__, request.method, 200)
+        return
+
+    # ハンドラーは (ステータス, 本文) か、追加のヘッダーを付けた (ステータス, 本文, ヘッダー) を返す
+    status, payload, *extra = await handler(request, **values)
+    if isinstance(payload, (bytes, Iterator)):
+        # エンコード済みのJSON、またはその塊を順に返すイテレーター
+        response = Response(payload, mimetype=flask_app.json.mimetype)
+    else:
+        with flask_app.app_context():
+            response = flask_app.json.response(payload)
+    for extra_headers in extra:
+        response.headers.update(extra_headers)
+    compression.compress_response(response, request.accept_encodings, flask_app.config['COMPRESS_MIN_SIZE'])
+    server_timing = instrumentation.record_request(stats, handler.__name__, request.method, status)
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': headers + [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                              for name, value in response.headers.items()]
+                           + [(b'server-timing', server_timing.encode('latin-1'))],
+    })
+    if not response.is_streamed:
+        await send({'type': 'http.response.body', 'body': response.get_data()})
+        return
+
+    # 読み出し・エンコード・圧縮はスレッドプールで進め、ASGI_STREAM_BATCH 個の塊ごとに送る
+    watcher = asyncio.create_task(_watch_disconnect(receive, asyncio.current_task()))
+    try:
+        async for batch in db_pool.iterate(iter(response.response), ASGI_STREAM_BATCH):
+            await send({'type': 'http.response.body', 'body': b''.join(batch), 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b''})
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        # ステータスは送信済みなので、本文を途中で打ち切る
+        print(f'Error streaming {handler.__name__}: {e}')
+    finally:
+        watcher.cancel()
+
+async def handle_http(scope, receive, send):
+    body = await read_body(receive)
+    environ = build_environ(scope, body)
+    handler, values = _match(environ)
+    if handler is None:
+        await call_wsgi(environ, send)
+        return
+
+    request = Request(environ)
+    session = await db_pool.run(lambda: flask_app.session_interface.open_session(flask_app, request))
+    if not session or not session.get('user'):
+        # 未ログイン時のリダイレクトとフラッシュメッセージはFlask側に任せる
+        await call_wsgi(build_environ(scope, body), send)
+        return
+
+    stats = instrumentation.begin_request()
+    headers = await db_pool.run(lambda: _session_headers(session))
+
+    try:
+        release = await _admit(handler.__name__, session, request)
+    except rate_limit.RequestRejected as e:
+        await _send_rejected(e, send, headers)
+        instrumentation.record_request(stats, handler.__name__, request.method, e.status)
+        return
+
+    try:
+        await _respond(handler, values, request, receive, send, headers, stats)
+    finally:
+        release()
+
+async def handle_lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            changes_watcher.stop()
+            _wsgi_executor.shutdown(wait=False, cancel_futures=True)
+            db_pool.shutdown()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+async def app(scope, receive, send):
+    if scope['type'] == 'http':
+        await handle_http(scope, receive, send)
+    elif scope['type'] == 'lifespan':
+        await handle_lifespan(receive, send)
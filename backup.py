@@ -0,0 +1,446 @@
+"""オンラインバックアップ・WALアーカイブ・ポイントインタイムリストア
+
+稼働中のデータベースをファイルコピーすると書き込み途中の状態を写して壊れるため、
+SQLiteのオンラインバックアップAPIで一貫したスナップショットを取る。
+数ページずつコピーしては休むことで、通常のリクエストを待たせないようにする。
+
+アーカイブモードでは起動時にベースバックアップを取り、その後は一定間隔で
+WALファイルに追記されたフレームをセグメントとして保存する。リストア時は
+ベースバックアップに指定時刻までのセグメントを順に適用する。
+
+    python backup.py backup --output data/backups/enty-manual.db
+    python backup.py archive --dir data/backups --interval 60 --base-interval 86400
+    python backup.py restore --dir data/backups --until 2024-06-01T12:00:00 --output restored.db
+    python backup.py verify restored.db
+"""
+import os
+import json
+import time
+import shutil
+import struct
+import sqlite3
+import argparse
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+import db
+
+# 1ステップでコピーするページ数と、ステップ間の休止秒数
+BACKUP_PAGES_PER_STEP = int(os.environ.get('BACKUP_PAGES_PER_STEP', '256'))
+BACKUP_STEP_PAUSE = float(os.environ.get('BACKUP_STEP_PAUSE', '0.005'))
+
+WAL_HEADER_SIZE = 32
+WAL_FRAME_HEADER_SIZE = 24
+
+def _now() -> str:
+    return datetime.now().isoformat(timespec='seconds')
+
+def _open_snapshot(path: str) -> sqlite3.Connection:
+    """読み取りトランザクションを開いた接続（閉じるまで同じ時点のデータが見える）"""
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute('BEGIN')
+    conn.execute('SELECT COUNT(*) FROM sqlite_master').fetchone()
+    return conn
+
+def backup_database(output: str, source_path: str = None, pages_per_step: int = None,
+                    step_pause: float = None) -> Dict[str, Any]:
+    """オンラインバックアップAPIで一貫したコピーを作成し、処理量を返す
+
+    コピー元は読み取りトランザクションを保持したまま少しずつ読むので、
+    途中で他の接続が書き込んでも最初からやり直しにならない。
+    """
+    source_path = source_path or db.DB_PATH
+    pages_per_step = pages_per_step or BACKUP_PAGES_PER_STEP
+    step_pause = BACKUP_STEP_PAUSE if step_pause is None else step_pause
+
+    output_dir = os.path.dirname(output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    temp_path = output + '.partial'
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+
+    steps = 0
+    total_pages = 0
+
+    def progress(status, remaining, total):
+        nonlocal steps, total_pages
+        steps += 1
+        total_pages = total
+        if remaining:
+            time.sleep(step_pause)
+
+    started = time.perf_counter()
+    source = _open_snapshot(source_path)
+    target = sqlite3.connect(temp_path)
+    try:
+        source.backup(target, pages=pages_per_step, progress=progress)
+        page_size = source.execute('PRAGMA page_size').fetchone()[0]
+    finally:
+        target.close()
+        source.close()
+    os.replace(temp_path, output)
+
+    seconds = time.perf_counter() - started
+    size = total_pages * page_size
+    return {
+        'output': output,
+        'pages': total_pages,
+        'bytes': size,
+        'steps': steps,
+        'seconds': round(seconds, 3),
+        'mb_per_second': round(size / 1024 / 1024 / seconds, 2) if seconds else None,
+    }
+
+def verify_database(path: str) -> Dict[str, Any]:
+    """整合性チェック（integrity_check・foreign_key_check）とテーブルごとの件数"""
+    conn = sqlite3.connect(path)
+    try:
+        integrity = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+        foreign_key_errors = conn.execute('PRAGMA foreign_key_check').fetchall()
+        tables = [row[0] for row in conn.execute("""
+            SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name
+        """)]
+        counts = {table: conn.execute(f'SELECT COUNT(*) FROM "{table}"').fetchone()[0] for table in tables}
+    finally:
+        conn.close()
+    return {
+        'ok': integrity == ['ok'],
+        'integrity_check': integrity[:20],
+        'foreign_key_errors': len(foreign_key_errors),
+        'tables': counts,
+    }
+
+class WALReader:
+    """WALファイルのヘッダーとフレームを読み、チェックサムが正しいコミット済みフレームまでを返す
+
+    書き込み途中のフレームはチェックサムが合わないので、そこで読むのをやめる。
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @staticmethod
+    def checksum(data: bytes, big_endian: bool, s0: int = 0, s1: int = 0):
+        """WALのチェックサム（8バイトごとに2つの32bit整数を累積）"""
+        values = struct.unpack(('>' if big_endian else '<') + f'{len(data) // 4}I', data)
+        for index in range(0, len(values), 2):
+            s0 = (s0 + values[index] + s1) & 0xFFFFFFFF
+            s1 = (s1 + values[index + 1] + s0) & 0xFFFFFFFF
+        return s0, s1
+
+    def read_header(self) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read(WAL_HEADER_SIZE)
+        except FileNotFoundError:
+            return None
+        if len(data) < WAL_HEADER_SIZE:
+            return None
+        magic, version, page_size, checkpoint_seq, salt1, salt2, cksum1, cksum2 = struct.unpack('>8I', data)
+        if magic not in (0x377F0682, 0x377F0683):
+            return None
+        big_endian = magic == 0x377F0683
+        if self.checksum(data[:24], big_endian) != (cksum1, cksum2):
+            return None
+        return {
+            'page_size': page_size,
+            'checkpoint_seq': checkpoint_seq,
+            'salt1': salt1,
+            'salt2': salt2,
+            'big_endian': big_endian,
+            'checksum': (cksum1, cksum2),
+            'bytes': data,
+        }
+
+    def read_committed(self, header: Dict[str, Any], offset: int, checksum) -> Dict[str, Any]:
+        """offset から読み、最後のコミットフレームの終わりまでのバイト列を返す"""
+        frame_size = WAL_FRAME_HEADER_SIZE + header['page_size']
+        with open(self.path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+
+        s0, s1 = checksum
+        position = 0
+        committed_end, committed_checksum = 0, checksum
+        frames = commits = 0
+        while position + frame_size <= len(data):
+            frame = data[position:position + frame_size]
+            pgno, commit_size, salt1, salt2, cksum1, cksum2 = struct.unpack('>6I', frame[:24])
+            if (salt1, salt2) != (header['salt1'], header['salt2']):
+                break
+            s0, s1 = self.checksum(frame[:8], header['big_endian'], s0, s1)
+            s0, s1 = self.checksum(frame[24:], header['big_endian'], s0, s1)
+            if (s0, s1) != (cksum1, cksum2):
+                break
+            position += frame_size
+            frames += 1
+            if commit_size:
+                commits += 1
+                committed_end, committed_checksum = position, (s0, s1)
+        return {
+            'data': data[:committed_end],
+            'checksum': committed_checksum,
+            'frames': frames,
+            'commits': commits,
+        }
+
+class WALArchiver:
+    """ベースバックアップとWALセグメントを1つのチェーン（ディレクトリ）に保存する
+
+    アーカイバーは常にどちらかの接続で読み取りトランザクションを保持する。
+    チェックポイントはその時点より先のフレームをデータベースへ書き戻せないため、
+    保存済みのフレームより先でWALが先頭から書き直されることはない。
+    """
+
+    def __init__(self, archive_dir: str, source_path: str = None, pages_per_step: int = None,
+                 step_pause: float = None):
+        self.archive_dir = archive_dir
+        self.source_path = source_path or db.DB_PATH
+        self.pages_per_step = pages_per_step
+        self.step_pause = step_pause
+        self.wal = WALReader(self.source_path + '-wal')
+        self.chain_dir = None
+        self.segment = 0
+        self.generation = None
+        self.offset = 0
+        self.checksum = None
+        self._snapshot = None
+
+    def _manifest(self, entry: Dict[str, Any]):
+        with open(os.path.join(self.chain_dir, 'manifest.jsonl'), 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+
+    def _renew_snapshot(self, checkpoint: bool = True):
+        """新しい読み取りトランザクションを開いてから古いものを閉じ、書き戻せる範囲を進める"""
+        previous = self._snapshot
+        self._snapshot = _open_snapshot(self.source_path)
+        if previous is not None:
+            previous.execute('COMMIT')
+            if checkpoint:
+                previous.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            previous.close()
+
+    def _release_and_checkpoint(self):
+        """保持している読み取りトランザクションを閉じ、WALを書き戻せるところまで書き戻す"""
+        previous, self._snapshot = self._snapshot, None
+        if previous is not None:
+            previous.execute('COMMIT')
+            previous.execute('PRAGMA wal_checkpoint(PASSIVE)')
+            previous.close()
+
+    def start_chain(self) -> Dict[str, Any]:
+        """ベースバックアップを取り、新しいチェーンを開始"""
+        # WALファイルが消えないように、先に接続を保持しておく
+        self._renew_snapshot()
+
+        self.chain_dir = os.path.join(self.archive_dir, datetime.now().strftime('%Y%m%dT%H%M%S'))
+        os.makedirs(self.chain_dir, exist_ok=True)
+        stats = backup_database(os.path.join(self.chain_dir, 'base.db'), self.source_path,
+                                self.pages_per_step, self.step_pause)
+        self._manifest({'type': 'base', 'file': 'base.db', 'created_at': _now(),
+                        'pages': stats['pages'], 'seconds': stats['seconds']})
+
+        # 現在のWALは先頭から保存する（ベースに含まれるフレームを再適用しても結果は同じ）
+        self.segment = 0
+        self.generation = None
+        self.archive_wal()
+        return stats
+
+    def _save_committed(self) -> Optional[Dict[str, Any]]:
+        """前回保存した位置以降にコミットされたフレームをセグメントとして保存"""
+        header = self.wal.read_header()
+        if header is None:
+            return None
+
+        generation = (header['salt1'], header['salt2'])
+        if generation != self.generation:
+            if self.generation is not None and header['salt1'] != (self.generation[0] + 1) & 0xFFFFFFFF:
+                # 保存していない世代がある（アーカイバー停止中など）ので新しいチェーンを始める
+                raise RuntimeError('WAL generation gap detected')
+            self.generation = generation
+            self.offset = WAL_HEADER_SIZE
+            self.checksum = header['checksum']
+            prefix = header['bytes']
+        else:
+            prefix = b''
+
+        committed = self.wal.read_committed(header, self.offset, self.checksum)
+        if not committed['data'] and not prefix:
+            return None
+
+        self.segment += 1
+        entry = {
+            'type': 'wal',
+            'file': f'{self.segment:06d}.wal',
+            'generation': f'{generation[0]:08x}{generation[1]:08x}',
+            'start': 0 if prefix else self.offset,
+            'end': self.offset + len(committed['data']),
+            'commits': committed['commits'],
+            'archived_at': _now(),
+        }
+        with open(os.path.join(self.chain_dir, entry['file']), 'wb') as f:
+            f.write(prefix + committed['data'])
+            f.flush()
+            os.fsync(f.fileno())
+        self._manifest(entry)
+
+        self.offset = entry['end']
+        self.checksum = committed['checksum']
+        return entry
+
+    def archive_wal(self) -> List[Dict[str, Any]]:
+        """前回以降にコミットされたWALフレームを保存し、保存したセグメントを返す
+
+        大部分は書き込みを止めずにコピーし、残りだけを書き込みロックを取ってコピーする。
+        ロック中に全フレームを書き戻してから読み取りトランザクションを開き直すので、
+        次の書き込みでWALが先頭から再利用され、ファイルが大きくなり続けることはない。
+        """
+        entries = [self._save_committed()]
+        self._renew_snapshot()
+
+        writer = sqlite3.connect(self.source_path, isolation_level=None)
+        try:
+            writer.execute('BEGIN IMMEDIATE')
+            entries.append(self._save_committed())
+            self._release_and_checkpoint()
+            self._snapshot = _open_snapshot(self.source_path)
+            writer.execute('ROLLBACK')
+        finally:
+            writer.close()
+        return [entry for entry in entries if entry]
+
+    def run(self, interval: float, base_interval: float, keep: int):
+        """interval 秒ごとにWALを保存し、base_interval 秒ごとにベースバックアップを取り直す"""
+        stats = self.start_chain()
+        print(f"base backup: {stats['pages']} pages in {stats['seconds']}s ({stats['mb_per_second']} MB/s)")
+        chain_started = time.monotonic()
+        while True:
+            time.sleep(interval)
+            try:
+                if time.monotonic() - chain_started >= base_interval:
+                    raise RuntimeError('base backup interval reached')
+                for entry in self.archive_wal():
+                    print(f"wal segment {entry['file']}: {entry['end'] - entry['start']} bytes, "
+                          f"{entry['commits']} commits")
+            except RuntimeError as e:
+                print(f'Starting new backup chain: {e}')
+                stats = self.start_chain()
+                chain_started = time.monotonic()
+                remove_old_chains(self.archive_dir, keep)
+            except OSError as e:
+                print(f'Error archiving WAL: {e}')
+
+def list_chains(archive_dir: str) -> List[Dict[str, Any]]:
+    """保存済みのチェーン（ベースバックアップとセグメント）を古い順に取得"""
+    chains = []
+    if not os.path.isdir(archive_dir):
+        return chains
+    for name in sorted(os.listdir(archive_dir)):
+        manifest = os.path.join(archive_dir, name, 'manifest.jsonl')
+        if not os.path.exists(manifest):
+            continue
+        with open(manifest, encoding='utf-8') as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+        if entries and entries[0]['type'] == 'base':
+            chains.append({'dir': os.path.join(archive_dir, name), 'base': entries[0], 'segments': entries[1:]})
+    return chains
+
+def remove_old_chains(archive_dir: str, keep: int):
+    """新しい順に keep 個を残して古いチェーンを削除"""
+    for chain in list_chains(archive_dir)[:-keep]:
+        shutil.rmtree(chain['dir'])
+
+def restore(archive_dir: str, output: str, until: str = None) -> Dict[str, Any]:
+    """until（ISO形式の日時、省略時は最新）時点の状態を output に復元して検証結果を返す"""
+    until = until or _now()
+    chains = [chain for chain in list_chains(archive_dir) if chain['base']['created_at'] <= until]
+    if not chains:
+        raise ValueError(f'{until} 以前のベースバックアップがありません')
+    chain = chains[-1]
+
+    for suffix in ('', '-wal', '-shm'):
+        if os.path.exists(output + suffix):
+            os.remove(output + suffix)
+    shutil.copyfile(os.path.join(chain['dir'], chain['base']['file']), output)
+
+    # 最初のセグメントはベースバックアップ直後に保存したもので、常に適用する
+    segments = [segment for index, segment in enumerate(chain['segments'])
+                if index == 0 or segment['archived_at'] <= until]
+    generations = []
+    for segment in segments:
+        if not generations or generations[-1][0] != segment['generation']:
+            generations.append((segment['generation'], []))
+        generations[-1][1].append(segment)
+
+    # 世代ごとにWALファイルを組み立て、SQLiteに回復させてからデータベースへ書き戻す
+    commits = 0
+    for _, generation_segments in generations:
+        with open(output + '-wal', 'wb') as wal:
+            for segment in generation_segments:
+                with open(os.path.join(chain['dir'], segment['file']), 'rb') as f:
+                    wal.write(f.read())
+                commits += segment['commits']
+        conn = sqlite3.connect(output)
+        try:
+            conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        finally:
+            conn.close()
+
+    result = verify_database(output)
+    result.update({
+        'base': chain['base']['created_at'],
+        'segments': len(segments),
+        'commits': commits,
+        'restored_to': segments[-1]['archived_at'] if segments else chain['base']['created_at'],
+    })
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='オンラインバックアップ・WALアーカイブ・リストア')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    backup_parser = subparsers.add_parser('backup', help='オンラインバックアップを1回取得')
+    backup_parser.add_argument('--output', default=f"data/backups/enty-{datetime.now():%Y%m%dT%H%M%S}.db")
+    backup_parser.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP, help='1ステップのページ数')
+    backup_parser.add_argument('--pause', type=float, default=BACKUP_STEP_PAUSE, help='ステップ間の休止秒数')
+
+    archive_parser = subparsers.add_parser('archive', help='ベースバックアップとWALアーカイブを定期実行')
+    archive_parser.add_argument('--dir', default='data/backups')
+    archive_parser.add_argument('--interval', type=float, default=60, help='WALを保存する間隔（秒）')
+    archive_parser.add_argument('--base-interval', type=float, default=86400, help='ベースバックアップの間隔（秒）')
+    archive_parser.add_argument('--keep', type=int, default=7, help='残すチェーンの数')
+    archive_parser.add_argument('--pages', type=int, default=BACKUP_PAGES_PER_STEP)
+    archive_parser.add_argument('--pause', type=float, default=BACKUP_STEP_PAUSE)
+
+    restore_parser = subparsers.add_parser('restore', help='指定時刻の状態を復元')
+    restore_parser.add_argument('--dir', default='data/backups')
+    restore_parser.add_argument('--until', help='復元する時刻（YYYY-MM-DDTHH:MM:SS、省略時は最新）')
+    restore_parser.add_argument('--output', required=True)
+
+    verify_parser = subparsers.add_parser('verify', help='データベースファイルを検証')
+    verify_parser.add_argument('path')
+
+    args = parser.parse_args()
+
+    if args.command == 'backup':
+        db.init_db()
+        stats = backup_database(args.output, pages_per_step=args.pages, step_pause=args.pause)
+        result = verify_database(args.output)
+        print(f"{stats['output']}: {stats['pages']} pages / {stats['bytes']} bytes in {stats['seconds']}s "
+              f"({stats['mb_per_second']} MB/s, {stats['steps']} steps), integrity: {'ok' if result['ok'] else 'NG'}")
+    elif args.command == 'archive':
+        db.init_db()
+        WALArchiver(args.dir, pages_per_step=args.pages, step_pause=args.pause).run(
+            args.interval, args.base_interval, args.keep)
+    elif args.command == 'restore':
+        result = restore(args.dir, args.output, args.until)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    elif args.command == 'verify':
+        result = verify_database(args.path)
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+        if not result['ok']:
+            raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
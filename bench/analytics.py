@@ -0,0 +1,100 @@
+"""時系列集計の計測（イベントスイープ / 日付ごとの問い合わせ）
+
+同じ期間・バケットのエンティティ数を次の方法で求め、所要時間を比較する（結果が一致することも確認する）。
+
+- per-date: バケットごとに EntityRepository.get_by_type_at_date を呼ぶ（従来の方法）
+- sweep: AnalyticsRepository.count_series の1回の問い合わせ
+- sweep (group_by): 属性値ごとの内訳付き
+- cached: 2回目以降（変更履歴が進んでいなければキャッシュから返す）
+
+    python -m bench.analytics --preset medium --bucket day
+"""
+import argparse
+import os
+import time
+from datetime import date
+
+def _time(func, repeat: int):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+def measure(start: date, end: date, bucket: str, repeat: int) -> dict:
+    import analytics
+    from db import AnalyticsRepository, AttributeMetaRepository, EntityRepository, get_connection
+
+    with get_connection() as conn:
+        entity_class_id = conn.execute("""
+            SELECT class_id FROM entity_instance GROUP BY class_id ORDER BY COUNT(*) DESC LIMIT 1
+        """).fetchone()[0]
+    attributes = AttributeMetaRepository.get_by_entity_meta_id(entity_class_id)
+    group_by = attributes[0]['identifier'] if attributes else None
+    buckets = analytics.bucket_starts(start, end, bucket)
+
+    def sweep():
+        counts = dict.fromkeys(buckets, 0)
+        for row in AnalyticsRepository.count_series(buckets, entity_class_id):
+            counts[row['bucket']] = row['active']
+        return counts
+
+    cases = {
+        'per-date': lambda: {day: len(EntityRepository.get_by_type_at_date(entity_class_id, day)) for day in buckets},
+        'sweep': sweep,
+    }
+    if group_by is not None:
+        cases['sweep (group_by)'] = lambda: AnalyticsRepository.count_series(buckets, entity_class_id, group_by)
+
+    results = {}
+    expected = None
+    for name, func in cases.items():
+        seconds, result = _time(func, repeat)
+        if name in ('per-date', 'sweep'):
+            if expected is not None and result != expected:
+                raise AssertionError(f'{name} の結果が per-date と一致しません')
+            expected = result
+        results[name] = {'seconds': round(seconds, 4)}
+
+    analytics.cache.clear()
+    analytics.time_series(start, end, bucket, entity_class_id)
+    seconds, _ = _time(lambda: analytics.time_series(start, end, bucket, entity_class_id), repeat)
+    results['cached'] = {'seconds': round(seconds, 4)}
+    return {'buckets': len(buckets), 'entity_class_id': entity_class_id, 'group_by': group_by, 'cases': results}
+
+def main():
+    parser = argparse.ArgumentParser(description='時系列集計（イベントスイープ）と日付ごとの問い合わせを比較')
+    parser.add_argument('--preset', default='small', choices=['small', 'medium', 'large'],
+                        help='bench.generate のプリセット')
+    parser.add_argument('--db', help='計測に使うデータベース（既定は data/bench-<preset>.db）')
+    parser.add_argument('--start', default='2020-01-01')
+    parser.add_argument('--end', default='2024-12-31')
+    parser.add_argument('--bucket', default='month', choices=['day', 'week', 'month'])
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    db_path = args.db or f'data/bench-{args.preset}.db'
+    if not os.path.exists(db_path):
+        from bench.generate import PRESETS, generate
+        print(f'Generating {db_path} ({args.preset})...')
+        generate(db_path, **PRESETS[args.preset])
+
+    # リポジトリ層がベンチマーク用のデータベースを使うように切り替える
+    os.environ['ENTY_DB_PATH'] = db_path
+    import db
+    db.DB_PATH = db_path
+    # per-date は日付ごとの問い合わせの所要時間を比べるので、時点指定の読み取り結果のキャッシュは外す
+    db.as_of_cache.maxsize = 0
+
+    result = measure(date.fromisoformat(args.start), date.fromisoformat(args.end), args.bucket, args.repeat)
+    print(f'{result["buckets"]} {args.bucket} buckets, entity class {result["entity_class_id"]}, '
+          f'group_by attribute class {result["group_by"]}')
+    baseline = result['cases']['per-date']['seconds']
+    print(f'{"case":<18} {"seconds":>9} {"speedup":>8}')
+    for name, case in result['cases'].items():
+        print(f'{name:<18} {case["seconds"]:>9.4f} {baseline / case["seconds"]:>7.1f}x')
+
+if __name__ == '__main__':
+    main()
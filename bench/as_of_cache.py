@@ -0,0 +1,108 @@
+"""時点指定の読み取り結果のキャッシュ（db.as_of_cache）の計測
+
+日付を1日ずつ送りながら一覧（EntityRepository.get_by_type_at_date）と詳細の属性
+（AttributeRepository.get_by_entity_id_at_date）を読む操作と、今日の日付での属性値の書き込みを
+交互に繰り返し、キャッシュなし / ありで読み取りの所要時間とヒット率を比較する。
+書き込みは今日以降の時点にしか掛からないので、過去の日付の結果はキャッシュに残る。
+書き込みはデータベースのコピーに対して行う。
+
+    python -m bench.as_of_cache --preset medium --dates 60 --rounds 20
+"""
+import argparse
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+from bench.generate import PRESETS, generate
+from bench.run import _sample_ids
+
+def measure(db_path: str, dates: int, rounds: int, writes: int, seed: int) -> dict:
+    import db
+    from db import AttributeRepository, EntityRepository
+
+    ids = _sample_ids(db_path)
+    rng = random.Random(seed)
+    today = date.today().isoformat()
+    view_dates = [(date.today() - timedelta(days=offset)).isoformat() for offset in range(dates)]
+    with db.get_connection() as conn:
+        entity_ids = [row[0] for row in conn.execute("""
+            SELECT identifier FROM entity_instance WHERE class_id = ? AND date_out IS NULL LIMIT 200
+        """, (ids['entity_class_id'],))]
+        class_ids = [row[0] for row in conn.execute("""
+            SELECT identifier FROM attribute_class WHERE entity_id = ? AND data_type != 'ENTITY'
+        """, (ids['entity_class_id'],))]
+    detail_ids = rng.sample(entity_ids, min(10, len(entity_ids)))
+
+    def read_round():
+        started = time.perf_counter()
+        for view_date in view_dates:
+            EntityRepository.get_by_type_at_date(ids['entity_class_id'], view_date)
+            for entity_id in detail_ids:
+                AttributeRepository.get_by_entity_id_at_date(entity_id, view_date)
+        return time.perf_counter() - started
+
+    def write_round():
+        # 画面の値の変更と同じく、今の値に今日の無効日を設定してから新しい値を追加する
+        for _ in range(writes):
+            entity_id, class_id = rng.choice(entity_ids), rng.choice(class_ids)
+            for current in AttributeRepository.get_active_by_entity_and_class(entity_id, class_id):
+                AttributeRepository.logical_delete(current['identifier'], today)
+            AttributeRepository.create(f'bench-{rng.randrange(10 ** 6)}', class_id, entity_id, today)
+
+    result = {}
+    for label, size in (('no_cache', 0), ('cache', db.AS_OF_CACHE_SIZE)):
+        db.as_of_cache.clear()
+        # キャッシュなしでは参照数も数えないので、ヒット率はキャッシュありの回だけになる
+        db.as_of_cache.maxsize = size
+        samples = []
+        for _ in range(rounds):
+            samples.append(read_round())
+            write_round()
+        result[label] = {
+            'median_round_ms': round(statistics.median(samples) * 1000, 2),
+            'first_round_ms': round(samples[0] * 1000, 2),
+            'stats': db.as_of_cache.stats(),
+        }
+    result['reads_per_round'] = dates * (1 + len(detail_ids))
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='時点指定の読み取り結果のキャッシュを計測')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--db', help='元にするデータベース（既定は data/bench-<preset>.db、コピーに書き込む）')
+    parser.add_argument('--dates', type=int, default=60, help='1ラウンドで送る日付の数')
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--writes', type=int, default=5, help='ラウンドごとに今日の日付で書き込む属性値の数')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    source = args.db or f'data/bench-{args.preset}.db'
+    if not os.path.exists(source):
+        generate(source, **PRESETS[args.preset])
+
+    workdir = tempfile.mkdtemp(prefix='enty-as-of-cache-bench-')
+    try:
+        db_path = os.path.join(workdir, 'bench.db')
+        shutil.copyfile(source, db_path)
+        # リポジトリ層がコピーしたデータベースを使うように切り替える
+        os.environ['ENTY_DB_PATH'] = db_path
+        import db
+        db.DB_PATH = db_path
+        db.init_db(db_path)
+        result = measure(db_path, args.dates, args.rounds, args.writes, args.seed)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"{result['reads_per_round']} reads per round, {args.writes} writes dated today between rounds")
+    print(f'{"case":<10} {"first round ms":>15} {"median round ms":>16}  hit ratio')
+    for label in ('no_cache', 'cache'):
+        case = result[label]
+        ratios = ', '.join(f"{query.split('.')[-1]} {stats['hit_ratio']:.2f}" for query, stats in case['stats'].items())
+        print(f"{label:<10} {case['first_round_ms']:>15.2f} {case['median_round_ms']:>16.2f}  {ratios or '-'}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""バックアップ中のリクエスト遅延の計測
+
+主要ルート（bench.run と同じ）を一定時間繰り返し、バックアップなし・
+オンラインバックアップ実行中・WALアーカイブ実行中の p50/p99 を比較する。
+バックアップのスループット（MB/s）も表示する。
+
+    python -m bench.backup_impact --preset medium --seconds 10
+    python -m bench.backup_impact --pages 64 --pause 0.01
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from bench.generate import PRESETS, generate
+from bench.run import _sample_ids, route_benchmarks
+
+def _percentile(samples, ratio: float) -> float:
+    return round(samples[min(len(samples) - 1, int(len(samples) * ratio))], 3)
+
+def _drive(benchmarks, seconds: float) -> dict:
+    """seconds 秒間ルートを順に呼び出し、ルートごとの遅延（ミリ秒）を返す"""
+    samples = {name: [] for name, _ in benchmarks}
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        for name, func in benchmarks:
+            started = time.perf_counter()
+            func()
+            samples[name].append((time.perf_counter() - started) * 1000)
+
+    summary = {}
+    for name, values in samples.items():
+        values.sort()
+        summary[name] = {'runs': len(values), 'p50_ms': _percentile(values, 0.5), 'p99_ms': _percentile(values, 0.99)}
+    return summary
+
+def _in_background(target):
+    """target(stop) を別スレッドで動かし、停止用の関数を返す"""
+    stop = threading.Event()
+    thread = threading.Thread(target=target, args=(stop,), daemon=True)
+    thread.start()
+
+    def finish():
+        stop.set()
+        thread.join()
+    return finish
+
+def measure(db_path: str, seconds: float, pages_per_step: int, step_pause: float) -> dict:
+    import backup
+
+    benchmarks = route_benchmarks(_sample_ids(db_path))
+    workdir = tempfile.mkdtemp(prefix='enty-backup-bench-')
+    backups = []
+
+    def backup_loop(stop):
+        while not stop.is_set():
+            backups.append(backup.backup_database(os.path.join(workdir, 'backup.db'), db_path,
+                                                  pages_per_step, step_pause))
+
+    def archive_loop(stop):
+        archiver = backup.WALArchiver(os.path.join(workdir, 'archive'), db_path, pages_per_step, step_pause)
+        archiver.start_chain()
+        while not stop.wait(1):
+            archiver.archive_wal()
+
+    try:
+        result = {'idle': _drive(benchmarks, seconds)}
+
+        finish = _in_background(backup_loop)
+        result['backup'] = _drive(benchmarks, seconds)
+        finish()
+
+        finish = _in_background(archive_loop)
+        result['archive'] = _drive(benchmarks, seconds)
+        finish()
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    result['throughput'] = {
+        'backups': len(backups),
+        'bytes': backups[-1]['bytes'] if backups else 0,
+        'median_seconds': sorted(stats['seconds'] for stats in backups)[len(backups) // 2] if backups else None,
+        'mb_per_second': sorted(stats['mb_per_second'] for stats in backups)[len(backups) // 2] if backups else None,
+    }
+    return result
+
+def main():
+    import backup
+
+    parser = argparse.ArgumentParser(description='バックアップ中のリクエスト遅延を計測')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--db', help='計測に使うデータベース（既定は data/bench-<preset>.db）')
+    parser.add_argument('--seconds', type=float, default=10, help='各フェーズの計測時間')
+    parser.add_argument('--pages', type=int, default=backup.BACKUP_PAGES_PER_STEP, help='1ステップのページ数')
+    parser.add_argument('--pause', type=float, default=backup.BACKUP_STEP_PAUSE, help='ステップ間の休止秒数')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    db_path = args.db or f'data/bench-{args.preset}.db'
+    if not os.path.exists(db_path):
+        generate(db_path, **PRESETS[args.preset])
+
+    # リポジトリ層とアプリが計測用のデータベースを使うように切り替える
+    os.environ['ENTY_DB_PATH'] = db_path
+    import db
+    db.DB_PATH = db_path
+    db.init_db(db_path)
+
+    result = measure(db_path, args.seconds, args.pages, args.pause)
+
+    throughput = result['throughput']
+    print(f"backup: {throughput['backups']} runs, {throughput['bytes']} bytes, "
+          f"median {throughput['median_seconds']}s ({throughput['mb_per_second']} MB/s)")
+    print(f"{'route':<36} {'idle p50/p99':>18} {'backup p50/p99':>18} {'archive p50/p99':>18}")
+    for name in result['idle']:
+        cells = [f"{result[phase][name]['p50_ms']:.2f}/{result[phase][name]['p99_ms']:.2f}"
+                 for phase in ('idle', 'backup', 'archive')]
+        print(f'{name:<36} ' + ' '.join(f'{cell:>18}' for cell in cells))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'preset': args.preset, 'pages_per_step': args.pages, 'step_pause': args.pause, **result},
+                      f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,187 @@
+"""ベンチマーク用の合成データ生成
+
+シード固定の乱数で、複数年にわたる履歴を持つエンティティ・属性データを生成する。
+同じパラメータとシードからは常に同じデータベースができるため、
+実行ごとの計測結果を比較できる。
+
+    python -m bench.generate --output data/bench.db --preset medium
+"""
+import argparse
+import os
+import random
+import sqlite3
+import time
+from datetime import date, timedelta
+
+# 生成規模のプリセット（属性バージョン数はおおよそ classes × entities × attributes × versions）
+PRESETS = {
+    'small': {'classes': 3, 'attributes': 5, 'entities': 500, 'versions': 3, 'years': 3},
+    'medium': {'classes': 5, 'attributes': 8, 'entities': 5000, 'versions': 5, 'years': 5},
+    'large': {'classes': 8, 'attributes': 10, 'entities': 25000, 'versions': 6, 'years': 10},
+}
+
+# 属性値の語彙（実データに近い値の偏りを出すため、先頭ほど選ばれやすくする）
+VOCABULARY = {
+    'OS': ['Ubuntu 22.04', 'Ubuntu 20.04', 'RHEL 9', 'RHEL 8', 'Windows Server 2022', 'CentOS 7', 'Debian 12'],
+    'エンジン': ['PostgreSQL', 'MySQL', 'SQLite', 'Oracle', 'SQL Server'],
+    'バージョン': ['1.0.0', '1.1.0', '1.2.3', '2.0.0', '2.1.4', '3.0.0'],
+    'メモリ': ['8GB', '16GB', '32GB', '64GB', '128GB'],
+    'CPU': ['Intel Xeon E5-2680', 'Intel Xeon Gold 6248', 'AMD EPYC 7543', 'Apple M2'],
+    '部署': ['営業部', '開発部', '総務部', '経理部', '情報システム部'],
+    'ロケーション': ['東京', '大阪', '名古屋', '福岡', '札幌'],
+}
+
+def _weighted_choice(rng: random.Random, values):
+    """先頭ほど選ばれやすい重み付き選択"""
+    weights = [1.0 / (index + 1) for index in range(len(values))]
+    return rng.choices(values, weights)[0]
+
+def _random_interval_dates(rng: random.Random, start: date, end: date, count: int):
+    """start〜end の間を count 個の連続した区間に分割する境界日付"""
+    span = (end - start).days
+    cuts = sorted(rng.sample(range(1, span), min(count - 1, span - 1))) if count > 1 and span > 1 else []
+    return [start] + [start + timedelta(days=cut) for cut in cuts]
+
+def generate(output: str, classes: int, attributes: int, entities: int, versions: int,
+             years: int, seed: int = 42, entity_ref_ratio: float = 0.2, retire_ratio: float = 0.15,
+             end_date: date = date(2024, 12, 31)) -> dict:
+    """合成データベースを生成し、生成件数を返す
+
+    entities は1クラスあたりの件数、versions は属性ごとの平均バージョン数。
+    """
+    rng = random.Random(seed)
+    started = time.perf_counter()
+
+    if os.path.exists(output):
+        os.remove(output)
+    output_dir = os.path.dirname(output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    conn = sqlite3.connect(output)
+    # 生成中は耐障害性より速度を優先
+    conn.execute('PRAGMA journal_mode = OFF')
+    conn.execute('PRAGMA synchronous = OFF')
+    with open('init.sql', 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+
+    start_date = end_date - timedelta(days=365 * years)
+    vocabulary_names = list(VOCABULARY)
+
+    # エンティティクラスと属性クラス
+    class_rows = [(class_id, f'クラス{class_id:02d}') for class_id in range(1, classes + 1)]
+    conn.executemany('INSERT INTO entity_class (identifier, title) VALUES (?, ?)', class_rows)
+
+    attribute_rows = []
+    attribute_id = 0
+    for class_id in range(1, classes + 1):
+        for order in range(1, attributes + 1):
+            attribute_id += 1
+            if rng.random() < entity_ref_ratio and classes > 1:
+                attribute_rows.append((attribute_id, f'参照{order:02d}', class_id, 'ENTITY', order))
+            else:
+                name = vocabulary_names[(attribute_id - 1) % len(vocabulary_names)]
+                title = name if order <= len(vocabulary_names) else f'{name}{order:02d}'
+                attribute_rows.append((attribute_id, title, class_id, 'TEXT', order))
+    conn.executemany("""
+        INSERT INTO attribute_class (identifier, title, entity_id, data_type, order_display)
+        VALUES (?, ?, ?, ?, ?)
+    """, attribute_rows)
+
+    # エンティティインスタンス（期間内のどこかで登録され、一部は廃止される）
+    entity_rows = []
+    entity_id = 0
+    for class_id in range(1, classes + 1):
+        for index in range(entities):
+            entity_id += 1
+            date_in = start_date + timedelta(days=rng.randrange((end_date - start_date).days - 30))
+            date_out = None
+            if rng.random() < retire_ratio:
+                date_out = date_in + timedelta(days=rng.randrange(30, max((end_date - date_in).days, 31)))
+            entity_rows.append((entity_id, f'entity-{class_id:02d}-{index:06d}', class_id,
+                                date_in.isoformat(), date_out.isoformat() if date_out else None))
+    conn.executemany("""
+        INSERT INTO entity_instance (identifier, title, class_id, date_in, date_out)
+        VALUES (?, ?, ?, ?, ?)
+    """, entity_rows)
+    total_entities = entity_id
+
+    # 属性インスタンス（エンティティの有効期間を連続したバージョンに分割）
+    attribute_count = 0
+    batch = []
+    attributes_by_class = {}
+    for row in attribute_rows:
+        attributes_by_class.setdefault(row[2], []).append(row)
+
+    for entity_id, _, class_id, date_in, date_out in entity_rows:
+        entity_start = date.fromisoformat(date_in)
+        entity_end = date.fromisoformat(date_out) if date_out else end_date
+        for attr_id, title, _, data_type, _ in attributes_by_class[class_id]:
+            count = max(1, int(rng.expovariate(1.0 / versions)))
+            boundaries = _random_interval_dates(rng, entity_start, entity_end, count)
+            for index, version_start in enumerate(boundaries):
+                if index + 1 < len(boundaries):
+                    version_end = boundaries[index + 1].isoformat()
+                else:
+                    version_end = date_out
+                if data_type == 'ENTITY':
+                    value = str(rng.randrange(1, total_entities + 1))
+                else:
+                    name = title.rstrip('0123456789')
+                    value = _weighted_choice(rng, VOCABULARY[name]) if name in VOCABULARY else f'{title}-{rng.randrange(1000)}'
+                batch.append((value, attr_id, entity_id, version_start.isoformat(), version_end))
+            if len(batch) >= 50000:
+                conn.executemany("""
+                    INSERT INTO attribute_instance (title, class_id, entity_id, date_in, date_out)
+                    VALUES (?, ?, ?, ?, ?)
+                """, batch)
+                attribute_count += len(batch)
+                batch = []
+    if batch:
+        conn.executemany("""
+            INSERT INTO attribute_instance (title, class_id, entity_id, date_in, date_out)
+            VALUES (?, ?, ?, ?, ?)
+        """, batch)
+        attribute_count += len(batch)
+
+    conn.commit()
+    with open('upgrade.sql', 'r', encoding='utf-8') as f:
+        conn.executescript(f.read())
+    conn.execute('ANALYZE')
+    conn.commit()
+    conn.close()
+
+    return {
+        'entity_classes': classes,
+        'attribute_classes': len(attribute_rows),
+        'entities': total_entities,
+        'attribute_versions': attribute_count,
+        'seed': seed,
+        'start_date': start_date.isoformat(),
+        'end_date': end_date.isoformat(),
+        'seconds': round(time.perf_counter() - started, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='ベンチマーク用の合成データベースを生成')
+    parser.add_argument('--output', default='data/bench.db', help='出力するデータベースファイル')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--classes', type=int, help='エンティティクラス数')
+    parser.add_argument('--attributes', type=int, help='クラスあたりの属性数')
+    parser.add_argument('--entities', type=int, help='クラスあたりのエンティティ数')
+    parser.add_argument('--versions', type=int, help='属性あたりの平均バージョン数')
+    parser.add_argument('--years', type=int, help='履歴の年数')
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    params = dict(PRESETS[args.preset])
+    for key in params:
+        if getattr(args, key) is not None:
+            params[key] = getattr(args, key)
+
+    summary = generate(args.output, seed=args.seed, **params)
+    for key, value in summary.items():
+        print(f'{key}: {value}')
+
+if __name__ == '__main__':
+    main()
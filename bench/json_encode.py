@@ -0,0 +1,119 @@
+"""JSONシリアライズのスループット計測
+
+/api/entities と同じ内容（既定で10万件）を次の方法でJSONにし、所要時間と件数・バイト数の
+スループットを比較する。DBの読み取りを含む場合（end-to-end）と、用意済みの辞書の
+エンコードだけの場合（encode only）を分けて表示する。
+
+- jsonify (json): 行を辞書に詰め替えて標準ライブラリでまとめてエンコード（従来の方法）
+- jsonify (orjson): 同じ辞書を orjson プロバイダーでエンコード
+- stream_array (json / orjson): 辞書を1000件ずつエンコードして書き出す
+- SQL json_object: SQLiteが組み立てた行ごとのJSONをつなぐ（辞書を作らない）
+
+    python -m bench.json_encode --entities 100000
+"""
+import argparse
+import json
+import os
+import time
+
+from flask import Flask
+
+import json_provider
+
+def _providers() -> dict:
+    """比較するプロバイダー（orjson が無ければ標準のみ）"""
+    providers = {}
+    for name, cls in (('json', json_provider.StreamingJSONProvider), ('orjson', json_provider.OrjsonProvider)):
+        if name == 'orjson' and json_provider.orjson is None:
+            continue
+        app = Flask(__name__)
+        app.json = cls(app)
+        providers[name] = app
+    return providers
+
+def _rows_to_dicts():
+    from db import EntityRepository
+    return [{'identifier': row['identifier'], 'title': row['title'], 'type_name': row['type_name']}
+            for row in EntityRepository.iter_all()]
+
+def _time(func, repeat: int):
+    best = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        size = func()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return best, size
+
+def measure(count: int, repeat: int) -> dict:
+    from db import EntityRepository
+
+    providers = _providers()
+    prepared = _rows_to_dicts()
+    cases = {}
+
+    for name, app in providers.items():
+        cases[f'jsonify ({name})'] = (
+            lambda app=app: len(app.json.response(_rows_to_dicts()).get_data()),
+            lambda app=app: len(app.json.response(prepared).get_data()),
+        )
+        cases[f'stream_array ({name})'] = (
+            lambda app=app: sum(len(chunk) for chunk in app.json.stream_array(
+                {'identifier': row['identifier'], 'title': row['title'], 'type_name': row['type_name']}
+                for row in EntityRepository.iter_all())),
+            lambda app=app: sum(len(chunk) for chunk in app.json.stream_array(prepared)),
+        )
+    app = next(iter(providers.values()))
+    cases['SQL json_object'] = (
+        lambda: sum(len(chunk) for chunk in app.json.stream_encoded_array(EntityRepository.iter_all_json())),
+        None,
+    )
+
+    results = {}
+    for name, (end_to_end, encode_only) in cases.items():
+        seconds, size = _time(end_to_end, repeat)
+        result = {
+            'seconds': round(seconds, 3),
+            'rows_per_second': round(count / seconds),
+            'mb_per_second': round(size / seconds / 1024 / 1024, 1),
+            'bytes': size,
+        }
+        if encode_only is not None:
+            encode_seconds, _ = _time(encode_only, repeat)
+            result['encode_seconds'] = round(encode_seconds, 3)
+            result['encode_rows_per_second'] = round(count / encode_seconds)
+        results[name] = result
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='JSONシリアライズのスループットを計測')
+    parser.add_argument('--entities', type=int, default=100000, help='エンティティの総数')
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=3, help='各方法の実行回数（最短時間を採用）')
+    parser.add_argument('--db', help='計測に使うデータベース（既定は data/bench-memory-<件数>.db）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    db_path = args.db or f'data/bench-memory-{args.entities}.db'
+    if not os.path.exists(db_path):
+        from bench.generate import generate
+        print(f'Generating {db_path}...')
+        generate(db_path, classes=args.classes, attributes=1, entities=args.entities // args.classes,
+                 versions=1, years=5)
+
+    import db
+    db.DB_PATH = db_path
+
+    results = measure(args.entities, args.repeat)
+    print(f'{"method":<24} {"end-to-end s":>13} {"rows/s":>10} {"MB/s":>7} {"encode only s":>14} {"rows/s":>10}')
+    for name, result in results.items():
+        encode = (f'{result["encode_seconds"]:>14} {result["encode_rows_per_second"]:>10}'
+                  if 'encode_seconds' in result else f'{"-":>14} {"-":>10}')
+        print(f'{name:<24} {result["seconds"]:>13} {result["rows_per_second"]:>10} {result["mb_per_second"]:>7} {encode}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
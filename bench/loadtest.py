@@ -0,0 +1,299 @@
+"""HTTP負荷試験ドライバー
+
+多数の仮想ユーザーがローカルOIDCプロバイダー（bench.mock_oidc）経由でログインし、
+一覧・詳細・日付の連続切り替え・属性編集を混ぜた操作を繰り返す。
+終了時にスループット、p50/p99レイテンシ、エラー率を操作別に表示する。
+
+    # モックOIDCとgunicorn（4ワーカー）を起動して計測
+    python -m bench.loadtest --serve --workers 4 --users 50 --duration 60
+
+    # ASGI（uvicorn）で起動し、JSON APIと変更ログのロングポーリングを多めに混ぜる
+    python -m bench.loadtest --serve --asgi --users 500 --mix list=20,detail=20,api=30,watch=30
+
+    # 起動済みのアプリに対して計測（アプリ側はモックOIDCを向いていること）
+    python -m bench.loadtest --base-url http://127.0.0.1:8000 --users 50
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from datetime import date, timedelta
+from urllib.parse import urlparse
+
+import requests
+
+from bench import mock_oidc
+
+# 既定の操作の比率
+DEFAULT_MIX = 'list=35,detail=35,scrub=20,edit=10'
+
+class Recorder:
+    """操作別のレイテンシとエラーを集計"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, action: str, elapsed: float, ok: bool):
+        with self._lock:
+            self.samples.setdefault(action, []).append(elapsed)
+            if not ok:
+                self.errors[action] = self.errors.get(action, 0) + 1
+
+    @staticmethod
+    def _percentile(values, ratio):
+        ordered = sorted(values)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * ratio))]
+
+    def summary(self, duration: float) -> dict:
+        with self._lock:
+            actions = {}
+            all_samples = []
+            for action, values in sorted(self.samples.items()):
+                all_samples.extend(values)
+                actions[action] = {
+                    'requests': len(values),
+                    'errors': self.errors.get(action, 0),
+                    'p50_ms': round(statistics.median(values) * 1000, 1),
+                    'p99_ms': round(self._percentile(values, 0.99) * 1000, 1),
+                }
+            total_errors = sum(self.errors.values())
+        return {
+            'duration_s': round(duration, 1),
+            'requests': len(all_samples),
+            'throughput_rps': round(len(all_samples) / duration, 1) if duration else 0,
+            'error_rate': round(total_errors / len(all_samples), 4) if all_samples else 0,
+            'p50_ms': round(statistics.median(all_samples) * 1000, 1) if all_samples else None,
+            'p99_ms': round(self._percentile(all_samples, 0.99) * 1000, 1) if all_samples else None,
+            'actions': actions,
+        }
+
+class VirtualUser(threading.Thread):
+    """ログインして操作の比率に従ってリクエストを送り続ける仮想ユーザー"""
+
+    def __init__(self, index: int, base_url: str, mix: dict, recorder: Recorder, stop: threading.Event,
+                 think_time: float, seed: int):
+        super().__init__(daemon=True)
+        self.base_url = base_url.rstrip('/')
+        self.mix = mix
+        self.recorder = recorder
+        self.stop = stop
+        self.think_time = think_time
+        self.rng = random.Random(seed + index)
+        self.session = requests.Session()
+        self.entities = []
+        self.change_cursor = None
+
+    def _request(self, action: str, method: str, path: str, **kwargs) -> requests.Response:
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, self.base_url + path, timeout=30, **kwargs)
+            # ログイン切れはトップページへのリダイレクトになるのでエラーとして扱う
+            ok = response.status_code < 400 and not (response.history and urlparse(response.url).path == '/')
+        except requests.RequestException:
+            response, ok = None, False
+        self.recorder.record(action, time.perf_counter() - started, ok)
+        return response
+
+    def login(self) -> bool:
+        response = self._request('login', 'GET', '/login')
+        if response is None or not response.url.endswith('/profile'):
+            return False
+        entities = self._request('api_entities', 'GET', '/api/entities')
+        if entities is not None and entities.ok:
+            self.entities = [entity['identifier'] for entity in entities.json()]
+        return bool(self.entities)
+
+    def _random_date(self) -> date:
+        return date.today() - timedelta(days=self.rng.randrange(0, 365 * 3))
+
+    def do_list(self):
+        self._request('list', 'GET', f'/instances?view_date={self._random_date().isoformat()}')
+
+    def do_detail(self):
+        entity_id = self.rng.choice(self.entities)
+        self._request('detail', 'GET', f'/instances/{entity_id}?view_date={self._random_date().isoformat()}')
+
+    def do_scrub(self):
+        # 日付選択UIで1日ずつ送る操作（データ領域だけの部分更新）
+        current = self._random_date()
+        entity_type = self.rng.choice(['', '&type=1'])
+        for _ in range(self.rng.randint(3, 10)):
+            current += timedelta(days=1)
+            self._request('scrub', 'GET', f'/instances?view_date={current.isoformat()}&partial=1{entity_type}')
+            if self.stop.is_set():
+                return
+
+    def do_edit(self):
+        entity_id = self.rng.choice(self.entities)
+        response = self._request('edit_read', 'POST', '/api/v1/entities/query', json={'ids': [entity_id]})
+        if response is None or not response.ok:
+            return
+        entities = response.json().get('entities', [])
+        attributes = [attr for attr in (entities[0]['attributes'] if entities else []) if attr['data_type'] != 'ENTITY']
+        if not attributes:
+            return
+        attribute = self.rng.choice(attributes)
+        self._request('edit', 'POST', f'/instances/{entity_id}/attribute/add', allow_redirects=False, data={
+            'attribute_class_id': attribute['class_id'],
+            'data_type': attribute['data_type'],
+            'title': f'load-{self.rng.randrange(100000)}',
+            'date_in': date.today().isoformat(),
+        })
+
+    def do_api(self):
+        entity_id = self.rng.choice(self.entities)
+        self._request('api', 'GET', f'/api/v1/entities/{entity_id}/timeline')
+        date_to = self._random_date()
+        self._request('api', 'GET', f'/api/v1/diff?from={(date_to - timedelta(days=30)).isoformat()}'
+                                    f'&to={date_to.isoformat()}&type=1')
+
+    def do_watch(self):
+        # 変更ログのロングポーリング（接続を保持したまま変更を待つクライアント）
+        if self.change_cursor is None:
+            response = self._request('watch', 'GET', '/api/changes?since=0&limit=1000')
+            while response is not None and response.ok and response.json()['has_more']:
+                response = self._request('watch', 'GET', f"/api/changes?since={response.json()['next']}&limit=1000")
+            if response is None or not response.ok:
+                return
+            self.change_cursor = response.json()['next']
+        response = self._request('watch', 'GET', f'/api/changes?since={self.change_cursor}&wait=5')
+        if response is not None and response.ok:
+            self.change_cursor = response.json()['next']
+
+    def run(self):
+        if not self.login():
+            return
+        actions = list(self.mix)
+        weights = [self.mix[action] for action in actions]
+        while not self.stop.is_set():
+            action = self.rng.choices(actions, weights)[0]
+            getattr(self, f'do_{action}')()
+            if self.think_time:
+                time.sleep(self.rng.uniform(0, self.think_time * 2))
+
+def parse_mix(value: str) -> dict:
+    mix = {}
+    for item in value.split(','):
+        name, weight = item.split('=')
+        if name not in ('list', 'detail', 'scrub', 'edit', 'api', 'watch'):
+            raise argparse.ArgumentTypeError(f'unknown action: {name}')
+        mix[name] = float(weight)
+    return mix
+
+def _wait_for(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.RequestException:
+            time.sleep(0.2)
+    raise RuntimeError(f'{url} did not start within {timeout}s')
+
+def serve(args):
+    """モックOIDCとマルチワーカーのgunicorn（--asgi 時はuvicorn）を起動して (base_url, 停止関数) を返す"""
+    server = 'uvicorn' if args.asgi else 'gunicorn'
+    if shutil.which(server) is None:
+        sys.exit(f'{server} が必要です: pip install {server}')
+
+    oidc_server = mock_oidc.start_server('127.0.0.1', args.oidc_port)
+    oidc_host, oidc_port = oidc_server.server_address[:2]
+
+    env = dict(os.environ)
+    env.update({
+        'OIDC_METADATA_URL': f'http://{oidc_host}:{oidc_port}/.well-known/openid-configuration',
+        'OIDC_CLIENT_ID': 'loadtest',
+        'OIDC_CLIENT_SECRET': 'loadtest',
+        'SECRET_KEY': env.get('SECRET_KEY', 'loadtest-secret'),
+        'ENTY_DB_PATH': args.db,
+    })
+    base_url = f'http://127.0.0.1:{args.port}'
+    if args.asgi:
+        command = ['uvicorn', '--workers', str(args.workers), '--host', '127.0.0.1', '--port', str(args.port),
+                   '--log-level', 'warning', 'asgi:app']
+    else:
+        command = ['gunicorn', '--workers', str(args.workers), '--threads', str(args.threads),
+                   '--bind', f'127.0.0.1:{args.port}', '--log-level', 'warning', 'app:app']
+    process = subprocess.Popen(command, env=env)
+    _wait_for(base_url + '/')
+
+    def shutdown():
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            # ロングポーリング中の接続が残っていると正常終了を待ち続けるため
+            process.kill()
+            process.wait()
+        oidc_server.shutdown()
+
+    return base_url, shutdown
+
+def main():
+    parser = argparse.ArgumentParser(description='HTTP負荷試験ドライバー')
+    parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+    parser.add_argument('--users', type=int, default=20, help='仮想ユーザー数')
+    parser.add_argument('--duration', type=float, default=30, help='計測時間（秒）')
+    parser.add_argument('--ramp-up', type=float, default=5, help='全ユーザーがログインし終えるまでの時間（秒）')
+    parser.add_argument('--think-time', type=float, default=0.0, help='操作間の平均待ち時間（秒）')
+    parser.add_argument('--mix', type=parse_mix, default=parse_mix(DEFAULT_MIX))
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='結果JSONの保存先')
+    parser.add_argument('--serve', action='store_true', help='モックOIDCとgunicornを起動してから計測')
+    parser.add_argument('--workers', type=int, default=4, help='--serve 時のgunicornワーカー数')
+    parser.add_argument('--threads', type=int, default=1, help='--serve 時のワーカーあたりスレッド数')
+    parser.add_argument('--asgi', action='store_true', help='--serve 時にuvicornで asgi:app を起動')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--oidc-port', type=int, default=0)
+    parser.add_argument('--db', default='data/bench-small.db', help='--serve 時に使うデータベース')
+    args = parser.parse_args()
+
+    shutdown = None
+    if args.serve:
+        if not os.path.exists(args.db):
+            from bench.generate import PRESETS, generate
+            generate(args.db, **PRESETS['small'])
+        args.base_url, shutdown = serve(args)
+
+    recorder = Recorder()
+    stop = threading.Event()
+    users = [VirtualUser(index, args.base_url, args.mix, recorder, stop, args.think_time, args.seed)
+             for index in range(args.users)]
+    try:
+        started = time.perf_counter()
+        for user in users:
+            user.start()
+            time.sleep(args.ramp_up / max(args.users, 1))
+        time.sleep(max(args.duration - args.ramp_up, 0))
+        stop.set()
+        for user in users:
+            user.join(timeout=30)
+        duration = time.perf_counter() - started
+    finally:
+        if shutdown:
+            shutdown()
+
+    summary = recorder.summary(duration)
+    summary.update({'users': args.users, 'workers': args.workers if args.serve else None,
+                    'mix': args.mix, 'base_url': args.base_url})
+
+    print(f'requests: {summary["requests"]}  throughput: {summary["throughput_rps"]} req/s  '
+          f'error rate: {summary["error_rate"]:.2%}  p50: {summary["p50_ms"]} ms  p99: {summary["p99_ms"]} ms')
+    print(f'{"action":<12} {"requests":>9} {"errors":>7} {"p50 ms":>9} {"p99 ms":>9}')
+    for action, stats in summary['actions'].items():
+        print(f'{action:<12} {stats["requests"]:>9} {stats["errors"]:>7} {stats["p50_ms"]:>9} {stats["p99_ms"]:>9}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
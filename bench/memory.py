@@ -0,0 +1,88 @@
+"""大きな一覧のピークメモリの計測
+
+エンティティ数の多い合成データベースに対して、一覧系のリポジトリメソッドとルートを
+それぞれ新しいプロセスで1回実行し、tracemalloc のピーク（Pythonオブジェクトの確保量）と
+最大RSSを表示する。
+
+    python -m bench.memory --entities 500000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# 子プロセスで実行する計測スクリプト（計測対象の名前を引数で受け取る）
+PROBE = """
+import json, resource, sys, time, tracemalloc
+import db
+from db import EntityRepository
+
+target = sys.argv[1]
+view_date = '2024-12-31'
+if target.startswith('GET '):
+    import app as enty_app
+    client = enty_app.app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'id': 'bench', 'name': 'bench', 'email': 'bench@example.com'}
+
+tracemalloc.start()
+started = time.perf_counter()
+if target == 'EntityRepository.get_all':
+    result = EntityRepository.get_all()
+    count = len(result)
+elif target == 'EntityRepository.get_all_at_date':
+    result = EntityRepository.get_all_at_date(view_date)
+    count = len(result)
+elif target == 'GET /api/entities':
+    response = client.get('/api/entities')
+    count = sum(len(chunk) for chunk in response.response)
+elapsed = time.perf_counter() - started
+_, peak = tracemalloc.get_traced_memory()
+print(json.dumps({'count': count, 'seconds': elapsed, 'peak_mb': peak / 1024 / 1024,
+                  'maxrss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+TARGETS = ['EntityRepository.get_all', 'EntityRepository.get_all_at_date', 'GET /api/entities']
+
+def measure(db_path: str, targets) -> dict:
+    env = dict(os.environ)
+    env.setdefault('OIDC_METADATA_URL', 'http://127.0.0.1:9/.well-known/openid-configuration')
+    env.setdefault('OIDC_CLIENT_ID', 'bench')
+    env.setdefault('OIDC_CLIENT_SECRET', 'bench')
+    env['ENTY_DB_PATH'] = db_path
+
+    results = {}
+    for target in targets:
+        output = subprocess.run([sys.executable, '-c', PROBE, target], env=env, capture_output=True, text=True,
+                                check=True)
+        results[target] = json.loads(output.stdout.strip().splitlines()[-1])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='大きな一覧のピークメモリを計測')
+    parser.add_argument('--entities', type=int, default=500000, help='エンティティの総数')
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--db', help='計測に使うデータベース（既定は data/bench-memory-<件数>.db）')
+    parser.add_argument('--target', action='append', choices=TARGETS, help='計測対象（複数指定可、既定は全て）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    db_path = args.db or f'data/bench-memory-{args.entities}.db'
+    if not os.path.exists(db_path):
+        from bench.generate import generate
+        print(f'Generating {db_path}...')
+        generate(db_path, classes=args.classes, attributes=1, entities=args.entities // args.classes,
+                 versions=1, years=5)
+
+    results = measure(db_path, args.target or TARGETS)
+    print(f'{"target":<36} {"peak MB":>9} {"max RSS MB":>11} {"seconds":>8}')
+    for target, result in results.items():
+        print(f'{target:<36} {result["peak_mb"]:>9.1f} {result["maxrss_mb"]:>11.1f} {result["seconds"]:>8.2f}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+"""負荷試験用のローカルOIDCプロバイダー
+
+認可コードフローだけを実装した最小限のプロバイダー。/authorize は同意画面を出さずに
+即座にコードを発行するため、仮想ユーザーがブラウザなしでログインできる。
+IDトークンは起動時に生成したRSA鍵でRS256署名し、/jwks で公開鍵を返す。
+
+    python -m bench.mock_oidc --port 9000
+    OIDC_METADATA_URL=http://127.0.0.1:9000/.well-known/openid-configuration
+"""
+import argparse
+import json
+import secrets
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from authlib.jose import JsonWebKey, jwt
+
+class MockOIDCProvider:
+    """発行済みコードと署名鍵を保持するプロバイダー本体"""
+
+    def __init__(self, issuer: str, token_lifetime: int = 3600):
+        self.issuer = issuer.rstrip('/')
+        self.token_lifetime = token_lifetime
+        self.key = JsonWebKey.generate_key('RSA', 2048, is_private=True, options={'kid': 'mock-oidc'})
+        self._codes = {}
+        self._lock = threading.Lock()
+
+    def metadata(self) -> dict:
+        return {
+            'issuer': self.issuer,
+            'authorization_endpoint': f'{self.issuer}/authorize',
+            'token_endpoint': f'{self.issuer}/token',
+            'userinfo_endpoint': f'{self.issuer}/userinfo',
+            'jwks_uri': f'{self.issuer}/jwks',
+            'response_types_supported': ['code'],
+            'subject_types_supported': ['public'],
+            'id_token_signing_alg_values_supported': ['RS256'],
+            'token_endpoint_auth_methods_supported': ['client_secret_basic', 'client_secret_post'],
+            'scopes_supported': ['openid', 'profile', 'email'],
+        }
+
+    def jwks(self) -> dict:
+        return {'keys': [self.key.as_dict(is_private=False)]}
+
+    def issue_code(self, client_id: str, nonce: str, login_hint: str = None) -> str:
+        """認可コードを発行（login_hint がなければ毎回新しいユーザー）"""
+        subject = login_hint or f'user-{secrets.token_hex(4)}'
+        code = secrets.token_urlsafe(16)
+        with self._lock:
+            self._codes[code] = {'client_id': client_id, 'nonce': nonce, 'sub': subject}
+        return code
+
+    def exchange_code(self, code: str, client_id: str) -> dict:
+        """認可コードをトークンに交換（コードは1回限り）"""
+        with self._lock:
+            grant = self._codes.pop(code, None)
+        if grant is None or (client_id and grant['client_id'] != client_id):
+            return None
+
+        now = int(time.time())
+        claims = {
+            'iss': self.issuer,
+            'sub': grant['sub'],
+            'aud': grant['client_id'],
+            'iat': now,
+            'exp': now + self.token_lifetime,
+            'name': f'Load Test {grant["sub"]}',
+            'email': f'{grant["sub"]}@example.com',
+        }
+        if grant['nonce']:
+            claims['nonce'] = grant['nonce']
+        header = {'alg': 'RS256', 'kid': 'mock-oidc'}
+        id_token = jwt.encode(header, claims, self.key).decode('ascii')
+        return {
+            'access_token': secrets.token_urlsafe(24),
+            'token_type': 'Bearer',
+            'expires_in': self.token_lifetime,
+            'id_token': id_token,
+            'scope': 'openid profile email',
+        }
+
+def _make_handler(provider: MockOIDCProvider):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = {key: values[0] for key, values in parse_qs(url.query).items()}
+
+            if url.path == '/.well-known/openid-configuration':
+                self._send_json(200, provider.metadata())
+            elif url.path == '/jwks':
+                self._send_json(200, provider.jwks())
+            elif url.path == '/authorize':
+                if 'redirect_uri' not in query:
+                    self._send_json(400, {'error': 'invalid_request'})
+                    return
+                code = provider.issue_code(query.get('client_id'), query.get('nonce'), query.get('login_hint'))
+                params = {'code': code}
+                if 'state' in query:
+                    params['state'] = query['state']
+                separator = '&' if '?' in query['redirect_uri'] else '?'
+                self.send_response(302)
+                self.send_header('Location', f'{query["redirect_uri"]}{separator}{urlencode(params)}')
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+            else:
+                self._send_json(404, {'error': 'not_found'})
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            length = int(self.headers.get('Content-Length', 0))
+            form = {key: values[0] for key, values in parse_qs(self.rfile.read(length).decode('utf-8')).items()}
+
+            if url.path != '/token':
+                self._send_json(404, {'error': 'not_found'})
+                return
+            if form.get('grant_type') != 'authorization_code':
+                self._send_json(400, {'error': 'unsupported_grant_type'})
+                return
+
+            client_id = form.get('client_id')
+            authorization = self.headers.get('Authorization', '')
+            if not client_id and authorization.startswith('Basic '):
+                import base64
+                client_id = base64.b64decode(authorization[6:]).decode('utf-8').split(':', 1)[0]
+
+            token = provider.exchange_code(form.get('code', ''), client_id)
+            if token is None:
+                self._send_json(400, {'error': 'invalid_grant'})
+                return
+            self._send_json(200, token)
+
+    return Handler
+
+def start_server(host: str = '127.0.0.1', port: int = 9000) -> ThreadingHTTPServer:
+    """バックグラウンドスレッドでプロバイダーを起動して返す"""
+    server = ThreadingHTTPServer((host, port), None)
+    provider = MockOIDCProvider(f'http://{host}:{server.server_address[1]}')
+    server.RequestHandlerClass = _make_handler(provider)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='負荷試験用のローカルOIDCプロバイダー')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9000)
+    args = parser.parse_args()
+
+    server = start_server(args.host, args.port)
+    host, port = server.server_address[:2]
+    print(f'OIDC_METADATA_URL=http://{host}:{port}/.well-known/openid-configuration')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()
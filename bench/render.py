@@ -0,0 +1,109 @@
+"""テンプレートのコンパイル時間と大きな一覧の描画の計測
+
+- compile: 全テンプレートのコンパイル時間（バイトコードキャッシュなし / あり）
+- GET /instances・GET /instances?partial=1: 最初のバイトまでの時間・全体の時間・
+  tracemalloc のピーク（描画中に確保したPythonオブジェクト）・レスポンスの大きさ
+
+それぞれ新しいプロセスで実行する。
+
+    python -m bench.render --entities 50000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+# 子プロセスで実行する計測スクリプト（計測対象の名前を引数で受け取る）
+PROBE = """
+import json, sys, tempfile, time, tracemalloc
+import app as enty_app
+
+target = sys.argv[1]
+if target == 'compile':
+    from jinja2 import Environment, FileSystemBytecodeCache
+    names = enty_app.app.jinja_env.list_templates(extensions=['html'])
+    result = {'templates': len(names)}
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for label, cache in (('no_cache', None), ('cold_cache', FileSystemBytecodeCache(cache_dir)),
+                             ('warm_cache', FileSystemBytecodeCache(cache_dir))):
+            env = Environment(loader=enty_app.app.jinja_env.loader, bytecode_cache=cache)
+            started = time.perf_counter()
+            for name in names:
+                env.get_template(name)
+            result[label + '_ms'] = (time.perf_counter() - started) * 1000
+    print(json.dumps(result))
+    sys.exit()
+
+client = enty_app.app.test_client()
+with client.session_transaction() as session:
+    session['user'] = {'id': 'bench', 'name': 'bench', 'email': 'bench@example.com'}
+path = target.split(' ', 1)[1]
+# テンプレートのコンパイルとSQLiteのページキャッシュを温めてから計測
+client.get(path).close()
+
+tracemalloc.start()
+started = time.perf_counter()
+response = client.get(path, buffered=False)
+first = None
+size = 0
+for chunk in response.response:
+    if first is None:
+        first = time.perf_counter() - started
+    size += len(chunk)
+response.close()
+elapsed = time.perf_counter() - started
+_, peak = tracemalloc.get_traced_memory()
+print(json.dumps({'status': response.status_code, 'first_byte_ms': first * 1000, 'total_ms': elapsed * 1000,
+                  'peak_mb': peak / 1024 / 1024, 'bytes': size}))
+"""
+
+TARGETS = ['compile', 'GET /instances', 'GET /instances?partial=1']
+
+def measure(db_path: str, targets) -> dict:
+    env = dict(os.environ)
+    env.setdefault('OIDC_METADATA_URL', 'http://127.0.0.1:9/.well-known/openid-configuration')
+    env.setdefault('OIDC_CLIENT_ID', 'bench')
+    env.setdefault('OIDC_CLIENT_SECRET', 'bench')
+    env['ENTY_DB_PATH'] = db_path
+
+    results = {}
+    for target in targets:
+        output = subprocess.run([sys.executable, '-c', PROBE, target], env=env, capture_output=True, text=True,
+                                check=True)
+        results[target] = json.loads(output.stdout.strip().splitlines()[-1])
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='テンプレートのコンパイルと大きな一覧の描画を計測')
+    parser.add_argument('--entities', type=int, default=50000, help='エンティティの総数')
+    parser.add_argument('--classes', type=int, default=5)
+    parser.add_argument('--db', help='計測に使うデータベース（既定は data/bench-memory-<件数>.db）')
+    parser.add_argument('--target', action='append', choices=TARGETS, help='計測対象（複数指定可、既定は全て）')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    db_path = args.db or f'data/bench-memory-{args.entities}.db'
+    if not os.path.exists(db_path):
+        from bench.generate import generate
+        print(f'Generating {db_path}...')
+        generate(db_path, classes=args.classes, attributes=1, entities=args.entities // args.classes,
+                 versions=1, years=5)
+
+    results = measure(db_path, args.target or TARGETS)
+    for target, result in results.items():
+        if target == 'compile':
+            print(f'compile {result["templates"]} templates: no cache {result["no_cache_ms"]:.1f} ms, '
+                  f'cold cache {result["cold_cache_ms"]:.1f} ms, warm cache {result["warm_cache_ms"]:.1f} ms')
+    print(f'{"target":<28} {"first byte ms":>14} {"total ms":>9} {"peak MB":>8} {"bytes":>10}')
+    for target, result in results.items():
+        if target != 'compile':
+            print(f'{target:<28} {result["first_byte_ms"]:>14.1f} {result["total_ms"]:>9.1f} '
+                  f'{result["peak_mb"]:>8.1f} {result["bytes"]:>10}')
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
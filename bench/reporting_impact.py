@@ -0,0 +1,114 @@
+"""レポート実行中のリクエスト遅延の計測（本体 / スナップショット）
+
+主要ルート（bench.run と同じ、差分APIを除く）を一定時間繰り返し、次のフェーズの p50/p99 を比較する。
+
+- idle: レポートなし
+- primary: 別スレッドで時系列集計（日単位・キャッシュなし）と差分を本体に対して繰り返す
+- snapshot: 同じレポートを reporting.snapshot() の中で繰り返す
+- refresh: 別スレッドでスナップショットを作り直し続ける
+
+    python -m bench.reporting_impact --preset medium --seconds 10
+"""
+import argparse
+import json
+import os
+import shutil
+import tempfile
+from datetime import date
+
+from bench.backup_impact import _drive, _in_background
+from bench.generate import PRESETS, generate
+from bench.run import _sample_ids, route_benchmarks
+
+def measure(db_path: str, seconds: float) -> dict:
+    import analytics
+    import reporting
+    from db import AttributeRepository, EntityRepository
+
+    ids = _sample_ids(db_path)
+    benchmarks = [(name, func) for name, func in route_benchmarks(ids) if 'diff' not in name]
+    workdir = tempfile.mkdtemp(prefix='enty-reporting-bench-')
+    reporting.REPORTING_SNAPSHOT_PATH = os.path.join(workdir, 'reporting.db')
+    refreshes = []
+    reports = []
+
+    def report():
+        analytics.cache.clear()
+        analytics.time_series(date.fromisoformat(ids['old_date']), date.fromisoformat(ids['view_date']), 'day',
+                              ids['entity_class_id'])
+        EntityRepository.diff_between_dates(ids['old_date'], ids['view_date'], ids['entity_class_id'])
+        AttributeRepository.diff_between_dates(ids['old_date'], ids['view_date'], ids['entity_class_id'])
+        reports.append(1)
+
+    def primary_loop(stop):
+        while not stop.is_set():
+            report()
+
+    def snapshot_loop(stop):
+        while not stop.is_set():
+            with reporting.snapshot() as info:
+                if info['snapshot'] == 'live':
+                    raise RuntimeError('スナップショットが使われていません')
+                report()
+
+    def refresh_loop(stop):
+        while not stop.is_set():
+            refreshes.append(reporting.refresh(source_path=db_path))
+
+    try:
+        result = {'idle': _drive(benchmarks, seconds)}
+        refreshes.append(reporting.refresh(source_path=db_path))
+
+        for phase, loop in (('primary', primary_loop), ('snapshot', snapshot_loop), ('refresh', refresh_loop)):
+            reports.clear()
+            finish = _in_background(loop)
+            result[phase] = _drive(benchmarks, seconds)
+            finish()
+            if phase != 'refresh':
+                result.setdefault('reports', {})[phase] = len(reports)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    seconds_list = sorted(stats['seconds'] for stats in refreshes if stats)
+    result['refresh_stats'] = {
+        'runs': len(seconds_list),
+        'bytes': refreshes[-1]['bytes'] if refreshes and refreshes[-1] else 0,
+        'median_seconds': seconds_list[len(seconds_list) // 2] if seconds_list else None,
+    }
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='レポート実行中のリクエスト遅延を計測')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--db', help='計測に使うデータベース（既定は data/bench-<preset>.db）')
+    parser.add_argument('--seconds', type=float, default=10, help='各フェーズの計測時間')
+    parser.add_argument('--output', help='結果を保存するJSONファイル')
+    args = parser.parse_args()
+
+    db_path = args.db or f'data/bench-{args.preset}.db'
+    if not os.path.exists(db_path):
+        generate(db_path, **PRESETS[args.preset])
+
+    # リポジトリ層とアプリが計測用のデータベースを使うように切り替える
+    os.environ['ENTY_DB_PATH'] = db_path
+    import db
+    db.DB_PATH = db_path
+    db.init_db(db_path)
+
+    result = measure(db_path, args.seconds)
+
+    stats = result['refresh_stats']
+    print(f"snapshot refresh: {stats['runs']} runs, {stats['bytes']} bytes, median {stats['median_seconds']}s")
+    print(f"reports completed: primary {result['reports']['primary']}, snapshot {result['reports']['snapshot']}")
+    phases = ('idle', 'primary', 'snapshot', 'refresh')
+    print(f"{'route':<36} " + ' '.join(f'{phase + " p50/p99":>18}' for phase in phases))
+    for name in result['idle']:
+        cells = [f"{result[phase][name]['p50_ms']:.2f}/{result[phase][name]['p99_ms']:.2f}" for phase in phases]
+        print(f'{name:<36} ' + ' '.join(f'{cell:>18}' for cell in cells))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump({'preset': args.preset, **result}, f, ensure_ascii=False, indent=2)
+
+if __name__ == '__main__':
+    main()
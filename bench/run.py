@@ -0,0 +1,290 @@
+"""リポジトリ層と主要ルートのベンチマーク
+
+合成データベース（bench.generate）に対して EntityRepository / AttributeRepository の
+各メソッドと、Flaskテストクライアント経由の主要ルートの実行時間を計測し、JSONに保存する。
+
+    python -m bench.run --preset medium
+    python -m bench.run --compare bench/results/before.json bench/results/after.json
+"""
+import argparse
+import inspect
+import json
+import os
+import platform
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+from bench.generate import PRESETS, generate
+
+# 計測結果の既定の保存先
+RESULTS_DIR = 'bench/results'
+
+def _git_revision() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+def _measure(func, repeat: int, warmup: int = 1) -> dict:
+    """func を repeat 回実行し、所要時間の統計（ミリ秒）を返す"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return {
+        'runs': repeat,
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'mean_ms': round(statistics.fmean(samples), 3),
+    }
+
+def _sample_ids(db_path: str) -> dict:
+    """計測に使う代表的なIDと日付をデータベースから選ぶ"""
+    conn = sqlite3.connect(db_path)
+    try:
+        entity_class_id = conn.execute('SELECT MIN(identifier) FROM entity_class').fetchone()[0]
+        entity_id, date_in = conn.execute("""
+            SELECT e.identifier, e.date_in FROM entity_instance e
+            WHERE e.date_out IS NULL
+            ORDER BY (SELECT COUNT(*) FROM attribute_instance a WHERE a.entity_id = e.identifier) DESC
+            LIMIT 1
+        """).fetchone()
+        attribute_class_id = conn.execute(
+            'SELECT MIN(identifier) FROM attribute_class WHERE entity_id = ?', (entity_class_id,)).fetchone()[0]
+        max_date = conn.execute('SELECT MAX(date_in) FROM attribute_instance').fetchone()[0]
+        min_date = conn.execute('SELECT MIN(date_in) FROM attribute_instance').fetchone()[0]
+        many_ids = [row[0] for row in conn.execute(
+            'SELECT identifier FROM entity_instance ORDER BY identifier LIMIT 200')]
+    finally:
+        conn.close()
+    return {
+        'entity_class_id': entity_class_id,
+        'entity_id': entity_id,
+        'attribute_class_id': attribute_class_id,
+        'view_date': max_date,
+        'old_date': min_date,
+        'many_ids': many_ids,
+    }
+
+def repository_benchmarks(ids: dict):
+    """リポジトリメソッドごとの計測対象（名前, 関数）"""
+    from db import EntityRepository, AttributeRepository
+
+    view_date = ids['view_date']
+    entity_id = ids['entity_id']
+    class_id = ids['attribute_class_id']
+
+    def write_cycle():
+        """作成・更新・論理削除・削除を1セットで実行（データを汚さないため）"""
+        new_entity_id = EntityRepository.create('bench-entity', ids['entity_class_id'], view_date)
+        EntityRepository.update(new_entity_id, title='bench-entity-updated')
+        attribute_id = AttributeRepository.create('bench-value', class_id, new_entity_id, view_date)
+        AttributeRepository.update(attribute_id, title='bench-value-updated')
+        AttributeRepository.logical_delete(attribute_id, view_date)
+        AttributeRepository.delete(attribute_id)
+        EntityRepository.delete(new_entity_id)
+
+    def apply_batch():
+        new_entity_id = EntityRepository.create('bench-batch', ids['entity_class_id'], view_date)
+        results = AttributeRepository.apply_batch([
+            {'op': 'create', 'entity_id': new_entity_id, 'class_id': class_id, 'value': f'v{index}',
+             'date_in': view_date}
+            for index in range(1000)
+        ])
+        AttributeRepository.apply_batch([{'op': 'delete', 'identifier': result['identifier']} for result in results])
+        EntityRepository.delete(new_entity_id)
+
+    return [
+        ('EntityRepository.get_all', EntityRepository.get_all),
+        ('EntityRepository.get_all_at_date', lambda: EntityRepository.get_all_at_date(view_date)),
+        ('EntityRepository.get_by_type', lambda: EntityRepository.get_by_type(ids['entity_class_id'])),
+        ('EntityRepository.get_by_type_at_date',
+         lambda: EntityRepository.get_by_type_at_date(ids['entity_class_id'], view_date)),
+        ('EntityRepository.get_by_id', lambda: EntityRepository.get_by_id(entity_id)),
+        ('EntityRepository.get_many', lambda: EntityRepository.get_many(ids['many_ids'])),
+        ('EntityRepository.diff_between_dates',
+         lambda: EntityRepository.diff_between_dates(ids['old_date'], view_date)),
+        ('AttributeRepository.get_by_entity_id', lambda: AttributeRepository.get_by_entity_id(entity_id)),
+        ('AttributeRepository.get_by_entity_id_at_date',
+         lambda: AttributeRepository.get_by_entity_id_at_date(entity_id, view_date)),
+        ('AttributeRepository.get_by_entity_ids_at_date',
+         lambda: AttributeRepository.get_by_entity_ids_at_date(ids['many_ids'], view_date)),
+        ('AttributeRepository.get_timeline', lambda: AttributeRepository.get_timeline(entity_id)),
+        ('AttributeRepository.diff_between_dates',
+         lambda: AttributeRepository.diff_between_dates(ids['old_date'], view_date, ids['entity_class_id'])),
+        ('AttributeRepository.get_all_by_entity_and_class',
+         lambda: AttributeRepository.get_all_by_entity_and_class(entity_id, class_id)),
+        ('AttributeRepository.get_active_by_entity_and_class',
+         lambda: AttributeRepository.get_active_by_entity_and_class(entity_id, class_id)),
+        ('EntityRepository.create+update+delete / AttributeRepository.create+update+logical_delete+delete',
+         write_cycle),
+        ('AttributeRepository.apply_batch (1000 ops)', apply_batch),
+    ]
+
+def route_benchmarks(ids: dict):
+    """主要ルートの計測対象（テストクライアント経由、ログイン済みセッション）"""
+    # アプリのimport時に必要なOIDC設定（計測ではプロバイダーに接続しない）
+    os.environ.setdefault('OIDC_METADATA_URL', 'http://localhost/.well-known/openid-configuration')
+    os.environ.setdefault('OIDC_CLIENT_ID', 'bench')
+    os.environ.setdefault('OIDC_CLIENT_SECRET', 'bench')
+    # 同じユーザーで同じルートを繰り返すので、レート制限・同時実行数の上限は外す
+    os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+    from app import app
+
+    app.config['TESTING'] = True
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'id': 'bench', 'name': 'bench', 'email': 'bench@example.com'}
+
+    def get(path):
+        def run():
+            response = client.get(path)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{path}: HTTP {response.status_code}')
+        return run
+
+    def post(path, payload):
+        def run():
+            response = client.post(path, json=payload)
+            if response.status_code >= 400:
+                raise RuntimeError(f'{path}: HTTP {response.status_code}')
+        return run
+
+    view_date = ids['view_date']
+    entity_id = ids['entity_id']
+    return [
+        ('GET /instances', get(f'/instances?view_date={view_date}')),
+        ('GET /instances?type', get(f'/instances?type={ids["entity_class_id"]}&view_date={view_date}')),
+        ('GET /instances?partial', get(f'/instances?type={ids["entity_class_id"]}&view_date={view_date}&partial=1')),
+        ('GET /instances/<id>', get(f'/instances/{entity_id}?view_date={view_date}')),
+        ('GET /instances/<id>/edit', get(f'/instances/{entity_id}/edit')),
+        ('GET /api/entities', get('/api/entities')),
+        ('POST /api/v1/entities/query', post('/api/v1/entities/query',
+                                             {'ids': ids['many_ids'], 'view_date': view_date})),
+        ('GET /api/v1/entities/<id>/timeline', get(f'/api/v1/entities/{entity_id}/timeline')),
+        ('GET /api/v1/diff', get(f'/api/v1/diff?from={ids["old_date"]}&to={view_date}&type={ids["entity_class_id"]}')),
+        ('GET /api/changes', get('/api/changes?since=0')),
+    ]
+
+def _uncovered_methods(benchmarks) -> list:
+    """計測対象に含まれていないリポジトリの公開メソッド"""
+    from db import EntityRepository, AttributeRepository
+
+    names = ' '.join(name for name, _ in benchmarks)
+    missing = []
+    for repository in (EntityRepository, AttributeRepository):
+        for method, _ in inspect.getmembers(repository, inspect.isfunction):
+            if not method.startswith('_') and method not in names:
+                missing.append(f'{repository.__name__}.{method}')
+    return missing
+
+def run(args) -> dict:
+    params = dict(PRESETS[args.preset])
+    if not os.path.exists(args.db) or args.regenerate:
+        print(f'Generating {args.db} ({args.preset})...')
+        dataset = generate(args.db, seed=args.seed, **params)
+    else:
+        dataset = {'preset': args.preset, 'reused': True}
+
+    # リポジトリ層がベンチマーク用のデータベースを使うように切り替える
+    os.environ['ENTY_DB_PATH'] = args.db
+    import db
+    db.DB_PATH = args.db
+    # 同じ引数で繰り返すので、時点指定の読み取り結果のキャッシュを外してクエリ自体を計測する
+    db.as_of_cache.maxsize = 0
+
+    ids = _sample_ids(args.db)
+    benchmarks = repository_benchmarks(ids)
+    if not args.skip_routes:
+        benchmarks += route_benchmarks(ids)
+
+    for method in _uncovered_methods(benchmarks):
+        print(f'warning: {method} is not benchmarked')
+
+    results = {}
+    for name, func in benchmarks:
+        if args.filter and args.filter not in name:
+            continue
+        results[name] = _measure(func, args.repeat)
+        print(f'{name:<70} median {results[name]["median_ms"]:>10.3f} ms  p95 {results[name]["p95_ms"]:>10.3f} ms')
+
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': _git_revision(),
+        'python': platform.python_version(),
+        'sqlite': sqlite3.sqlite_version,
+        'preset': args.preset,
+        'dataset': dataset,
+        'repeat': args.repeat,
+        'results': results,
+    }
+
+def compare(baseline_path: str, current_path: str, threshold: float) -> int:
+    """2つの計測結果を中央値で比較し、しきい値を超えて遅くなったものを回帰として表示"""
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(current_path, encoding='utf-8') as f:
+        current = json.load(f)
+
+    if baseline.get('preset') != current.get('preset'):
+        print(f'warning: preset differs ({baseline.get("preset")} vs {current.get("preset")})')
+
+    regressions = 0
+    print(f'{"benchmark":<70} {"baseline":>10} {"current":>10} {"ratio":>7}')
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f'{name:<70} {"-":>10} {result["median_ms"]:>10.3f} {"new":>7}')
+            continue
+        ratio = result['median_ms'] / before['median_ms'] if before['median_ms'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            flag = '  REGRESSION'
+            regressions += 1
+        elif ratio < 1 - threshold:
+            flag = '  improved'
+        print(f'{name:<70} {before["median_ms"]:>10.3f} {result["median_ms"]:>10.3f} {ratio:>7.2f}{flag}')
+
+    print(f'{regressions} regression(s) over {threshold:.0%}')
+    return 1 if regressions else 0
+
+def main():
+    parser = argparse.ArgumentParser(description='リポジトリ層と主要ルートのベンチマーク')
+    parser.add_argument('--db', help='計測に使うデータベース（既定: data/bench-<preset>.db）')
+    parser.add_argument('--preset', choices=sorted(PRESETS), default='small')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--regenerate', action='store_true', help='データベースを作り直す')
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--filter', help='名前にこの文字列を含むものだけ計測')
+    parser.add_argument('--skip-routes', action='store_true', help='Flaskルートの計測を省略')
+    parser.add_argument('--output', help='結果JSONの保存先（既定: bench/results/<日時>.json）')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='2つの結果JSONを比較')
+    parser.add_argument('--threshold', type=float, default=0.2, help='回帰とみなす中央値の悪化率')
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(args.compare[0], args.compare[1], args.threshold))
+
+    args.db = args.db or f'data/bench-{args.preset}.db'
+    report = run(args)
+
+    output = args.output or os.path.join(RESULTS_DIR, f'{datetime.now():%Y%m%d-%H%M%S}-{args.preset}.json')
+    output_dir = os.path.dirname(output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f'Saved {output}')
+
+if __name__ == '__main__':
+    main()
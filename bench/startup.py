@@ -0,0 +1,66 @@
+"""起動時間の計測
+
+新しいプロセスで app を import してから最初のレスポンスを返すまでを繰り返し計測する。
+ワーカー起動（gunicorn の各ワーカーが行う import と create_app）にかかる時間の目安になる。
+
+    python -m bench.startup --runs 10
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+# 子プロセスで実行する計測スクリプト（OIDCプロバイダーには接続しない）
+PROBE = """
+import json, time
+started = time.perf_counter()
+import app as enty_app
+imported = time.perf_counter()
+client = enty_app.app.test_client()
+response = client.get('/')
+first_response = time.perf_counter()
+print(json.dumps({
+    'import_s': imported - started,
+    'create_app_s': enty_app.app.config['STARTUP_SECONDS'],
+    'first_response_s': first_response - imported,
+    'status': response.status_code,
+}))
+"""
+
+def measure(runs: int, db_path: str) -> dict:
+    env = dict(os.environ)
+    env.setdefault('OIDC_METADATA_URL', 'http://127.0.0.1:9/.well-known/openid-configuration')
+    env.setdefault('OIDC_CLIENT_ID', 'bench')
+    env.setdefault('OIDC_CLIENT_SECRET', 'bench')
+    env['ENTY_DB_PATH'] = db_path
+
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', PROBE], env=env, capture_output=True, text=True, check=True)
+        samples.append(json.loads(output.stdout.strip().splitlines()[-1]))
+
+    summary = {'runs': runs}
+    for key in ('import_s', 'create_app_s', 'first_response_s'):
+        values = [sample[key] for sample in samples]
+        summary[key] = {'median_ms': round(statistics.median(values) * 1000, 1),
+                        'max_ms': round(max(values) * 1000, 1)}
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='アプリの起動時間を計測')
+    parser.add_argument('--runs', type=int, default=10)
+    parser.add_argument('--db', default='data/bench-small.db')
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db):
+        from bench.generate import PRESETS, generate
+        generate(args.db, **PRESETS['small'])
+
+    summary = measure(args.runs, args.db)
+    for key in ('import_s', 'create_app_s', 'first_response_s'):
+        print(f'{key:<18} median {summary[key]["median_ms"]:>8} ms   max {summary[key]["max_ms"]:>8} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""属性インスタンスの有効期間と参照の整合性チェック
+
+同じエンティティ・属性クラスで有効期間の重なる値、無効日が有効日より前の値、削除された
+エンティティ・属性クラスに属する値、存在しないエンティティを指すENTITY型の値を検出する
+（IntegrityRepository.find_issues、ライブテーブルとアーカイブを1回の走査で調べる）。
+値のない期間（gap）は件数だけ警告として表示する。
+
+新しい書き込みは AttributeRepository が同じ条件で検証して拒否するので、ここで見つかるのは
+検証を入れる前のデータや、SQLで直接書き換えたデータ。不整合があれば終了コード1で終わる。
+
+    python check_integrity.py
+    python check_integrity.py --class-id 3 --show 50
+    python check_integrity.py --json > integrity.json
+"""
+import sys
+import json
+import argparse
+from collections import Counter
+
+from db import IntegrityRepository, init_db
+
+def check(entity_class_id: int = None) -> dict:
+    """問題の種類ごとの件数と一覧を返す"""
+    issues = [dict(row) for row in IntegrityRepository.find_issues(entity_class_id)]
+    counts = Counter(issue['issue'] for issue in issues)
+    errors = sum(count for issue, count in counts.items() if issue not in IntegrityRepository.WARNINGS)
+    return {
+        'counts': {issue: counts.get(issue, 0) for issue in IntegrityRepository.ISSUES},
+        'errors': errors,
+        'issues': issues,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='属性インスタンスの有効期間と参照の整合性チェック')
+    parser.add_argument('--class-id', type=int, help='エンティティクラスIDで対象を絞る')
+    parser.add_argument('--show', type=int, default=20, help='種類ごとに表示する件数（既定は20）')
+    parser.add_argument('--json', action='store_true', help='結果をJSONで出力')
+    args = parser.parse_args()
+
+    init_db()
+    result = check(args.class_id)
+
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        for issue, count in result['counts'].items():
+            label = ' (warning)' if issue in IntegrityRepository.WARNINGS else ''
+            print(f'{issue:<20} {count:>8}{label}')
+        for issue in IntegrityRepository.ISSUES:
+            rows = [row for row in result['issues'] if row['issue'] == issue][:args.show]
+            if not rows:
+                continue
+            print(f'\n[{issue}]')
+            print(f'{"id":>10} {"entity":>10} {"class":>6} {"date_in":<10} {"date_out":<10} {"related":>10} '
+                  f'{"until":<10} title')
+            for row in rows:
+                print(f'{row["identifier"]:>10} {row["entity_id"]:>10} {row["class_id"]:>6} '
+                      f'{row["date_in"] or "":<10} {row["date_out"] or "":<10} {row["related_id"] or "":>10} '
+                      f'{row["related_date"] or "":<10} {row["title"]}')
+
+    sys.exit(1 if result['errors'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""属性インスタンスの履歴圧縮とアーカイブ
+
+1. 同じ値のまま途切れずに続くバージョン（前の date_out と次の date_in が一致）を1行にまとめる
+2. アーカイブ境界より前に閉じたバージョンを attribute_instance_archive に移す
+
+境界より前の日付を指定した画面・APIは自動的にアーカイブも読むため、結果は変わらない。
+アプリを止めずに実行でき、書き込みは chunk-size 件ごとの短いトランザクションに分ける。
+
+    python compact_history.py --keep-years 5
+    python compact_history.py --horizon 2020-01-01 --dry-run
+"""
+import os
+import argparse
+from datetime import date
+
+from db import HistoryArchiveRepository, get_connection
+
+# 境界を指定しない場合に残す年数
+ARCHIVE_KEEP_YEARS = int(os.environ.get('ARCHIVE_KEEP_YEARS', '5'))
+
+def default_horizon(keep_years: int, today: date = None) -> str:
+    """今日から keep_years 年前の日付"""
+    today = today or date.today()
+    try:
+        return today.replace(year=today.year - keep_years).isoformat()
+    except ValueError:
+        # 2月29日
+        return today.replace(year=today.year - keep_years, day=28).isoformat()
+
+def compact(horizon: str, chunk_size: int = 5000, merge: bool = True, dry_run: bool = False) -> dict:
+    """履歴の圧縮とアーカイブを実行し、処理件数を返す"""
+    if date.fromisoformat(horizon) > date.today():
+        raise ValueError('アーカイブ境界に未来の日付は指定できません')
+
+    summary = {'horizon': horizon, 'merged': 0, 'archived': 0}
+
+    groups = HistoryArchiveRepository.find_adjacent_duplicates() if merge else []
+    if dry_run:
+        summary['merged'] = sum(len(group) - 1 for group in groups)
+        summary['archived'] = HistoryArchiveRepository.count_archivable(horizon)
+        return summary
+
+    for start in range(0, len(groups), chunk_size):
+        summary['merged'] += HistoryArchiveRepository.merge_versions(groups[start:start + chunk_size])
+
+    # 先に境界を進めてから行を移す（移動途中でも境界より前の時点はアーカイブも読まれる）
+    summary['horizon'] = horizon = HistoryArchiveRepository.raise_horizon(horizon)
+    while True:
+        moved = HistoryArchiveRepository.archive_closed_versions(horizon, chunk_size)
+        summary['archived'] += moved
+        if moved < chunk_size:
+            break
+
+    with get_connection() as conn:
+        conn.execute('PRAGMA optimize')
+    return summary
+
+def main():
+    parser = argparse.ArgumentParser(description='属性インスタンスの履歴圧縮とアーカイブ')
+    parser.add_argument('--horizon', help='この日付以前に閉じたバージョンをアーカイブ（YYYY-MM-DD）')
+    parser.add_argument('--keep-years', type=int, default=ARCHIVE_KEEP_YEARS,
+                        help='--horizon 省略時に残す年数（既定は ARCHIVE_KEEP_YEARS または5）')
+    parser.add_argument('--chunk-size', type=int, default=5000, help='1トランザクションで処理する件数')
+    parser.add_argument('--no-merge', action='store_true', help='同じ値の連続したバージョンをまとめない')
+    parser.add_argument('--dry-run', action='store_true', help='件数だけ表示して変更しない')
+    args = parser.parse_args()
+
+    horizon = args.horizon or default_horizon(args.keep_years)
+    summary = compact(horizon, args.chunk_size, merge=not args.no_merge, dry_run=args.dry_run)
+    print(f"horizon: {summary['horizon']}  merged: {summary['merged']}  archived: {summary['archived']}"
+          + ('  (dry run)' if args.dry_run else ''))
+
+if __name__ == '__main__':
+    main()
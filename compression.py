@@ -0,0 +1,113 @@
+import os
+import zlib
+from typing import Iterable, Iterator, Optional
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# これより小さいレスポンスは圧縮しない（バイト）
+COMPRESS_MIN_SIZE = int(os.environ.get('COMPRESS_MIN_SIZE', '1024'))
+
+# ストリーミングのレスポンスで、これだけ入力がたまった塊の区切りで圧縮を吐き出す（バイト）
+COMPRESS_STREAM_FLUSH_SIZE = int(os.environ.get('COMPRESS_STREAM_FLUSH_SIZE', '4096'))
+
+# 動的なレスポンスの圧縮レベル（リクエストごとに圧縮するので速さを優先）
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4
+
+# 圧縮するContent-Type
+COMPRESSIBLE_MIMETYPES = frozenset({
+    'text/html', 'text/plain', 'text/css', 'application/json', 'application/javascript', 'text/javascript',
+})
+
+def negotiate(accept_encodings) -> Optional[str]:
+    """Accept-Encoding（werkzeugの Accept）から使う圧縮方式を選ぶ（br > gzip）"""
+    if brotli is not None and accept_encodings.quality('br') > 0:
+        return 'br'
+    if accept_encodings.quality('gzip') > 0:
+        return 'gzip'
+    return None
+
+def compress(data: bytes, encoding: str, level: Optional[int] = None) -> bytes:
+    """data を gzip または br で圧縮（level 省略時は動的なレスポンス向けの設定）"""
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY if level is None else level)
+    compressor = zlib.compressobj(GZIP_LEVEL if level is None else level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+def compress_stream(chunks: Iterable[bytes], encoding: str,
+                    flush_size: int = COMPRESS_STREAM_FLUSH_SIZE) -> Iterator[bytes]:
+    """ストリーミングのレスポンスを書き出しながら圧縮
+
+    圧縮器は出力をためるので、flush_size バイト以上の入力を渡した塊の区切りで吐き出す
+    （gzip は Z_SYNC_FLUSH）。そうしないと、描画済みのテンプレートの先頭も圧縮後の
+    ブロックがたまるまでクライアントに届かない。
+    """
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        process, flush, finish = compressor.process, compressor.flush, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        process, finish = compressor.compress, compressor.flush
+        flush = lambda: compressor.flush(zlib.Z_SYNC_FLUSH)
+    try:
+        pending = 0
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            data = process(chunk)
+            pending += len(chunk)
+            if pending >= flush_size:
+                data += flush()
+                pending = 0
+            if data:
+                yield data
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+def compress_response(response, accept_encodings, min_size: int = COMPRESS_MIN_SIZE):
+    """HTML・JSONなどのレスポンスを Accept-Encoding に応じて圧縮（対象外ならそのまま返す）"""
+    response.vary.add('Accept-Encoding')
+    if (response.status_code < 200 or response.status_code in (204, 304)
+            or response.direct_passthrough
+            or 'Content-Encoding' in response.headers
+            or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+        return response
+
+    encoding = negotiate(accept_encodings)
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        # 大きさが事前に分からないので常に圧縮する（/api/entities など）
+        response.response = compress_stream(response.response, encoding)
+        response.headers.pop('Content-Length', None)
+    else:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding))
+
+    response.headers['Content-Encoding'] = encoding
+    if response.headers.get('ETag'):
+        # 圧縮前と同じETagを返さない（強いETagはバイト列ごとに異なる必要がある）
+        etag, weak = response.get_etag()
+        response.set_etag(f'{etag}-{encoding}', weak)
+    return response
+
+def init_app(app):
+    """HTML・JSONのレスポンス圧縮をFlaskアプリに登録"""
+    from flask import request
+
+    min_size = app.config.setdefault('COMPRESS_MIN_SIZE', COMPRESS_MIN_SIZE)
+
+    @app.after_request
+    def compress_after_request(response):
+        if request.method == 'HEAD':
+            return response
+        return compress_response(response, request.accept_encodings, min_size)
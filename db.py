@@ -1,41 +1,518 @@
 import sqlite3
 import os
-from typing import List, Dict, Any, Optional
-
-# データベースファイルのパス
-DB_PATH = 'data/enty.db'
-
-def get_connection():
-    """データベース接続を取得"""
-    if not os.path.exists('data'):
-        os.makedirs('data')
-    
-    if os.path.exists(DB_PATH):
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        return conn
-    else:
-        print('Initializing database...')
-        conn = sqlite3.connect(DB_PATH)
-        conn.row_factory = sqlite3.Row
-        
-        # 新しいスキーマを使用
-        with open('init.sql', 'r', encoding='utf-8') as f:
+import json
+import operator
+import contextvars
+from typing import Iterator, List, Dict, Any, Optional, Tuple
+from instrumentation import InstrumentedConnection
+from result_cache import IntervalCache
+
+# データベースファイルのパス（ENTY_DB_PATH で上書き可能）
+DB_PATH = os.environ.get('ENTY_DB_PATH', 'data/enty.db')
+
+# 既存データベースに追加テーブルを適用するスキーマ
+UPGRADE_SQL_PATH = 'upgrade.sql'
+
+# 同じエンティティ・属性クラスで有効期間の重なる属性値の書き込み（reject: 拒否 / allow: 許可）
+ATTRIBUTE_OVERLAP_POLICY = os.environ.get('ATTRIBUTE_OVERLAP_POLICY', 'reject')
+
+# 表示日ごとの一覧・属性の読み取り結果をワーカー内に保持する件数（0で保持しない）
+AS_OF_CACHE_SIZE = int(os.environ.get('AS_OF_CACHE_SIZE', '1024'))
+
+# 1回の参照で反映する変更履歴の件数の上限（超えたらキャッシュをすべて捨てる）
+AS_OF_CACHE_SYNC_LIMIT = int(os.environ.get('AS_OF_CACHE_SYNC_LIMIT', '1000'))
+
+# プロセス内でスキーマを初期化済みのデータベースファイル
+_initialized_paths = set()
+
+# get_connection の接続先の差し替え（reporting.snapshot() の中ではレポート用スナップショットに接続する関数）
+connection_override = contextvars.ContextVar('enty_connection_override', default=None)
+
+def init_db(db_path: str = None):
+    """データベースのスキーマを初期化（起動時に1回呼ぶ）
+    
+    ファイルがなければ init.sql で作成し、既存データベースには追加テーブル・
+    インデックス（upgrade.sql、冪等）を適用する。
+    """
+    db_path = db_path or DB_PATH
+    db_dir = os.path.dirname(db_path)
+    if db_dir and not os.path.exists(db_dir):
+        os.makedirs(db_dir)
+    
+    is_new = not os.path.exists(db_path)
+    conn = sqlite3.connect(db_path, factory=InstrumentedConnection)
+    try:
+        if is_new:
+            print('Initializing database...')
+            with open('init.sql', 'r', encoding='utf-8') as f:
+                conn.executescript(f.read())
+            conn.commit()
+        
+        _migrate_attribute_instance_autoincrement(conn)
+        
+        with open(UPGRADE_SQL_PATH, 'r', encoding='utf-8') as f:
             conn.executescript(f.read())
-                
         conn.commit()
-        return conn
+        
+        # WALモード（読み取りが書き込みを待たず、オンラインバックアップとWALアーカイブが使える）
+        conn.execute('PRAGMA journal_mode = WAL')
+    finally:
+        conn.close()
+    _initialized_paths.add(db_path)
+
+def _migrate_attribute_instance_autoincrement(conn: sqlite3.Connection):
+    """既存データベースの attribute_instance を AUTOINCREMENT に作り直す（1回だけ）
+    
+    INTEGER PRIMARY KEY は最大値+1で採番するため、アーカイブへ移した行や削除した行のIDが
+    新しい行に再利用され、変更ログやアーカイブの identifier と食い違う。採番の起点は
+    本体とアーカイブの最大IDにする。インデックスは続く upgrade.sql で作り直される。
+    """
+    row = conn.execute("""
+        SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'attribute_instance'
+    """).fetchone()
+    if row is None or 'AUTOINCREMENT' in row[0].upper():
+        return
+    
+    print('Migrating attribute_instance to AUTOINCREMENT...')
+    has_archive = conn.execute("""
+        SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'attribute_instance_archive'
+    """).fetchone() is not None
+    archive_max = '(SELECT MAX(identifier) FROM attribute_instance_archive)' if has_archive else '0'
+    conn.executescript(f"""
+        BEGIN;
+        CREATE TABLE attribute_instance_migrated (
+            identifier INTEGER PRIMARY KEY AUTOINCREMENT,
+            title TEXT,
+            class_id INTEGER,
+            entity_id INTEGER,
+            date_in TEXT,
+            date_out TEXT,
+            FOREIGN KEY (entity_id) REFERENCES entity_instance(identifier),
+            FOREIGN KEY (class_id) REFERENCES attribute_class(identifier)
+        );
+        INSERT INTO attribute_instance_migrated (identifier, title, class_id, entity_id, date_in, date_out)
+        SELECT identifier, title, class_id, entity_id, date_in, date_out FROM attribute_instance;
+        DROP TABLE attribute_instance;
+        ALTER TABLE attribute_instance_migrated RENAME TO attribute_instance;
+        DELETE FROM sqlite_sequence WHERE name IN ('attribute_instance', 'attribute_instance_migrated');
+        INSERT INTO sqlite_sequence (name, seq) VALUES ('attribute_instance', MAX(
+            COALESCE((SELECT MAX(identifier) FROM attribute_instance), 0),
+            COALESCE({archive_max}, 0)
+        ));
+        COMMIT;
+    """)
+
+class Record(tuple):
+    """列名・添字・属性のどれでも参照できる読み取り専用の行
+    
+    sqlite3.Row と同じように row['title'] や dict(row) が使え、テンプレートからは
+    row.title でも参照できる。列の並びごとにサブクラスを1つ作り、列名はクラス側に
+    持たせるので、1行あたりのメモリは値を並べたタプルと同じになる。
+    """
+    __slots__ = ()
+    _fields: Tuple[str, ...] = ()
+    # 列名と添字（負の添字を含む）から位置への対応
+    _index: Dict[Any, int] = {}
+    
+    def __getitem__(self, key):
+        try:
+            return tuple.__getitem__(self, self._index[key])
+        except (KeyError, TypeError):
+            if isinstance(key, str):
+                raise IndexError(f'No item with that key: {key}') from None
+            return tuple.__getitem__(self, key)
+    
+    def keys(self) -> Tuple[str, ...]:
+        return self._fields
+    
+    def get(self, key: str, default=None):
+        index = self._index.get(key)
+        return default if index is None else tuple.__getitem__(self, index)
+    
+    def __repr__(self):
+        values = ', '.join(f'{name}={value!r}' for name, value in zip(self._fields, self))
+        return f'{type(self).__name__}({values})'
+
+# 列の並びごとの Record サブクラス
+_record_types: Dict[Tuple[str, ...], type] = {}
+# カーソルの description（同じ結果セットの行では同じオブジェクト）から Record サブクラスへのキャッシュ
+_record_type_by_description: Dict[int, Tuple[tuple, type]] = {}
+
+def record_type(fields: Tuple[str, ...]) -> type:
+    """列の並びに対応する Record サブクラスを取得"""
+    cls = _record_types.get(fields)
+    if cls is None:
+        index = {}
+        for position, name in enumerate(fields):
+            index[position] = index[position - len(fields)] = position
+        namespace = {'__slots__': (), '_fields': fields}
+        # 同じ列名が複数ある場合は sqlite3.Row と同じく最初の列を返す
+        for position, name in reversed(list(enumerate(fields))):
+            index[name] = position
+            if name not in Record.__dict__:
+                namespace[name] = property(operator.itemgetter(position))
+        namespace['_index'] = index
+        cls = type('Record', (Record,), namespace)
+        _record_types[fields] = cls
+    return cls
+
+def record_factory(cursor: sqlite3.Cursor, row: tuple) -> Record:
+    """行を Record として返す row_factory"""
+    description = cursor.description
+    cached = _record_type_by_description.get(id(description))
+    if cached is None or cached[0] is not description:
+        if len(_record_type_by_description) > 256:
+            _record_type_by_description.clear()
+        cached = (description, record_type(tuple(column[0] for column in description)))
+        _record_type_by_description[id(description)] = cached
+    return tuple.__new__(cached[1], row)
+
+def get_connection(check_same_thread: bool = True):
+    """データベース接続を取得（スキーマ初期化はプロセスごとに1回だけ）
+    
+    check_same_thread=False は、1つの呼び出し元が順に別のスレッドから使う接続（スレッドプールで
+    少しずつ進めるイテレーターなど）に指定する。
+    """
+    override = connection_override.get()
+    if override is not None:
+        return override()
+    if DB_PATH not in _initialized_paths:
+        init_db(DB_PATH)
+    
+    conn = sqlite3.connect(DB_PATH, factory=InstrumentedConnection, check_same_thread=check_same_thread)
+    conn.row_factory = record_factory
+    return conn
 
 # 後方互換性のため
 def Connect():
     """後方互換性のためのConnect関数"""
     return get_connection()
 
+class BatchValidationError(ValueError):
+    """一括操作の検証エラー（どの操作で失敗したかを index で保持）"""
+    
+    def __init__(self, index: int, message: str):
+        super().__init__(f'operations[{index}]: {message}')
+        self.index = index
+        self.message = message
+
+class IntervalConflictError(ValueError):
+    """属性値の有効期間の不整合（無効日が有効日より前・同じ属性クラスの値と期間が重なる）"""
+
+def _row_to_dict(conn: sqlite3.Connection, table_name: str, row_id: int) -> Optional[Dict[str, Any]]:
+    """変更前後のスナップショット用に1行を辞書で取得"""
+    row = conn.execute(f"SELECT * FROM {table_name} WHERE identifier = ?", (row_id,)).fetchone()
+    return dict(row) if row else None
+
+def _attribute_versions(date_param: str = None) -> str:
+    """属性バージョンの読み取り元（ライブテーブル＋アーカイブ）のSQL
+    
+    date_param に名前付きパラメータ名を渡すと、その日付がアーカイブ境界より前のときだけ
+    アーカイブを読む。境界以降の時点で有効なバージョンはすべてライブテーブルにある。
+    """
+    condition = ''
+    if date_param:
+        condition = f"""
+        WHERE :{date_param} < (SELECT horizon FROM history_horizon WHERE table_name = 'attribute_instance')"""
+    return f"""(
+        SELECT identifier, title, class_id, entity_id, date_in, date_out FROM attribute_instance
+        UNION ALL
+        SELECT identifier, title, class_id, entity_id, date_in, date_out FROM attribute_instance_archive{condition}
+    )"""
+
+def _attribute_filter_sql(filters: Dict[int, List[str]], params: Dict[str, Any], entity_alias: str = 'e',
+                          date_param: str = 'view_date') -> str:
+    """属性値での絞り込み条件のSQL（先頭に AND を付けて返し、パラメータは params に追加する）
+    
+    filters は属性クラスIDから値のリストへ。同じ属性クラスの値はいずれか、属性クラス間はすべてを満たす
+    エンティティが対象で、date_param の時点で有効な属性値だけを見る。
+    """
+    conditions = []
+    for i, (class_id, values) in enumerate(sorted(filters.items())):
+        params[f'filter_class_{i}'] = class_id
+        params[f'filter_values_{i}'] = json.dumps(values, ensure_ascii=False)
+        conditions.append(f"""
+            AND {entity_alias}.identifier IN (
+                SELECT f.entity_id FROM {_attribute_versions(date_param)} f
+                WHERE f.class_id = :filter_class_{i}
+                  AND f.title IN (SELECT value FROM json_each(:filter_values_{i}))
+                  AND (f.date_in IS NULL OR f.date_in <= :{date_param})
+                  AND (f.date_out IS NULL OR f.date_out > :{date_param})
+            )""")
+    return ''.join(conditions)
+
+def _check_attribute_interval(conn: sqlite3.Connection, attribute_id: int):
+    """書き込んだ属性インスタンスの有効期間を検証（不整合なら IntervalConflictError）
+    
+    同じ (entity_id, class_id) の値だけを (entity_id, class_id, date_in) のインデックスで引いて
+    期間の重なりを調べる。書き込みと同じトランザクションで呼び、例外ならロールバックさせる。
+    date_in = date_out の空の期間（追加した日に削除した値）は何とも重ならないものとして扱う。
+    """
+    if ATTRIBUTE_OVERLAP_POLICY not in ('reject', 'allow'):
+        raise ValueError(f'Unknown ATTRIBUTE_OVERLAP_POLICY: {ATTRIBUTE_OVERLAP_POLICY}')
+    row = conn.execute("""
+        SELECT identifier, entity_id, class_id, date_in, date_out FROM attribute_instance WHERE identifier = ?
+    """, (attribute_id,)).fetchone()
+    if row is None:
+        return
+    if row['date_in'] and row['date_out'] and row['date_out'] < row['date_in']:
+        raise IntervalConflictError(f'無効日（{row["date_out"]}）が有効日（{row["date_in"]}）より前です')
+    if ATTRIBUTE_OVERLAP_POLICY == 'allow' or (row['date_in'] and row['date_in'] == row['date_out']):
+        return
+    
+    conflict = conn.execute(f"""
+        SELECT t.title, t.date_in, t.date_out FROM {_attribute_versions()} t
+        WHERE t.entity_id = :entity_id AND t.class_id = :class_id AND t.identifier != :identifier
+          AND (t.date_in IS NULL OR :date_out IS NULL OR t.date_in < :date_out)
+          AND (:date_in IS NULL OR t.date_out IS NULL OR :date_in < t.date_out)
+          AND (t.date_in IS NULL OR t.date_out IS NULL OR t.date_in < t.date_out)
+        ORDER BY t.date_in
+        LIMIT 1
+    """, dict(row)).fetchone()
+    if conflict is not None:
+        raise IntervalConflictError(
+            f'有効期間が同じ属性の値「{conflict["title"]}」（{conflict["date_in"] or "未設定"}〜'
+            f'{conflict["date_out"] or ""}）と重なっています。先にその値の無効日を設定してください')
+
+# 変更履歴のスナップショットに含める列（_row_to_dict と同じ）
+_SNAPSHOT_COLUMNS = {
+    'entity_instance': ('identifier', 'title', 'class_id', 'date_in', 'date_out'),
+    'attribute_instance': ('identifier', 'title', 'class_id', 'entity_id', 'date_in', 'date_out'),
+    'relation_instance': ('identifier', 'class_id', 'entity_from', 'entity_to', 'date_in', 'date_out'),
+}
+
+def _json_snapshot(table_name: str, alias: str, overrides: Dict[str, str] = None) -> str:
+    """行を変更履歴のスナップショットと同じ形のJSONにするSQL式（overrides は列名からSQL式へ）"""
+    overrides = overrides or {}
+    return 'json_object(' + ', '.join(
+        f"'{column}', {overrides.get(column, f'{alias}.{column}')}" for column in _SNAPSHOT_COLUMNS[table_name]
+    ) + ')'
+
+class ChangeLogRepository:
+    """変更履歴（変更データキャプチャ）のデータアクセス
+    
+    エンティティ・属性インスタンスへの書き込みと同じトランザクション内で
+    追記されるため、seqの順に読めば書き込み順に差分を再生できる。
+    """
+    
+    @staticmethod
+    def record(conn: sqlite3.Connection, table_name: str, row_id: int, operation: str,
+               before: Dict[str, Any] = None, after: Dict[str, Any] = None) -> int:
+        """変更を1件追記（呼び出し元の接続・トランザクションを使用）"""
+        payload = json.dumps({'before': before, 'after': after}, ensure_ascii=False)
+        cursor = conn.execute("""
+            INSERT INTO change_log (table_name, row_id, operation, payload)
+            VALUES (?, ?, ?, ?)
+        """, (table_name, row_id, operation, payload))
+        return cursor.lastrowid
+    
+    @staticmethod
+    def record_rows(conn: sqlite3.Connection, table_name: str, operation: str, where: str, params: Dict[str, Any],
+                    before: bool = True, after: Optional[Dict[str, str]] = None) -> int:
+        """where に一致する行の変更をまとめて追記（1文で実行し、追記した件数を返す）
+        
+        before=True なら現在の行を変更前として記録する。after には変更後の行で値が変わる
+        列をSQL式で渡す（空の辞書なら現在の行をそのまま変更後とする、None なら変更後なし）。
+        更新の場合は UPDATE より前に、作成の場合は INSERT の後に呼ぶ。
+        """
+        before_sql = _json_snapshot(table_name, 'r') if before else 'NULL'
+        after_sql = _json_snapshot(table_name, 'r', after) if after is not None else 'NULL'
+        cursor = conn.execute(f"""
+            INSERT INTO change_log (table_name, row_id, operation, payload)
+            SELECT '{table_name}', r.identifier, '{operation}',
+                   json_object('before', {before_sql}, 'after', {after_sql})
+            FROM {table_name} r
+            WHERE {where}
+            ORDER BY r.identifier
+        """, params)
+        return cursor.rowcount
+    
+    @staticmethod
+    def get_since(since_seq: int, limit: int = 500) -> List[Dict[str, Any]]:
+        """指定シーケンス番号より後の変更を古い順に取得"""
+        with get_connection() as conn:
+            rows = conn.execute("""
+                SELECT seq, table_name, row_id, operation, payload, changed_at
+                FROM change_log
+                WHERE seq > ?
+                ORDER BY seq
+                LIMIT ?
+            """, (since_seq, limit)).fetchall()
+        
+        changes = []
+        for row in rows:
+            payload = json.loads(row['payload'])
+            changes.append({
+                'seq': row['seq'],
+                'table': row['table_name'],
+                'row_id': row['row_id'],
+                'operation': row['operation'],
+                'changed_at': row['changed_at'],
+                'before': payload.get('before'),
+                'after': payload.get('after')
+            })
+        return changes
+    
+    @staticmethod
+    def get_latest_seq() -> int:
+        """最新のシーケンス番号を取得（変更がない場合は0）"""
+        with get_connection() as conn:
+            return conn.execute("SELECT COALESCE(MAX(seq), 0) FROM change_log").fetchone()[0]
+    
+    @staticmethod
+    def get_data_version(conn: sqlite3.Connection = None) -> Tuple[int, int, int]:
+        """集計結果が変わり得る書き込みの目印（最新のシーケンス番号・完了したスキーマ変更ジョブの件数・
+        エンティティクラスと属性クラスの変更の版）
+        
+        アーカイブの値を書き換えるスキーマ変更ジョブと、クラスの名前・表示順などの変更は変更履歴に
+        記録しないため、ジョブの完了とクラスの変更の版（トリガーで数える）も見る。
+        conn を渡すとその接続（レポート用スナップショットなど）の版を返す。
+        """
+        if conn is not None:
+            return tuple(conn.execute("""
+                SELECT (SELECT COALESCE(MAX(seq), 0) FROM change_log),
+                       (SELECT COUNT(*) FROM schema_job WHERE status = 'done'),
+                       (SELECT COALESCE(MAX(version), 0) FROM metadata_version)
+            """).fetchone())
+        with get_connection() as conn:
+            return ChangeLogRepository.get_data_version(conn)
+
+def _change_dependencies(change: Dict[str, Any]) -> List[Tuple[Optional[tuple], Optional[str], Optional[str]]]:
+    """変更履歴の1件を、影響を受ける時点指定の読み取り結果の (依存先, date_in, date_out) の並びにする
+    
+    変更前・変更後の行それぞれの有効期間に表示日が入る結果だけが変わる（行の列も結果に含まれるので、
+    期間の中では日付以外の変更も影響する）。エンティティ名は時点によらず参照先の表示に使われるため、
+    作成・削除・名前の変更は参照している属性の結果をすべての時点で捨てる。依存先 None はすべての結果。
+    """
+    table = change['table']
+    rows = [row for row in (change['before'], change['after']) if row]
+    if table == 'relation_instance':
+        return []
+    if table not in ('entity_instance', 'attribute_instance') or not rows:
+        return [(None, None, None)]
+    
+    dependencies = []
+    for row in rows:
+        interval = (row.get('date_in'), row.get('date_out'))
+        if table == 'entity_instance':
+            dependencies += [(('entity_class', row.get('class_id')),) + interval, (('entity_class', '*'),) + interval]
+        else:
+            dependencies += [(('entity', row.get('entity_id')),) + interval,
+                             (('attribute_class', row.get('class_id')),) + interval]
+    if table == 'entity_instance' and (len(rows) < 2 or rows[0].get('title') != rows[1].get('title')):
+        dependencies.append((('entity_ref', change['row_id']), None, None))
+    return dependencies
+
+# 表示日ごとの一覧・属性の読み取り結果（書き込みの有効期間に入る表示日の結果だけを捨てる）
+as_of_cache = IntervalCache(
+    AS_OF_CACHE_SIZE,
+    # 計測などでデータベースを切り替えたら捨てる
+    version_source=lambda: ChangeLogRepository.get_data_version() + (DB_PATH,),
+    changes_since=lambda seq, limit: ChangeLogRepository.get_since(seq, limit),
+    dependencies_of=_change_dependencies,
+    sync_limit=AS_OF_CACHE_SYNC_LIMIT,
+)
+
+def _cached_at_date(query: str, params: tuple, view_date: str, load, dependencies) -> List[Record]:
+    """表示日の時点の読み取りを as_of_cache に保持する（レポート用スナップショットを読む間は使わない）"""
+    if connection_override.get() is not None:
+        return load()
+    return list(as_of_cache.fetch(query, params, view_date, load, dependencies))
+
+class SessionRepository:
+    """サーバー側セッションのデータアクセス（CookieにはセッションIDだけを持たせる）"""
+    
+    @staticmethod
+    def get(session_id: str) -> Optional[Record]:
+        """有効期限内のセッションを取得"""
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT session_id, user_id, data, expires_at
+                FROM user_session
+                WHERE session_id = ? AND expires_at > strftime('%s', 'now')
+            """, (session_id,)).fetchone()
+    
+    @staticmethod
+    def save(session_id: str, user_id: Optional[str], data: str, expires_at: float):
+        """セッションを作成または更新"""
+        with get_connection() as conn:
+            conn.execute("""
+                INSERT INTO user_session (session_id, user_id, data, expires_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT (session_id) DO UPDATE SET
+                    user_id = excluded.user_id,
+                    data = excluded.data,
+                    expires_at = excluded.expires_at
+            """, (session_id, user_id, data, expires_at))
+            conn.commit()
+    
+    @staticmethod
+    def delete(session_id: str) -> bool:
+        with get_connection() as conn:
+            cursor = conn.execute("DELETE FROM user_session WHERE session_id = ?", (session_id,))
+            conn.commit()
+            return cursor.rowcount > 0
+    
+    @staticmethod
+    def delete_by_user(user_id: str) -> List[str]:
+        """ユーザーの全セッションを失効させ、削除したセッションIDを返す"""
+        with get_connection() as conn:
+            rows = conn.execute("""
+                DELETE FROM user_session WHERE user_id = ? RETURNING session_id
+            """, (user_id,)).fetchall()
+            conn.commit()
+            return [row['session_id'] for row in rows]
+    
+    @staticmethod
+    def delete_expired() -> int:
+        """期限切れのセッションを削除し、削除件数を返す"""
+        with get_connection() as conn:
+            cursor = conn.execute("DELETE FROM user_session WHERE expires_at <= strftime('%s', 'now')")
+            conn.commit()
+            return cursor.rowcount
+
+class RateLimitRepository:
+    """レート制限のトークンバケット（RATE_LIMIT_BACKEND=sqlite で複数ワーカーが共有する）"""
+    
+    @staticmethod
+    def take(bucket_key: str, rate: float, burst: float, now: float, cost: float = 1) -> Optional[float]:
+        """経過時間分を補充してからトークンを取り出し、残りを返す（足りなければ何もせず None）
+        
+        補充・判定・取り出しを1文で行うので、複数のワーカーが同時に取り出しても超過しない。
+        """
+        with get_connection() as conn:
+            row = conn.execute("""
+                INSERT INTO rate_limit_bucket (bucket_key, tokens, updated_at)
+                VALUES (:key, :burst - :cost, :now)
+                ON CONFLICT (bucket_key) DO UPDATE SET
+                    tokens = MIN(:burst, tokens + MAX(0, :now - updated_at) * :rate) - :cost,
+                    updated_at = MAX(updated_at, :now)
+                WHERE MIN(:burst, tokens + MAX(0, :now - updated_at) * :rate) >= :cost
+                RETURNING tokens
+            """, {'key': bucket_key, 'rate': rate, 'burst': burst, 'now': now, 'cost': cost}).fetchone()
+            conn.commit()
+            return row['tokens'] if row else None
+    
+    @staticmethod
+    def get(bucket_key: str) -> Optional[Record]:
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT bucket_key, tokens, updated_at FROM rate_limit_bucket WHERE bucket_key = ?
+            """, (bucket_key,)).fetchone()
+    
+    @staticmethod
+    def delete_older_than(cutoff: float) -> int:
+        """cutoff より前から使われていない（満タンに戻った）バケットを削除し、削除件数を返す"""
+        with get_connection() as conn:
+            cursor = conn.execute("DELETE FROM rate_limit_bucket WHERE updated_at < ?", (cutoff,))
+            conn.commit()
+            return cursor.rowcount
+
 class EntityMetaRepository:
     """エンティティクラスのデータアクセス（旧EntityMeta）"""
     
     @staticmethod
-    def get_all() -> List[sqlite3.Row]:
+    def get_all() -> List[Record]:
         """全てのエンティティクラスを取得"""
         with get_connection() as conn:
             return conn.execute("""
@@ -45,7 +522,7 @@ class EntityMetaRepository:
             """).fetchall()
     
     @staticmethod
-    def get_by_id(entity_class_id: int) -> Optional[sqlite3.Row]:
+    def get_by_id(entity_class_id: int) -> Optional[Record]:
         """IDでエンティティクラスを取得"""
         with get_connection() as conn:
             return conn.execute("""
@@ -100,31 +577,74 @@ class EntityRepository:
     """エンティティインスタンスのデータアクセス（旧Entity）"""
     
     @staticmethod
-    def get_all() -> List[sqlite3.Row]:
+    def get_all() -> List[Record]:
         """全てのエンティティインスタンスを取得"""
-        with get_connection() as conn:
-            return conn.execute("""
+        return list(EntityRepository.iter_all())
+    
+    @staticmethod
+    def iter_all(batch_size: int = 1000) -> Iterator[Record]:
+        """全てのエンティティインスタンスを順に返す（全件をリストにせずにJSONなどへ書き出す用）"""
+        conn = get_connection()
+        try:
+            cursor = conn.execute("""
                 SELECT e.identifier, e.title, e.date_in, e.date_out, ec.title as type_name
                 FROM entity_instance e
                 JOIN entity_class ec ON e.class_id = ec.identifier
                 ORDER BY e.date_in DESC
-            """).fetchall()
+            """)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                yield from rows
+        finally:
+            conn.close()
     
     @staticmethod
-    def get_all_at_date(view_date: str) -> List[sqlite3.Row]:
-        """指定日付時点での全てのエンティティインスタンスを取得"""
-        with get_connection() as conn:
-            return conn.execute("""
-                SELECT e.identifier, e.title, e.date_in, e.date_out, ec.title as type_name
+    def iter_all_json(batch_size: int = 1000, class_id: int = None) -> Iterator[str]:
+        """全てのエンティティインスタンスを /api/entities の1件分のJSON文字列として順に返す
+        
+        JSONはSQLiteの json_object で組み立てるので、行ごとの辞書やエンコードが要らない。
+        キーは標準のJSONプロバイダーと同じくソート順に並べる。class_id でクラスを絞り込める。
+        ASGI側ではスレッドプールの別のスレッドから順に進めるので、接続はスレッドに固定しない。
+        """
+        conn = get_connection(check_same_thread=False)
+        conn.row_factory = None
+        try:
+            cursor = conn.execute(f"""
+                SELECT json_object('identifier', e.identifier, 'title', e.title, 'type_name', ec.title)
                 FROM entity_instance e
                 JOIN entity_class ec ON e.class_id = ec.identifier
-                WHERE (e.date_in IS NULL OR e.date_in <= ?)
-                  AND (e.date_out IS NULL OR e.date_out > ?)
+                {'WHERE e.class_id = ?' if class_id is not None else ''}
                 ORDER BY e.date_in DESC
-            """, (view_date, view_date)).fetchall()
+            """, (class_id,) if class_id is not None else ())
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    return
+                for row in rows:
+                    yield row[0]
+        finally:
+            conn.close()
+    
+    @staticmethod
+    def get_all_at_date(view_date: str) -> List[Record]:
+        """指定日付時点での全てのエンティティインスタンスを取得"""
+        def load():
+            with get_connection() as conn:
+                return conn.execute("""
+                    SELECT e.identifier, e.title, e.date_in, e.date_out, ec.title as type_name
+                    FROM entity_instance e
+                    JOIN entity_class ec ON e.class_id = ec.identifier
+                    WHERE (e.date_in IS NULL OR e.date_in <= ?)
+                      AND (e.date_out IS NULL OR e.date_out > ?)
+                    ORDER BY e.date_in DESC
+                """, (view_date, view_date)).fetchall()
+        return _cached_at_date('EntityRepository.get_all_at_date', (), view_date, load,
+                               lambda rows: [('entity_class', '*')])
     
     @staticmethod
-    def get_by_type(entity_type_id: int) -> List[sqlite3.Row]:
+    def get_by_type(entity_type_id: int) -> List[Record]:
         """特定のタイプのエンティティインスタンスを取得"""
         with get_connection() as conn:
             return conn.execute("""
@@ -136,29 +656,82 @@ class EntityRepository:
             """, (entity_type_id,)).fetchall()
     
     @staticmethod
-    def get_by_type_at_date(entity_type_id: int, view_date: str) -> List[sqlite3.Row]:
-        """指定日付時点での特定タイプのエンティティインスタンスを取得"""
+    def get_by_type_at_date(entity_type_id: int, view_date: str,
+                            attribute_filters: Dict[int, List[str]] = None) -> List[Record]:
+        """指定日付時点での特定タイプのエンティティインスタンスを取得
+        
+        attribute_filters（属性クラスIDから値のリスト）を指定すると、その時点の属性値で絞り込む。
+        """
+        attribute_filters = attribute_filters or {}
+        
+        def load():
+            params = {'entity_type_id': entity_type_id, 'view_date': view_date}
+            filter_sql = _attribute_filter_sql(attribute_filters, params) if attribute_filters else ''
+            with get_connection() as conn:
+                return conn.execute(f"""
+                    SELECT e.identifier, e.title, e.date_in, e.date_out, ec.title as type_name
+                    FROM entity_instance e
+                    JOIN entity_class ec ON e.class_id = ec.identifier
+                    WHERE ec.identifier = :entity_type_id
+                      AND (e.date_in IS NULL OR e.date_in <= :view_date)
+                      AND (e.date_out IS NULL OR e.date_out > :view_date)
+                      {filter_sql}
+                    ORDER BY e.date_in DESC
+                """, params).fetchall()
+        
+        # 属性値で絞り込んだ一覧は、その属性クラスの値の変更でも変わる
+        dependencies = [('entity_class', entity_type_id)] + [('attribute_class', class_id)
+                                                            for class_id in attribute_filters]
+        filters_key = tuple((class_id, tuple(values)) for class_id, values in sorted(attribute_filters.items()))
+        return _cached_at_date('EntityRepository.get_by_type_at_date', (entity_type_id, filters_key), view_date,
+                               load, lambda rows: dependencies)
+    
+    @staticmethod
+    def get_by_id(entity_id: int) -> Optional[Record]:
+        """IDでエンティティインスタンスを取得"""
         with get_connection() as conn:
             return conn.execute("""
-                SELECT e.identifier, e.title, e.date_in, e.date_out, ec.title as type_name
+                SELECT e.*, ec.title as type_name
                 FROM entity_instance e
                 JOIN entity_class ec ON e.class_id = ec.identifier
-                WHERE ec.identifier = ?
-                  AND (e.date_in IS NULL OR e.date_in <= ?)
-                  AND (e.date_out IS NULL OR e.date_out > ?)
-                ORDER BY e.date_in DESC
-            """, (entity_type_id, view_date, view_date)).fetchall()
+                WHERE e.identifier = ?
+            """, (entity_id,)).fetchone()
     
     @staticmethod
-    def get_by_id(entity_id: int) -> Optional[sqlite3.Row]:
-        """IDでエンティティインスタンスを取得"""
+    def diff_between_dates(date_from: str, date_to: str, entity_class_id: int = None) -> List[Record]:
+        """2つの日付時点の間で有効になった・無効になったエンティティを取得"""
+        low, high = sorted([date_from, date_to])
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT 
+                    e.identifier, e.title, e.class_id, e.date_in, e.date_out, ec.title as type_name,
+                    CASE
+                        WHEN (e.date_in IS NULL OR e.date_in <= :date_to)
+                             AND (e.date_out IS NULL OR e.date_out > :date_to)
+                        THEN 'added'
+                        ELSE 'removed'
+                    END as change
+                FROM entity_instance e
+                JOIN entity_class ec ON e.class_id = ec.identifier
+                WHERE ((e.date_in > :low AND e.date_in <= :high) OR (e.date_out > :low AND e.date_out <= :high))
+                  AND ((e.date_in IS NULL OR e.date_in <= :date_from) AND (e.date_out IS NULL OR e.date_out > :date_from))
+                   != ((e.date_in IS NULL OR e.date_in <= :date_to) AND (e.date_out IS NULL OR e.date_out > :date_to))
+                  AND (:entity_class_id IS NULL OR e.class_id = :entity_class_id)
+                ORDER BY e.identifier
+            """, {'low': low, 'high': high, 'date_from': date_from, 'date_to': date_to,
+                  'entity_class_id': entity_class_id}).fetchall()
+    
+    @staticmethod
+    def get_many(entity_ids: List[int]) -> List[Record]:
+        """複数のエンティティインスタンスをIDで一括取得（ID一覧はJSON配列として1回で渡す）"""
         with get_connection() as conn:
             return conn.execute("""
                 SELECT e.*, ec.title as type_name
                 FROM entity_instance e
                 JOIN entity_class ec ON e.class_id = ec.identifier
-                WHERE e.identifier = ?
-            """, (entity_id,)).fetchone()
+                WHERE e.identifier IN (SELECT value FROM json_each(?))
+                ORDER BY e.identifier
+            """, (json.dumps(entity_ids),)).fetchall()
     
     @staticmethod
     def create(title: str, class_id: int, date_in: str = None, date_out: str = None) -> int:
@@ -168,8 +741,11 @@ class EntityRepository:
                 INSERT INTO entity_instance (title, class_id, date_in, date_out)
                 VALUES (?, ?, ?, ?)
             """, (title, class_id, date_in, date_out))
+            entity_id = cursor.lastrowid
+            ChangeLogRepository.record(conn, 'entity_instance', entity_id, 'create',
+                                       after=_row_to_dict(conn, 'entity_instance', entity_id))
             conn.commit()
-            return cursor.lastrowid
+            return entity_id
     
     @staticmethod
     def update(entity_id: int, title: str = None, class_id: int = None, 
@@ -197,11 +773,15 @@ class EntityRepository:
         params.append(entity_id)
         
         with get_connection() as conn:
+            before = _row_to_dict(conn, 'entity_instance', entity_id)
             cursor = conn.execute(f"""
                 UPDATE entity_instance
                 SET {', '.join(updates)}
                 WHERE identifier = ?
             """, params)
+            if cursor.rowcount > 0:
+                ChangeLogRepository.record(conn, 'entity_instance', entity_id, 'update', before=before,
+                                           after=_row_to_dict(conn, 'entity_instance', entity_id))
             conn.commit()
             return cursor.rowcount > 0
     
@@ -209,9 +789,12 @@ class EntityRepository:
     def delete(entity_id: int) -> bool:
         """エンティティインスタンスを削除"""
         with get_connection() as conn:
+            before = _row_to_dict(conn, 'entity_instance', entity_id)
             cursor = conn.execute("""
                 DELETE FROM entity_instance WHERE identifier = ?
             """, (entity_id,))
+            if cursor.rowcount > 0:
+                ChangeLogRepository.record(conn, 'entity_instance', entity_id, 'delete', before=before)
             conn.commit()
             return cursor.rowcount > 0
 
@@ -219,7 +802,7 @@ class AttributeRepository:
     """属性インスタンスのデータアクセス（旧Attribute）"""
     
     @staticmethod
-    def get_by_entity_id(entity_id: int) -> List[sqlite3.Row]:
+    def get_by_entity_id(entity_id: int) -> List[Record]:
         """エンティティIDで属性インスタンスを取得（現在時点で有効なもの）"""
         with get_connection() as conn:
             return conn.execute("""
@@ -252,10 +835,51 @@ class AttributeRepository:
             """, (entity_id,)).fetchall()
     
     @staticmethod
-    def get_by_entity_id_at_date(entity_id: int, view_date: str) -> List[sqlite3.Row]:
+    def get_by_entity_id_at_date(entity_id: int, view_date: str) -> List[Record]:
         """エンティティIDで属性インスタンスを取得（指定日付時点で有効なもののみ）"""
+        def load():
+            with get_connection() as conn:
+                return conn.execute(f"""
+                    SELECT 
+                        a.identifier,
+                        a.title,
+                        a.class_id,
+                        a.entity_id,
+                        a.date_in,
+                        a.date_out,
+                        ac.title as attr_name,
+                        ac.data_type,
+                        ac.order_display,
+                        CASE 
+                            WHEN ac.data_type = 'ENTITY' AND a.title IS NOT NULL 
+                            THEN te.title
+                            ELSE NULL
+                        END as target_entity_title,
+                        CASE 
+                            WHEN ac.data_type = 'ENTITY' AND a.title IS NOT NULL 
+                            THEN CAST(a.title AS INTEGER)
+                            ELSE NULL
+                        END as target_entity_id
+                    FROM {_attribute_versions('view_date')} a
+                    JOIN attribute_class ac ON a.class_id = ac.identifier
+                    LEFT JOIN entity_instance te ON (ac.data_type = 'ENTITY' AND CAST(a.title AS INTEGER) = te.identifier)
+                    WHERE a.entity_id = :entity_id
+                      AND (a.date_in IS NULL OR a.date_in <= :view_date)
+                      AND (a.date_out IS NULL OR a.date_out > :view_date)
+                    ORDER BY COALESCE(ac.order_display, ac.identifier)
+                """, {'entity_id': entity_id, 'view_date': view_date}).fetchall()
+    
+        # 参照先のエンティティ名はどの時点でも表示されるので、参照先も依存先にする
+        return _cached_at_date('AttributeRepository.get_by_entity_id_at_date', (entity_id,), view_date, load,
+                               lambda rows: [('entity', entity_id)] + [('entity_ref', row['target_entity_id'])
+                                                                       for row in rows
+                                                                       if row['target_entity_id'] is not None])
+    
+    @staticmethod
+    def get_by_entity_ids_at_date(entity_ids: List[int], view_date: str) -> List[Record]:
+        """複数エンティティの属性インスタンスを一括取得（指定日付時点で有効なもののみ）"""
         with get_connection() as conn:
-            return conn.execute("""
+            return conn.execute(f"""
                 SELECT 
                     a.identifier,
                     a.title,
@@ -276,29 +900,34 @@ class AttributeRepository:
                         THEN CAST(a.title AS INTEGER)
                         ELSE NULL
                     END as target_entity_id
-                FROM attribute_instance a
+                FROM {_attribute_versions('view_date')} a
                 JOIN attribute_class ac ON a.class_id = ac.identifier
                 LEFT JOIN entity_instance te ON (ac.data_type = 'ENTITY' AND CAST(a.title AS INTEGER) = te.identifier)
-                WHERE a.entity_id = ?
-                  AND (a.date_in IS NULL OR a.date_in <= ?)
-                  AND (a.date_out IS NULL OR a.date_out > ?)
-                ORDER BY COALESCE(ac.order_display, ac.identifier)
-            """, (entity_id, view_date, view_date)).fetchall()
+                WHERE a.entity_id IN (SELECT value FROM json_each(:entity_ids))
+                  AND (a.date_in IS NULL OR a.date_in <= :view_date)
+                  AND (a.date_out IS NULL OR a.date_out > :view_date)
+                ORDER BY a.entity_id, COALESCE(ac.order_display, ac.identifier)
+            """, {'entity_ids': json.dumps(entity_ids), 'view_date': view_date}).fetchall()
     
     @staticmethod
     def create(title: str, class_id: int, entity_id: int, date_in: str = None, date_out: str = None) -> int:
-        """新しい属性インスタンスを作成"""
+        """新しい属性インスタンスを作成（有効期間が不正なら IntervalConflictError）"""
         with get_connection() as conn:
             cursor = conn.execute("""
                 INSERT INTO attribute_instance (title, class_id, entity_id, date_in, date_out)
                 VALUES (?, ?, ?, ?, ?)
             """, (title, class_id, entity_id, date_in, date_out))
+            attribute_id = cursor.lastrowid
+            _check_attribute_interval(conn, attribute_id)
+            ChangeLogRepository.record(conn, 'attribute_instance', attribute_id, 'create',
+                                       after=_row_to_dict(conn, 'attribute_instance', attribute_id))
             conn.commit()
-            return cursor.lastrowid
+            return attribute_id
     
     @staticmethod
-    def update(attribute_id: int, title: str = None, date_in: str = None, date_out: str = None) -> bool:
-        """属性インスタンスを更新"""
+    def update(attribute_id: int, title: str = None, date_in: str = None, date_out: str = None,
+               operation: str = 'update') -> bool:
+        """属性インスタンスを更新（operationは変更履歴に記録する操作名、有効期間が不正なら IntervalConflictError）"""
         updates = []
         params = []
         
@@ -318,11 +947,16 @@ class AttributeRepository:
         params.append(attribute_id)
         
         with get_connection() as conn:
+            before = _row_to_dict(conn, 'attribute_instance', attribute_id)
             cursor = conn.execute(f"""
                 UPDATE attribute_instance
                 SET {', '.join(updates)}
                 WHERE identifier = ?
             """, params)
+            if cursor.rowcount > 0:
+                _check_attribute_interval(conn, attribute_id)
+                ChangeLogRepository.record(conn, 'attribute_instance', attribute_id, operation, before=before,
+                                           after=_row_to_dict(conn, 'attribute_instance', attribute_id))
             conn.commit()
             return cursor.rowcount > 0
     
@@ -330,9 +964,12 @@ class AttributeRepository:
     def delete(attribute_id: int) -> bool:
         """属性インスタンスを削除"""
         with get_connection() as conn:
+            before = _row_to_dict(conn, 'attribute_instance', attribute_id)
             cursor = conn.execute("""
                 DELETE FROM attribute_instance WHERE identifier = ?
             """, (attribute_id,))
+            if cursor.rowcount > 0:
+                ChangeLogRepository.record(conn, 'attribute_instance', attribute_id, 'delete', before=before)
             conn.commit()
             return cursor.rowcount > 0
     
@@ -343,13 +980,259 @@ class AttributeRepository:
             from datetime import datetime
             date_out = datetime.now().strftime('%Y-%m-%d')
         
-        return AttributeRepository.update(attribute_id, date_out=date_out)
+        return AttributeRepository.update(attribute_id, date_out=date_out, operation='logical_delete')
+    
+    @staticmethod
+    def get_timeline(entity_id: int) -> List[Record]:
+        """エンティティの属性変更イベントを時系列順に取得
+        
+        各バージョンの date_in を 'set'、date_out を 'unset' イベントとして展開する。
+        同日のイベントは unset を先に並べるため、先頭から順に適用すれば各日付時点の状態になる。
+        """
+        with get_connection() as conn:
+            return conn.execute(f"""
+                WITH versions AS (
+                    SELECT 
+                        a.identifier,
+                        a.title,
+                        a.class_id,
+                        a.date_in,
+                        a.date_out,
+                        ac.title as attr_name,
+                        ac.data_type,
+                        ac.order_display,
+                        CASE 
+                            WHEN ac.data_type = 'ENTITY' AND a.title IS NOT NULL 
+                            THEN te.title
+                            ELSE NULL
+                        END as target_entity_title,
+                        CASE 
+                            WHEN ac.data_type = 'ENTITY' AND a.title IS NOT NULL 
+                            THEN CAST(a.title AS INTEGER)
+                            ELSE NULL
+                        END as target_entity_id
+                    FROM {_attribute_versions()} a
+                    JOIN attribute_class ac ON a.class_id = ac.identifier
+                    LEFT JOIN entity_instance te ON (ac.data_type = 'ENTITY' AND CAST(a.title AS INTEGER) = te.identifier)
+                    WHERE a.entity_id = ?
+                )
+                SELECT * FROM (
+                    SELECT date_in as event_date, 'set' as event, 1 as event_order, * FROM versions
+                    UNION ALL
+                    SELECT date_out as event_date, 'unset' as event, 0 as event_order, * FROM versions
+                    WHERE date_out IS NOT NULL
+                )
+                ORDER BY event_date IS NOT NULL, event_date, event_order, COALESCE(order_display, class_id)
+            """, (entity_id,)).fetchall()
+    
+    @staticmethod
+    def diff_between_dates(date_from: str, date_to: str, entity_class_id: int = None) -> List[Record]:
+        """2つの日付時点の間で変化した属性を (entity_id, class_id) 単位で取得
+        
+        片方の日付時点でのみ有効なバージョンは、date_in か date_out が
+        2つの日付の間に入っているものに限られるため、その範囲だけを走査する。
+        """
+        low, high = sorted([date_from, date_to])
+        with get_connection() as conn:
+            return conn.execute(f"""
+                WITH versions AS NOT MATERIALIZED {_attribute_versions('low')},
+                boundary AS (
+                    SELECT * FROM versions
+                    WHERE date_in > :low AND date_in <= :high
+                    UNION
+                    SELECT * FROM versions
+                    WHERE date_out > :low AND date_out <= :high
+                ),
+                changed AS (
+                    SELECT 
+                        a.*,
+                        ((a.date_in IS NULL OR a.date_in <= :date_from)
+                          AND (a.date_out IS NULL OR a.date_out > :date_from)) as active_from,
+                        ((a.date_in IS NULL OR a.date_in <= :date_to)
+                          AND (a.date_out IS NULL OR a.date_out > :date_to)) as active_to
+                    FROM boundary a
+                )
+                SELECT 
+                    c.entity_id,
+                    e.title as entity_title,
+                    e.class_id as entity_class_id,
+                    c.class_id,
+                    ac.title as attr_name,
+                    ac.data_type,
+                    json_group_array(c.title) FILTER (WHERE c.active_from AND NOT c.active_to) as values_from,
+                    json_group_array(c.title) FILTER (WHERE c.active_to AND NOT c.active_from) as values_to,
+                    CASE
+                        WHEN SUM(c.active_from AND NOT c.active_to) = 0 THEN 'added'
+                        WHEN SUM(c.active_to AND NOT c.active_from) = 0 THEN 'removed'
+                        ELSE 'changed'
+                    END as change
+                FROM changed c
+                JOIN entity_instance e ON c.entity_id = e.identifier
+                JOIN attribute_class ac ON c.class_id = ac.identifier
+                WHERE c.active_from != c.active_to
+                  AND (:entity_class_id IS NULL OR e.class_id = :entity_class_id)
+                GROUP BY c.entity_id, c.class_id
+                ORDER BY c.entity_id, COALESCE(ac.order_display, ac.identifier)
+            """, {'low': low, 'high': high, 'date_from': date_from, 'date_to': date_to,
+                  'entity_class_id': entity_class_id}).fetchall()
+    
+    @staticmethod
+    def apply_batch(operations: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """属性インスタンスへの複数の変更を1トランザクションで適用
+        
+        operations の各要素は op（create / update / logical_delete / delete）と
+        その操作に必要なキーを持つ辞書。1件でも検証（有効期間の逆転・重なりを含む）に
+        失敗した場合は BatchValidationError を送出し、何も書き込まない。
+        """
+        from datetime import datetime
+        today = datetime.now().strftime('%Y-%m-%d')
+        
+        # 参照先をまとめて取得するためにIDを収集
+        entity_ids, class_ids, attribute_ids = set(), set(), set()
+        for index, operation in enumerate(operations):
+            if not isinstance(operation, dict):
+                raise BatchValidationError(index, '操作はオブジェクトで指定してください')
+            op = operation.get('op')
+            try:
+                if op == 'create':
+                    entity_ids.add(int(operation['entity_id']))
+                    class_ids.add(int(operation['class_id']))
+                elif op in ('update', 'logical_delete', 'delete'):
+                    attribute_ids.add(int(operation['identifier']))
+                else:
+                    raise BatchValidationError(index, f'不明な操作です: {op}')
+            except KeyError as e:
+                raise BatchValidationError(index, f'{e.args[0]} が指定されていません')
+            except (TypeError, ValueError):
+                raise BatchValidationError(index, 'IDは整数で指定してください')
+        
+        with get_connection() as conn:
+            known_entities = {row[0] for row in conn.execute("""
+                SELECT identifier FROM entity_instance
+                WHERE identifier IN (SELECT value FROM json_each(?))
+            """, (json.dumps(sorted(entity_ids)),))}
+            attribute_classes = {row['identifier']: row for row in conn.execute("""
+                SELECT identifier, data_type FROM attribute_class
+                WHERE identifier IN (SELECT value FROM json_each(?))
+            """, (json.dumps(sorted(class_ids)),))}
+            existing = {row['identifier']: dict(row) for row in conn.execute("""
+                SELECT a.*, ac.data_type
+                FROM attribute_instance a
+                LEFT JOIN attribute_class ac ON a.class_id = ac.identifier
+                WHERE a.identifier IN (SELECT value FROM json_each(?))
+            """, (json.dumps(sorted(attribute_ids)),))}
+            
+            # ENTITY型の値として指定された参照先をまとめて検証
+            target_ids = set()
+            for operation in operations:
+                if operation['op'] == 'create':
+                    attr_class = attribute_classes.get(int(operation['class_id']))
+                    data_type = attr_class['data_type'] if attr_class else None
+                else:
+                    row = existing.get(int(operation['identifier']))
+                    data_type = row['data_type'] if row else None
+                if data_type == 'ENTITY' and operation.get('value') is not None:
+                    try:
+                        target_ids.add(int(operation['value']))
+                    except (TypeError, ValueError):
+                        pass
+            known_targets = {row[0] for row in conn.execute("""
+                SELECT identifier FROM entity_instance
+                WHERE identifier IN (SELECT value FROM json_each(?))
+            """, (json.dumps(sorted(target_ids)),))}
+            
+            def normalize_value(index, value, data_type):
+                if value is None or str(value).strip() == '':
+                    raise BatchValidationError(index, 'value を入力してください')
+                if data_type != 'ENTITY':
+                    return str(value)
+                try:
+                    target_id = int(value)
+                except (TypeError, ValueError):
+                    raise BatchValidationError(index, 'ENTITY型の value はエンティティIDで指定してください')
+                if target_id not in known_targets:
+                    raise BatchValidationError(index, f'参照先エンティティ {target_id} が存在しません')
+                return str(target_id)
+            
+            results = []
+            for index, operation in enumerate(operations):
+                op = operation['op']
+                
+                if op == 'create':
+                    entity_id = int(operation['entity_id'])
+                    class_id = int(operation['class_id'])
+                    if entity_id not in known_entities:
+                        raise BatchValidationError(index, f'エンティティ {entity_id} が存在しません')
+                    if class_id not in attribute_classes:
+                        raise BatchValidationError(index, f'属性クラス {class_id} が存在しません')
+                    after = {
+                        'title': normalize_value(index, operation.get('value'), attribute_classes[class_id]['data_type']),
+                        'class_id': class_id,
+                        'entity_id': entity_id,
+                        'date_in': operation.get('date_in'),
+                        'date_out': operation.get('date_out')
+                    }
+                    cursor = conn.execute("""
+                        INSERT INTO attribute_instance (title, class_id, entity_id, date_in, date_out)
+                        VALUES (:title, :class_id, :entity_id, :date_in, :date_out)
+                    """, after)
+                    after = {'identifier': cursor.lastrowid, **after}
+                    ChangeLogRepository.record(conn, 'attribute_instance', cursor.lastrowid, 'create', after=after)
+                    results.append({'index': index, 'op': op, 'identifier': cursor.lastrowid})
+                    continue
+                
+                attribute_id = int(operation['identifier'])
+                before = existing.get(attribute_id)
+                if before is None:
+                    raise BatchValidationError(index, f'属性インスタンス {attribute_id} が存在しません')
+                data_type = before.pop('data_type', None)
+                
+                if op == 'delete':
+                    conn.execute("DELETE FROM attribute_instance WHERE identifier = ?", (attribute_id,))
+                    ChangeLogRepository.record(conn, 'attribute_instance', attribute_id, 'delete', before=before)
+                    existing[attribute_id] = None
+                    results.append({'index': index, 'op': op, 'identifier': attribute_id})
+                    continue
+                
+                after = dict(before)
+                if op == 'logical_delete':
+                    after['date_out'] = operation.get('date_out') or today
+                else:
+                    if 'value' in operation:
+                        after['title'] = normalize_value(index, operation['value'], data_type)
+                    for key in ('date_in', 'date_out'):
+                        if key in operation:
+                            after[key] = operation[key]
+                
+                conn.execute("""
+                    UPDATE attribute_instance
+                    SET title = :title, date_in = :date_in, date_out = :date_out
+                    WHERE identifier = :identifier
+                """, after)
+                ChangeLogRepository.record(conn, 'attribute_instance', attribute_id, op, before=before, after=after)
+                # 同じバッチ内で続けて変更された場合に備えて最新状態を保持
+                existing[attribute_id] = {**after, 'data_type': data_type}
+                results.append({'index': index, 'op': op, 'identifier': attribute_id})
+            
+            # 有効期間はすべての操作を適用してから検証する（古い値を閉じる操作と新しい値の追加の順序は問わない）
+            checked = {}
+            for result in results:
+                if result['op'] != 'delete':
+                    checked[result['identifier']] = result['index']
+            for attribute_id, index in sorted(checked.items(), key=lambda item: item[1]):
+                try:
+                    _check_attribute_interval(conn, attribute_id)
+                except IntervalConflictError as e:
+                    raise BatchValidationError(index, str(e))
+            
+            conn.commit()
+            return results
     
     @staticmethod
-    def get_all_by_entity_and_class(entity_id: int, class_id: int) -> List[sqlite3.Row]:
+    def get_all_by_entity_and_class(entity_id: int, class_id: int) -> List[Record]:
         """エンティティと属性クラスで属性インスタンスの全履歴を取得"""
         with get_connection() as conn:
-            return conn.execute("""
+            return conn.execute(f"""
                 SELECT 
                     a.identifier,
                     a.title,
@@ -359,14 +1242,14 @@ class AttributeRepository:
                     a.date_out,
                     ac.title as attr_name,
                     ac.data_type
-                FROM attribute_instance a
+                FROM {_attribute_versions()} a
                 JOIN attribute_class ac ON a.class_id = ac.identifier
                 WHERE a.entity_id = ? AND a.class_id = ?
                 ORDER BY a.date_in DESC
             """, (entity_id, class_id)).fetchall()
     
     @staticmethod
-    def get_active_by_entity_and_class(entity_id: int, class_id: int) -> List[sqlite3.Row]:
+    def get_active_by_entity_and_class(entity_id: int, class_id: int) -> List[Record]:
         """エンティティと属性クラスで現在有効な属性インスタンスを取得"""
         with get_connection() as conn:
             return conn.execute("""
@@ -386,11 +1269,790 @@ class AttributeRepository:
                 ORDER BY a.date_in DESC
             """, (entity_id, class_id)).fetchall()
 
+class BulkRepository:
+    """絞り込んだエンティティの集合への一括操作のデータアクセス
+    
+    対象は selection（ids / class_id / attribute_class_id と attribute_value）で絞り込み、
+    at の時点で有効なエンティティだけを選ぶ。対象を一時テーブルに入れ、変更は集合単位の
+    UPDATE / INSERT ... SELECT で、変更履歴も INSERT ... SELECT で同じトランザクション内に書く。
+    dry_run=True では同じ処理を実行して件数だけ数え、ロールバックする。
+    """
+    
+    @staticmethod
+    def _select_targets(conn: sqlite3.Connection, selection: Dict[str, Any], entity_class_id: int = None) -> int:
+        """対象エンティティを一時テーブル bulk_target に入れて件数を返す（接続を閉じると消える）"""
+        conditions = ["(e.date_in IS NULL OR e.date_in <= :at)", "(e.date_out IS NULL OR e.date_out > :at)"]
+        params = {'at': selection['at']}
+        if selection.get('ids') is not None:
+            conditions.append("e.identifier IN (SELECT value FROM json_each(:ids))")
+            params['ids'] = json.dumps(selection['ids'])
+        if selection.get('class_id') is not None:
+            conditions.append("e.class_id = :class_id")
+            params['class_id'] = selection['class_id']
+        if entity_class_id is not None:
+            # 属性を操作する場合は、その属性クラスを持つエンティティクラスに限る
+            conditions.append("e.class_id = :entity_class_id")
+            params['entity_class_id'] = entity_class_id
+        if selection.get('attribute_class_id') is not None:
+            conditions.append(f"""EXISTS (
+                SELECT 1 FROM {_attribute_versions('at')} a
+                WHERE a.entity_id = e.identifier
+                  AND a.class_id = :attribute_class_id
+                  AND a.title = :attribute_value
+                  AND (a.date_in IS NULL OR a.date_in <= :at)
+                  AND (a.date_out IS NULL OR a.date_out > :at)
+            )""")
+            params['attribute_class_id'] = selection['attribute_class_id']
+            params['attribute_value'] = str(selection['attribute_value'])
+        
+        conn.execute("CREATE TEMP TABLE bulk_target (entity_id INTEGER PRIMARY KEY)")
+        return conn.execute(f"""
+            INSERT INTO temp.bulk_target (entity_id)
+            SELECT e.identifier FROM entity_instance e
+            WHERE {' AND '.join(conditions)}
+        """, params).rowcount
+    
+    @staticmethod
+    def _get_attribute_class(conn: sqlite3.Connection, attribute_class_id: int) -> Record:
+        attr_class = conn.execute("""
+            SELECT identifier, entity_id, data_type FROM attribute_class WHERE identifier = ?
+        """, (attribute_class_id,)).fetchone()
+        if attr_class is None:
+            raise ValueError(f'属性クラス {attribute_class_id} が存在しません')
+        return attr_class
+    
+    @staticmethod
+    def _finish(conn: sqlite3.Connection, summary: Dict[str, Any], dry_run: bool) -> Dict[str, Any]:
+        if dry_run:
+            conn.rollback()
+        else:
+            conn.commit()
+        summary['dry_run'] = dry_run
+        return summary
+    
+    @staticmethod
+    def deactivate_entities(selection: Dict[str, Any], date_out: str, dry_run: bool = False) -> Dict[str, Any]:
+        """対象エンティティに date_out を設定し、その日以降も有効な属性値を同じ日付で閉じる"""
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            matched = BulkRepository._select_targets(conn, selection)
+            params = {'date_out': date_out}
+            
+            entity_where = """r.identifier IN (SELECT entity_id FROM temp.bulk_target)
+              AND (r.date_out IS NULL OR r.date_out > :date_out)"""
+            ChangeLogRepository.record_rows(conn, 'entity_instance', 'update', entity_where, params,
+                                            after={'date_out': ':date_out'})
+            entities = conn.execute(f"""
+                UPDATE entity_instance AS r SET date_out = :date_out WHERE {entity_where}
+            """, params).rowcount
+            
+            attribute_where = """r.entity_id IN (SELECT entity_id FROM temp.bulk_target)
+              AND (r.date_in IS NULL OR r.date_in < :date_out)
+              AND (r.date_out IS NULL OR r.date_out > :date_out)"""
+            ChangeLogRepository.record_rows(conn, 'attribute_instance', 'logical_delete', attribute_where, params,
+                                            after={'date_out': ':date_out'})
+            attributes = conn.execute(f"""
+                UPDATE attribute_instance AS r SET date_out = :date_out WHERE {attribute_where}
+            """, params).rowcount
+            
+            return BulkRepository._finish(conn, {'matched': matched, 'entities': entities,
+                                                 'attributes_closed': attributes}, dry_run)
+    
+    @staticmethod
+    def set_attribute(selection: Dict[str, Any], attribute_class_id: int, value: Any, date_in: str,
+                      dry_run: bool = False) -> Dict[str, Any]:
+        """対象エンティティの属性値を date_in から value にする
+        
+        その日に有効な値が既に value のエンティティは変更しない。date_in より前から有効な
+        バージョンは date_in で閉じ、date_in に始まるバージョンは値を置き換える。新しい
+        バージョンは、より後に始まるバージョンがあればその開始日までとする。
+        """
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            attr_class = BulkRepository._get_attribute_class(conn, attribute_class_id)
+            if value is None or str(value).strip() == '':
+                raise ValueError('value を入力してください')
+            if attr_class['data_type'] == 'ENTITY':
+                try:
+                    target_id = int(value)
+                except (TypeError, ValueError):
+                    raise ValueError('ENTITY型の value はエンティティIDで指定してください')
+                if conn.execute("SELECT 1 FROM entity_instance WHERE identifier = ?", (target_id,)).fetchone() is None:
+                    raise ValueError(f'参照先エンティティ {target_id} が存在しません')
+                value = target_id
+            
+            matched = BulkRepository._select_targets(conn, selection, attr_class['entity_id'])
+            params = {'class_id': attribute_class_id, 'value': str(value), 'date_in': date_in}
+            
+            unchanged = conn.execute("""
+                DELETE FROM temp.bulk_target WHERE entity_id IN (
+                    SELECT entity_id FROM attribute_instance
+                    WHERE class_id = :class_id AND title = :value
+                      AND (date_in IS NULL OR date_in <= :date_in)
+                      AND (date_out IS NULL OR date_out > :date_in)
+                )
+            """, params).rowcount
+            
+            same_day_where = """r.entity_id IN (SELECT entity_id FROM temp.bulk_target)
+              AND r.class_id = :class_id AND r.date_in = :date_in"""
+            ChangeLogRepository.record_rows(conn, 'attribute_instance', 'update', same_day_where, params,
+                                            after={'title': ':value'})
+            replaced = conn.execute(f"""
+                UPDATE attribute_instance AS r SET title = :value WHERE {same_day_where}
+            """, params).rowcount
+            
+            close_where = """r.entity_id IN (SELECT entity_id FROM temp.bulk_target)
+              AND r.class_id = :class_id
+              AND (r.date_in IS NULL OR r.date_in < :date_in)
+              AND (r.date_out IS NULL OR r.date_out > :date_in)"""
+            ChangeLogRepository.record_rows(conn, 'attribute_instance', 'logical_delete', close_where, params,
+                                            after={'date_out': ':date_in'})
+            closed = conn.execute(f"""
+                UPDATE attribute_instance AS r SET date_out = :date_in WHERE {close_where}
+            """, params).rowcount
+            
+            last_id = conn.execute("SELECT COALESCE(MAX(identifier), 0) FROM attribute_instance").fetchone()[0]
+            created = conn.execute("""
+                INSERT INTO attribute_instance (title, class_id, entity_id, date_in, date_out)
+                SELECT :value, :class_id, t.entity_id, :date_in, (
+                    SELECT MIN(a.date_in) FROM attribute_instance a
+                    WHERE a.entity_id = t.entity_id AND a.class_id = :class_id AND a.date_in > :date_in
+                )
+                FROM temp.bulk_target t
+                WHERE NOT EXISTS (
+                    SELECT 1 FROM attribute_instance a
+                    WHERE a.entity_id = t.entity_id AND a.class_id = :class_id AND a.date_in = :date_in
+                )
+                ORDER BY t.entity_id
+            """, params).rowcount
+            ChangeLogRepository.record_rows(conn, 'attribute_instance', 'create', "r.identifier > :last_id",
+                                            {'last_id': last_id}, before=False, after={})
+            
+            return BulkRepository._finish(conn, {'matched': matched, 'unchanged': unchanged, 'created': created,
+                                                 'replaced': replaced, 'closed': closed}, dry_run)
+    
+    @staticmethod
+    def close_attribute(selection: Dict[str, Any], attribute_class_id: int, date_out: str,
+                        dry_run: bool = False) -> Dict[str, Any]:
+        """対象エンティティで date_out より前から有効な属性値を date_out で閉じる"""
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            attr_class = BulkRepository._get_attribute_class(conn, attribute_class_id)
+            matched = BulkRepository._select_targets(conn, selection, attr_class['entity_id'])
+            params = {'class_id': attribute_class_id, 'date_out': date_out}
+            
+            close_where = """r.entity_id IN (SELECT entity_id FROM temp.bulk_target)
+              AND r.class_id = :class_id
+              AND (r.date_in IS NULL OR r.date_in < :date_out)
+              AND (r.date_out IS NULL OR r.date_out > :date_out)"""
+            ChangeLogRepository.record_rows(conn, 'attribute_instance', 'logical_delete', close_where, params,
+                                            after={'date_out': ':date_out'})
+            closed = conn.execute(f"""
+                UPDATE attribute_instance AS r SET date_out = :date_out WHERE {close_where}
+            """, params).rowcount
+            
+            return BulkRepository._finish(conn, {'matched': matched, 'closed': closed}, dry_run)
+
+class HistoryArchiveRepository:
+    """属性インスタンスの履歴圧縮とアーカイブのデータアクセス
+    
+    アーカイブ境界（history_horizon）より前に閉じたバージョンは attribute_instance_archive に
+    移す。指定日付時点の取得は、その日付が境界より前のときだけアーカイブも読む。
+    """
+    
+    @staticmethod
+    def get_horizon() -> Optional[str]:
+        """現在のアーカイブ境界（未設定なら None）"""
+        with get_connection() as conn:
+            row = conn.execute("""
+                SELECT horizon FROM history_horizon WHERE table_name = 'attribute_instance'
+            """).fetchone()
+            return row['horizon'] if row else None
+    
+    @staticmethod
+    def raise_horizon(horizon: str) -> str:
+        """アーカイブ境界を進める（戻すことはしない）して、有効な境界を返す
+        
+        行を移す前に境界を進めておくことで、移動途中でも境界より前の時点の取得が
+        アーカイブを読むようにする。
+        """
+        with get_connection() as conn:
+            conn.execute("""
+                INSERT INTO history_horizon (table_name, horizon) VALUES ('attribute_instance', ?)
+                ON CONFLICT (table_name) DO UPDATE SET
+                    horizon = MAX(horizon, excluded.horizon),
+                    updated_at = datetime('now', 'localtime')
+            """, (horizon,))
+            conn.commit()
+            return conn.execute("""
+                SELECT horizon FROM history_horizon WHERE table_name = 'attribute_instance'
+            """).fetchone()['horizon']
+    
+    @staticmethod
+    def find_adjacent_duplicates() -> List[List[int]]:
+        """同じ値のまま途切れずに続くバージョンの並びを取得
+        
+        (entity_id, class_id, title) ごとに date_in 順に並べ、直前のバージョンの date_out と
+        date_in が一致するものをつなげる。戻り値は各並びの identifier（先頭が残す行）。
+        """
+        with get_connection() as conn:
+            rows = conn.execute("""
+                SELECT identifier, prev_identifier FROM (
+                    SELECT 
+                        identifier,
+                        entity_id,
+                        class_id,
+                        title,
+                        date_in,
+                        LAG(identifier) OVER w as prev_identifier,
+                        LAG(date_out) OVER w as prev_date_out
+                    FROM attribute_instance
+                    WHERE date_in IS NOT NULL
+                    WINDOW w AS (PARTITION BY entity_id, class_id, title ORDER BY date_in, identifier)
+                )
+                WHERE prev_date_out = date_in
+                ORDER BY entity_id, class_id, title, date_in, identifier
+            """).fetchall()
+        
+        # 直前の行をたどって、各並びの先頭の行にまとめる
+        keeper = {}
+        groups = {}
+        for row in rows:
+            head = keeper.get(row['prev_identifier'], row['prev_identifier'])
+            keeper[row['identifier']] = head
+            groups.setdefault(head, [head]).append(row['identifier'])
+        return list(groups.values())
+    
+    @staticmethod
+    def merge_versions(groups: List[List[int]]) -> int:
+        """同じ値の連続したバージョンを先頭の行にまとめ、削除した行数を返す
+        
+        各並びは取得後に変更されていないことを確認してから、1トランザクションで適用する。
+        変更ログには並びごとに1件、先頭の行の有効期間の変更として記録し、まとめて削除した行の
+        identifier を after の merged に入れる（削除した行ごとには記録しない）。
+        """
+        merged = 0
+        with get_connection() as conn:
+            for identifiers in groups:
+                rows = conn.execute("""
+                    SELECT * FROM attribute_instance
+                    WHERE identifier IN (SELECT value FROM json_each(?))
+                    ORDER BY date_in, identifier
+                """, (json.dumps(identifiers),)).fetchall()
+                rows = [dict(row) for row in rows]
+                
+                # 取得後に他の更新が入っていたらこの並びは飛ばす
+                if len(rows) != len(identifiers) or rows[0]['identifier'] != identifiers[0]:
+                    continue
+                if any(rows[index - 1]['date_out'] != row['date_in'] or rows[index - 1]['title'] != row['title']
+                       for index, row in enumerate(rows) if index > 0):
+                    continue
+                
+                head, tail = rows[0], rows[1:]
+                merged_ids = [row['identifier'] for row in tail]
+                after = {**head, 'date_out': tail[-1]['date_out']}
+                conn.execute("""
+                    UPDATE attribute_instance SET date_out = ? WHERE identifier = ?
+                """, (after['date_out'], head['identifier']))
+                conn.execute("""
+                    DELETE FROM attribute_instance WHERE identifier IN (SELECT value FROM json_each(?))
+                """, (json.dumps(merged_ids),))
+                ChangeLogRepository.record(conn, 'attribute_instance', head['identifier'], 'compact',
+                                           before=head, after={**after, 'merged': merged_ids})
+                conn.commit()
+                merged += len(tail)
+        return merged
+    
+    @staticmethod
+    def count_archivable(horizon: str) -> int:
+        """アーカイブ境界より前に閉じたバージョンの件数"""
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT COUNT(*) FROM attribute_instance
+                WHERE date_out IS NOT NULL AND date_out <= ?
+            """, (horizon,)).fetchone()[0]
+    
+    @staticmethod
+    def archive_closed_versions(horizon: str, limit: int = 5000) -> int:
+        """境界より前に閉じたバージョンを最大 limit 件アーカイブへ移し、移した件数を返す
+        
+        attribute_instance は AUTOINCREMENT なので、移した行のIDが新しい行に再利用されることはない。
+        移した行は境界より前の時点の取得でアーカイブから同じ内容で返るので、変更ログには記録しない
+        （連携先や時点指定のキャッシュに、何も変わらない変更を流さない）。
+        """
+        with get_connection() as conn:
+            moved = [row['identifier'] for row in conn.execute("""
+                SELECT identifier FROM attribute_instance
+                WHERE date_out IS NOT NULL AND date_out <= ?
+                LIMIT ?
+            """, (horizon, limit))]
+            if not moved:
+                return 0
+            
+            identifiers = json.dumps(moved)
+            conn.execute("""
+                INSERT INTO attribute_instance_archive (identifier, title, class_id, entity_id, date_in, date_out)
+                SELECT identifier, title, class_id, entity_id, date_in, date_out
+                FROM attribute_instance
+                WHERE identifier IN (SELECT value FROM json_each(?))
+            """, (identifiers,))
+            conn.execute("""
+                DELETE FROM attribute_instance WHERE identifier IN (SELECT value FROM json_each(?))
+            """, (identifiers,))
+            conn.commit()
+            return len(moved)
+
+class AnalyticsRepository:
+    """期間（date_in / date_out）から時系列の件数を集計する
+    
+    日付ごとに問い合わせる代わりに、各期間を開始日の +1 と終了日の -1 のイベントにして
+    日付順に累積し（イベントスイープ）、各バケットの先頭日の時点で有効な件数を1回の問い合わせで求める。
+    """
+    
+    @staticmethod
+    def count_series(buckets: List[str], entity_class_id: int = None, group_by: int = None) -> List[Record]:
+        """各バケットの先頭日の時点で有効なエンティティ数（bucket, grp, active）を取得
+        
+        group_by に属性クラスIDを指定すると、その時点の属性値ごとの件数を返す
+        （エンティティと属性値の期間が両方とも有効な日だけ数える）。grp は group_by なしなら NULL。
+        """
+        entity_filter = 'AND e.class_id = :entity_class_id' if entity_class_id is not None else ''
+        if group_by is None:
+            intervals = f"""
+                SELECT NULL AS grp, e.date_in, e.date_out
+                FROM entity_instance e
+                WHERE 1 = 1 {entity_filter}
+            """
+        else:
+            # エンティティと属性値の期間の重なり（NULL の開始日は '' として最も古い日付とみなす）
+            intervals = f"""
+                SELECT a.title AS grp,
+                       MAX(COALESCE(e.date_in, ''), COALESCE(a.date_in, '')) AS date_in,
+                       CASE WHEN e.date_out IS NULL THEN a.date_out
+                            WHEN a.date_out IS NULL THEN e.date_out
+                            ELSE MIN(e.date_out, a.date_out) END AS date_out
+                FROM {_attribute_versions()} a
+                JOIN entity_instance e ON a.entity_id = e.identifier
+                WHERE a.class_id = :group_by {entity_filter}
+            """
+        
+        with get_connection() as conn:
+            return conn.execute(f"""
+                WITH
+                buckets(bucket) AS (SELECT value FROM json_each(:buckets)),
+                intervals AS (
+                    SELECT grp, COALESCE(date_in, '') AS date_in, date_out FROM ({intervals})
+                    -- 最初のバケットより前に終わった期間・最後のバケットより後に始まる期間・空の期間は数に影響しない
+                    WHERE (date_out IS NULL OR (date_out > :first AND date_out > COALESCE(date_in, '')))
+                      AND COALESCE(date_in, '') <= :last
+                ),
+                sweep AS (
+                    SELECT grp, day, SUM(delta) AS delta, 0 AS is_bucket
+                    FROM (
+                        SELECT grp, date_in AS day, 1 AS delta FROM intervals
+                        UNION ALL
+                        SELECT grp, date_out, -1 FROM intervals WHERE date_out IS NOT NULL AND date_out <= :last
+                    )
+                    GROUP BY grp, day
+                    UNION ALL
+                    -- 同じ日のイベントより後に並べて、その日に始まった期間を含め終わった期間を除く
+                    SELECT g.grp, b.bucket, 0, 1
+                    FROM buckets b CROSS JOIN (SELECT DISTINCT grp FROM intervals) g
+                )
+                SELECT bucket, grp, active FROM (
+                    SELECT day AS bucket, grp, is_bucket,
+                           SUM(delta) OVER (PARTITION BY grp ORDER BY day, is_bucket ROWS UNBOUNDED PRECEDING) AS active
+                    FROM sweep
+                )
+                WHERE is_bucket = 1 AND active > 0
+                ORDER BY bucket, grp
+            """, {'buckets': json.dumps(buckets), 'first': buckets[0], 'last': buckets[-1],
+                  'entity_class_id': entity_class_id, 'group_by': group_by}).fetchall()
+
+class FacetRepository:
+    """インスタンス一覧のファセット（属性値ごとのエンティティ数）の集計"""
+    
+    @staticmethod
+    def count_values(entity_class_id: int, view_date: str, facet_class_id: int,
+                     attribute_filters: Dict[int, List[str]] = None, limit: int = 10,
+                     pinned: List[str] = None) -> List[Record]:
+        """view_date の時点で有効なエンティティの、facet_class_id の値ごとの件数を多い順に取得
+        
+        1回の集計で値ごとの件数（value, count）と値の種類数（values_total）を返す。
+        attribute_filters で絞り込んだエンティティだけを数える（ファセット自身の絞り込みは
+        呼び出し側で除いておくと、選択中でも他の値の件数が表示される）。pinned の値は件数によらず先に返す。
+        """
+        params = {'entity_class_id': entity_class_id, 'view_date': view_date, 'facet_class_id': facet_class_id,
+                  'limit': limit, 'pinned': json.dumps(pinned or [], ensure_ascii=False)}
+        filter_sql = _attribute_filter_sql(attribute_filters, params) if attribute_filters else ''
+        with get_connection() as conn:
+            return conn.execute(f"""
+                SELECT a.title AS value, COUNT(DISTINCT a.entity_id) AS count, COUNT(*) OVER () AS values_total
+                FROM {_attribute_versions('view_date')} a
+                JOIN entity_instance e ON a.entity_id = e.identifier
+                WHERE a.class_id = :facet_class_id
+                  AND (a.date_in IS NULL OR a.date_in <= :view_date)
+                  AND (a.date_out IS NULL OR a.date_out > :view_date)
+                  AND e.class_id = :entity_class_id
+                  AND (e.date_in IS NULL OR e.date_in <= :view_date)
+                  AND (e.date_out IS NULL OR e.date_out > :view_date)
+                  {filter_sql}
+                GROUP BY a.title
+                ORDER BY a.title IN (SELECT value FROM json_each(:pinned)) DESC, count DESC, value
+                LIMIT :limit
+            """, params).fetchall()
+
+class IntegrityRepository:
+    """属性インスタンスの有効期間と参照の整合性チェック
+    
+    ライブテーブルとアーカイブの全バージョンを (entity_id, class_id) ごとに date_in 順に並べた
+    1回のウィンドウ関数の走査で、次の問題を検出する。
+    
+    - overlap: それより前に始まるバージョンの有効期間と重なる
+    - gap: 直前までのバージョンがすべて閉じてから間を空けて始まる（値のない期間、警告）
+    - inverted: 無効日が有効日より前
+    - missing_entity / missing_class: 所属するエンティティ・属性クラスが存在しない
+    - dangling_reference: ENTITY型の値が存在しないエンティティを指す
+    """
+    
+    ISSUES = ('overlap', 'gap', 'inverted', 'missing_entity', 'missing_class', 'dangling_reference')
+    # 値のない期間は正常な履歴でも起こるので、件数は出すが不整合とはみなさない
+    WARNINGS = ('gap',)
+    
+    @staticmethod
+    def find_issues(entity_class_id: int = None) -> List[Record]:
+        """問題のあるバージョンを (entity_id, class_id, date_in) の順に取得
+        
+        各行は issue・バージョンの列・related_id（overlap / gap では直前のバージョン、
+        dangling_reference では参照先のID）・related_date（直前までのバージョンが有効な最後の日、無期限なら NULL）。
+        """
+        with get_connection() as conn:
+            return conn.execute(f"""
+                WITH versions AS MATERIALIZED (
+                    SELECT
+                        v.*,
+                        e.identifier IS NULL AS missing_entity,
+                        ac.identifier IS NULL AS missing_class,
+                        ac.data_type = 'ENTITY' AND v.title IS NOT NULL AND t.identifier IS NULL AS dangling_reference,
+                        v.date_out < v.date_in AS inverted,
+                        v.date_in IS NULL OR v.date_out IS NULL OR v.date_in < v.date_out AS nonempty,
+                        -- それより前に始まる（空・逆転でない）バージョンが有効な最後の日（無期限は 9999-12-31）
+                        MAX(CASE WHEN v.date_in IS NULL OR v.date_out IS NULL OR v.date_in < v.date_out
+                                 THEN COALESCE(v.date_out, '9999-12-31') END)
+                            OVER (w ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS covered_until,
+                        LAG(v.identifier) OVER w AS previous_id
+                    FROM {_attribute_versions()} v
+                    LEFT JOIN entity_instance e ON v.entity_id = e.identifier
+                    LEFT JOIN attribute_class ac ON v.class_id = ac.identifier
+                    LEFT JOIN entity_instance t ON ac.data_type = 'ENTITY' AND t.identifier = CAST(v.title AS INTEGER)
+                    WHERE :entity_class_id IS NULL OR ac.entity_id = :entity_class_id
+                    WINDOW w AS (PARTITION BY v.entity_id, v.class_id ORDER BY v.date_in, v.identifier)
+                )
+                SELECT issue, identifier, entity_id, class_id, title, date_in, date_out, related_id,
+                       NULLIF(related_date, '9999-12-31') AS related_date
+                FROM (
+                    SELECT 'overlap' AS issue, *, previous_id AS related_id, covered_until AS related_date
+                    FROM versions WHERE nonempty AND covered_until > COALESCE(date_in, '')
+                    UNION ALL
+                    SELECT 'gap', *, previous_id, covered_until
+                    FROM versions WHERE nonempty AND covered_until < date_in
+                    UNION ALL
+                    SELECT 'inverted', *, NULL, NULL FROM versions WHERE inverted
+                    UNION ALL
+                    SELECT 'missing_entity', *, NULL, NULL FROM versions WHERE missing_entity
+                    UNION ALL
+                    SELECT 'missing_class', *, NULL, NULL FROM versions WHERE missing_class
+                    UNION ALL
+                    SELECT 'dangling_reference', *, CAST(title AS INTEGER), NULL FROM versions WHERE dangling_reference
+                )
+                ORDER BY entity_id, class_id, date_in IS NOT NULL, date_in, identifier
+            """, {'entity_class_id': entity_class_id}).fetchall()
+
+# 属性クラスのデータ型
+ATTRIBUTE_DATA_TYPES = ('TEXT', 'NUMBER', 'DATE', 'ENTITY')
+
+# _convert_values の結果で「元が NULL」を表す印（変換失敗の None と区別する）
+MISSING = object()
+
+# データ型変更で日付として受け付ける書式
+_DATE_INPUT_FORMATS = ('%Y-%m-%d', '%Y/%m/%d', '%Y%m%d', '%Y.%m.%d')
+
+def _convert_values(conn: sqlite3.Connection, values: List[Optional[str]], from_type: str,
+                    to_type: str) -> List[Optional[str]]:
+    """属性値を新しいデータ型の表現に変換（変換できない値は None、元が NULL の値は NULL のまま）"""
+    from datetime import datetime
+    
+    entity_ids, entity_titles = {}, {}
+    if to_type == 'ENTITY' or from_type == 'ENTITY':
+        # 参照先はまとめて引く（ID そのもの、または一意に決まるエンティティ名）
+        candidates = sorted({value for value in values if value is not None})
+        for row in conn.execute("""
+            SELECT identifier, title, COUNT(*) OVER (PARTITION BY title) AS same_title
+            FROM entity_instance
+            WHERE CAST(identifier AS TEXT) IN (SELECT value FROM json_each(:values))
+               OR title IN (SELECT value FROM json_each(:values))
+        """, {'values': json.dumps(candidates, ensure_ascii=False)}):
+            entity_ids[str(row['identifier'])] = row['title']
+            if row['same_title'] == 1:
+                entity_titles[row['title']] = str(row['identifier'])
+    
+    def convert(value: str) -> Optional[str]:
+        text = value.strip()
+        if to_type == 'TEXT':
+            return entity_ids.get(text, value) if from_type == 'ENTITY' else value
+        if to_type == 'NUMBER':
+            try:
+                number = float(text.replace(',', ''))
+            except ValueError:
+                return None
+            return str(int(number)) if number.is_integer() and abs(number) < 2 ** 53 else repr(number)
+        if to_type == 'DATE':
+            for date_format in _DATE_INPUT_FORMATS:
+                try:
+                    return datetime.strptime(text, date_format).strftime('%Y-%m-%d')
+                except ValueError:
+                    continue
+            return None
+        if text in entity_ids:
+            return text
+        return entity_titles.get(text)
+    
+    return [MISSING if value is None else convert(value) for value in values]
+
+class SchemaJobRepository:
+    """属性クラスのスキーマ変更ジョブ（schema_job）のデータアクセス
+    
+    kind は delete_class（値を消してからクラスを削除）・change_type（値を変換してから
+    データ型を切り替え）・merge（値を統合先のクラスに移してからクラスを削除）。
+    1回の run_chunk で chunk_size 件だけ処理し、処理位置と件数を同じトランザクションで
+    保存するので、書き込みロックを持つのは1チャンク分だけで、中断しても続きから再開できる。
+    """
+    
+    KINDS = ('delete_class', 'change_type', 'merge')
+    ACTIVE_STATUSES = ('pending', 'running')
+    
+    @staticmethod
+    def create(kind: str, class_id: int, params: Dict[str, Any] = None) -> int:
+        """ジョブを登録（対象クラスに実行中のジョブがある場合などは ValueError）"""
+        params = dict(params or {})
+        if kind not in SchemaJobRepository.KINDS:
+            raise ValueError(f'不明なジョブです: {kind}')
+        
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            attr_class = conn.execute("""
+                SELECT identifier, title, entity_id, data_type FROM attribute_class WHERE identifier = ?
+            """, (class_id,)).fetchone()
+            if attr_class is None:
+                raise ValueError(f'属性クラス {class_id} が存在しません')
+            # 削除・統合の後も一覧に表示できるよう、クラス名と所属を控えておく
+            params.update(class_title=attr_class['title'], entity_class_id=attr_class['entity_id'])
+            
+            class_ids = [class_id]
+            if kind == 'change_type':
+                if params.get('data_type') not in ATTRIBUTE_DATA_TYPES:
+                    raise ValueError(f'不明なデータ型です: {params.get("data_type")}')
+                if params['data_type'] == attr_class['data_type']:
+                    raise ValueError('データ型が変わっていません')
+                params['from_type'] = attr_class['data_type']
+            elif kind == 'merge':
+                target = conn.execute("""
+                    SELECT identifier, entity_id, data_type FROM attribute_class WHERE identifier = ?
+                """, (params.get('target_class_id'),)).fetchone()
+                if target is None or target['identifier'] == class_id:
+                    raise ValueError('統合先の属性クラスを指定してください')
+                if target['entity_id'] != attr_class['entity_id'] or target['data_type'] != attr_class['data_type']:
+                    raise ValueError('統合先は同じエンティティクラス・同じデータ型の属性クラスにしてください')
+                class_ids.append(target['identifier'])
+            
+            busy = conn.execute(f"""
+                SELECT COUNT(*) FROM schema_job
+                WHERE status IN {SchemaJobRepository.ACTIVE_STATUSES}
+                  AND (class_id IN (SELECT value FROM json_each(:class_ids))
+                       OR json_extract(params, '$.target_class_id') IN (SELECT value FROM json_each(:class_ids)))
+            """, {'class_ids': json.dumps(class_ids)}).fetchone()[0]
+            if busy:
+                raise ValueError('この属性クラスには実行中のジョブがあります')
+            
+            total = conn.execute("""
+                SELECT (SELECT COUNT(*) FROM attribute_instance WHERE class_id = :class_id)
+                     + (SELECT COUNT(*) FROM attribute_instance_archive WHERE class_id = :class_id)
+            """, {'class_id': class_id}).fetchone()[0]
+            cursor = conn.execute("""
+                INSERT INTO schema_job (kind, class_id, params, total) VALUES (?, ?, ?, ?)
+            """, (kind, class_id, json.dumps(params, ensure_ascii=False), total))
+            conn.commit()
+            return cursor.lastrowid
+    
+    @staticmethod
+    def get(job_id: int) -> Optional[Record]:
+        """IDでジョブを取得"""
+        with get_connection() as conn:
+            return conn.execute("SELECT * FROM schema_job WHERE identifier = ?", (job_id,)).fetchone()
+    
+    @staticmethod
+    def get_recent(entity_class_id: int = None, limit: int = 20) -> List[Record]:
+        """新しい順にジョブを取得（entity_class_id を指定するとそのクラスの属性のジョブだけ）"""
+        with get_connection() as conn:
+            return conn.execute(f"""
+                SELECT * FROM schema_job
+                {"WHERE json_extract(params, '$.entity_class_id') = :entity_class_id" if entity_class_id is not None else ''}
+                ORDER BY identifier DESC
+                LIMIT :limit
+            """, {'entity_class_id': entity_class_id, 'limit': limit}).fetchall()
+    
+    @staticmethod
+    def claim(owner: str, stale_before: float, now: float) -> Optional[Record]:
+        """待機中のジョブ、またはハートビートが途絶えた実行中のジョブを1件引き受ける"""
+        with get_connection() as conn:
+            job = conn.execute("""
+                UPDATE schema_job SET status = 'running', owner = :owner, heartbeat = :now
+                WHERE identifier = (
+                    SELECT identifier FROM schema_job
+                    WHERE status = 'pending' OR (status = 'running' AND heartbeat < :stale_before)
+                    ORDER BY identifier
+                    LIMIT 1
+                )
+                RETURNING *
+            """, {'owner': owner, 'now': now, 'stale_before': stale_before}).fetchone()
+            conn.commit()
+            return job
+    
+    @staticmethod
+    def fail(job_id: int, owner: str, error: str):
+        """ジョブを失敗として記録（retry で処理位置から再開できる）"""
+        with get_connection() as conn:
+            conn.execute("""
+                UPDATE schema_job SET status = 'failed', error = ?, finished_at = datetime('now', 'localtime')
+                WHERE identifier = ? AND owner = ?
+            """, (error, job_id, owner))
+            conn.commit()
+    
+    @staticmethod
+    def retry(job_id: int) -> bool:
+        """失敗したジョブを待機中に戻す"""
+        with get_connection() as conn:
+            cursor = conn.execute("""
+                UPDATE schema_job SET status = 'pending', error = NULL, finished_at = NULL
+                WHERE identifier = ? AND status = 'failed'
+            """, (job_id,))
+            conn.commit()
+            return cursor.rowcount > 0
+    
+    @staticmethod
+    def run_chunk(job_id: int, owner: str, chunk_size: int, now: float) -> Optional[Record]:
+        """ジョブを1チャンク進めて更新後のジョブを返す（他のワーカーに引き継がれていたら None）"""
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            job = conn.execute("SELECT * FROM schema_job WHERE identifier = ?", (job_id,)).fetchone()
+            if job is None or job['status'] != 'running' or job['owner'] != owner:
+                conn.rollback()
+                return None
+            
+            params = json.loads(job['params'])
+            phase, cursor = job['phase'], job['cursor']
+            if phase == 'finalize':
+                # live フェーズの後に追加された値も含めて残りを処理し、クラスを切り替える
+                table, cursor, limit = 'attribute_instance', params.get('live_cursor', 0), -1
+            else:
+                table = 'attribute_instance' if phase == 'live' else 'attribute_instance_archive'
+                limit = chunk_size
+            
+            rows = conn.execute(f"""
+                SELECT identifier, title, class_id, entity_id, date_in, date_out FROM {table}
+                WHERE class_id = ? AND identifier > ?
+                ORDER BY identifier
+                LIMIT ?
+            """, (job['class_id'], cursor, limit)).fetchall()
+            failed = SchemaJobRepository._apply(conn, job['kind'], params, table, rows) if rows else 0
+            
+            updates = {'processed': job['processed'] + len(rows), 'failed': job['failed'] + failed,
+                       'cursor': rows[-1]['identifier'] if rows else cursor, 'phase': phase,
+                       'params': job['params'], 'heartbeat': now, 'status': 'running'}
+            if phase == 'finalize':
+                SchemaJobRepository._finalize(conn, job['kind'], job['class_id'], params)
+                updates['status'] = 'done'
+            elif len(rows) < chunk_size:
+                if phase == 'live':
+                    params['live_cursor'] = updates['cursor']
+                    updates['params'] = json.dumps(params, ensure_ascii=False)
+                updates['phase'] = 'archive' if phase == 'live' else 'finalize'
+                updates['cursor'] = 0
+            
+            conn.execute(f"""
+                UPDATE schema_job
+                SET processed = :processed, failed = :failed, cursor = :cursor, phase = :phase, params = :params,
+                    heartbeat = :heartbeat, status = :status,
+                    finished_at = CASE WHEN :status = 'done' THEN datetime('now', 'localtime') END
+                WHERE identifier = :identifier
+            """, {**updates, 'identifier': job_id})
+            conn.commit()
+            return conn.execute("SELECT * FROM schema_job WHERE identifier = ?", (job_id,)).fetchone()
+    
+    @staticmethod
+    def _apply(conn: sqlite3.Connection, kind: str, params: Dict[str, Any], table: str, rows: List[Record]) -> int:
+        """1チャンク分の値を削除・変換・移動し、変換できなかった件数を返す
+        
+        ライブテーブルの変更は変更履歴にも記録する（アーカイブは閉じた過去のバージョンなので記録しない）。
+        """
+        live = table == 'attribute_instance'
+        chunk = {'ids': json.dumps([row['identifier'] for row in rows])}
+        in_chunk = "r.identifier IN (SELECT value FROM json_each(:ids))"
+        
+        if kind == 'delete_class':
+            if live:
+                ChangeLogRepository.record_rows(conn, table, 'delete', in_chunk, chunk)
+            conn.execute(f"DELETE FROM {table} AS r WHERE {in_chunk}", chunk)
+            return 0
+        
+        if kind == 'change_type':
+            converted = _convert_values(conn, [row['title'] for row in rows], params['from_type'], params['data_type'])
+            failed = 0
+            for row, value in zip(rows, converted):
+                if value is MISSING or value == row['title']:
+                    continue
+                if value is None:
+                    # 変換できない値はそのまま残し、件数だけ数える
+                    failed += 1
+                    continue
+                conn.execute(f"UPDATE {table} SET title = ? WHERE identifier = ?", (value, row['identifier']))
+                if live:
+                    before = dict(row)
+                    ChangeLogRepository.record(conn, table, row['identifier'], 'update', before=before,
+                                               after={**before, 'title': value})
+            return failed
+        
+        # merge: 統合先に期間の重なる値があるエンティティでは統合先を優先し、元の値は削除する
+        merge = {**chunk, 'target_class_id': params['target_class_id']}
+        conflict = f"""{in_chunk} AND EXISTS (
+            SELECT 1 FROM {_attribute_versions()} t
+            WHERE t.entity_id = r.entity_id AND t.class_id = :target_class_id
+              AND (t.date_in IS NULL OR r.date_out IS NULL OR t.date_in < r.date_out)
+              AND (r.date_in IS NULL OR t.date_out IS NULL OR r.date_in < t.date_out)
+        )"""
+        if live:
+            ChangeLogRepository.record_rows(conn, table, 'delete', conflict, merge)
+        conflicts = conn.execute(f"DELETE FROM {table} AS r WHERE {conflict}", merge).rowcount
+        if live:
+            ChangeLogRepository.record_rows(conn, table, 'update', in_chunk, merge,
+                                            after={'class_id': ':target_class_id'})
+        conn.execute(f"UPDATE {table} AS r SET class_id = :target_class_id WHERE {in_chunk}", merge)
+        return conflicts
+    
+    @staticmethod
+    def _finalize(conn: sqlite3.Connection, kind: str, class_id: int, params: Dict[str, Any]):
+        """すべての値を処理した後のクラスの切り替え（データ型の変更・クラスの削除）"""
+        if kind == 'change_type':
+            conn.execute("UPDATE attribute_class SET data_type = ? WHERE identifier = ?",
+                         (params['data_type'], class_id))
+        else:
+            conn.execute("DELETE FROM attribute_class WHERE identifier = ?", (class_id,))
+
 class AttributeMetaRepository:
     """属性クラスのデータアクセス（旧AttributeMeta）"""
     
     @staticmethod
-    def get_by_entity_meta_id(entity_class_id: int) -> List[sqlite3.Row]:
+    def get_by_entity_meta_id(entity_class_id: int) -> List[Record]:
         """エンティティクラスIDで属性クラスを取得"""
         with get_connection() as conn:
             return conn.execute("""
@@ -406,7 +2068,7 @@ class AttributeMetaRepository:
             """, (entity_class_id,)).fetchall()
     
     @staticmethod
-    def get_by_id(attribute_class_id: int) -> Optional[sqlite3.Row]:
+    def get_by_id(attribute_class_id: int) -> Optional[Record]:
         """IDで属性クラスを取得"""
         with get_connection() as conn:
             return conn.execute("""
@@ -487,6 +2149,237 @@ class AttributeMetaRepository:
                 """, (title, entity_id))
             return cursor.fetchone()[0] > 0
 
+class RelationClassRepository:
+    """リレーションクラス（エンティティクラス間の関係の種類）のデータアクセス"""
+    
+    @staticmethod
+    def get_by_entity_meta_id(entity_class_id: int) -> List[Record]:
+        """エンティティクラスが開始・終了のどちらかになっているリレーションクラスを取得"""
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT 
+                    rc.identifier,
+                    rc.title,
+                    rc.from_entity_id,
+                    rc.to_entity_id,
+                    ef.title as from_entity_name,
+                    et.title as to_entity_name
+                FROM relation_class rc
+                LEFT JOIN entity_class ef ON rc.from_entity_id = ef.identifier
+                LEFT JOIN entity_class et ON rc.to_entity_id = et.identifier
+                WHERE rc.from_entity_id = :entity_class_id OR rc.to_entity_id = :entity_class_id
+                ORDER BY rc.identifier
+            """, {'entity_class_id': entity_class_id}).fetchall()
+    
+    @staticmethod
+    def get_by_id(relation_class_id: int) -> Optional[Record]:
+        """IDでリレーションクラスを取得"""
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT identifier, title, from_entity_id, to_entity_id
+                FROM relation_class
+                WHERE identifier = ?
+            """, (relation_class_id,)).fetchone()
+    
+    @staticmethod
+    def create(title: str, from_entity_id: int, to_entity_id: int) -> int:
+        """新しいリレーションクラスを作成"""
+        with get_connection() as conn:
+            cursor = conn.execute("""
+                INSERT INTO relation_class (title, from_entity_id, to_entity_id)
+                VALUES (?, ?, ?)
+            """, (title, from_entity_id, to_entity_id))
+            conn.commit()
+            return cursor.lastrowid
+    
+    @staticmethod
+    def update(relation_class_id: int, title: str, from_entity_id: int, to_entity_id: int) -> bool:
+        """リレーションクラスを更新（インスタンスがある場合は開始・終了のエンティティクラスを変えられない）"""
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            current = conn.execute("""
+                SELECT from_entity_id, to_entity_id FROM relation_class WHERE identifier = ?
+            """, (relation_class_id,)).fetchone()
+            if current is None:
+                return False
+            if (current['from_entity_id'], current['to_entity_id']) != (from_entity_id, to_entity_id):
+                used = conn.execute("""
+                    SELECT 1 FROM relation_instance WHERE class_id = ? LIMIT 1
+                """, (relation_class_id,)).fetchone()
+                if used:
+                    raise ValueError('リレーションが登録されているため、開始・終了のエンティティクラスは変更できません')
+            cursor = conn.execute("""
+                UPDATE relation_class
+                SET title = ?, from_entity_id = ?, to_entity_id = ?
+                WHERE identifier = ?
+            """, (title, from_entity_id, to_entity_id, relation_class_id))
+            conn.commit()
+            return cursor.rowcount > 0
+    
+    @staticmethod
+    def delete(relation_class_id: int) -> int:
+        """リレーションクラスをそのインスタンスごと削除し、削除したインスタンスの件数を返す"""
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            params = {'class_id': relation_class_id}
+            ChangeLogRepository.record_rows(conn, 'relation_instance', 'delete', "r.class_id = :class_id", params)
+            deleted = conn.execute("""
+                DELETE FROM relation_instance WHERE class_id = :class_id
+            """, params).rowcount
+            conn.execute("DELETE FROM relation_class WHERE identifier = :class_id", params)
+            conn.commit()
+            return deleted
+    
+    @staticmethod
+    def exists_by_title_and_entity(title: str, from_entity_id: int, exclude_id: int = None) -> bool:
+        """同じ開始エンティティクラスで同じタイトルのリレーションクラスが存在するかチェック"""
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT COUNT(*) FROM relation_class
+                WHERE title = ? AND from_entity_id = ? AND identifier IS NOT ?
+            """, (title, from_entity_id, exclude_id)).fetchone()[0] > 0
+
+class RelationRepository:
+    """リレーションインスタンス（エンティティ間の期間付きの関係）のデータアクセス
+    
+    relation_instance には両方向の索引（entity_from / entity_to から class_id・期間・相手まで）が
+    あるので、隣接エンティティの取得は索引だけで済む。複数エンティティ分もまとめて1回で取得する。
+    """
+    
+    @staticmethod
+    def get_neighbors(entity_id: int, view_date: str, direction: str = 'both',
+                      relation_class_id: int = None) -> List[Record]:
+        """view_date の時点で有効な、エンティティの隣接エンティティを取得"""
+        return RelationRepository.get_neighbors_many([entity_id], view_date, direction, relation_class_id)
+    
+    @staticmethod
+    def get_neighbors_many(entity_ids: List[int], view_date: str, direction: str = 'both',
+                           relation_class_id: int = None) -> List[Record]:
+        """複数エンティティの view_date 時点の隣接エンティティを1回の問い合わせで取得
+        
+        direction は out（entity_from として持つ関係）・in（entity_to として持つ関係）・both。
+        各行の entity_id は問い合わせたエンティティ、neighbor_id は関係の相手。
+        """
+        if direction not in ('out', 'in', 'both'):
+            raise ValueError(f'direction は out / in / both のいずれかで指定してください: {direction}')
+        branches = []
+        for branch, own, other in (('out', 'entity_from', 'entity_to'), ('in', 'entity_to', 'entity_from')):
+            if direction in (branch, 'both'):
+                branches.append(f"""
+                    SELECT r.identifier, r.class_id, r.{own} AS entity_id, '{branch}' AS direction,
+                           r.{other} AS neighbor_id, r.date_in, r.date_out
+                    FROM relation_instance r
+                    WHERE r.{own} IN (SELECT value FROM json_each(:entity_ids))
+                      AND (:class_id IS NULL OR r.class_id = :class_id)
+                      AND (r.date_in IS NULL OR r.date_in <= :view_date)
+                      AND (r.date_out IS NULL OR r.date_out > :view_date)""")
+        with get_connection() as conn:
+            return conn.execute(f"""
+                WITH edges AS ({' UNION ALL '.join(branches)})
+                SELECT 
+                    edges.*,
+                    rc.title as relation_name,
+                    n.title as neighbor_title,
+                    n.class_id as neighbor_class_id,
+                    ec.title as neighbor_type_name
+                FROM edges
+                JOIN relation_class rc ON edges.class_id = rc.identifier
+                LEFT JOIN entity_instance n ON edges.neighbor_id = n.identifier
+                LEFT JOIN entity_class ec ON n.class_id = ec.identifier
+                ORDER BY edges.entity_id, edges.direction DESC, rc.identifier, n.title
+            """, {'entity_ids': json.dumps(entity_ids), 'view_date': view_date,
+                  'class_id': relation_class_id}).fetchall()
+    
+    @staticmethod
+    def get_by_id(relation_id: int) -> Optional[Record]:
+        """IDでリレーションインスタンスを取得"""
+        with get_connection() as conn:
+            return conn.execute("""
+                SELECT identifier, class_id, entity_from, entity_to, date_in, date_out
+                FROM relation_instance
+                WHERE identifier = ?
+            """, (relation_id,)).fetchone()
+    
+    @staticmethod
+    def create(class_id: int, entity_from: int, entity_to: int, date_in: str = None, date_out: str = None) -> int:
+        """新しいリレーションインスタンスを作成
+        
+        リレーションクラスの開始・終了のエンティティクラスと合わないエンティティ、期間の逆転、
+        同じ2つのエンティティ間で期間の重なる同じ種類の関係は ValueError。
+        """
+        if date_in and date_out and date_out < date_in:
+            raise ValueError(f'無効日（{date_out}）が有効日（{date_in}）より前です')
+        with get_connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            relation_class = conn.execute("""
+                SELECT identifier, from_entity_id, to_entity_id FROM relation_class WHERE identifier = ?
+            """, (class_id,)).fetchone()
+            if relation_class is None:
+                raise ValueError(f'リレーションクラス {class_id} が存在しません')
+            entity_classes = {row['identifier']: row['class_id'] for row in conn.execute("""
+                SELECT identifier, class_id FROM entity_instance WHERE identifier IN (?, ?)
+            """, (entity_from, entity_to))}
+            if entity_classes.get(entity_from) != relation_class['from_entity_id']:
+                raise ValueError(f'開始エンティティ {entity_from} はこのリレーションの開始エンティティクラスではありません')
+            if entity_classes.get(entity_to) != relation_class['to_entity_id']:
+                raise ValueError(f'終了エンティティ {entity_to} はこのリレーションの終了エンティティクラスではありません')
+            
+            params = {'class_id': class_id, 'entity_from': entity_from, 'entity_to': entity_to,
+                      'date_in': date_in, 'date_out': date_out}
+            duplicate = conn.execute("""
+                SELECT identifier FROM relation_instance
+                WHERE entity_from = :entity_from AND class_id = :class_id AND entity_to = :entity_to
+                  AND (date_in IS NULL OR :date_out IS NULL OR date_in < :date_out)
+                  AND (:date_in IS NULL OR date_out IS NULL OR :date_in < date_out)
+                LIMIT 1
+            """, params).fetchone()
+            if duplicate is not None:
+                raise ValueError(f'同じリレーションが期間の重なる形で登録されています（ID: {duplicate[0]}）')
+            
+            cursor = conn.execute("""
+                INSERT INTO relation_instance (class_id, entity_from, entity_to, date_in, date_out)
+                VALUES (:class_id, :entity_from, :entity_to, :date_in, :date_out)
+            """, params)
+            relation_id = cursor.lastrowid
+            ChangeLogRepository.record(conn, 'relation_instance', relation_id, 'create',
+                                       after=_row_to_dict(conn, 'relation_instance', relation_id))
+            conn.commit()
+            return relation_id
+    
+    @staticmethod
+    def logical_delete(relation_id: int, date_out: str = None) -> bool:
+        """リレーションインスタンスを論理削除（date_outを設定）"""
+        if date_out is None:
+            from datetime import datetime
+            date_out = datetime.now().strftime('%Y-%m-%d')
+        
+        with get_connection() as conn:
+            before = _row_to_dict(conn, 'relation_instance', relation_id)
+            if before is None:
+                return False
+            if before['date_in'] and date_out < before['date_in']:
+                raise ValueError(f'無効日（{date_out}）が有効日（{before["date_in"]}）より前です')
+            conn.execute("""
+                UPDATE relation_instance SET date_out = ? WHERE identifier = ?
+            """, (date_out, relation_id))
+            ChangeLogRepository.record(conn, 'relation_instance', relation_id, 'logical_delete', before=before,
+                                       after={**before, 'date_out': date_out})
+            conn.commit()
+            return True
+    
+    @staticmethod
+    def delete(relation_id: int) -> bool:
+        """リレーションインスタンスを削除"""
+        with get_connection() as conn:
+            before = _row_to_dict(conn, 'relation_instance', relation_id)
+            cursor = conn.execute("""
+                DELETE FROM relation_instance WHERE identifier = ?
+            """, (relation_id,))
+            if cursor.rowcount > 0:
+                ChangeLogRepository.record(conn, 'relation_instance', relation_id, 'delete', before=before)
+            conn.commit()
+            return cursor.rowcount > 0
+
 # 汎用的なデータベースハンドラー（既存コードとの互換性のため）
 class DatabaseHandler:
     def __init__(self, db_path: str = None):
@@ -0,0 +1,55 @@
+import os
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+import itertools
+from typing import Any, AsyncIterator, Callable, Iterator, List
+
+# DBアクセスに使うスレッド数（同時に実行するSQLの上限）
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '8'))
+
+_executor = ThreadPoolExecutor(max_workers=DB_POOL_SIZE, thread_name_prefix='enty-db')
+
+def _bind(call: Callable[[], Any]) -> Callable[[], Any]:
+    """呼び出し元のコンテキスト（リクエストごとのSQL統計など）を引き継いで実行する関数"""
+    context = contextvars.copy_context()
+    return lambda: context.run(call)
+
+def gather(*calls: Callable[[], Any]) -> List[Any]:
+    """互いに独立したDBアクセスを並行に実行し、結果を引数の順に返す
+
+    最後の1つは呼び出し元のスレッドで実行する。SQLiteは実行中にGILを解放し、
+    リポジトリのメソッドは呼び出しごとに接続を開くので、読み取り同士は並行に進む。
+    """
+    if len(calls) < 2:
+        return [call() for call in calls]
+    futures = [_executor.submit(_bind(call)) for call in calls[:-1]]
+    last = calls[-1]()
+    return [future.result() for future in futures] + [last]
+
+async def run(call: Callable[[], Any]) -> Any:
+    """DBアクセスをスレッドプールで実行し、イベントループを止めずに待つ"""
+    return await asyncio.get_running_loop().run_in_executor(_executor, _bind(call))
+
+async def gather_async(*calls: Callable[[], Any]) -> List[Any]:
+    """gather の非同期版（すべてスレッドプールで実行）"""
+    return list(await asyncio.gather(*(run(call) for call in calls)))
+
+async def iterate(iterator: Iterator[Any], batch_size: int) -> AsyncIterator[List[Any]]:
+    """同期のイテレーター（DBの読み出しを含むもの）を batch_size 件ずつスレッドプールで進める
+
+    各バッチは別のスレッドで進むことがある。途中で止めた場合もイテレーターを閉じる。
+    """
+    try:
+        while True:
+            batch = await run(lambda: list(itertools.islice(iterator, batch_size)))
+            if not batch:
+                return
+            yield batch
+    finally:
+        close = getattr(iterator, 'close', None)
+        if close is not None:
+            await run(close)
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
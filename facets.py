@@ -0,0 +1,90 @@
+"""インスタンス一覧のファセット（属性値ごとのエンティティ数）
+
+エンティティクラスを選んだ一覧で、表示日の時点の属性値ごとの件数を属性クラスごとに表示する。
+件数は属性クラスごとに1回の集計（FacetRepository.count_values）で多い順に FACET_TOP_VALUES 件まで求め、
+(クラス, 表示日, 絞り込み) ごとにワーカー内で保持する（書き込みがあれば再集計）。
+
+各ファセットの件数は、そのファセット以外の絞り込みを適用して数える。同じ属性クラスの中では
+値をいずれか（OR）、属性クラス間はすべて（AND）で絞り込むので、選択中の値以外の件数も表示される。
+"""
+import os
+from typing import Any, Dict, List
+
+import db_pool
+from db import AttributeMetaRepository, ChangeLogRepository, FacetRepository
+from result_cache import VersionedCache
+
+# 1つのファセットに表示する値の数
+FACET_TOP_VALUES = int(os.environ.get('FACET_TOP_VALUES', '10'))
+
+# 保持するファセットの集計結果の件数（ワーカーごと）
+FACET_CACHE_SIZE = int(os.environ.get('FACET_CACHE_SIZE', '512'))
+
+# 絞り込みのクエリパラメータ（attr.<属性クラスID>=<値>、複数指定可）
+FILTER_PREFIX = 'attr.'
+
+# ファセットにしないデータ型（値がエンティティIDで件数の意味が薄い）
+EXCLUDED_DATA_TYPES = ('ENTITY',)
+
+cache = VersionedCache(FACET_CACHE_SIZE)
+
+def parse_filters(args) -> Dict[int, List[str]]:
+    """クエリパラメータ（werkzeugの MultiDict）から属性値の絞り込みを取り出す（不正なキーは無視）"""
+    filters = {}
+    for key in args:
+        if not key.startswith(FILTER_PREFIX):
+            continue
+        try:
+            class_id = int(key[len(FILTER_PREFIX):])
+        except ValueError:
+            continue
+        values = sorted({value for value in args.getlist(key) if value})
+        if values:
+            filters[class_id] = values
+    return filters
+
+def _cache_key(entity_class_id: int, view_date: str, filters: Dict[int, List[str]]) -> tuple:
+    return entity_class_id, view_date, tuple((class_id, tuple(values)) for class_id, values in sorted(filters.items()))
+
+def facet_counts(entity_class_id: int, view_date: str, filters: Dict[int, List[str]] = None,
+                 limit: int = FACET_TOP_VALUES) -> List[Dict[str, Any]]:
+    """属性クラスごとのファセット（表示順）を返す
+
+    各ファセットは class_id・title・values（value, count, selected）・more（表示しきれない値の数）。
+    """
+    filters = filters or {}
+    key = _cache_key(entity_class_id, view_date, filters) + (limit,)
+    version = ChangeLogRepository.get_data_version()
+    facets = cache.get(key, version)
+    if facets is not None:
+        return facets
+
+    attributes = [attr for attr in AttributeMetaRepository.get_by_entity_meta_id(entity_class_id)
+                  if attr['data_type'] not in EXCLUDED_DATA_TYPES]
+
+    def count(attr):
+        # このファセット自身の絞り込みは除く
+        others = {class_id: values for class_id, values in filters.items() if class_id != attr['identifier']}
+        selected = filters.get(attr['identifier'])
+        return lambda: FacetRepository.count_values(entity_class_id, view_date, attr['identifier'], others,
+                                                    max(limit, len(selected or ())), selected)
+
+    # 属性クラスごとの集計は独立しているので並行に実行する
+    results = db_pool.gather(*[count(attr) for attr in attributes]) if attributes else []
+
+    facets = []
+    for attr, rows in zip(attributes, results):
+        selected = set(filters.get(attr['identifier'], ()))
+        # 選択中の値は上位に入らなくても表示する（一致するエンティティがなければ件数0）
+        values = sorted(({'value': row['value'], 'count': row['count'], 'selected': row['value'] in selected}
+                         for row in rows), key=lambda value: (-value['count'], value['value']))
+        shown = {value['value'] for value in values}
+        values += [{'value': value, 'count': 0, 'selected': True} for value in sorted(selected - shown)]
+        facets.append({
+            'class_id': attr['identifier'],
+            'title': attr['title'],
+            'values': values,
+            'more': max(0, (rows[0]['values_total'] if rows else 0) - len(rows)),
+        })
+    cache.put(key, version, facets)
+    return facets
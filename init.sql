@@ -2,6 +2,15 @@ DROP TABLE IF EXISTS entity_class;
 DROP TABLE IF EXISTS attribute_class;
 DROP TABLE IF EXISTS entity_instance;
 DROP TABLE IF EXISTS attribute_instance;
+DROP TABLE IF EXISTS change_log;
+DROP TABLE IF EXISTS user_session;
+DROP TABLE IF EXISTS attribute_instance_archive;
+DROP TABLE IF EXISTS history_horizon;
+DROP TABLE IF EXISTS schema_job;
+DROP TABLE IF EXISTS relation_instance;
+DROP TABLE IF EXISTS relation_class;
+DROP TABLE IF EXISTS rate_limit_bucket;
+DROP TABLE IF EXISTS metadata_version;
 
 CREATE TABLE entity_class (
     identifier INTEGER PRIMARY KEY,
@@ -26,8 +35,9 @@ CREATE TABLE entity_instance (
     FOREIGN KEY (class_id) REFERENCES entity_class(identifier)
 );
 
+-- アーカイブへ移した行のIDを再利用しないように AUTOINCREMENT にする
 CREATE TABLE attribute_instance (
-    identifier INTEGER PRIMARY KEY,
+    identifier INTEGER PRIMARY KEY AUTOINCREMENT,
     title TEXT,
     class_id INTEGER,
     entity_id INTEGER,
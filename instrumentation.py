@@ -0,0 +1,311 @@
+import os
+import re
+import time
+import sqlite3
+import logging
+import threading
+from contextvars import ContextVar
+from typing import Dict, Optional, Tuple
+
+# スロークエリとして記録するしきい値（ミリ秒）
+SLOW_QUERY_THRESHOLD_MS = float(os.environ.get('SLOW_QUERY_THRESHOLD_MS', '200'))
+
+# スロークエリのログでパラメーターを出さないテーブル（セッションにはOIDCのユーザー情報と鍵が入る）
+SLOW_QUERY_REDACTED_TABLES = ('user_session',)
+
+# スロークエリのログに出すパラメーターの長さと個数の上限
+SLOW_QUERY_PARAM_MAX_LENGTH = 200
+SLOW_QUERY_PARAM_MAX_ITEMS = 20
+
+# レイテンシのヒストグラムのバケット境界（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# METRICS_TOKEN 未設定のとき /metrics を許可する接続元（ローカルのみ）
+LOCAL_ADDRS = frozenset({'127.0.0.1', '::1'})
+
+slow_query_logger = logging.getLogger('enty.slow_query')
+
+class RequestStats:
+    """1リクエスト中のSQL実行回数・DB時間・取得行数"""
+
+    __slots__ = ('started_at', 'statements', 'db_time', 'rows')
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started_at
+
+# 現在のリクエストの統計（リクエスト外では None）
+_current_stats: ContextVar[Optional[RequestStats]] = ContextVar('enty_request_stats', default=None)
+
+def current_stats() -> Optional[RequestStats]:
+    """現在のリクエストの統計を取得"""
+    return _current_stats.get()
+
+def begin_request() -> RequestStats:
+    """現在のコンテキストでリクエストの統計を開始（Flask以外で処理するリクエスト用）"""
+    stats = RequestStats()
+    _current_stats.set(stats)
+    return stats
+
+def _compact_sql(sql: str) -> str:
+    """ログ出力用に空白を詰めたSQL"""
+    return re.sub(r'\s+', ' ', sql).strip()
+
+def _truncate_param(value):
+    """ログ出力用に長い文字列・バイト列を切り詰めた値"""
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return f'<{len(value)} bytes>'
+    if isinstance(value, str) and len(value) > SLOW_QUERY_PARAM_MAX_LENGTH:
+        return f'{value[:SLOW_QUERY_PARAM_MAX_LENGTH]}...<{len(value)} chars>'
+    return value
+
+def _loggable_params(sql: str, params):
+    """ログ出力用のパラメーター（機密を含むテーブルは伏せ、長い値・多すぎる値は切り詰める）"""
+    if re.search(r'\b(?:%s)\b' % '|'.join(SLOW_QUERY_REDACTED_TABLES), sql, re.IGNORECASE):
+        return '<redacted>'
+    if isinstance(params, dict):
+        items = list(params.items())
+        loggable = {key: _truncate_param(value) for key, value in items[:SLOW_QUERY_PARAM_MAX_ITEMS]}
+    elif isinstance(params, (list, tuple)):
+        items = params
+        loggable = type(params)(_truncate_param(value) for value in items[:SLOW_QUERY_PARAM_MAX_ITEMS])
+    else:
+        return params
+    if len(items) > SLOW_QUERY_PARAM_MAX_ITEMS:
+        return f'{loggable!r}...<{len(items)} params>'
+    return loggable
+
+def _record_statement(sql: str, params, elapsed: float):
+    """SQL1回分の実行時間を記録し、しきい値を超えたらスロークエリとして出力"""
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+
+    metrics.observe('enty_db_statement_duration_seconds', elapsed)
+
+    if elapsed * 1000 >= SLOW_QUERY_THRESHOLD_MS:
+        slow_query_logger.warning('slow query %.1fms: %s params=%r', elapsed * 1000, _compact_sql(sql),
+                                  _loggable_params(sql, params))
+
+def _record_rows(count: int):
+    stats = _current_stats.get()
+    if stats is not None:
+        stats.rows += count
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """実行時間と取得行数を記録するカーソル"""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_statement(sql, parameters, time.perf_counter() - started)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_statement(sql, '<executemany>', time.perf_counter() - started)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is not None:
+            _record_rows(1)
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        _record_rows(len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        _record_rows(len(rows))
+        return rows
+
+    def __next__(self):
+        row = super().__next__()
+        _record_rows(1)
+        return row
+
+class InstrumentedConnection(sqlite3.Connection):
+    """すべてのSQLを InstrumentedCursor 経由で実行する接続"""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def executescript(self, sql_script):
+        started = time.perf_counter()
+        try:
+            return super().executescript(sql_script)
+        finally:
+            _record_statement(sql_script, None, time.perf_counter() - started)
+
+class MetricsRegistry:
+    """Prometheusテキスト形式で出力できるプロセス内メトリクス
+
+    ワーカープロセスごとに集計されるため、複数ワーカー構成ではPrometheus側で合算する。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._histograms: Dict[Tuple[str, Tuple], list] = {}
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._help: Dict[str, Tuple[str, str]] = {}
+
+    def describe(self, name: str, metric_type: str, help_text: str):
+        """メトリクスの種類と説明を登録"""
+        self._help[name] = (metric_type, help_text)
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                # [各バケットの件数..., 合計値, 件数]
+                histogram = self._histograms[key] = [0] * len(LATENCY_BUCKETS) + [0.0, 0]
+            for index, bound in enumerate(LATENCY_BUCKETS):
+                if value <= bound:
+                    histogram[index] += 1
+            histogram[-2] += value
+            histogram[-1] += 1
+
+    def get(self, name: str, **labels) -> float:
+        """カウンター・ゲージの現在値を取得（未記録の場合は0）"""
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            return self._counters.get(key, self._gauges.get(key, 0))
+
+    @staticmethod
+    def _format_labels(labels, extra: Tuple = ()) -> str:
+        items = list(labels) + list(extra)
+        if not items:
+            return ''
+        escaped = []
+        for key, value in items:
+            value = str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+            escaped.append(f'{key}="{value}"')
+        return '{' + ','.join(escaped) + '}'
+
+    def render(self) -> str:
+        """Prometheusテキスト形式（version 0.0.4）で出力"""
+        lines = []
+        with self._lock:
+            series = {}
+            for (name, labels), value in self._counters.items():
+                series.setdefault(name, []).append(('counter', labels, value))
+            for (name, labels), value in self._gauges.items():
+                series.setdefault(name, []).append(('gauge', labels, value))
+            for (name, labels), value in self._histograms.items():
+                series.setdefault(name, []).append(('histogram', labels, list(value)))
+
+        for name in sorted(series):
+            entries = series[name]
+            metric_type, help_text = self._help.get(name, (entries[0][0], name))
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {metric_type}')
+            for kind, labels, value in entries:
+                if kind != 'histogram':
+                    lines.append(f'{name}{self._format_labels(labels)} {value}')
+                    continue
+                for index, bound in enumerate(LATENCY_BUCKETS):
+                    lines.append(f'{name}_bucket{self._format_labels(labels, (("le", bound),))} {value[index]}')
+                lines.append(f'{name}_bucket{self._format_labels(labels, (("le", "+Inf"),))} {value[-1]}')
+                lines.append(f'{name}_sum{self._format_labels(labels)} {value[-2]}')
+                lines.append(f'{name}_count{self._format_labels(labels)} {value[-1]}')
+        return '\n'.join(lines) + '\n'
+
+# アプリ全体で共有するメトリクス
+metrics = MetricsRegistry()
+metrics.describe('enty_http_requests_total', 'counter', 'HTTPリクエスト数')
+metrics.describe('enty_http_request_duration_seconds', 'histogram', 'HTTPリクエストの処理時間')
+metrics.describe('enty_db_statements_total', 'counter', 'リクエスト中に実行したSQL文の数')
+metrics.describe('enty_db_time_seconds_total', 'counter', 'リクエスト中のDB処理時間の合計')
+metrics.describe('enty_db_rows_fetched_total', 'counter', 'リクエスト中に取得した行数')
+metrics.describe('enty_db_statement_duration_seconds', 'histogram', 'SQL1文あたりの実行時間')
+metrics.describe('enty_app_startup_seconds', 'gauge', 'ワーカー起動時のアプリ初期化時間')
+
+def record_request(stats: RequestStats, endpoint: str, method: str, status: int) -> str:
+    """1リクエスト分の統計をメトリクスに加算し、Server-Timing ヘッダーの値を返す"""
+    elapsed = stats.elapsed
+    metrics.inc('enty_http_requests_total', endpoint=endpoint, method=method, status=status)
+    metrics.observe('enty_http_request_duration_seconds', elapsed, endpoint=endpoint)
+    metrics.inc('enty_db_statements_total', stats.statements, endpoint=endpoint)
+    metrics.inc('enty_db_time_seconds_total', stats.db_time, endpoint=endpoint)
+    metrics.inc('enty_db_rows_fetched_total', stats.rows, endpoint=endpoint)
+    return (
+        f'db;dur={stats.db_time * 1000:.1f};desc="{stats.statements} queries", '
+        f'total;dur={elapsed * 1000:.1f}'
+    )
+
+def init_app(app):
+    """リクエスト計測・/metrics・デバッグパネルをFlaskアプリに登録"""
+    from flask import request, Response, abort
+
+    app.config.setdefault('DEBUG_TOOLBAR', os.environ.get('DEBUG_TOOLBAR') == '1')
+    app.config.setdefault('METRICS_TOKEN', os.environ.get('METRICS_TOKEN'))
+
+    @app.before_request
+    def start_request_stats():
+        request.environ['enty.stats_token'] = _current_stats.set(RequestStats())
+
+    @app.after_request
+    def record_request_stats(response):
+        stats = _current_stats.get()
+        if stats is None:
+            return response
+
+        response.headers['Server-Timing'] = record_request(stats, request.endpoint or 'unknown',
+                                                          request.method, response.status_code)
+        return response
+
+    @app.teardown_request
+    def clear_request_stats(exc=None):
+        token = request.environ.pop('enty.stats_token', None)
+        if token is not None:
+            _current_stats.reset(token)
+
+    @app.context_processor
+    def inject_request_stats():
+        return {'request_stats': current_stats}
+
+    @app.route('/metrics')
+    def prometheus_metrics():
+        """Prometheus形式のメトリクス
+
+        METRICS_TOKEN 設定時はBearerトークン必須。未設定ならローカルからの直接のアクセスだけ許可し、
+        それ以外（同じホストのリバースプロキシ経由を含む）は存在しないものとして 404 を返す。
+        """
+        token = app.config.get('METRICS_TOKEN')
+        if token:
+            if request.headers.get('Authorization') != f'Bearer {token}':
+                abort(401)
+        elif request.remote_addr not in LOCAL_ADDRS or 'X-Forwarded-For' in request.headers:
+            abort(404)
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
@@ -0,0 +1,103 @@
+import os
+from typing import Any, Iterable, Iterator
+
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# JSONエンコーダー（auto: orjson がインストールされていれば使う / orjson / json: 標準ライブラリ）
+JSON_ENCODER = os.environ.get('JSON_ENCODER', 'auto')
+
+# 配列を書き出すときに1回でエンコードする件数
+JSON_STREAM_CHUNK_SIZE = 1000
+
+class StreamingJSONProvider(DefaultJSONProvider):
+    """標準ライブラリの json を使うプロバイダー（大きな配列を少しずつ書き出せる）"""
+
+    def encode_items(self, items: list) -> bytes:
+        """要素のリストを外側の [] を除いたJSON（要素をカンマでつないだもの）にする"""
+        return self.dumps(items, separators=(',', ':')).encode('utf-8')[1:-1]
+
+    def stream_array(self, items: Iterable[Any], chunk_size: int = JSON_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """要素を chunk_size 件ずつエンコードしてJSON配列を書き出す（response と同じ形式）"""
+        yield b'['
+        separator = b''
+        chunk = []
+        for item in items:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield separator + self.encode_items(chunk)
+                separator = b','
+                chunk = []
+        if chunk:
+            yield separator + self.encode_items(chunk)
+        yield b']\n'
+
+    def stream_encoded_array(self, encoded: Iterable[str], chunk_size: int = JSON_STREAM_CHUNK_SIZE) -> Iterator[bytes]:
+        """エンコード済みの要素（SQLiteの json_object で作った行など）をつないでJSON配列を書き出す"""
+        yield b'['
+        separator = b''
+        chunk = []
+        for item in encoded:
+            chunk.append(item)
+            if len(chunk) >= chunk_size:
+                yield separator + ','.join(chunk).encode('utf-8')
+                separator = b','
+                chunk = []
+        if chunk:
+            yield separator + ','.join(chunk).encode('utf-8')
+        yield b']\n'
+
+    def stream_response(self, chunks: Iterable[bytes]):
+        """stream_array / stream_encoded_array の出力をそのまま返すレスポンス"""
+        return self._app.response_class(chunks, mimetype=self.mimetype)
+
+class OrjsonProvider(StreamingJSONProvider):
+    """orjson でエンコードするプロバイダー
+
+    出力は標準ライブラリと同じくキーをソートしたJSONだが、日本語などの非ASCII文字は
+    \\uXXXX にエスケープせずUTF-8のまま出力する。日付は標準と同じ形式にするため
+    default（HTTP日付）に渡す。
+    """
+
+    option = (orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME) if orjson else 0
+
+    def dumps_bytes(self, obj: Any, indent: bool = False) -> bytes:
+        option = self.option
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        return self.dumps_bytes(obj, indent=bool(kwargs.get('indent'))).decode('utf-8')
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def encode_items(self, items: list) -> bytes:
+        return self.dumps_bytes(items)[1:-1]
+
+    def response(self, *args: Any, **kwargs: Any):
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        return self._app.response_class(self.dumps_bytes(obj, indent=indent) + b'\n', mimetype=self.mimetype)
+
+def init_app(app):
+    """JSON_ENCODER に応じてJSONプロバイダーを設定"""
+    encoder = app.config.setdefault('JSON_ENCODER', JSON_ENCODER)
+    if encoder == 'orjson' and orjson is None:
+        raise ValueError('JSON_ENCODER=orjson には orjson が必要です: pip install orjson')
+    if encoder not in ('auto', 'orjson', 'json'):
+        raise ValueError(f'Unknown JSON_ENCODER: {encoder}')
+
+    if encoder == 'orjson' or (encoder == 'auto' and orjson is not None):
+        app.json = OrjsonProvider(app)
+    else:
+        app.json = StreamingJSONProvider(app)
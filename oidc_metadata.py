@@ -0,0 +1,84 @@
+import time
+import logging
+import threading
+from typing import Any, Dict, List, Optional
+
+import requests
+
+logger = logging.getLogger('enty.oidc')
+
+class OIDCMetadataCache:
+    """OIDCプロバイダーのメタデータとJWKSのTTL付きキャッシュ
+
+    Authlib のクライアントは server_metadata に '_loaded_at' があると取得を省略するため、
+    取得済みのメタデータ（jwks を含む）を登録済みクライアントへ書き込んでおく。
+    TTLを過ぎたら古い値を返しつつバックグラウンドで再取得するので、
+    ログイン処理がメタデータ取得で待たされるのはプロセスで最初の1回だけになる。
+    """
+
+    def __init__(self, metadata_url: str, ttl: float = 3600, timeout: float = 5, retry_interval: float = 30):
+        self.metadata_url = metadata_url
+        self.ttl = ttl
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.metadata: Optional[Dict[str, Any]] = None
+        self.loaded_at = 0.0
+        self._clients: List[Any] = []
+        self._lock = threading.Lock()
+        self._refreshing = False
+        self._retry_at = 0.0
+
+    def attach(self, client):
+        """メタデータを書き込む Authlib クライアントを登録"""
+        self._clients.append(client)
+        if self.metadata is not None:
+            client.server_metadata.update(self.metadata)
+
+    @property
+    def is_stale(self) -> bool:
+        return self.metadata is None or time.time() - self.loaded_at >= self.ttl
+
+    def refresh(self) -> Dict[str, Any]:
+        """メタデータとJWKSを取得してクライアントへ反映"""
+        response = requests.get(self.metadata_url, timeout=self.timeout)
+        response.raise_for_status()
+        metadata = response.json()
+
+        if metadata.get('jwks_uri'):
+            response = requests.get(metadata['jwks_uri'], timeout=self.timeout)
+            response.raise_for_status()
+            metadata['jwks'] = response.json()
+
+        metadata['_loaded_at'] = time.time()
+        with self._lock:
+            self.metadata = metadata
+            self.loaded_at = metadata['_loaded_at']
+        for client in self._clients:
+            client.server_metadata.update(metadata)
+        return metadata
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            # プロバイダーに到達できない間は retry_interval ごとにしか再試行しない
+            self._retry_at = time.time() + self.retry_interval
+            logger.warning('OIDC metadata refresh failed: %s', e)
+        finally:
+            self._refreshing = False
+
+    def refresh_async(self):
+        """バックグラウンドで再取得（取得中なら何もしない）"""
+        with self._lock:
+            if self._refreshing or time.time() < self._retry_at:
+                return
+            self._refreshing = True
+        threading.Thread(target=self._refresh_in_background, daemon=True).start()
+
+    def ensure_loaded(self) -> Dict[str, Any]:
+        """未取得なら同期的に取得し、期限切れならバックグラウンドで更新"""
+        if self.metadata is None:
+            return self.refresh()
+        if self.is_stale:
+            self.refresh_async()
+        return self.metadata
@@ -0,0 +1,302 @@
+"""高コストなルートのレート制限と同時実行数の上限
+
+一覧・差分・集計のようなルートは1回ごとに大きな走査を行うため、1人のユーザーが日付を連続して
+送ったり、スクリプトが /api/entities を繰り返し呼んだりするとワーカーが埋まってしまう。
+そこでルート（Flaskのエンドポイント名）ごとに次の2つを設定する。
+
+- RATE_LIMITS: ユーザー（未ログイン時はIPアドレス）×ルートごとのトークンバケット。
+  超えたリクエストは 429 と Retry-After（次のトークンが貯まるまでの秒数）を返す。
+- RATE_LIMIT_CONCURRENCY: ワーカー内でそのルートを同時に処理する数の上限。
+  空きを RATE_LIMIT_QUEUE_TIMEOUT 秒待っても空かなければ 503 と Retry-After を返す。
+
+トークンバケットはワーカーのメモリ（memory）か、アプリのSQLiteデータベース（sqlite、
+複数ワーカーで共有）に保持する。同時実行数はワーカーごとに数える。拒否した件数は /metrics の
+enty_rate_limited_total（endpoint・reason=rate / concurrency）で確認できる。
+
+    RATE_LIMITS="instances_list=5/s:20,get_diff_v1=30/m"
+    RATE_LIMIT_CONCURRENCY="instances_list=4,get_diff_v1=2"
+"""
+import os
+import math
+import time
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable, Dict, NamedTuple, Optional
+
+from db import RateLimitRepository
+from instrumentation import metrics
+
+# トークンバケットの保存先（memory: ワーカーごと / sqlite: 全ワーカーで共有 / off: 制限しない）
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+
+# ルートごとのレート（<エンドポイント>=<回数>/<s|m|h>[:<バースト>]、* はその他のすべてのルート）
+RATE_LIMITS = os.environ.get(
+    'RATE_LIMITS',
+    'instances_list=5/s:20,get_entities_json=2/s:10,query_entities_v1=10/s:20,query_relations_v1=10/s:20,'
+    'get_diff_v1=1/s:5,get_analytics_series_v1=1/s:5')
+
+# ルートごとの同時実行数の上限（ワーカーごと、<エンドポイント>=<数>）
+RATE_LIMIT_CONCURRENCY = os.environ.get(
+    'RATE_LIMIT_CONCURRENCY',
+    'instances_list=4,get_entities_json=2,get_diff_v1=2,get_analytics_series_v1=2')
+
+# 同時実行数の空きを待つ秒数（超えると503）
+RATE_LIMIT_QUEUE_TIMEOUT = float(os.environ.get('RATE_LIMIT_QUEUE_TIMEOUT', '0.5'))
+
+# 503 のときに返す Retry-After（秒）
+RATE_LIMIT_BUSY_RETRY_AFTER = int(os.environ.get('RATE_LIMIT_BUSY_RETRY_AFTER', '1'))
+
+# 使われていないバケットを掃除する間隔（秒）
+RATE_LIMIT_SWEEP_INTERVAL = float(os.environ.get('RATE_LIMIT_SWEEP_INTERVAL', '300'))
+
+PERIODS = {'s': 1, 'm': 60, 'h': 3600}
+
+metrics.describe('enty_rate_limited_total', 'counter', 'レート制限・同時実行数の上限で拒否したリクエスト数')
+metrics.describe('enty_rate_limit_in_flight', 'gauge', '同時実行数を制限しているルートの処理中のリクエスト数')
+
+class RateRule(NamedTuple):
+    """1秒あたりに貯まるトークン数と、貯められる上限（連続して送れる回数）"""
+    rate: float
+    burst: float
+
+def parse_rules(text: str) -> Dict[str, RateRule]:
+    """RATE_LIMITS の形式の文字列をエンドポイントごとのレートにする"""
+    rules = {}
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            endpoint, spec = item.split('=', 1)
+            spec, _, burst = spec.partition(':')
+            count, _, period = spec.partition('/')
+            count = float(count)
+            seconds = PERIODS[period.strip() or 's']
+            burst = float(burst) if burst else count
+        except (ValueError, KeyError):
+            raise ValueError(f'Invalid RATE_LIMITS entry: {item}')
+        if count <= 0 or burst < 1:
+            raise ValueError(f'Invalid RATE_LIMITS entry: {item}')
+        rules[endpoint.strip()] = RateRule(count / seconds, burst)
+    return rules
+
+def parse_concurrency(text: str) -> Dict[str, int]:
+    """RATE_LIMIT_CONCURRENCY の形式の文字列をエンドポイントごとの上限にする"""
+    limits = {}
+    for item in (text or '').split(','):
+        item = item.strip()
+        if not item:
+            continue
+        try:
+            endpoint, limit = item.split('=', 1)
+            limit = int(limit)
+        except ValueError:
+            raise ValueError(f'Invalid RATE_LIMIT_CONCURRENCY entry: {item}')
+        if limit < 1:
+            raise ValueError(f'Invalid RATE_LIMIT_CONCURRENCY entry: {item}')
+        limits[endpoint.strip()] = limit
+    return limits
+
+class RequestRejected(Exception):
+    """レート制限（429）・同時実行数の上限（503）で拒否したリクエスト"""
+
+    def __init__(self, status: int, retry_after: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+        self.message = message
+
+class BucketStore(ABC):
+    """トークンバケットの保存先のインターフェース（take は取り出せれば0、足りなければ次のトークンまでの秒数を返す）"""
+
+    @abstractmethod
+    def take(self, key: str, rule: RateRule, now: float) -> float:
+        ...
+
+    @abstractmethod
+    def sweep(self, cutoff: float) -> int:
+        """cutoff より前から使われていないバケットを削除し、削除件数を返す"""
+        ...
+
+class MemoryBucketStore(BucketStore):
+    """ワーカーのメモリに保持（ワーカー数倍まで通る）"""
+
+    def __init__(self):
+        self._buckets: Dict[str, list] = {}
+        self._lock = threading.Lock()
+
+    def take(self, key, rule, now):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [rule.burst, now]
+            tokens = min(rule.burst, bucket[0] + max(0.0, now - bucket[1]) * rule.rate)
+            bucket[1] = max(bucket[1], now)
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rule.rate
+
+    def sweep(self, cutoff):
+        with self._lock:
+            stale = [key for key, bucket in self._buckets.items() if bucket[1] < cutoff]
+            for key in stale:
+                del self._buckets[key]
+            return len(stale)
+
+class SQLiteBucketStore(BucketStore):
+    """アプリのSQLiteデータベース（rate_limit_bucket テーブル）に保持（全ワーカーで共有）"""
+
+    def take(self, key, rule, now):
+        if RateLimitRepository.take(key, rule.rate, rule.burst, now) is not None:
+            return 0
+        row = RateLimitRepository.get(key)
+        tokens = min(rule.burst, row['tokens'] + max(0.0, now - row['updated_at']) * rule.rate) if row else 0
+        return max(1 - tokens, 0) / rule.rate
+
+    def sweep(self, cutoff):
+        return RateLimitRepository.delete_older_than(cutoff)
+
+class RateLimiter:
+    """ルートごとのトークンバケットと同時実行数の上限"""
+
+    def __init__(self, store: BucketStore, rules: Dict[str, RateRule], concurrency: Dict[str, int],
+                 queue_timeout: float = 0.5, sweep_interval: float = 300):
+        self.store = store
+        self.rules = rules
+        self.queue_timeout = queue_timeout
+        self.sweep_interval = sweep_interval
+        self._slots = {endpoint: threading.BoundedSemaphore(limit) for endpoint, limit in concurrency.items()}
+        self._in_flight = {endpoint: 0 for endpoint in concurrency}
+        self._lock = threading.Lock()
+        self._next_sweep = time.monotonic() + sweep_interval
+        # バケットが満タンに戻るまでの最長の秒数（これより長く使われていなければ消してよい）
+        self._refill_seconds = max((rule.burst / rule.rate for rule in rules.values()), default=0)
+
+    def limits(self, endpoint: str) -> bool:
+        """このルートを制限するかどうか"""
+        return endpoint in self.rules or '*' in self.rules or endpoint in self._slots
+
+    def check_rate(self, endpoint: str, identity: str):
+        """トークンを1つ取り出す（足りなければ RequestRejected(429)）"""
+        rule = self.rules.get(endpoint) or self.rules.get('*')
+        if rule is None:
+            return
+        self._maybe_sweep()
+        # * のルールもルートごとに別のバケットにする
+        wait = self.store.take(f'{endpoint}:{identity}', rule, time.time())
+        if wait > 0:
+            metrics.inc('enty_rate_limited_total', endpoint=endpoint, reason='rate')
+            raise RequestRejected(429, max(1, math.ceil(wait)),
+                                  'リクエストが多すぎます。しばらく待ってから再度お試しください')
+
+    def acquire_slot(self, endpoint: str, timeout: float = None) -> Callable[[], None]:
+        """同時実行数の枠を取得し、解放する関数を返す（空かなければ RequestRejected(503)）"""
+        slot = self._slots.get(endpoint)
+        if slot is None:
+            return lambda: None
+        timeout = self.queue_timeout if timeout is None else timeout
+        acquired = slot.acquire(timeout=timeout) if timeout > 0 else slot.acquire(blocking=False)
+        if not acquired:
+            metrics.inc('enty_rate_limited_total', endpoint=endpoint, reason='concurrency')
+            raise RequestRejected(503, RATE_LIMIT_BUSY_RETRY_AFTER,
+                                  '混み合っています。しばらく待ってから再度お試しください')
+        self._track(endpoint, 1)
+
+        released = []
+
+        def release():
+            # ストリーミングの終了時と例外時の両方から呼ばれても1回だけ解放する
+            with self._lock:
+                if released:
+                    return
+                released.append(True)
+            self._track(endpoint, -1)
+            slot.release()
+        return release
+
+    def admit(self, endpoint: str, identity: str, timeout: float = None) -> Callable[[], None]:
+        """レートと同時実行数を確認し、処理後に呼ぶ解放関数を返す（拒否する場合は RequestRejected）"""
+        self.check_rate(endpoint, identity)
+        return self.acquire_slot(endpoint, timeout)
+
+    def _track(self, endpoint: str, delta: int):
+        with self._lock:
+            self._in_flight[endpoint] += delta
+            metrics.set('enty_rate_limit_in_flight', self._in_flight[endpoint], endpoint=endpoint)
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        try:
+            self.store.sweep(time.time() - self._refill_seconds)
+        except Exception as e:
+            print(f'Error sweeping rate limit buckets: {e}')
+
+def identity(user: Optional[dict], remote_addr: Optional[str]) -> str:
+    """バケットを分ける単位（ログインユーザーのID、未ログイン時はIPアドレス）"""
+    if isinstance(user, dict) and user.get('id') is not None:
+        return f"user:{user['id']}"
+    return f'ip:{remote_addr or "unknown"}'
+
+# アプリで使う制限（init_app で設定、無効なら None）
+limiter: Optional[RateLimiter] = None
+
+def init_app(app):
+    """RATE_LIMIT_BACKEND に応じて、各リクエストの前にレートと同時実行数を確認する"""
+    global limiter
+    from flask import request, session, jsonify, Response
+
+    backend = app.config.setdefault('RATE_LIMIT_BACKEND', RATE_LIMIT_BACKEND)
+    if backend == 'off':
+        return
+    if backend == 'memory':
+        store = MemoryBucketStore()
+    elif backend == 'sqlite':
+        store = SQLiteBucketStore()
+    else:
+        raise ValueError(f'Unknown RATE_LIMIT_BACKEND: {backend}')
+
+    limiter = RateLimiter(
+        store,
+        parse_rules(app.config.setdefault('RATE_LIMITS', RATE_LIMITS)),
+        parse_concurrency(app.config.setdefault('RATE_LIMIT_CONCURRENCY', RATE_LIMIT_CONCURRENCY)),
+        queue_timeout=RATE_LIMIT_QUEUE_TIMEOUT,
+        sweep_interval=RATE_LIMIT_SWEEP_INTERVAL,
+    )
+
+    @app.before_request
+    def check_rate_limit():
+        endpoint = request.endpoint
+        if endpoint is None or endpoint == 'static' or not limiter.limits(endpoint):
+            return None
+        try:
+            release = limiter.admit(endpoint, identity(session.get('user'), request.remote_addr))
+        except RequestRejected as e:
+            if request.path.startswith('/api/'):
+                response = jsonify({'error': e.message})
+            else:
+                response = Response(e.message, mimetype='text/plain')
+            response.status_code = e.status
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response
+        request.environ['enty.rate_limit_release'] = release
+        return None
+
+    @app.after_request
+    def release_after_response(response):
+        # ストリーミングのレスポンスは送り終わるまで枠を保持する
+        release = request.environ.pop('enty.rate_limit_release', None)
+        if release is not None:
+            response.call_on_close(release)
+        return response
+
+    @app.teardown_request
+    def release_on_error(exc=None):
+        # after_request まで到達しなかった場合
+        release = request.environ.pop('enty.rate_limit_release', None)
+        if release is not None:
+            release()
@@ -0,0 +1,277 @@
+"""読み取り専用のレポート用スナップショット
+
+時系列集計や日付間の差分のような大きな読み取りを data/enty.db で実行すると、画面の操作と
+ページキャッシュ・I/Oを取り合い、長い読み取りトランザクションの間はWALのチェックポイントも進まない。
+そこで VACUUM INTO で作ったコピーを REPORTING_REFRESH_INTERVAL 秒ごとに作り直し、
+snapshot() の中のリポジトリの読み取りをそのコピーに振り分ける。
+
+コピーは作成後に書き換えず、新しいコピーと置き換える（開いている接続は古いファイルを読み続ける）ので、
+immutable・query_only・mmap で開いてロックを取らずに読む。レスポンスには
+X-Data-Snapshot（コピーの時点）と X-Data-Staleness（経過秒数、本体を読んだ場合は0）を付ける。
+
+スナップショットのパスは既定では本体のパスから決め（data/enty.db なら data/enty-reporting.db）、
+コピーには元のデータベースのパスとデータの版を記録しておく。別のデータベースから作られたコピーや、
+本体より版が進んでいるコピー（本体を復元した場合など）は使わずに本体を読む。
+
+アプリの各ワーカーが更新スレッドを持つ（REPORTING_SNAPSHOT_WORKER=0 で無効）。同時に作り直すのは
+1プロセスだけで、他のプロセスは新しいコピーができるまで古いコピーを使う。
+
+    python reporting.py            # スナップショットを作り直す
+    python reporting.py --loop     # 一定間隔で作り直し続ける
+    python reporting.py --status   # スナップショットの時点と経過秒数
+"""
+import os
+import json
+import time
+import sqlite3
+import argparse
+import functools
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+import db
+from instrumentation import InstrumentedConnection
+
+# スナップショットのパス（未設定なら本体のパスから決める。空にすると作らず、レポートも本体を読む）
+REPORTING_SNAPSHOT_PATH = os.environ.get('REPORTING_SNAPSHOT_PATH')
+
+# スナップショットを作り直す間隔（秒）
+REPORTING_REFRESH_INTERVAL = float(os.environ.get('REPORTING_REFRESH_INTERVAL', '300'))
+
+# これより古いスナップショットは使わず本体を読む（秒、更新が止まっている場合）
+REPORTING_MAX_STALENESS = float(os.environ.get('REPORTING_MAX_STALENESS', '3600'))
+
+# スナップショットの接続でメモリマップするバイト数
+REPORTING_MMAP_SIZE = int(os.environ.get('REPORTING_MMAP_SIZE', str(256 * 1024 * 1024)))
+
+# アプリのワーカーでスナップショットを作り直すか
+REPORTING_SNAPSHOT_WORKER = os.environ.get('REPORTING_SNAPSHOT_WORKER', '1').lower() not in ('0', 'false', 'no', 'off')
+
+# スナップショットに記録した作成元（パスと更新時刻ごと）
+_sources: Dict[Tuple[str, float], Optional[Tuple[str, tuple]]] = {}
+
+def snapshot_path() -> str:
+    """スナップショットのパス（空文字ならスナップショットを使わない）"""
+    if REPORTING_SNAPSHOT_PATH is not None:
+        return REPORTING_SNAPSHOT_PATH
+    return os.path.splitext(db.DB_PATH)[0] + '-reporting.db'
+
+def snapshot_time(path: str = None) -> Optional[float]:
+    """スナップショットの時点（作成を始めた時刻、なければ None）"""
+    path = snapshot_path() if path is None else path
+    if not path:
+        return None
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return None
+
+def refresh(path: str = None, source_path: str = None) -> Optional[Dict[str, Any]]:
+    """VACUUM INTO でスナップショットを作り直す（他のプロセスが作成中なら None）
+
+    作成中のファイル（<path>.partial）を排他的に作ってから書き込み、できあがったら置き換える。
+    ファイルの更新時刻はコピーを始めた時刻にそろえる（それ以降の書き込みは含まれない）。
+    """
+    path = path or snapshot_path()
+    source_path = source_path or db.DB_PATH
+    temp_path = path + '.partial'
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # 作成中に止まったプロセスのファイルは消す
+    try:
+        if time.time() - os.path.getmtime(temp_path) > max(REPORTING_REFRESH_INTERVAL, 600):
+            os.remove(temp_path)
+    except OSError:
+        pass
+    try:
+        os.close(os.open(temp_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644))
+    except FileExistsError:
+        return None
+
+    try:
+        started = time.time()
+        conn = sqlite3.connect(source_path, factory=InstrumentedConnection)
+        try:
+            conn.execute('VACUUM INTO ?', (temp_path,))
+        finally:
+            conn.close()
+        # 読み取り専用で開くのでWALを使わない形式にしておき、作成元と（コピー自身から求めた）版を記録する
+        conn = sqlite3.connect(temp_path)
+        try:
+            conn.execute('PRAGMA journal_mode = DELETE')
+            version = db.ChangeLogRepository.get_data_version(conn)
+            conn.execute('CREATE TABLE reporting_snapshot (source_path TEXT NOT NULL, data_version TEXT NOT NULL)')
+            conn.execute('INSERT INTO reporting_snapshot (source_path, data_version) VALUES (?, ?)',
+                         (os.path.abspath(source_path), json.dumps(version)))
+            conn.commit()
+        finally:
+            conn.close()
+        os.utime(temp_path, (started, started))
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+    return {
+        'path': path,
+        'bytes': os.path.getsize(path),
+        'taken_at': datetime.fromtimestamp(started).isoformat(timespec='seconds'),
+        'seconds': round(time.time() - started, 3),
+    }
+
+def refresh_if_stale(path: str = None, interval: float = None) -> Optional[Dict[str, Any]]:
+    """スナップショットが interval 秒より古いか、本体と照合できなければ作り直す"""
+    path = path or snapshot_path()
+    interval = REPORTING_REFRESH_INTERVAL if interval is None else interval
+    taken = snapshot_time(path)
+    if taken is not None and time.time() - taken < interval and matches_live(path, taken):
+        return None
+    return refresh(path)
+
+def snapshot_source(path: str, taken: float) -> Optional[Tuple[str, tuple]]:
+    """スナップショットに記録した (作成元のパス, データの版)（記録がなければ None）"""
+    key = (path, taken)
+    if key not in _sources:
+        try:
+            conn = connect(path)
+            try:
+                row = conn.execute('SELECT source_path, data_version FROM reporting_snapshot').fetchone()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            row = None
+        # 置き換えられたコピーの分は捨てる
+        for stale in [cached for cached in list(_sources) if cached[0] == path]:
+            _sources.pop(stale, None)
+        _sources[key] = (row['source_path'], tuple(json.loads(row['data_version']))) if row else None
+    return _sources[key]
+
+def matches_live(path: str, taken: float) -> bool:
+    """スナップショットが本体から作られ、本体より版が進んでいないか"""
+    source = snapshot_source(path, taken)
+    if source is None or source[0] != os.path.abspath(db.DB_PATH):
+        return False
+    live = db.ChangeLogRepository.get_data_version()
+    return len(source[1]) == len(live) and all(mine <= theirs for mine, theirs in zip(source[1], live))
+
+def connect(path: str) -> sqlite3.Connection:
+    """スナップショットへの読み取り専用の接続"""
+    conn = sqlite3.connect(f'file:{path}?mode=ro&immutable=1', uri=True, factory=InstrumentedConnection)
+    conn.execute('PRAGMA query_only = ON')
+    conn.execute(f'PRAGMA mmap_size = {REPORTING_MMAP_SIZE}')
+    conn.row_factory = db.record_factory
+    return conn
+
+@contextmanager
+def snapshot():
+    """この中のリポジトリの読み取りをスナップショットに振り分け、鮮度を返す
+
+    スナップショットがない・REPORTING_MAX_STALENESS より古い・本体から作られたものでない場合は
+    本体を読む（staleness は0）。db_pool.gather などで別スレッドに渡した読み取りもスナップショットを読む。
+    """
+    path = snapshot_path()
+    taken = snapshot_time(path) if path else None
+    if taken is None or time.time() - taken > REPORTING_MAX_STALENESS or not matches_live(path, taken):
+        yield {'snapshot': 'live', 'staleness': 0}
+        return
+
+    token = db.connection_override.set(lambda: connect(path))
+    try:
+        yield {'snapshot': datetime.fromtimestamp(taken).isoformat(timespec='seconds'),
+               'staleness': round(time.time() - taken, 1)}
+    finally:
+        db.connection_override.reset(token)
+
+def headers(info: Dict[str, Any]) -> Dict[str, str]:
+    """鮮度を伝えるレスポンスヘッダー"""
+    return {'X-Data-Snapshot': info['snapshot'], 'X-Data-Staleness': str(info['staleness'])}
+
+def reporting_view(view):
+    """ビューの読み取りをスナップショットに振り分け、鮮度をヘッダーで返すデコレーター"""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        from flask import current_app
+        with snapshot() as info:
+            response = current_app.make_response(view(*args, **kwargs))
+        response.headers.update(headers(info))
+        return response
+    return wrapper
+
+class SnapshotRefresher:
+    """スナップショットが古くなったら作り直すスレッド"""
+
+    def __init__(self, interval: float = REPORTING_REFRESH_INTERVAL):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        """更新スレッドを開始（開始済みなら何もしない）"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='enty-reporting-snapshot', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                refresh_if_stale(interval=self.interval)
+            except Exception as e:
+                print(f'Error refreshing reporting snapshot: {e}')
+            # 他のワーカーが作り直した場合もその時点から数える
+            taken = snapshot_time()
+            wait = self.interval - (time.time() - taken) if taken is not None else self.interval
+            time.sleep(min(max(wait, 1), self.interval))
+
+# アプリのワーカーで使う更新スレッド
+refresher = SnapshotRefresher()
+
+def init_app(app):
+    """スナップショットの更新スレッドをFlaskアプリに登録（最初のリクエストで開始）"""
+    enabled = app.config.setdefault('REPORTING_SNAPSHOT_WORKER', REPORTING_SNAPSHOT_WORKER)
+    if not enabled or not snapshot_path():
+        return
+
+    @app.before_request
+    def start_snapshot_refresher():
+        # fork するサーバーでも各ワーカーで動くよう、インポート時ではなく最初のリクエストで開始する
+        refresher.start()
+
+def main():
+    parser = argparse.ArgumentParser(description='レポート用スナップショットを作り直す')
+    parser.add_argument('--output', default=snapshot_path(), help='スナップショットのパス（既定は本体のパスから決める）')
+    parser.add_argument('--loop', action='store_true', help='--interval 秒ごとに作り直し続ける')
+    parser.add_argument('--interval', type=float, default=REPORTING_REFRESH_INTERVAL)
+    parser.add_argument('--status', action='store_true', help='スナップショットの時点と経過秒数を表示して終了')
+    args = parser.parse_args()
+    if not args.output:
+        parser.error('REPORTING_SNAPSHOT_PATH または --output を指定してください')
+
+    if args.status:
+        taken = snapshot_time(args.output)
+        if taken is None:
+            print(f'{args.output}: not found')
+        else:
+            print(f'{args.output}: {datetime.fromtimestamp(taken).isoformat(timespec="seconds")} '
+                  f'({time.time() - taken:.0f}s ago, {os.path.getsize(args.output)} bytes)')
+        return
+
+    db.init_db()
+    while True:
+        result = refresh(args.output)
+        if result is None:
+            print(f'{args.output}: another process is refreshing the snapshot')
+        else:
+            print(f"{result['path']}: {result['bytes']} bytes at {result['taken_at']} in {result['seconds']}s")
+        if not args.loop:
+            return
+        time.sleep(args.interval)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+"""集計結果・時点指定の読み取り結果のワーカー内キャッシュ
+
+時系列集計・ファセットのように、同じ条件なら書き込みがあるまで結果が変わらない集計を保持する。
+各結果はデータの版（ChangeLogRepository.get_data_version）と一緒に保存し、版が変わった結果は使わない。
+版は他のワーカーの書き込みでも進むので、明示的に消さなくても古い結果は返らない。
+
+IntervalCache は表示日（view_date）ごとの読み取り結果を保持し、書き込みがあっても
+その有効期間に表示日が入る結果だけを捨てる（過去の時点の一覧は今日の書き込みでは消えない）。
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from instrumentation import metrics
+
+class VersionedCache:
+    """データの版つきのLRUキャッシュ"""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries: 'OrderedDict[Hashable, tuple]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable, version) -> Optional[Any]:
+        """version の時点で保存した結果（なければ None）"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: Hashable, version, result: Any):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (version, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+metrics.describe('enty_interval_cache_requests_total', 'counter', '時点指定の読み取り結果のキャッシュの参照数（result=hit / miss）')
+metrics.describe('enty_interval_cache_hit_ratio', 'gauge', '時点指定の読み取り結果のキャッシュのヒット率（ワーカーの起動から）')
+metrics.describe('enty_interval_cache_evictions_total', 'counter',
+                 '時点指定の読み取り結果のキャッシュから捨てた件数（reason=change / lru / reset）')
+metrics.describe('enty_interval_cache_entries', 'gauge', '時点指定の読み取り結果のキャッシュの件数')
+
+def _active(view_date: str, date_in: Optional[str], date_out: Optional[str]) -> bool:
+    """view_date が [date_in, date_out) に入るか（リポジトリの時点指定のSQLと同じ条件）"""
+    return (date_in is None or date_in <= view_date) and (date_out is None or date_out > view_date)
+
+class IntervalCache:
+    """表示日ごとの読み取り結果を、書き込みの有効期間に応じて部分的に捨てるLRUキャッシュ
+
+    結果は (問い合わせ名, パラメータ, 表示日) をキーに、依存先（エンティティクラス・エンティティなど、
+    呼び出し側が決めるキー）と一緒に保存する。参照のたびに version_source() でデータの版を確認し、
+    変更履歴が進んでいれば changes_since(seq, limit) で新しい変更を読んで dependencies_of(change) で
+    (依存先, date_in, date_out) の並びに変換し、その依存先を持ち、表示日が期間に入る結果だけを捨てる。
+    依存先が None の変更、版の先頭（変更履歴のシーケンス番号）以外の変化、sync_limit 件を超える
+    未処理の変更はすべての結果を捨てる。
+    """
+
+    def __init__(self, maxsize: int, version_source: Callable[[], tuple],
+                 changes_since: Callable[[int, int], List[Dict[str, Any]]],
+                 dependencies_of: Callable[[Dict[str, Any]], Iterable[tuple]], sync_limit: int = 1000,
+                 name: str = 'as_of'):
+        self.maxsize = maxsize
+        self.version_source = version_source
+        self.changes_since = changes_since
+        self.dependencies_of = dependencies_of
+        self.sync_limit = sync_limit
+        self.name = name
+        # キー → (結果, 表示日, 依存先)
+        self._entries: 'OrderedDict[Hashable, Tuple[Any, str, Tuple[Hashable, ...]]]' = OrderedDict()
+        # 依存先 → その依存先を持つ結果のキー
+        self._by_dependency: Dict[Hashable, Set[Hashable]] = {}
+        # 反映済みの版（変更履歴はこの版のシーケンス番号まで反映している）
+        self._version = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._counts: Dict[str, List[int]] = {}
+
+    def fetch(self, query: str, params: Hashable, view_date: str, load: Callable[[], Any],
+              dependencies: Callable[[Any], Iterable[Hashable]]) -> Any:
+        """保持している結果を返し、なければ load() の結果を dependencies(結果) の依存先で保存して返す"""
+        if self.maxsize <= 0:
+            return load()
+        version = self._sync()
+        key = (query, params, view_date)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        self._count(query, entry is not None)
+        if entry is not None:
+            return entry[0]
+
+        result = load()
+        self._put(key, view_date, result, tuple(set(dependencies(result))), version)
+        return result
+
+    def stats(self) -> Dict[str, Dict[str, float]]:
+        """問い合わせごとのヒット数・ミス数・ヒット率"""
+        with self._lock:
+            return {query: {'hits': hits, 'misses': misses, 'hit_ratio': hits / (hits + misses)}
+                    for query, (hits, misses) in self._counts.items()}
+
+    def clear(self):
+        with self._lock:
+            self._reset()
+            self._version = None
+
+    def _count(self, query: str, hit: bool):
+        metrics.inc('enty_interval_cache_requests_total', cache=self.name, query=query,
+                    result='hit' if hit else 'miss')
+        with self._lock:
+            counts = self._counts.setdefault(query, [0, 0])
+            counts[0 if hit else 1] += 1
+            ratio = counts[0] / (counts[0] + counts[1])
+        metrics.set('enty_interval_cache_hit_ratio', ratio, cache=self.name, query=query)
+
+    def _put(self, key, view_date, result, dependencies, version):
+        with self._lock:
+            # 読み取りの間に他のスレッドが新しい変更を反映していたら、その変更を見落とした結果かもしれない
+            if version != self._version:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (result, view_date, dependencies)
+            for dependency in dependencies:
+                self._by_dependency.setdefault(dependency, set()).add(key)
+            evicted = 0
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                evicted += 1
+            size = len(self._entries)
+        if evicted:
+            metrics.inc('enty_interval_cache_evictions_total', evicted, cache=self.name, reason='lru')
+        metrics.set('enty_interval_cache_entries', size, cache=self.name)
+
+    def _remove(self, key):
+        _, _, dependencies = self._entries.pop(key)
+        for dependency in dependencies:
+            keys = self._by_dependency.get(dependency)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_dependency[dependency]
+
+    def _reset(self) -> int:
+        count = len(self._entries)
+        self._entries.clear()
+        self._by_dependency.clear()
+        return count
+
+    def _sync(self) -> tuple:
+        """変更履歴の新しい変更を反映し、反映済みの版を返す（_lock は持たずに呼ぶ）"""
+        version = tuple(self.version_source())
+        with self._sync_lock:
+            current = self._version
+            if current is not None and version[1:] == current[1:] and version[0] <= current[0]:
+                # 変更がない（または他のスレッドが先に新しい版まで反映した）
+                return current
+
+            changes = None
+            if current is not None and version[1:] == current[1:]:
+                changes = self.changes_since(current[0], self.sync_limit + 1)
+                if len(changes) > self.sync_limit:
+                    changes = None
+
+            evicted, reason = 0, 'change'
+            with self._lock:
+                if changes is None:
+                    evicted, reason = self._reset(), 'reset'
+                for change in changes or ():
+                    if change['seq'] > version[0]:
+                        # 版を読んだ後の変更は次の参照で反映する
+                        break
+                    evicted += self._evict(change)
+                    if not self._entries:
+                        break
+                self._version = version
+                size = len(self._entries)
+        if evicted:
+            metrics.inc('enty_interval_cache_evictions_total', evicted, cache=self.name, reason=reason)
+        metrics.set('enty_interval_cache_entries', size, cache=self.name)
+        return version
+
+    def _evict(self, change) -> int:
+        """1件の変更の影響を受ける結果を捨て、捨てた件数を返す"""
+        evicted = 0
+        for dependency, date_in, date_out in self.dependencies_of(change):
+            if dependency is None:
+                return evicted + self._reset()
+            for key in list(self._by_dependency.get(dependency, ())):
+                if _active(self._entries[key][1], date_in, date_out):
+                    self._remove(key)
+                    evicted += 1
+        return evicted
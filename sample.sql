@@ -60,7 +60,7 @@ INSERT INTO entity_instance (title, class_id, date_in, date_out) VALUES
 
 -- 5. 属性インスタンスの登録
 -- web-server-01の属性
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('web-server-01', 1, 1, '2023-01-01'),
 ('192.168.1.10', 2, 1, '2023-01-01'),
 ('Ubuntu 20.04', 3, 1, '2023-01-01'),
@@ -68,7 +68,7 @@ INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES
 ('32GB', 5, 1, '2023-01-01');
 
 -- web-server-02の属性
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('web-server-02', 1, 2, '2023-06-01'),
 ('192.168.1.11', 2, 2, '2023-06-01'),
 ('Ubuntu 22.04', 3, 2, '2023-06-01'),
@@ -76,52 +76,52 @@ INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES
 ('64GB', 5, 2, '2023-06-01');
 
 -- db-server-01の属性（廃止済み）
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('db-server-01', 1, 3, '2022-01-01'),
 ('192.168.1.20', 2, 3, '2022-01-01'),
 ('CentOS 7', 3, 3, '2022-01-01');
 
 -- db-server-02の属性（新サーバー）
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('db-server-02', 1, 4, '2024-05-01'),
 ('192.168.1.21', 2, 4, '2024-05-01'),
 ('Ubuntu 22.04', 3, 4, '2024-05-01');
 
 -- WebShopアプリの属性
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('WebShop', 6, 6, '2023-01-15'),
 ('v1.0.0', 7, 6, '2023-01-15'),
 ('80', 8, 6, '2023-01-15'),
 ('https://webshop.company.com', 9, 6, '2023-01-15');
 
 -- UserAPI v2の属性
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('UserAPI', 6, 8, '2023-12-01'),
 ('v2.0.0', 7, 8, '2023-12-01'),
 ('8080', 8, 8, '2023-12-01'),
 ('https://api.company.com/user', 9, 8, '2023-12-01');
 
 -- maindb-v2の属性
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('maindb-v2', 10, 11, '2024-05-15'),
 ('PostgreSQL', 11, 11, '2024-05-15'),
 ('15.3', 12, 11, '2024-05-15');
 
 -- userdbの属性
-INSERT INTO attribute_instance (title, class_id, entity_id, date_event) VALUES 
+INSERT INTO attribute_instance (title, class_id, entity_id, date_in) VALUES 
 ('userdb', 10, 12, '2023-01-01'),
 ('MySQL', 11, 12, '2023-01-01'),
 ('8.0', 12, 12, '2023-01-01');
 
 -- 6. リレーションインスタンスの登録
 -- アプリケーション → サーバー（稼働関係）
-INSERT INTO relation_instance (class_id, entity_from, entity_to, date_event) VALUES 
+INSERT INTO relation_instance (class_id, entity_from, entity_to, date_in) VALUES 
 (1, 6, 1, '2023-01-15'),  -- WebShop → web-server-01
 (1, 8, 2, '2023-12-01'),  -- UserAPI-v2 → web-server-02
 (1, 9, 5, '2023-03-15');  -- AdminPanel → app-server-01
 
 -- アプリケーション → データベース（接続関係）
-INSERT INTO relation_instance (class_id, entity_from, entity_to, date_event) VALUES 
+INSERT INTO relation_instance (class_id, entity_from, entity_to, date_in) VALUES 
 (2, 6, 12, '2023-01-15'),  -- WebShop → userdb
 (2, 8, 11, '2023-12-15'),  -- UserAPI-v2 → maindb-v2
 (2, 9, 12, '2023-03-15');  -- AdminPanel → userdb
@@ -0,0 +1,161 @@
+"""属性クラスのスキーマ変更ジョブ（クラス削除・データ型変更・統合）の実行
+
+件数の多い属性クラスでも画面・APIを止めないよう、値の削除・変換・移動は
+バックグラウンドで SCHEMA_JOB_CHUNK_SIZE 件ずつの短いトランザクションに分けて行う。
+処理位置は schema_job に保存されるので、プロセスが止まっても別のワーカーや
+次の起動時に続きから再開する（ハートビートが SCHEMA_JOB_STALE_AFTER 秒途絶えたジョブを引き継ぐ）。
+
+アプリの各ワーカーが実行スレッドを1つ持つ（SCHEMA_JOB_WORKER=0 で無効）。
+ワーカーを止めた場合や手動で進める場合はCLIで実行する。
+
+    python schema_jobs.py            # 待機中のジョブをすべて実行
+    python schema_jobs.py --list     # 進捗の一覧
+    python schema_jobs.py --retry 3  # 失敗したジョブを再開
+"""
+import os
+import json
+import time
+import socket
+import argparse
+import threading
+from typing import Any, Dict, Optional
+
+from db import SchemaJobRepository, init_db
+
+# 1トランザクションで処理する値の件数（書き込みロックを持つ時間の目安）
+SCHEMA_JOB_CHUNK_SIZE = int(os.environ.get('SCHEMA_JOB_CHUNK_SIZE', '500'))
+
+# チャンクの間に空ける時間（秒、画面・APIの書き込みを先に通す）
+SCHEMA_JOB_PAUSE = float(os.environ.get('SCHEMA_JOB_PAUSE', '0.05'))
+
+# 待機中のジョブを確認する間隔（秒、ジョブの登録時はすぐに起こす）
+SCHEMA_JOB_POLL_INTERVAL = float(os.environ.get('SCHEMA_JOB_POLL_INTERVAL', '5'))
+
+# この秒数ハートビートのない実行中のジョブは止まったとみなして引き継ぐ
+SCHEMA_JOB_STALE_AFTER = float(os.environ.get('SCHEMA_JOB_STALE_AFTER', '60'))
+
+# アプリのワーカーでジョブを実行するか
+SCHEMA_JOB_WORKER = os.environ.get('SCHEMA_JOB_WORKER', '1').lower() not in ('0', 'false', 'no', 'off')
+
+class SchemaJobRunner:
+    """待機中のジョブを1件ずつ引き受け、チャンクごとに進める"""
+
+    def __init__(self, chunk_size: int = SCHEMA_JOB_CHUNK_SIZE, pause: float = SCHEMA_JOB_PAUSE,
+                 poll_interval: float = SCHEMA_JOB_POLL_INTERVAL, stale_after: float = SCHEMA_JOB_STALE_AFTER):
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.poll_interval = poll_interval
+        self.stale_after = stale_after
+        self.owner = f'{socket.gethostname()}:{os.getpid()}'
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def run_job(self, job) -> Optional[Dict[str, Any]]:
+        """引き受けたジョブを最後まで進め、最終状態を返す（他のワーカーに引き継がれたら None）"""
+        job_id = job['identifier']
+        try:
+            while job is not None and job['status'] == 'running':
+                job = SchemaJobRepository.run_chunk(job_id, self.owner, self.chunk_size, time.time())
+                if job is not None and job['status'] == 'running' and self.pause:
+                    time.sleep(self.pause)
+        except Exception as e:
+            print(f'Error running schema job {job_id}: {e}')
+            SchemaJobRepository.fail(job_id, self.owner, str(e))
+            job = SchemaJobRepository.get(job_id)
+        return dict(job) if job is not None else None
+
+    def run_once(self) -> Optional[Dict[str, Any]]:
+        """ジョブを1件引き受けて実行（なければ None）"""
+        now = time.time()
+        job = SchemaJobRepository.claim(self.owner, now - self.stale_after, now)
+        if job is None:
+            return None
+        return self.run_job(job)
+
+    def run_pending(self) -> list:
+        """待機中のジョブがなくなるまで実行"""
+        results = []
+        while True:
+            result = self.run_once()
+            if result is None:
+                return results
+            results.append(result)
+
+    def notify(self):
+        """ジョブが登録されたことを実行スレッドに知らせる"""
+        self._wakeup.set()
+
+    def start(self):
+        """実行スレッドを開始（開始済みなら何もしない）"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._loop, name='enty-schema-job', daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_pending()
+            except Exception as e:
+                print(f'Error in schema job runner: {e}')
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+# アプリのワーカーで使う実行スレッド
+runner = SchemaJobRunner()
+
+def submit(kind: str, class_id: int, params: Dict[str, Any] = None) -> int:
+    """ジョブを登録して実行スレッドを起こし、ジョブIDを返す（登録できない場合は ValueError）"""
+    job_id = SchemaJobRepository.create(kind, class_id, params)
+    runner.notify()
+    return job_id
+
+def progress(job) -> Dict[str, Any]:
+    """画面・API向けのジョブの進捗（params は辞書にする）"""
+    job = dict(job)
+    job['params'] = json.loads(job['params'])
+    job['percent'] = 100 if job['status'] == 'done' else (
+        min(99, job['processed'] * 100 // job['total']) if job['total'] else 0)
+    return job
+
+def init_app(app):
+    """スキーマ変更ジョブの実行スレッドをFlaskアプリに登録（最初のリクエストで開始）"""
+    enabled = app.config.setdefault('SCHEMA_JOB_WORKER', SCHEMA_JOB_WORKER)
+    if not enabled:
+        return
+
+    @app.before_request
+    def start_schema_job_runner():
+        # fork するサーバーでも各ワーカーで動くよう、インポート時ではなく最初のリクエストで開始する
+        runner.start()
+
+def main():
+    parser = argparse.ArgumentParser(description='属性クラスのスキーマ変更ジョブを実行')
+    parser.add_argument('--list', action='store_true', help='最近のジョブの進捗を表示して終了')
+    parser.add_argument('--retry', type=int, metavar='JOB_ID', help='失敗したジョブを待機中に戻してから実行')
+    parser.add_argument('--chunk-size', type=int, default=SCHEMA_JOB_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    init_db()
+
+    if args.list:
+        print(f'{"id":>5} {"kind":<12} {"class":<20} {"status":<8} {"phase":<8} {"processed":>10} {"total":>10} '
+              f'{"failed":>7}')
+        for job in SchemaJobRepository.get_recent():
+            job = progress(job)
+            class_title = job['params'].get('class_title', '')
+            print(f'{job["identifier"]:>5} {job["kind"]:<12} {class_title:<20} {job["status"]:<8} {job["phase"]:<8} '
+                  f'{job["processed"]:>10} {job["total"]:>10} {job["failed"]:>7}')
+        return
+
+    if args.retry is not None and not SchemaJobRepository.retry(args.retry):
+        parser.error(f'ジョブ {args.retry} は失敗状態ではありません')
+
+    for job in SchemaJobRunner(chunk_size=args.chunk_size, pause=0).run_pending():
+        print(f'job {job["identifier"]} {job["kind"]} class {job["class_id"]}: {job["status"]}, '
+              f'{job["processed"]}/{job["total"]} processed, {job["failed"]} failed'
+              + (f' ({job["error"]})' if job['error'] else ''))
+
+if __name__ == '__main__':
+    main()
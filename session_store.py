@@ -0,0 +1,280 @@
+import os
+import time
+import secrets
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+from db import SessionRepository
+
+# セッションの保存先（sqlite: サーバー側に保存 / cookie: Flask標準の署名付きCookie）
+SESSION_BACKEND = os.environ.get('SESSION_BACKEND', 'sqlite')
+
+# プロセス内LRUの件数と保持秒数（他ワーカーでの失効が反映されるまでの最大遅延）
+SESSION_CACHE_SIZE = int(os.environ.get('SESSION_CACHE_SIZE', '1000'))
+SESSION_CACHE_TTL = float(os.environ.get('SESSION_CACHE_TTL', '5'))
+
+# 期限切れセッションを掃除する間隔（秒）
+SESSION_SWEEP_INTERVAL = float(os.environ.get('SESSION_SWEEP_INTERVAL', '300'))
+
+class SessionStore(ABC):
+    """セッションの保存先のインターフェース（load は (データ, 有効期限) を返し、なければ None）"""
+
+    @abstractmethod
+    def load(self, session_id: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        ...
+
+    @abstractmethod
+    def save(self, session_id: str, data: Dict[str, Any], user_id: Optional[str], expires_at: float):
+        ...
+
+    @abstractmethod
+    def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    def delete_user(self, user_id: str) -> List[str]:
+        """ユーザーの全セッションを失効させ、失効したセッションIDを返す"""
+        ...
+
+    @abstractmethod
+    def sweep(self) -> int:
+        """期限切れセッションを削除し、削除件数を返す"""
+        ...
+
+class SQLiteSessionStore(SessionStore):
+    """アプリのSQLiteデータベース（user_session テーブル）に保存"""
+
+    def __init__(self):
+        self.serializer = TaggedJSONSerializer()
+
+    def load(self, session_id):
+        row = SessionRepository.get(session_id)
+        if row is None:
+            return None
+        return self.serializer.loads(row['data']), row['expires_at']
+
+    def save(self, session_id, data, user_id, expires_at):
+        SessionRepository.save(session_id, user_id, self.serializer.dumps(data), expires_at)
+
+    def delete(self, session_id):
+        SessionRepository.delete(session_id)
+
+    def delete_user(self, user_id):
+        return SessionRepository.delete_by_user(user_id)
+
+    def sweep(self):
+        return SessionRepository.delete_expired()
+
+class CachedSessionStore(SessionStore):
+    """別の保存先の前段に置くプロセス内LRU
+
+    同じワーカーで失効させたセッションは即座に消えるが、他のワーカーの
+    キャッシュには最大 ttl 秒残る。
+    """
+
+    def __init__(self, backend: SessionStore, maxsize: int = 1000, ttl: float = 5):
+        self.backend = backend
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: 'OrderedDict[str, Tuple[Dict[str, Any], float, Optional[str], float]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _put(self, session_id, data, expires_at, user_id):
+        with self._lock:
+            self._entries[session_id] = (data, expires_at, user_id, time.monotonic())
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def load(self, session_id):
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None:
+                data, expires_at, _, cached_at = entry
+                if time.monotonic() - cached_at < self.ttl and expires_at > time.time():
+                    self._entries.move_to_end(session_id)
+                    # 呼び出し側が書き換えてもキャッシュが汚れないようにコピーを返す
+                    return dict(data), expires_at
+                del self._entries[session_id]
+
+        loaded = self.backend.load(session_id)
+        if loaded is not None:
+            data, expires_at = loaded
+            self._put(session_id, dict(data), expires_at, _user_id(data))
+        return loaded
+
+    def save(self, session_id, data, user_id, expires_at):
+        self.backend.save(session_id, data, user_id, expires_at)
+        self._put(session_id, dict(data), expires_at, user_id)
+
+    def delete(self, session_id):
+        with self._lock:
+            self._entries.pop(session_id, None)
+        self.backend.delete(session_id)
+
+    def delete_user(self, user_id):
+        session_ids = self.backend.delete_user(user_id)
+        with self._lock:
+            for session_id in session_ids:
+                self._entries.pop(session_id, None)
+            for session_id in [key for key, entry in self._entries.items() if entry[2] == user_id]:
+                del self._entries[session_id]
+        return session_ids
+
+    def sweep(self):
+        return self.backend.sweep()
+
+def _user_id(data: Dict[str, Any]) -> Optional[str]:
+    """一括失効用にセッションデータからユーザーIDを取り出す"""
+    user = data.get('user')
+    if isinstance(user, dict) and user.get('id') is not None:
+        return str(user['id'])
+    return None
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    """サーバー側に保存するセッション（CookieにはセッションIDだけを持たせる）"""
+
+    def __init__(self, initial=None, session_id: str = None, expires_at: float = None, new: bool = False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(initial, on_update)
+        self.session_id = session_id or secrets.token_urlsafe(32)
+        self.expires_at = expires_at
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self.previous_session_id = None
+
+    def __getitem__(self, key):
+        self.accessed = True
+        return super().__getitem__(key)
+
+    def get(self, key, default=None):
+        self.accessed = True
+        return super().get(key, default)
+
+    def setdefault(self, key, default=None):
+        self.accessed = True
+        return super().setdefault(key, default)
+
+    def regenerate(self):
+        """セッションIDを振り直す（ログイン時のセッション固定攻撃対策）"""
+        self.previous_session_id = self.session_id
+        self.session_id = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+class ServerSideSessionInterface(SessionInterface):
+    """セッションデータを SessionStore に保存する SessionInterface"""
+
+    session_class = ServerSideSession
+
+    def __init__(self, store: SessionStore, sweep_interval: float = 300):
+        self.store = store
+        self.sweep_interval = sweep_interval
+        self._next_sweep = time.monotonic() + sweep_interval
+
+    def open_session(self, app, request):
+        session_id = request.cookies.get(self.get_cookie_name(app))
+        if session_id:
+            loaded = self.store.load(session_id)
+            if loaded is not None:
+                data, expires_at = loaded
+                return self.session_class(data, session_id=session_id, expires_at=expires_at)
+        return self.session_class(new=True)
+
+    def _maybe_sweep(self):
+        now = time.monotonic()
+        if now < self._next_sweep:
+            return
+        self._next_sweep = now + self.sweep_interval
+        try:
+            self.store.sweep()
+        except Exception as e:
+            print(f'Error sweeping sessions: {e}')
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+
+        if session.previous_session_id:
+            self.store.delete(session.previous_session_id)
+
+        # 空になったセッション（ログアウト等）は保存先からもCookieからも消す
+        if not session:
+            if not session.new:
+                self.store.delete(session.session_id)
+                response.delete_cookie(name, domain=domain, path=path,
+                                       secure=self.get_cookie_secure(app),
+                                       samesite=self.get_cookie_samesite(app),
+                                       httponly=self.get_cookie_httponly(app))
+            return
+
+        # 有効期限は残り半分を切ったときだけ延長し、読むだけのリクエストでは書き込まない
+        lifetime = app.permanent_session_lifetime.total_seconds()
+        now = time.time()
+        needs_touch = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if session.modified or session.new or needs_touch:
+            session.expires_at = now + lifetime
+            self.store.save(session.session_id, dict(session), _user_id(session), session.expires_at)
+            self._maybe_sweep()
+
+        if session.new or (session.permanent and needs_touch):
+            response.set_cookie(
+                name,
+                session.session_id,
+                expires=self.get_expiration_time(app, session),
+                httponly=self.get_cookie_httponly(app),
+                domain=domain,
+                path=path,
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+            )
+
+    def revoke_user(self, user_id: str) -> int:
+        """ユーザーの全セッションを失効させる（ログアウト時・権限変更時）"""
+        return len(self.store.delete_user(str(user_id)))
+
+def revoke_user(user_id: Optional[str]) -> int:
+    """ユーザーの全セッションを失効させ、失効した件数を返す（Cookieセッションでは何もしない）
+
+    アプリのコンテキスト内ではアプリのセッションの保存先（プロセス内LRUを含む）から、
+    コンテキスト外（管理用のスクリプトなど）ではデータベースから直接削除する。
+    """
+    from flask import current_app, has_app_context
+
+    if user_id is None:
+        return 0
+    if has_app_context():
+        interface = current_app.session_interface
+        if not isinstance(interface, ServerSideSessionInterface):
+            return 0
+        return interface.revoke_user(user_id)
+    if SESSION_BACKEND != 'sqlite':
+        return 0
+    return len(SQLiteSessionStore().delete_user(str(user_id)))
+
+def init_app(app):
+    """SESSION_BACKEND に応じてセッションの保存先を設定"""
+    backend = app.config.setdefault('SESSION_BACKEND', SESSION_BACKEND)
+    if backend == 'cookie':
+        return
+    if backend != 'sqlite':
+        raise ValueError(f'Unknown SESSION_BACKEND: {backend}')
+
+    store = SQLiteSessionStore()
+    if SESSION_CACHE_SIZE > 0:
+        store = CachedSessionStore(store, maxsize=SESSION_CACHE_SIZE, ttl=SESSION_CACHE_TTL)
+    app.session_interface = ServerSideSessionInterface(store, sweep_interval=SESSION_SWEEP_INTERVAL)
@@ -1,24 +1,136 @@
 /**
  * 日付時点指定UI のJavaScript
+ * データ領域（data-date-region）があるページでは、日付変更時にその部分だけを差し替える
  */
 
+// 部分更新の結果を保持する件数
+const REGION_CACHE_SIZE = 30;
+// 日付ごとのデータ領域HTMLのキャッシュ（URL → Promise<string|null>）
+const regionCache = new Map();
+
 // URL パラメータから日付を取得する関数  
 function getDateFromUrl() {
     const urlParams = new URLSearchParams(window.location.search);
     return urlParams.get('view_date');
 }
 
-// URL パラメータに日付を設定する関数
-function setDateInUrl(date) {
+// 指定日付のページURLを作成（他のパラメータ（type等）は保持される）
+function buildDateUrl(date) {
     const url = new URL(window.location);
     if (date) {
         url.searchParams.set('view_date', date);
     } else {
         url.searchParams.delete('view_date');
     }
+    return url;
+}
+
+// レート制限（429）・混雑（503）のときに Retry-After だけ待って取得し直す回数と、待つ秒数の上限
+const REGION_RETRY_COUNT = 2;
+const REGION_RETRY_MAX_SECONDS = 5;
+
+// 断片を取得（429 / 503 なら Retry-After だけ待って retries 回まで取得し直す）
+function fetchWithRetry(key, retries) {
+    return fetch(key, { credentials: 'same-origin' }).then(response => {
+        if ((response.status === 429 || response.status === 503) && retries > 0) {
+            const seconds = Math.min(Number(response.headers.get('Retry-After')) || 1, REGION_RETRY_MAX_SECONDS);
+            return new Promise(resolve => setTimeout(resolve, seconds * 1000))
+                .then(() => fetchWithRetry(key, retries - 1));
+        }
+        return response;
+    });
+}
+
+// データ領域のHTML断片を取得（同じ日付は1回だけ取得してキャッシュする）
+// 先読みは制限に掛かっても取得し直さない（retries = 0）
+function fetchRegion(url, retries = REGION_RETRY_COUNT) {
+    const partialUrl = new URL(url);
+    partialUrl.searchParams.set('partial', '1');
+    const key = partialUrl.toString();
     
-    // ページをリロードして新しい日付でデータを取得
-    // 他のパラメータ（type等）は保持される
+    if (regionCache.has(key)) {
+        // 最近使ったものとして末尾に移動
+        const cached = regionCache.get(key);
+        regionCache.delete(key);
+        regionCache.set(key, cached);
+        return cached;
+    }
+    
+    const request = fetchWithRetry(key, retries)
+        .then(response => {
+            // 断片以外（エラーやリダイレクト先のページ）はキャッシュしない
+            if (!response.ok || response.headers.get('X-Partial-Content') !== '1') {
+                regionCache.delete(key);
+                return null;
+            }
+            return response.text();
+        })
+        .catch(() => {
+            regionCache.delete(key);
+            return null;
+        });
+    
+    regionCache.set(key, request);
+    while (regionCache.size > REGION_CACHE_SIZE) {
+        regionCache.delete(regionCache.keys().next().value);
+    }
+    return request;
+}
+
+// 日付表示ラベルを更新
+function updateViewDateLabels(date) {
+    document.querySelectorAll('[data-view-date-label]').forEach(label => {
+        if (label.dataset.viewDateFormat === 'ja') {
+            const [year, month, day] = date.split('-');
+            label.textContent = `${year}年${month}月${day}日`;
+        } else {
+            label.textContent = date;
+        }
+    });
+}
+
+// 前後の日付を先読みしておく（連続して日付を送る操作を即座に表示するため）
+function prefetchAdjacentDates(date) {
+    const schedule = window.requestIdleCallback || (callback => setTimeout(callback, 200));
+    schedule(function() {
+        [-1, 1].forEach(offset => {
+            const adjacent = new Date(`${date}T00:00:00Z`);
+            adjacent.setUTCDate(adjacent.getUTCDate() + offset);
+            fetchRegion(buildDateUrl(adjacent.toISOString().split('T')[0]), 0);
+        });
+    });
+}
+
+// データ領域を指定日付の内容に差し替える（差し替えられない場合は false）
+async function showDateRegion(date, url) {
+    const region = document.querySelector('[data-date-region]');
+    if (!region || !date) {
+        return false;
+    }
+    
+    const html = await fetchRegion(url);
+    if (html === null) {
+        return false;
+    }
+    
+    region.innerHTML = html;
+    region.dataset.viewDate = date;
+    updateViewDateLabels(date);
+    document.dispatchEvent(new CustomEvent('dateregion:updated', { detail: { date: date } }));
+    prefetchAdjacentDates(date);
+    return true;
+}
+
+// URL パラメータに日付を設定する関数
+async function setDateInUrl(date) {
+    const url = buildDateUrl(date);
+    
+    if (await showDateRegion(date, url)) {
+        history.pushState({ viewDate: date }, '', url.toString());
+        return;
+    }
+    
+    // データ領域がないページでは従来どおりリロードして新しい日付でデータを取得
     window.location.href = url.toString();
 }
 
@@ -47,6 +159,10 @@ document.addEventListener('DOMContentLoaded', function() {
         dateInput.value = getCurrentDate();
     }
     
+    if (document.querySelector('[data-date-region]')) {
+        prefetchAdjacentDates(dateInput.value);
+    }
+    
     // 適用ボタンのクリック処理
     applyButton.addEventListener('click', function() {
         const selectedDate = dateInput.value;
@@ -68,4 +184,13 @@ document.addEventListener('DOMContentLoaded', function() {
             applyButton.click();
         }
     });
+    
+    // ブラウザの戻る・進むでも部分更新で表示を戻す
+    window.addEventListener('popstate', async function() {
+        const date = getDateFromUrl() || getCurrentDate();
+        dateInput.value = date;
+        if (!await showDateRegion(date, new URL(window.location))) {
+            window.location.reload();
+        }
+    });
 });
@@ -0,0 +1,149 @@
+/**
+ * エンティティ詳細ページの履歴ステップ表示
+ * タイムラインAPIを1回だけ取得し、前後の変更日へページを再読み込みせずに移動する
+ * （日付ラベルの更新には date-selector.js の updateViewDateLabels を使う）
+ */
+
+// タイムラインのイベントから「有効になったバージョン」の一覧を作る
+function collectVersions(events) {
+    return events
+        .filter(event => event.event === 'set')
+        .map(event => event.attribute);
+}
+
+// 指定日付時点で有効なバージョンを抽出
+function versionsAtDate(versions, viewDate) {
+    return versions.filter(version =>
+        (!version.date_in || version.date_in <= viewDate) &&
+        (!version.date_out || version.date_out > viewDate)
+    );
+}
+
+// 属性テーブルを描画（サーバー側テンプレートと同じ構造）
+function renderAttributes(region, versions, entityUrl) {
+    region.replaceChildren();
+    
+    if (versions.length === 0) {
+        const empty = document.createElement('div');
+        empty.className = 'text-muted text-center py-3';
+        empty.textContent = '属性情報がありません';
+        region.appendChild(empty);
+        return;
+    }
+    
+    const table = document.createElement('table');
+    table.className = 'table table-borderless table-sm';
+    versions.forEach(attr => {
+        const row = table.insertRow();
+        const header = document.createElement('th');
+        header.width = '120';
+        header.textContent = `${attr.name}:`;
+        row.appendChild(header);
+        
+        const cell = row.insertCell();
+        if (attr.data_type === 'ENTITY') {
+            if (attr.target_entity_title) {
+                const link = document.createElement('a');
+                link.href = entityUrl + attr.target_entity_id;
+                link.className = 'text-decoration-none';
+                link.textContent = `🔗 ${attr.target_entity_title}`;
+                cell.appendChild(link);
+            } else {
+                const missing = document.createElement('span');
+                missing.className = 'text-muted';
+                missing.textContent = '(参照先なし)';
+                cell.appendChild(missing);
+            }
+        } else if (attr.data_type === 'DATE') {
+            const value = document.createElement('span');
+            value.className = 'text-info';
+            value.textContent = `📅 ${attr.value}`;
+            cell.appendChild(value);
+        } else {
+            cell.appendChild(document.createTextNode(attr.value));
+        }
+        
+        if (attr.date_in) {
+            const dateIn = document.createElement('small');
+            dateIn.className = 'text-muted d-block';
+            dateIn.textContent = `有効日: ${attr.date_in}`;
+            cell.appendChild(dateIn);
+        }
+    });
+    region.appendChild(table);
+}
+
+document.addEventListener('DOMContentLoaded', async function() {
+    const region = document.getElementById('attribute-region');
+    const controls = document.getElementById('timeline-controls');
+    const prevButton = document.getElementById('timeline-prev');
+    const nextButton = document.getElementById('timeline-next');
+    
+    if (!region || !controls || !prevButton || !nextButton) {
+        return;
+    }
+    
+    let timeline;
+    try {
+        const response = await fetch(region.dataset.timelineUrl);
+        if (!response.ok) {
+            return;
+        }
+        timeline = await response.json();
+    } catch (error) {
+        console.error('Error loading timeline:', error);
+        return;
+    }
+    
+    const versions = collectVersions(timeline.events);
+    // 変更が起きた日付（重複なし・昇順）
+    const eventDates = [...new Set(timeline.events.map(event => event.date).filter(Boolean))].sort();
+    let currentDate = region.dataset.viewDate;
+    
+    function updateButtons() {
+        prevButton.disabled = !eventDates.some(value => value < currentDate);
+        nextButton.disabled = !eventDates.some(value => value > currentDate);
+    }
+    
+    function showDate(viewDate) {
+        currentDate = viewDate;
+        renderAttributes(region, versionsAtDate(versions, viewDate), region.dataset.entityUrl);
+        
+        updateViewDateLabels(viewDate);
+        const dateInput = document.getElementById('viewDate');
+        if (dateInput) {
+            dateInput.value = viewDate;
+        }
+        
+        // 再読み込みせずにURLだけ更新（リロード時も同じ日付で表示される）
+        const url = new URL(window.location);
+        url.searchParams.set('view_date', viewDate);
+        history.replaceState(null, '', url.toString());
+        updateButtons();
+    }
+    
+    prevButton.addEventListener('click', function() {
+        const candidates = eventDates.filter(value => value < currentDate);
+        if (candidates.length > 0) {
+            showDate(candidates[candidates.length - 1]);
+        }
+    });
+    
+    nextButton.addEventListener('click', function() {
+        const candidate = eventDates.find(value => value > currentDate);
+        if (candidate) {
+            showDate(candidate);
+        }
+    });
+    
+    // 日付選択UIで属性部分が差し替えられたら、その日付を基準に前後の変更を辿る
+    document.addEventListener('dateregion:updated', function(event) {
+        currentDate = event.detail.date;
+        updateButtons();
+    });
+    
+    if (eventDates.length > 0) {
+        controls.style.display = 'flex';
+        updateButtons();
+    }
+});
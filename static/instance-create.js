@@ -0,0 +1,102 @@
+/**
+ * インスタンス作成ページのクラス選択・ENTITY型の選択肢・入力チェック
+ */
+
+function loadAttributeForm() {
+    const classId = document.getElementById('class_id').value;
+    const attributesSection = document.getElementById('attributes-section');
+    const attributeFields = document.getElementById('attribute-fields');
+    
+    if (!classId) {
+        attributesSection.style.display = 'none';
+        return;
+    }
+    
+    // 現在のページをリロードして属性フィールドを表示
+    const currentUrl = new URL(window.location);
+    currentUrl.searchParams.set('type', classId);
+    window.location.href = currentUrl.toString();
+}
+
+// エンティティ一覧を読み込む関数
+async function loadEntities() {
+    try {
+        const response = await fetch('/api/entities');
+        const entities = await response.json();
+        
+        // 全てのENTITY型セレクトボックスにエンティティを追加
+        const entitySelects = document.querySelectorAll('.entity-select');
+        entitySelects.forEach(select => {
+            // 既存のオプションをクリア（初期オプション以外）
+            while (select.children.length > 1) {
+                select.removeChild(select.lastChild);
+            }
+            
+            // エンティティを追加
+            entities.forEach(entity => {
+                const option = document.createElement('option');
+                option.value = entity.identifier;
+                option.textContent = `${entity.title} (${entity.type_name})`;
+                select.appendChild(option);
+            });
+        });
+        
+    } catch (error) {
+        console.error('Error loading entities:', error);
+    }
+}
+
+// ページ読み込み時にエンティティ一覧を読み込み
+document.addEventListener('DOMContentLoaded', function() {
+    loadEntities();
+});
+
+// フォーム送信前のバリデーション
+document.getElementById('create-entity-form').addEventListener('submit', function(e) {
+    const title = document.getElementById('title').value.trim();
+    const classId = document.getElementById('class_id').value;
+    
+    if (!title) {
+        e.preventDefault();
+        alert('インスタンス名を入力してください。');
+        document.getElementById('title').focus();
+        return;
+    }
+    
+    if (!classId) {
+        e.preventDefault();
+        alert('エンティティクラスを選択してください。');
+        document.getElementById('class_id').focus();
+        return;
+    }
+    
+    // 必須属性のチェック
+    const requiredFields = document.querySelectorAll('.attribute-field[data-type="required"] input, .attribute-field[data-type="required"] textarea');
+    for (let field of requiredFields) {
+        if (!field.value.trim()) {
+            e.preventDefault();
+            alert(`必須項目「${field.previousElementSibling.textContent}」を入力してください。`);
+            field.focus();
+            return;
+        }
+    }
+});
+
+// 日付フィールドの制御
+document.getElementById('date_in').addEventListener('change', function() {
+    const dateOut = document.getElementById('date_out');
+    if (this.value) {
+        dateOut.min = this.value;
+    } else {
+        dateOut.removeAttribute('min');
+    }
+});
+
+document.getElementById('date_out').addEventListener('change', function() {
+    const dateIn = document.getElementById('date_in');
+    if (this.value) {
+        dateIn.max = this.value;
+    } else {
+        dateIn.removeAttribute('max');
+    }
+});
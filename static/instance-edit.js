@@ -0,0 +1,158 @@
+/**
+ * インスタンス編集ページの属性追加・編集モーダル
+ * （エンティティ一覧のURLはセレクトボックスの data-entities-url から読む）
+ */
+
+// 属性インスタンス追加モーダルを開く
+function addAttributeInstance(attributeClassId, attributeName, dataType) {
+    document.getElementById('addModalTitle').textContent = `${attributeName} の追加`;
+    document.getElementById('addAttributeClassId').value = attributeClassId;
+    document.getElementById('addDataType').value = dataType;
+    
+    // フォームをリセット
+    document.getElementById('addValue').value = '';
+    document.getElementById('addDateIn').value = '';
+    document.getElementById('addDateOut').value = '';
+    
+    const valueInput = document.getElementById('addValue');
+    const entitySelect = document.getElementById('addEntitySelect');
+    
+    if (dataType === 'ENTITY') {
+        // ENTITY型の場合はセレクトボックスを表示
+        valueInput.style.display = 'none';
+        valueInput.required = false;
+        entitySelect.style.display = 'block';
+        entitySelect.required = true;
+        entitySelect.value = '';
+        
+        // エンティティ一覧を読み込み
+        loadEntitiesForAdd();
+    } else {
+        // 通常の属性の場合
+        valueInput.style.display = 'block';
+        valueInput.required = true;
+        entitySelect.style.display = 'none';
+        entitySelect.required = false;
+        
+        // データ型に応じて入力フィールドを調整
+        if (dataType === 'DATE') {
+            valueInput.type = 'date';
+        } else if (dataType === 'NUMBER') {
+            valueInput.type = 'number';
+        } else {
+            valueInput.type = 'text';
+        }
+    }
+    
+    document.getElementById('attributeAddModal').style.display = 'flex';
+}
+
+function editAttribute(attributeId, attributeName, currentValue, currentDateIn, currentDateOut, dataType) {
+    document.getElementById('editModalTitle').textContent = `${attributeName} の編集`;
+    document.getElementById('editAttributeId').value = attributeId;
+    document.getElementById('editDateIn').value = currentDateIn;
+    document.getElementById('editDateOut').value = currentDateOut;
+    document.getElementById('editDataType').value = dataType;
+    document.getElementById('editDataTypeField').value = dataType;
+    
+    const valueInput = document.getElementById('editValue');
+    const entitySelect = document.getElementById('editEntitySelect');
+    
+    if (dataType === 'ENTITY') {
+        // ENTITY型の場合はセレクトボックスを表示
+        valueInput.style.display = 'none';
+        valueInput.required = false;
+        entitySelect.style.display = 'block';
+        entitySelect.required = true;
+        entitySelect.value = currentValue;
+        
+        // エンティティ一覧を読み込み
+        loadEntities();
+    } else {
+        // 通常の属性の場合
+        valueInput.style.display = 'block';
+        valueInput.required = true;
+        entitySelect.style.display = 'none';
+        entitySelect.required = false;
+        valueInput.value = currentValue;
+        
+        // データ型に応じて入力フィールドを調整
+        if (dataType === 'DATE') {
+            valueInput.type = 'date';
+        } else if (dataType === 'NUMBER') {
+            valueInput.type = 'number';
+        } else {
+            valueInput.type = 'text';
+        }
+    }
+    
+    document.getElementById('attributeEditModal').style.display = 'flex';
+}
+
+// 追加用エンティティ一覧読み込み
+async function loadEntitiesForAdd() {
+    try {
+        const response = await fetch(document.getElementById('addEntitySelect').dataset.entitiesUrl);
+        const entities = await response.json();
+        
+        const select = document.getElementById('addEntitySelect');
+        // 選択オプション以外をクリア
+        while (select.children.length > 1) {
+            select.removeChild(select.lastChild);
+        }
+        
+        // エンティティを追加
+        entities.forEach(entity => {
+            const option = document.createElement('option');
+            option.value = entity.identifier;
+            option.textContent = `${entity.title} (${entity.type_name})`;
+            select.appendChild(option);
+        });
+        
+    } catch (error) {
+        console.error('Error loading entities:', error);
+    }
+}
+
+// 編集用エンティティ一覧読み込み
+async function loadEntities() {
+    try {
+        const response = await fetch(document.getElementById('editEntitySelect').dataset.entitiesUrl);
+        const entities = await response.json();
+        
+        const select = document.getElementById('editEntitySelect');
+        // 選択オプション以外をクリア
+        while (select.children.length > 1) {
+            select.removeChild(select.lastChild);
+        }
+        
+        // エンティティを追加
+        entities.forEach(entity => {
+            const option = document.createElement('option');
+            option.value = entity.identifier;
+            option.textContent = `${entity.title} (${entity.type_name})`;
+            select.appendChild(option);
+        });
+        
+    } catch (error) {
+        console.error('Error loading entities:', error);
+    }
+}
+
+// モーダルを閉じる関数
+function closeAddModal() {
+    document.getElementById('attributeAddModal').style.display = 'none';
+}
+
+function closeEditModal() {
+    document.getElementById('attributeEditModal').style.display = 'none';
+}
+
+// モーダル外クリックで閉じる
+document.addEventListener('click', function(e) {
+    if (e.target.id === 'attributeAddModal') {
+        closeAddModal();
+    } else if (e.target.id === 'attributeEditModal') {
+        closeEditModal();
+    }
+});
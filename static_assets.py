@@ -0,0 +1,221 @@
+"""静的ファイル（CSS・JavaScript）の縮小とフィンガープリント
+
+static/ 直下の .css・.js を縮小し、内容のハッシュを含む名前（例: dist/style.3f2a1b9c0d4e.css）で
+配信する。テンプレートの url_for('static', filename='style.css') は自動的にこの名前になり、
+レスポンスには1年間の immutable な Cache-Control を付ける。内容が変われば名前も変わるので、
+ブラウザは再検証なしにキャッシュを使い続けられる。
+
+起動時にメモリ上で作るので事前の作業は不要。gzip・brotli の圧縮版は最初に要求されたときに
+最大圧縮で作って保持する。リバースプロキシから配信する場合や起動を速くしたい場合は、
+事前に static/dist に書き出しておく（ソースと一致するときは起動時にそれを読み込む）。
+
+    python static_assets.py
+"""
+import os
+import re
+import json
+import hashlib
+import argparse
+import mimetypes
+from typing import Dict, Optional
+
+import compression
+
+# 縮小・フィンガープリントの対象
+ASSET_EXTENSIONS = ('.css', '.js')
+
+# 書き出し先（static フォルダからの相対パス）
+ASSET_BUILD_DIR = 'dist'
+ASSET_MANIFEST = 'manifest.json'
+
+# フィンガープリント付きの名前で配信するときのキャッシュ期間（秒）
+ASSET_MAX_AGE = 365 * 24 * 60 * 60
+
+# 事前圧縮の圧縮レベル（1回だけ圧縮するので最大にする）
+ASSET_GZIP_LEVEL = 9
+ASSET_BROTLI_QUALITY = 11
+
+_CSS_STRING = r'"(?:[^"\\]|\\.)*"|\'(?:[^\'\\]|\\.)*\''
+_CSS_COMMENT = re.compile(rf'({_CSS_STRING})|/\*.*?\*/', re.S)
+
+def _minify_css_code(code: str) -> str:
+    code = re.sub(r'\s+', ' ', code)
+    code = re.sub(r'\s*([{};,>])\s*', r'\1', code)
+    return re.sub(r':\s+', ':', code).replace(';}', '}')
+
+def minify_css(text: str) -> str:
+    """CSSのコメントと余分な空白を取り除く（文字列リテラルはそのまま）"""
+    # コメントは空白として扱う（前後のトークンがつながらないように）
+    text = _CSS_COMMENT.sub(lambda match: match.group(1) or ' ', text)
+    parts = re.split(f'({_CSS_STRING})', text)
+    for i in range(0, len(parts), 2):
+        parts[i] = _minify_css_code(parts[i])
+    return ''.join(parts).strip() + '\n'
+
+def minify_js(text: str) -> str:
+    """JavaScriptの行頭の空白・空行・行全体のコメントを取り除く
+
+    行の区切りは残すので、セミコロンの自動挿入に頼ったコードも動作は変わらない。
+    複数行にまたがるテンプレートリテラルがある場合は内容を変えないよう縮小しない。
+    """
+    lines = text.splitlines()
+    if any(line.count('`') % 2 for line in lines):
+        return text
+
+    minified = []
+    in_comment = False
+    for line in lines:
+        stripped = line.strip()
+        if in_comment:
+            in_comment = '*/' not in stripped
+            continue
+        if stripped.startswith('/*'):
+            in_comment = '*/' not in stripped
+            continue
+        if not stripped or stripped.startswith('//'):
+            continue
+        minified.append(stripped)
+    return '\n'.join(minified) + '\n'
+
+MINIFIERS = {'.css': minify_css, '.js': minify_js}
+
+class Asset:
+    """縮小済みの静的ファイル1つ（圧縮版は要求されたときに作って保持する）"""
+
+    __slots__ = ('source', 'path', 'digest', 'source_digest', 'mimetype', 'variants')
+
+    def __init__(self, source: str, content: bytes, source_digest: str):
+        self.source = source
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        stem, ext = os.path.splitext(source)
+        self.path = f'{ASSET_BUILD_DIR}/{stem}.{self.digest}{ext}'
+        self.source_digest = source_digest
+        self.mimetype = mimetypes.guess_type(source)[0] or 'application/octet-stream'
+        self.variants = {None: content}
+
+    def get(self, encoding: Optional[str]) -> bytes:
+        """指定の圧縮方式（None は無圧縮）の内容"""
+        data = self.variants.get(encoding)
+        if data is None:
+            level = ASSET_BROTLI_QUALITY if encoding == 'br' else ASSET_GZIP_LEVEL
+            data = self.variants[encoding] = compression.compress(self.variants[None], encoding, level)
+        return data
+
+def _source_digest(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+def _load_manifest(static_folder: str) -> dict:
+    try:
+        with open(os.path.join(static_folder, ASSET_BUILD_DIR, ASSET_MANIFEST), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _load_built(static_folder: str, source: str, entry: dict, source_digest: str) -> Optional[Asset]:
+    """書き出し済みのファイルがソースと一致すれば読み込む"""
+    if entry.get('source_digest') != source_digest:
+        return None
+    path = os.path.join(static_folder, entry['path'])
+    try:
+        with open(path, 'rb') as f:
+            asset = Asset(source, f.read(), source_digest)
+        if asset.path != entry['path']:
+            return None
+        for encoding, suffix in (('gzip', '.gz'), ('br', '.br')):
+            if os.path.exists(path + suffix):
+                with open(path + suffix, 'rb') as f:
+                    asset.variants[encoding] = f.read()
+    except OSError:
+        return None
+    return asset
+
+def build(static_folder: str) -> Dict[str, Asset]:
+    """static フォルダの対象ファイルを縮小し、元のファイル名ごとの Asset を返す"""
+    manifest = _load_manifest(static_folder)
+    assets = {}
+    for name in sorted(os.listdir(static_folder)):
+        stem, ext = os.path.splitext(name)
+        if ext not in ASSET_EXTENSIONS or not os.path.isfile(os.path.join(static_folder, name)):
+            continue
+        with open(os.path.join(static_folder, name), 'rb') as f:
+            source = f.read()
+        source_digest = _source_digest(source)
+
+        asset = None
+        if name in manifest:
+            asset = _load_built(static_folder, name, manifest[name], source_digest)
+        if asset is None:
+            content = MINIFIERS[ext](source.decode('utf-8')).encode('utf-8')
+            asset = Asset(name, content, source_digest)
+        assets[name] = asset
+    return assets
+
+def write(static_folder: str, assets: Dict[str, Asset]) -> dict:
+    """縮小版と gzip・brotli の圧縮版を static/dist に書き出す"""
+    build_dir = os.path.join(static_folder, ASSET_BUILD_DIR)
+    os.makedirs(build_dir, exist_ok=True)
+
+    encodings = [None, 'gzip'] + (['br'] if compression.brotli is not None else [])
+    manifest = {}
+    for name, asset in assets.items():
+        path = os.path.join(static_folder, asset.path)
+        for encoding in encodings:
+            suffix = {None: '', 'gzip': '.gz', 'br': '.br'}[encoding]
+            with open(path + suffix, 'wb') as f:
+                f.write(asset.get(encoding))
+        manifest[name] = {'path': asset.path, 'source_digest': asset.source_digest}
+
+    with open(os.path.join(build_dir, ASSET_MANIFEST), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    return manifest
+
+def init_app(app):
+    """フィンガープリント付きの静的ファイル配信をFlaskアプリに登録"""
+    from flask import request
+
+    assets = build(app.static_folder)
+    assets_by_path = {asset.path: asset for asset in assets.values()}
+    app.extensions['static_assets'] = assets
+
+    @app.url_defaults
+    def fingerprint_static_url(endpoint, values):
+        if endpoint == 'static':
+            asset = assets.get(values.get('filename'))
+            if asset is not None:
+                values['filename'] = asset.path
+
+    def static(filename):
+        """フィンガープリント付きの名前ならメモリ上の縮小版を返し、それ以外は通常の静的ファイル"""
+        asset = assets_by_path.get(filename)
+        if asset is None:
+            return app.send_static_file(filename)
+
+        encoding = compression.negotiate(request.accept_encodings)
+        response = app.response_class(asset.get(encoding), mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.max_age = ASSET_MAX_AGE
+        response.cache_control.immutable = True
+        response.set_etag(asset.digest + (f'-{encoding}' if encoding else ''))
+        return response.make_conditional(request)
+
+    app.view_functions['static'] = static
+
+def main():
+    parser = argparse.ArgumentParser(description='静的ファイルを縮小・フィンガープリントして static/dist に書き出す')
+    parser.add_argument('--static-folder', default=os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static'))
+    args = parser.parse_args()
+
+    assets = build(args.static_folder)
+    write(args.static_folder, assets)
+    print(f'{"source":<24} {"path":<40} {"source B":>9} {"min B":>7} {"gzip B":>7} {"br B":>7}')
+    for name, asset in assets.items():
+        source_size = os.path.getsize(os.path.join(args.static_folder, name))
+        br = len(asset.get('br')) if compression.brotli is not None else '-'
+        print(f'{name:<24} {asset.path:<40} {source_size:>9} {len(asset.get(None)):>7} '
+              f'{len(asset.get("gzip")):>7} {br:>7}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""テンプレートのバイトコードキャッシュとストリーミング描画
+
+コンパイル済みのテンプレートを TEMPLATE_CACHE_DIR に保存し、ワーカー間・再起動後も共有する。
+テンプレートを変更するとソースのチェックサムが変わるので、古いキャッシュは使われない。
+デプロイ時に全テンプレートをコンパイルしておけば、各ワーカーの最初のリクエストでもコンパイルしない。
+
+    python templating.py
+"""
+import os
+import argparse
+from typing import Iterable, Iterator
+
+from jinja2 import FileSystemBytecodeCache
+
+# コンパイル済みテンプレートの保存先（空文字でキャッシュしない）
+TEMPLATE_CACHE_DIR = os.environ.get('TEMPLATE_CACHE_DIR', 'data/template-cache')
+
+# ストリーミング描画で1回に送る大きさの目安（文字数）
+TEMPLATE_STREAM_BUFFER_SIZE = 16 * 1024
+
+def _buffered(pieces: Iterable[str], size: int) -> Iterator[str]:
+    """テンプレートが細かく出力する文字列を size 程度ずつまとめる"""
+    buffer = []
+    buffered = 0
+    for piece in pieces:
+        buffer.append(piece)
+        buffered += len(piece)
+        if buffered >= size:
+            yield ''.join(buffer)
+            buffer = []
+            buffered = 0
+    if buffer:
+        yield ''.join(buffer)
+
+def render_stream(template_name: str, **context):
+    """テンプレートを描画しながら送るレスポンス（ページ全体の文字列を作らない）
+
+    レスポンスヘッダーとセッションは描画より先に送られるので、テンプレートで表示する
+    フラッシュメッセージはここで取り出しておく（描画中に取り出すとセッションに反映されない）。
+    """
+    from flask import current_app, get_flashed_messages, stream_template
+
+    get_flashed_messages()
+    chunks = _buffered(stream_template(template_name, **context),
+                       current_app.config['TEMPLATE_STREAM_BUFFER_SIZE'])
+    return current_app.response_class(chunks, mimetype='text/html')
+
+def compile_all(app) -> int:
+    """全テンプレートをコンパイルしてバイトコードキャッシュに保存し、件数を返す"""
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
+def init_app(app):
+    """バイトコードキャッシュをFlaskアプリのJinja環境に設定"""
+    cache_dir = app.config.setdefault('TEMPLATE_CACHE_DIR', TEMPLATE_CACHE_DIR)
+    app.config.setdefault('TEMPLATE_STREAM_BUFFER_SIZE', TEMPLATE_STREAM_BUFFER_SIZE)
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+def main():
+    parser = argparse.ArgumentParser(description='全テンプレートをコンパイルしてバイトコードキャッシュに保存')
+    parser.parse_args()
+
+    from app import create_app
+    app = create_app()
+    print(f'{compile_all(app)} templates compiled into {app.config["TEMPLATE_CACHE_DIR"]}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""テスト共通の設定
+
+init.sql・upgrade.sql はカレントディレクトリからの相対パスで読むので、リポジトリの
+ルートに移動してからモジュールを読み込む。テストごとに一時ディレクトリの新しい
+データベースを使う。
+"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+os.chdir(ROOT)
+sys.path.insert(0, ROOT)
+
+# アプリのimport時に作られるデータベースは、テストごとのデータベースとは別の一時ディレクトリに置く
+os.environ['ENTY_DB_PATH'] = os.path.join(tempfile.mkdtemp(prefix='enty-test-'), 'enty.db')
+# アプリのimport時に必要なOIDC設定（テストではプロバイダーに接続しない）
+os.environ.setdefault('OIDC_METADATA_URL', 'http://localhost/.well-known/openid-configuration')
+os.environ.setdefault('OIDC_CLIENT_ID', 'test')
+os.environ.setdefault('OIDC_CLIENT_SECRET', 'test')
+os.environ.setdefault('RATE_LIMIT_BACKEND', 'off')
+os.environ.setdefault('REPORTING_SNAPSHOT_WORKER', '0')
+os.environ.setdefault('SLOW_QUERY_THRESHOLD_MS', '100000')
+
+import db  # noqa: E402
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """テスト用の空のデータベース（スキーマ初期化済み）のパス"""
+    path = str(tmp_path / 'enty.db')
+    monkeypatch.setattr(db, 'DB_PATH', path)
+    db.init_db(path)
+    db.as_of_cache.clear()
+    yield path
+    db.as_of_cache.clear()
+
+
+@pytest.fixture
+def client(db_path):
+    """ログイン済みのテストクライアント"""
+    from app import app
+
+    app.config['TESTING'] = True
+    client = app.test_client()
+    with client.session_transaction() as session:
+        session['user'] = {'id': 'test', 'name': 'test', 'email': 'test@example.com'}
+    return client
+
+
+@pytest.fixture
+def entity_class(db_path):
+    """エンティティクラスと TEXT 型の属性クラス（entity_class_id, attribute_class_id）"""
+    entity_class_id = db.EntityMetaRepository.create('サーバー')
+    attribute_class_id = db.AttributeMetaRepository.create('OS', entity_class_id, 'TEXT')
+    return entity_class_id, attribute_class_id
@@ -0,0 +1,88 @@
+"""時点指定の読み取りのキャッシュ（as_of_cache）が変更履歴で捨てられること"""
+import sqlite3
+
+import db
+
+QUERY = 'AttributeRepository.get_by_entity_id_at_date'
+
+
+def _counts():
+    stats = db.as_of_cache.stats().get(QUERY, {'hits': 0, 'misses': 0})
+    return stats['hits'], stats['misses']
+
+
+def _read(entity_id, view_date):
+    """読み取って (値の一覧, キャッシュにヒットしたか) を返す"""
+    hits = _counts()[0]
+    titles = [row['title'] for row in db.AttributeRepository.get_by_entity_id_at_date(entity_id, view_date)]
+    return titles, _counts()[0] > hits
+
+
+def _setup(entity_class):
+    entity_class_id, attribute_class_id = entity_class
+    entity_id = db.EntityRepository.create('server', entity_class_id, '2020-01-01')
+    db.AttributeRepository.create('Ubuntu 20.04', attribute_class_id, entity_id, '2020-01-01')
+    return entity_id, attribute_class_id
+
+
+def test_repeated_read_is_a_hit(entity_class):
+    entity_id, _ = _setup(entity_class)
+
+    assert _read(entity_id, '2024-06-01') == (['Ubuntu 20.04'], False)
+    assert _read(entity_id, '2024-06-01') == (['Ubuntu 20.04'], True)
+
+
+def test_write_evicts_only_dates_in_its_interval(entity_class):
+    entity_class_id, attribute_class_id = entity_class
+    entity_id = db.EntityRepository.create('server', entity_class_id, '2020-01-01')
+    db.AttributeRepository.create('Ubuntu 20.04', attribute_class_id, entity_id, '2020-01-01', '2023-01-01')
+    _read(entity_id, '2022-06-01')
+    _read(entity_id, '2024-06-01')
+
+    db.AttributeRepository.create('Ubuntu 22.04', attribute_class_id, entity_id, '2024-01-01')
+
+    # 2024-01-01 以降の表示日だけが変わる
+    assert _read(entity_id, '2022-06-01') == (['Ubuntu 20.04'], True)
+    assert _read(entity_id, '2024-06-01') == (['Ubuntu 22.04'], False)
+
+
+def test_write_to_other_entity_keeps_result(entity_class):
+    entity_id, attribute_class_id = _setup(entity_class)
+    other_id = db.EntityRepository.create('other', entity_class[0], '2020-01-01')
+    _read(entity_id, '2024-06-01')
+
+    db.AttributeRepository.create('RHEL 9', attribute_class_id, other_id, '2020-01-01')
+
+    assert _read(entity_id, '2024-06-01') == (['Ubuntu 20.04'], True)
+
+
+def test_write_from_another_connection_is_seen(entity_class, db_path):
+    entity_id, attribute_class_id = _setup(entity_class)
+    [old] = db.AttributeRepository.get_active_by_entity_and_class(entity_id, attribute_class_id)
+    _read(entity_id, '2024-06-01')
+
+    # 他のワーカーの書き込み（このプロセスのキャッシュを経由しない）
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("UPDATE attribute_instance SET title = 'Debian 12' WHERE identifier = ?",
+                     (old['identifier'],))
+        db.ChangeLogRepository.record(conn, 'attribute_instance', old['identifier'], 'update',
+                                      before=dict(old),
+                                      after={**dict(old), 'title': 'Debian 12'})
+        conn.commit()
+    finally:
+        conn.close()
+
+    assert _read(entity_id, '2024-06-01') == (['Debian 12'], False)
+
+
+def test_change_beyond_sync_limit_resets(entity_class, monkeypatch):
+    entity_id, _ = _setup(entity_class)
+    _read(entity_id, '2024-06-01')
+    monkeypatch.setattr(db.as_of_cache, 'sync_limit', 2)
+
+    for i in range(3):
+        db.EntityRepository.create(f'other-{i}', entity_class[0], '2020-01-01')
+
+    # 未処理の変更が多すぎると、影響のない結果も含めてすべて捨てる
+    assert _read(entity_id, '2024-06-01') == (['Ubuntu 20.04'], False)
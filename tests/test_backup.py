@@ -0,0 +1,64 @@
+"""バックアップ → リストア → 検証"""
+import sqlite3
+
+import backup
+import db
+
+
+def _titles(path):
+    conn = sqlite3.connect(path)
+    try:
+        return [row[0] for row in conn.execute("SELECT title FROM entity_instance ORDER BY identifier")]
+    finally:
+        conn.close()
+
+
+def _create_entities(entity_class, prefix, count):
+    for i in range(count):
+        db.EntityRepository.create(f'{prefix}-{i}', entity_class[0], '2020-01-01')
+
+
+def test_backup_database_is_consistent_copy(entity_class, db_path, tmp_path):
+    _create_entities(entity_class, 'server', 50)
+    output = str(tmp_path / 'backup' / 'enty.db')
+
+    stats = backup.backup_database(output, db_path, pages_per_step=1, step_pause=0)
+    result = backup.verify_database(output)
+
+    assert stats['pages'] > 1 and stats['steps'] >= stats['pages']
+    assert result['ok'] and result['foreign_key_errors'] == 0
+    assert result['tables']['entity_instance'] == 50
+    assert result['tables']['change_log'] == backup.verify_database(db_path)['tables']['change_log']
+    assert _titles(output) == _titles(db_path)
+
+
+def test_wal_archive_restores_writes_after_base(entity_class, db_path, tmp_path):
+    archive_dir = str(tmp_path / 'archive')
+    _create_entities(entity_class, 'base', 10)
+
+    archiver = backup.WALArchiver(archive_dir, db_path, step_pause=0)
+    archiver.start_chain()
+    _create_entities(entity_class, 'first', 10)
+    first = archiver.archive_wal()
+    _create_entities(entity_class, 'second', 10)
+    second = archiver.archive_wal()
+
+    assert first and second
+    assert all(entry['commits'] > 0 for entry in first + second)
+
+    output = str(tmp_path / 'restored.db')
+    result = backup.restore(archive_dir, output)
+
+    assert result['ok'] and result['foreign_key_errors'] == 0
+    assert result['tables']['entity_instance'] == 30
+    assert result['segments'] == len(backup.list_chains(archive_dir)[0]['segments'])
+    assert _titles(output) == _titles(db_path)
+    assert backup.verify_database(output)['tables'] == backup.verify_database(db_path)['tables']
+
+
+def test_restore_without_base_is_rejected(tmp_path):
+    try:
+        backup.restore(str(tmp_path / 'archive'), str(tmp_path / 'restored.db'))
+    except ValueError:
+        return
+    raise AssertionError('ValueError が発生しませんでした')
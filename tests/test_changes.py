@@ -0,0 +1,65 @@
+"""変更ログ（/api/changes）のカーソルと件数の上限"""
+import db
+
+
+def _create_entities(entity_class, count):
+    entity_class_id, _ = entity_class
+    return [db.EntityRepository.create(f'server-{i}', entity_class_id, '2024-01-01') for i in range(count)]
+
+
+def test_cursor_pages_through_every_change_once(client, entity_class):
+    _create_entities(entity_class, 5)
+    latest = db.ChangeLogRepository.get_latest_seq()
+
+    seen, since, pages = [], 0, 0
+    while True:
+        body = client.get(f'/api/changes?since={since}&limit=2').get_json()
+        seen += [change['seq'] for change in body['changes']]
+        since = body['next']
+        pages += 1
+        if not body['has_more']:
+            break
+
+    assert seen == sorted(set(seen))
+    assert seen[-1] == latest
+    assert len(seen) == latest
+    assert pages == 3
+
+
+def test_cursor_past_latest_returns_same_cursor(client, entity_class):
+    _create_entities(entity_class, 2)
+    latest = db.ChangeLogRepository.get_latest_seq()
+
+    body = client.get(f'/api/changes?since={latest}').get_json()
+
+    assert body == {'changes': [], 'next': latest, 'has_more': False}
+
+
+def test_last_event_id_resumes_after_offset(client, entity_class):
+    entity_ids = _create_entities(entity_class, 3)
+
+    body = client.get('/api/changes', headers={'Last-Event-ID': '1'}).get_json()
+
+    assert [change['row_id'] for change in body['changes']] == entity_ids[1:]
+    assert all(change['operation'] == 'create' for change in body['changes'])
+
+
+def test_limit_is_clamped(client, entity_class):
+    _create_entities(entity_class, 3)
+
+    # 0 以下は1件ずつ（全件や、カーソルの進まない has_more にならない）
+    body = client.get('/api/changes?since=0&limit=0').get_json()
+    assert len(body['changes']) == 1
+    assert body['next'] == body['changes'][0]['seq']
+    assert body['has_more'] is True
+
+    body = client.get('/api/changes?since=0&limit=100000').get_json()
+    assert len(body['changes']) == 3
+    assert body['has_more'] is False
+
+
+def test_invalid_params_are_rejected(client):
+    response = client.get('/api/changes?limit=abc')
+
+    assert response.status_code == 400
+    assert 'error' in response.get_json()
@@ -0,0 +1,100 @@
+"""スキーマ変更ジョブの中断と再開"""
+import json
+
+import db
+from db import SchemaJobRepository
+from schema_jobs import SchemaJobRunner
+
+VALUES = ['1,000', '2', '3.5', 'abc', '5', '6', '7', '8', '9', '10']
+
+
+def _setup(entity_class):
+    entity_class_id, attribute_class_id = entity_class
+    for i, value in enumerate(VALUES):
+        entity_id = db.EntityRepository.create(f'server-{i}', entity_class_id, '2020-01-01')
+        db.AttributeRepository.create(value, attribute_class_id, entity_id, '2020-01-01')
+    start = db.ChangeLogRepository.get_latest_seq()
+    job_id = SchemaJobRepository.create('change_type', attribute_class_id, {'data_type': 'NUMBER'})
+    return attribute_class_id, job_id, start
+
+
+def _values(attribute_class_id):
+    with db.get_connection() as conn:
+        return [row[0] for row in conn.execute(
+            "SELECT title FROM attribute_instance WHERE class_id = ? ORDER BY identifier", (attribute_class_id,))]
+
+
+def _updates_since(seq):
+    return [change['row_id'] for change in db.ChangeLogRepository.get_since(seq, 1000)]
+
+
+def _assert_converted_once(attribute_class_id, job_id, start):
+    job = SchemaJobRepository.get(job_id)
+    assert job['status'] == 'done'
+    # 引き継いだワーカーが処理済みの行を数え直さない
+    assert job['processed'] == job['total'] == len(VALUES)
+    assert job['failed'] == 1
+    assert _values(attribute_class_id) == ['1000', '2', '3.5', 'abc', '5', '6', '7', '8', '9', '10']
+    assert db.AttributeMetaRepository.get_by_id(attribute_class_id)['data_type'] == 'NUMBER'
+    # 値が変わった行だけを1回記録する
+    updates = _updates_since(start)
+    assert len(updates) == len(set(updates)) == 1
+
+
+def test_stale_job_is_resumed_by_another_worker(entity_class):
+    attribute_class_id, job_id, start = _setup(entity_class)
+
+    job = SchemaJobRepository.claim('worker-a', stale_before=0, now=100)
+    assert job['identifier'] == job_id
+    for _ in range(2):
+        job = SchemaJobRepository.run_chunk(job_id, 'worker-a', 3, now=101)
+    assert (job['phase'], job['processed']) == ('live', 6)
+
+    # worker-a が止まり、ハートビートが途絶えたジョブを worker-b が引き受ける
+    assert SchemaJobRepository.claim('worker-b', stale_before=100, now=200) is None
+    job = SchemaJobRepository.claim('worker-b', stale_before=150, now=200)
+    assert job['owner'] == 'worker-b' and job['processed'] == 6
+
+    # 引き継がれた後の worker-a は何もしない
+    assert SchemaJobRepository.run_chunk(job_id, 'worker-a', 3, now=201) is None
+
+    runner = SchemaJobRunner(chunk_size=3, pause=0)
+    runner.owner = 'worker-b'
+    assert runner.run_job(job)['status'] == 'done'
+    _assert_converted_once(attribute_class_id, job_id, start)
+
+
+def test_failed_job_resumes_from_cursor(entity_class):
+    attribute_class_id, job_id, start = _setup(entity_class)
+
+    SchemaJobRepository.claim('worker-a', stale_before=0, now=100)
+    job = SchemaJobRepository.run_chunk(job_id, 'worker-a', 4, now=101)
+    SchemaJobRepository.fail(job_id, 'worker-a', 'disk I/O error')
+    assert SchemaJobRepository.get(job_id)['status'] == 'failed'
+
+    assert SchemaJobRepository.retry(job_id)
+    runner = SchemaJobRunner(chunk_size=4, pause=0)
+    [result] = runner.run_pending()
+
+    assert job['processed'] == 4
+    assert result['status'] == 'done'
+    _assert_converted_once(attribute_class_id, job_id, start)
+
+
+def test_rows_added_during_job_are_processed(entity_class):
+    attribute_class_id, job_id, _ = _setup(entity_class)
+
+    SchemaJobRepository.claim('worker-a', stale_before=0, now=100)
+    while SchemaJobRepository.get(job_id)['phase'] == 'live':
+        SchemaJobRepository.run_chunk(job_id, 'worker-a', 3, now=101)
+    assert json.loads(SchemaJobRepository.get(job_id)['params'])['live_cursor'] > 0
+
+    # live フェーズが終わった後に追加された値は finalize で変換する
+    entity_id = db.EntityRepository.create('late', entity_class[0], '2020-01-01')
+    db.AttributeRepository.create('11,000', attribute_class_id, entity_id, '2020-01-01')
+    job = SchemaJobRepository.get(job_id)
+    while job['status'] == 'running':
+        job = SchemaJobRepository.run_chunk(job_id, 'worker-a', 3, now=102)
+
+    assert job['status'] == 'done'
+    assert _values(attribute_class_id)[-1] == '11000'
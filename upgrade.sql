@@ -0,0 +1,139 @@
+-- 既存データベースにも適用する追加スキーマ
+-- 起動時に毎回実行されるため、すべて IF NOT EXISTS で冪等にしておくこと
+
+-- 変更履歴（エンティティ・属性インスタンスへの書き込みを追記専用で記録）
+CREATE TABLE IF NOT EXISTS change_log (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    table_name TEXT NOT NULL,
+    row_id INTEGER NOT NULL,
+    operation TEXT NOT NULL,
+    payload TEXT,
+    changed_at TEXT DEFAULT (datetime('now', 'localtime'))
+);
+
+-- 属性インスタンスの検索用インデックス（エンティティ単位の取得と日付境界での差分計算）
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_entity_class
+    ON attribute_instance (entity_id, class_id, date_in);
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_date_in ON attribute_instance (date_in);
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_date_out ON attribute_instance (date_out);
+CREATE INDEX IF NOT EXISTS idx_entity_instance_date_in ON entity_instance (date_in);
+CREATE INDEX IF NOT EXISTS idx_entity_instance_date_out ON entity_instance (date_out);
+
+-- サーバー側セッション（ユーザー単位の一括失効と期限切れの掃除用にインデックスを張る）
+CREATE TABLE IF NOT EXISTS user_session (
+    session_id TEXT PRIMARY KEY,
+    user_id TEXT,
+    data TEXT NOT NULL,
+    expires_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_user_session_user ON user_session (user_id);
+CREATE INDEX IF NOT EXISTS idx_user_session_expires ON user_session (expires_at);
+
+-- 属性インスタンスのアーカイブ（アーカイブ境界より前に閉じたバージョンを移す）
+CREATE TABLE IF NOT EXISTS attribute_instance_archive (
+    identifier INTEGER PRIMARY KEY,
+    title TEXT,
+    class_id INTEGER,
+    entity_id INTEGER,
+    date_in TEXT,
+    date_out TEXT,
+    archived_at TEXT DEFAULT (datetime('now', 'localtime'))
+);
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_archive_entity_class
+    ON attribute_instance_archive (entity_id, class_id, date_in);
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_archive_date_in ON attribute_instance_archive (date_in);
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_archive_date_out ON attribute_instance_archive (date_out);
+
+-- テーブルごとのアーカイブ境界（この日付より前の時点を参照するときだけアーカイブを読む）
+CREATE TABLE IF NOT EXISTS history_horizon (
+    table_name TEXT PRIMARY KEY,
+    horizon TEXT NOT NULL,
+    updated_at TEXT DEFAULT (datetime('now', 'localtime'))
+);
+
+-- 属性クラスのスキーマ変更ジョブ（クラス削除・データ型変更・統合をバックグラウンドで少しずつ実行）
+-- phase は live（attribute_instance）→ archive（attribute_instance_archive）→ finalize の順に進み、
+-- cursor はそのフェーズで処理済みの最大 identifier。中断しても cursor の続きから再開する
+CREATE TABLE IF NOT EXISTS schema_job (
+    identifier INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL,
+    class_id INTEGER NOT NULL,
+    params TEXT NOT NULL DEFAULT '{}',
+    status TEXT NOT NULL DEFAULT 'pending',
+    phase TEXT NOT NULL DEFAULT 'live',
+    cursor INTEGER NOT NULL DEFAULT 0,
+    total INTEGER NOT NULL DEFAULT 0,
+    processed INTEGER NOT NULL DEFAULT 0,
+    failed INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    owner TEXT,
+    heartbeat REAL,
+    created_at TEXT DEFAULT (datetime('now', 'localtime')),
+    finished_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_schema_job_status ON schema_job (status);
+
+-- ファセット・属性値での絞り込み用（属性クラスの値ごとの集計を索引だけで行う）
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_class_title
+    ON attribute_instance (class_id, title, entity_id, date_in, date_out);
+CREATE INDEX IF NOT EXISTS idx_attribute_instance_archive_class_title
+    ON attribute_instance_archive (class_id, title, entity_id, date_in, date_out);
+CREATE INDEX IF NOT EXISTS idx_entity_instance_class ON entity_instance (class_id, date_in);
+
+-- リレーションクラス（from_entity_id のエンティティクラスから to_entity_id のエンティティクラスへの関係の種類）
+CREATE TABLE IF NOT EXISTS relation_class (
+    identifier INTEGER PRIMARY KEY,
+    title TEXT,
+    from_entity_id INTEGER,
+    to_entity_id INTEGER,
+    FOREIGN KEY (from_entity_id) REFERENCES entity_class(identifier),
+    FOREIGN KEY (to_entity_id) REFERENCES entity_class(identifier)
+);
+CREATE INDEX IF NOT EXISTS idx_relation_class_from ON relation_class (from_entity_id);
+CREATE INDEX IF NOT EXISTS idx_relation_class_to ON relation_class (to_entity_id);
+
+-- リレーションインスタンス（entity_from から entity_to への関係、date_in 〜 date_out の間有効）
+CREATE TABLE IF NOT EXISTS relation_instance (
+    identifier INTEGER PRIMARY KEY,
+    class_id INTEGER,
+    entity_from INTEGER,
+    entity_to INTEGER,
+    date_in TEXT,
+    date_out TEXT,
+    FOREIGN KEY (class_id) REFERENCES relation_class(identifier),
+    FOREIGN KEY (entity_from) REFERENCES entity_instance(identifier),
+    FOREIGN KEY (entity_to) REFERENCES entity_instance(identifier)
+);
+-- 両方向の隣接エンティティを、日付時点の条件も含めて索引だけで引く（テーブル本体は読まない）
+CREATE INDEX IF NOT EXISTS idx_relation_instance_from
+    ON relation_instance (entity_from, class_id, date_in, date_out, entity_to);
+CREATE INDEX IF NOT EXISTS idx_relation_instance_to
+    ON relation_instance (entity_to, class_id, date_in, date_out, entity_from);
+CREATE INDEX IF NOT EXISTS idx_relation_instance_class ON relation_instance (class_id);
+
+-- レート制限のトークンバケット（RATE_LIMIT_BACKEND=sqlite で複数ワーカーが共有する）
+CREATE TABLE IF NOT EXISTS rate_limit_bucket (
+    bucket_key TEXT PRIMARY KEY,
+    tokens REAL NOT NULL,
+    updated_at REAL NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_rate_limit_bucket_updated ON rate_limit_bucket (updated_at);
+
+-- エンティティクラス・属性クラスの変更の版（変更履歴に記録しない書き込みでワーカー内のキャッシュを捨てる目印）
+CREATE TABLE IF NOT EXISTS metadata_version (
+    identifier INTEGER PRIMARY KEY CHECK (identifier = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO metadata_version (identifier, version) VALUES (1, 0);
+CREATE TRIGGER IF NOT EXISTS trg_entity_class_insert_version AFTER INSERT ON entity_class
+BEGIN UPDATE metadata_version SET version = version + 1 WHERE identifier = 1; END;
+CREATE TRIGGER IF NOT EXISTS trg_entity_class_update_version AFTER UPDATE ON entity_class
+BEGIN UPDATE metadata_version SET version = version + 1 WHERE identifier = 1; END;
+CREATE TRIGGER IF NOT EXISTS trg_entity_class_delete_version AFTER DELETE ON entity_class
+BEGIN UPDATE metadata_version SET version = version + 1 WHERE identifier = 1; END;
+CREATE TRIGGER IF NOT EXISTS trg_attribute_class_insert_version AFTER INSERT ON attribute_class
+BEGIN UPDATE metadata_version SET version = version + 1 WHERE identifier = 1; END;
+CREATE TRIGGER IF NOT EXISTS trg_attribute_class_update_version AFTER UPDATE ON attribute_class
+BEGIN UPDATE metadata_version SET version = version + 1 WHERE identifier = 1; END;
+CREATE TRIGGER IF NOT EXISTS trg_attribute_class_delete_version AFTER DELETE ON attribute_class
+BEGIN UPDATE metadata_version SET version = version + 1 WHERE identifier = 1; END;
@@ -3,6 +3,8 @@ from flask import session, redirect, url_for, flash, g
 import sqlite3
 from datetime import datetime
 
+import session_store
+
 class UserManager:
     def __init__(self, db_path='aggre.db'):
         self.db_path = db_path
@@ -51,9 +53,9 @@ class UserManager:
                 ))
                 conn.commit()
                 
-                # 新規ユーザーには 'viewer' ロールを自動付与
+                # 新規ユーザーには 'viewer' ロールを自動付与（ログイン中のセッションは失効させない）
                 user_id = cursor.lastrowid
-                self.assign_role(user_id, 'viewer')
+                self.assign_role(user_id, 'viewer', revoke_sessions=False)
                 
                 return self.get_user_by_id(user_id)
         finally:
@@ -113,8 +115,18 @@ class UserManager:
         roles = self.get_user_roles(user_id)
         return any(role['name'] == role_name for role in roles)
     
-    def assign_role(self, user_id, role_name, granted_by=None):
-        """ユーザーにロールを付与"""
+    def revoke_sessions(self, user_id):
+        """ユーザーの全セッションを失効させる（権限の変更を次のリクエストから反映するため）
+        
+        セッションはOIDCのユーザーID（provider_id）で保存されている。
+        """
+        user = self.get_user_by_id(user_id)
+        if not user:
+            return 0
+        return session_store.revoke_user(user['provider_id'])
+    
+    def assign_role(self, user_id, role_name, granted_by=None, revoke_sessions=True):
+        """ユーザーにロールを付与し、ユーザーのセッションを失効させる"""
         conn = self.get_db_connection()
         try:
             # ロールIDを取得
@@ -148,9 +160,12 @@ class UserManager:
             conn.commit()
         finally:
             conn.close()
+        
+        if revoke_sessions:
+            self.revoke_sessions(user_id)
     
     def revoke_role(self, user_id, role_name):
-        """ユーザーからロールを取り消し"""
+        """ユーザーからロールを取り消し、ユーザーのセッションを失効させる"""
         conn = self.get_db_connection()
         try:
             conn.execute('''
@@ -163,6 +178,22 @@ class UserManager:
             conn.commit()
         finally:
             conn.close()
+        
+        self.revoke_sessions(user_id)
+    
+    def deactivate_user(self, user_id):
+        """ユーザーを無効化（削除）し、ユーザーのセッションを失効させる"""
+        conn = self.get_db_connection()
+        try:
+            conn.execute(
+                'UPDATE users SET is_active = FALSE, updated_at = ? WHERE id = ?',
+                (datetime.now(), user_id)
+            )
+            conn.commit()
+        finally:
+            conn.close()
+        
+        self.revoke_sessions(user_id)
     
     def get_all_users(self):
         """全ユーザーを取得"""